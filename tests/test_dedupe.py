@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+from unified_app.config import DedupeConfig
+from unified_app.dedupe import RecordMerger
+from unified_app.sinks import SinkSet, make_record
+
+
+DESC = "Wireless mechanical keyboard with hot-swappable switches, RGB backlight and USB-C"
+
+
+def _products(n=50):
+    return [
+        make_record("test", f"https://shop.example/p/{i}", {"title": f"Keyboard K{i}", "price": 100 + i, "desc": DESC})
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize("max_distance", [0, 4, 15])
+def test_similar_products_without_keys_all_survive(max_distance):
+    merger = RecordMerger(max_distance=max_distance)
+    out = merger.feed_many(_products())
+    assert [r["result"]["title"] for r in out] == [f"Keyboard K{i}" for i in range(50)]
+    # 输出的是原始记录，没有与其他商品合并字段
+    assert [r["result"]["price"] for r in out] == [100 + i for i in range(50)]
+    assert len({r["dedupe_key"] for r in out}) == 50
+    assert merger.stats.duplicates == 0
+    if max_distance:
+        assert merger.stats.near_duplicates > 0
+    else:
+        assert merger.stats.near_duplicates == 0
+
+
+def test_exact_content_repeats_are_dropped_without_keys():
+    records = _products(5)
+    # 同一商品出现在另一个列表页：url 不同，抽取结果相同
+    repeats = [make_record("test", f"https://shop.example/list?page=2#{i}", dict(r["result"])) for i, r in enumerate(records)]
+    merger = RecordMerger(max_distance=4)
+    out = merger.feed_many(records + repeats)
+    assert len(out) == 5
+    assert merger.stats.duplicates == 5 and merger.stats.dropped == 5
+
+
+def test_similar_products_are_distinct_rows_in_sqlite(tmp_path):
+    merger = RecordMerger.from_config(DedupeConfig(enabled=True, max_distance=4))
+    with SinkSet.open(["sqlite:products.db"], directory=tmp_path, dedupe=merger) as sinks:
+        for record in _products():
+            sinks.write(record)
+    assert not sinks.errors
+    conn = sqlite3.connect(str(tmp_path / "products.db"))
+    try:
+        rows = conn.execute("SELECT url, dedupe_key FROM results").fetchall()
+    finally:
+        conn.close()
+    assert len(rows) == 50
+    assert len({url for url, _ in rows}) == 50
+
+
+def test_explicit_keys_still_merge_fields():
+    merger = RecordMerger(keys=["url"])
+    first = make_record("test", "https://shop.example/p/1", {"title": "Keyboard", "price": None})
+    second = make_record("test", "https://shop.example/p/1", {"title": "", "price": 129})
+    out = merger.feed_many([first, second])
+    assert len(out) == 2
+    assert out[1]["result"] == {"title": "Keyboard", "price": 129}
+    assert out[0]["dedupe_key"] == out[1]["dedupe_key"]
+
+
+def test_default_config_does_not_enable_near_duplicate_detection():
+    assert DedupeConfig().max_distance == 0
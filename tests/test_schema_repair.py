@@ -0,0 +1,44 @@
+from unified_app.schema_repair import FAILED, REPAIRED, VALID, check_and_repair
+
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "price": {"type": "number"},
+    },
+    "required": ["title", "price"],
+}
+
+
+def test_missing_required_number_is_filled_with_null():
+    check = check_and_repair({"title": "键盘"}, SCHEMA)
+    assert check.status == REPAIRED
+    assert check.value == {"title": "键盘", "price": None}
+    assert "fill_null:$.price" in check.repairs
+
+
+def test_explicit_null_in_required_number_passes_like_a_missing_one():
+    check = check_and_repair({"title": "键盘", "price": None}, SCHEMA)
+    assert check.ok
+    assert check.status == VALID
+    assert check.value == {"title": "键盘", "price": None}
+
+
+def test_explicit_null_in_nested_required_field_passes():
+    schema = {"type": "array", "items": SCHEMA}
+    check = check_and_repair([{"title": "键盘", "price": None}, {"title": "鼠标", "price": "1,299"}], schema)
+    assert check.ok
+    assert check.value[1]["price"] == 1299
+
+
+def test_wrong_type_in_required_field_still_fails():
+    check = check_and_repair({"title": "键盘", "price": "面议"}, SCHEMA)
+    assert check.status == FAILED
+    assert any("$.price" in error for error in check.errors)
+
+
+def test_null_in_optional_field_still_fails():
+    schema = dict(SCHEMA, required=["title"])
+    check = check_and_repair({"title": "键盘", "price": None}, schema)
+    assert check.status == FAILED
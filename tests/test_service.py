@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from unified_app import service
+from unified_app.mock_servers import MockLLMServer
+from unified_app.pipeline import ScrapeOutcome
+
+
+BODY = {"url": "http://example.com/", "prompt": "列出所有商品"}
+
+
+@pytest.fixture
+def llm():
+    server = MockLLMServer(models=["mock-model"], latency_ms=1500).start()
+    yield server
+    server.stop()
+
+
+def _llm_runner(app_cfg, request, reporter, progress):
+    """不抓取页面，只向仿真模型服务发一次对话请求，耗时由仿真服务的延迟决定。"""
+    progress(0.5, "调用模型")
+    resp = httpx.post(
+        f"{app_cfg.lmstudio.base_url}/chat/completions",
+        json={"model": app_cfg.lmstudio.model, "messages": [{"role": "user", "content": request.prompt}]},
+        timeout=30,
+    )
+    resp.raise_for_status()
+    return ScrapeOutcome(result=resp.json()["choices"][0]["message"]["content"], provider="lmstudio")
+
+
+def _run(llm, check, workers=1, queue_size=0):
+    async def main():
+        scrape = service.ScrapeService(
+            workers=workers,
+            queue_size=queue_size,
+            config_loader=service.mock_config_loader(llm.url),
+            runner=_llm_runner,
+        )
+        async with TestClient(TestServer(service.create_app(scrape))) as client:
+            await check(client)
+
+    asyncio.run(main())
+
+
+def test_submit_beyond_capacity_returns_429(llm):
+    async def check(client):
+        first = await client.post("/v1/jobs", json=BODY)
+        assert first.status == 202
+        second = await client.post("/v1/jobs", json=BODY)
+        assert second.status == 429
+        assert second.headers["Retry-After"] == "5"
+        stats = await (await client.get("/v1/stats")).json()
+        assert stats["accepted"] == 1 and stats["rejected"] == 1
+
+    _run(llm, check)
+
+
+def test_extract_past_timeout_returns_504(llm):
+    async def check(client):
+        resp = await client.post("/v1/extract?timeout=1", json=BODY)
+        assert resp.status == 504
+        body = await resp.json()
+        assert (await client.get(body["result_url"])).status == 202
+        # 超时不会中断任务，完成后仍可按 ID 取到结果
+        job = client.server.app[service.SERVICE_KEY].get(body["id"])
+        assert await client.server.app[service.SERVICE_KEY].wait(job, 10)
+        result = await client.get(body["result_url"])
+        assert result.status == 200
+        assert (await result.json())["result"]
+
+    _run(llm, check)
+
+
+def test_extract_stream_returns_ndjson_ending_with_result(llm):
+    async def check(client):
+        resp = await client.post("/v1/extract?stream=1", json=BODY)
+        assert resp.status == 200
+        assert resp.headers["Content-Type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in (await resp.text()).splitlines()]
+        types = [line["type"] for line in lines]
+        assert types[0] == "started"
+        assert "progress" in types
+        assert types[-2:] == [service.DONE, "result"]
+        assert lines[-1]["state"] == service.DONE
+        assert lines[-1]["result"]
+
+    _run(llm, check, workers=2, queue_size=1)
+
+
+def test_list_with_invalid_limit_returns_400(llm):
+    async def check(client):
+        resp = await client.get("/v1/jobs?limit=abc")
+        assert resp.status == 400
+        assert "limit" in (await resp.json())["error"]
+        assert (await client.get("/v1/jobs?limit=5")).status == 200
+
+    _run(llm, check)
@@ -1,129 +1,68 @@
 import sys
 from pathlib import Path
-import os
-import asyncio
 import json
+from typing import Optional
 
-import requests
 import streamlit as st
-from scrapegraphai.graphs import SmartScraperGraph
-from playwright.async_api import async_playwright, TimeoutError
 
 # Ensure project root is on sys.path so absolute imports work when run via `streamlit run unified_app/app.py`
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from unified_app.config import AppConfig, build_graph_config
-from unified_app.history import load_history, append_history
+from unified_app.config import AppConfig
+from unified_app.crawler import (
+    BFS,
+    FETCH_BROWSER,
+    FETCH_HTTP,
+    PATTERN,
+    CrawlConfig,
+    Crawler,
+    list_crawls,
+    start_crawl_process,
+    stop_crawl,
+)
+from unified_app.coalesce import COALESCER, coalesce_key
+from unified_app.history import load_history
+from unified_app.jobs import JobStore, ensure_pool, QUEUED, RUNNING, DONE, FAILED
+from unified_app.endpoints import LOCAL_PROVIDERS, EndpointPool
+from unified_app.har import MODES as HAR_MODES
+from unified_app.llm_cassette import MODES as CASSETTE_MODES, mode_from_env
+from unified_app.monitor import MonitorStore, parse_selectors
+from unified_app.pipeline import ScrapeRequest, run_scrape
+from unified_app.profiling import MODES as PROFILE_MODES, resolve_path as resolve_profile_path
+from unified_app.residency import ModelResidency
+from unified_app.router import AUTO
+from unified_app.startup import WarmupReport, start_background_warmup, warmup_enabled
 
 
 st.set_page_config(page_title="统一 Web Scraping AI Agent", layout="wide")
 
 
-async def fetch_html_with_playwright(
-    url: str,
-    need_login: bool = False,
-    login_url: str | None = None,
-    use_storage: bool = True,
-    manual_login: bool = False,
-    headless: bool = True,
-    page_wait_strategy: str = "domcontentloaded",
-    page_timeout: int = 60,
-):
-    """复用原有 LM Studio demo 中的 Playwright 登录抓取逻辑。"""
-    storage_state_path = "login_state.json" if need_login and use_storage else None
-
-    async with async_playwright() as p:
-        if need_login:
-            st.info("🔑 启动带登录的浏览器...")
-        browser = await p.chromium.launch(headless=headless)
-
-        # 读取存储状态
-        context_options = {"accept_downloads": False}
-        if storage_state_path and os.path.exists(storage_state_path):
-            try:
-                raw_state = Path(storage_state_path).read_text(encoding="utf-8").strip()
-                if raw_state:
-                    json.loads(raw_state)
-                    context_options["storage_state"] = storage_state_path
-                    st.info("🔑 检测到保存的登录状态，将自动使用")
-                else:
-                    st.warning("⚠️ 检测到空的 login_state.json，已忽略并删除，请重新登录")
-                    os.remove(storage_state_path)
-            except Exception:
-                st.warning("⚠️ 登录状态文件不可用，已忽略")
-
-        context = await browser.new_context(**context_options)
-        page = await context.new_page()
+def st_reporter(level: str, message: str) -> None:
+    """把抓取流水线的进度提示输出到 Streamlit 页面。"""
+    getattr(st, level, st.info)(message)
 
-        try:
-            if need_login:
-                target_login_url = login_url if login_url else url
-                st.info(f"🔐 正在访问登录页面: {target_login_url}")
-                try:
-                    await page.goto(
-                        target_login_url,
-                        wait_until=page_wait_strategy,
-                        timeout=page_timeout * 1000,
-                    )
-                except TimeoutError:
-                    st.warning("⚠️ 登录页加载超时，改用 domcontentloaded 再试")
-                    await page.goto(
-                        target_login_url,
-                        wait_until="domcontentloaded",
-                        timeout=page_timeout * 1000,
-                    )
-                await page.wait_for_timeout(2000)
 
-                if manual_login:
-                    st.warning(
-                        "⚠️ 手动登录模式开启，请在弹出的浏览器中完成登录。"
-                    )
-                    # 这里沿用原 demo 的简化逻辑：等待用户在浏览器中完成登录
-                    waited = 0
-                    interval = 3000
-                    while waited < 300_000:
-                        await page.wait_for_timeout(interval)
-                        waited += interval
-                        cur = page.url
-                        st.info(f"📍 当前页面: {cur}")
-                        if "/login" not in cur and "signin" not in cur:
-                            st.success("✅ 检测到已登录，继续抓取页面")
-                            break
-                    else:
-                        st.error("❌ 登录超时，请重试")
-                        return None
+@st.cache_resource(show_spinner=False)
+def background_warmup() -> Optional[WarmupReport]:
+    """每个 Streamlit 服务进程只预热一次（设置 SCRAPER_WARMUP=1 开启）。"""
+    if not warmup_enabled():
+        return None
+    return start_background_warmup(AppConfig.load())
 
-                    if storage_state_path:
-                        await context.storage_state(path=storage_state_path)
-                        st.success("✅ 登录状态已保存到 login_state.json")
 
-            # 访问目标页
-            st.info(f"🌐 正在访问: {url}")
-            target_wait_until = (
-                "domcontentloaded" if "github.com" in url else page_wait_strategy
-            )
-            try:
-                await page.goto(
-                    url,
-                    wait_until=target_wait_until,
-                    timeout=page_timeout * 1000,
-                )
-            except TimeoutError:
-                st.warning("⚠️ 页面加载超时，改用 domcontentloaded 再试")
-                await page.goto(
-                    url,
-                    wait_until="domcontentloaded",
-                    timeout=page_timeout * 1000,
-                )
-
-            await page.wait_for_timeout(2000)
-            html = await page.content()
-            st.success("✅ 已获取页面 HTML")
-            return html
-        finally:
-            await browser.close()
+def render_warmup(report: Optional[WarmupReport]) -> None:
+    if report is None:
+        return
+    state = "已完成" if report.done else "进行中"
+    with st.sidebar.expander(f"⏱️ 启动预热（{state}）", expanded=False):
+        st.caption(f"开始于 {report.started_at} · 合计 {report.total_s:.1f}s")
+        for step in list(report.steps):
+            mark = "✅" if step.ok else "⚠️"
+            st.markdown(f"{mark} `{step.name}` {step.seconds:.2f}s")
+            if not step.ok:
+                st.caption(step.detail)
 
 
 def render_provider_settings(app_cfg: AppConfig) -> AppConfig:
@@ -156,6 +95,9 @@ def render_provider_settings(app_cfg: AppConfig) -> AppConfig:
 
         # 测试 OpenAI 连接并拉取模型列表
         if st.sidebar.button("🔍 测试连接", help="测试 OpenAI API 是否可用，并列出部分模型"):
+            # 仅在测试连接时才需要，延迟导入以加快首屏
+            import requests
+
             with st.sidebar:
                 if not app_cfg.openai.api_key:
                     st.error("❌ 请先填写 OpenAI API Key")
@@ -225,6 +167,8 @@ def render_provider_settings(app_cfg: AppConfig) -> AppConfig:
 
         # 测试 Ollama 连接并拉取模型列表
         if st.sidebar.button("🔍 测试连接", help="测试 Ollama Server 是否可用，并列出本地模型"):
+            import requests
+
             with st.sidebar:
                 with st.spinner("正在测试 Ollama 连接并获取模型列表..."):
                     try:
@@ -298,6 +242,8 @@ def render_provider_settings(app_cfg: AppConfig) -> AppConfig:
 
         # 测试 LM Studio 连接并列出模型
         if st.sidebar.button("🔍 测试连接", help="测试 LM Studio 服务器是否可用"):
+            import requests
+
             with st.sidebar:
                 with st.spinner("正在测试连接..."):
                     try:
@@ -348,6 +294,9 @@ def render_provider_settings(app_cfg: AppConfig) -> AppConfig:
             )
             app_cfg.lmstudio.model = selected
 
+    render_endpoints(app_cfg)
+    render_residency(app_cfg)
+
     if st.sidebar.button("💾 保存配置"):
         app_cfg.save()
         st.sidebar.success("配置已保存到本地 unified_config.json")
@@ -355,6 +304,76 @@ def render_provider_settings(app_cfg: AppConfig) -> AppConfig:
     return app_cfg
 
 
+def _parse_endpoints(text: str) -> list:
+    """每行一个地址，后面可以跟权重，例如 "http://gpu-2:1234/v1 2"。"""
+    endpoints = []
+    for line in _lines(text):
+        url, _, weight = line.partition(" ")
+        try:
+            endpoints.append({"base_url": url, "weight": float(weight.strip() or 1)})
+        except ValueError:
+            st.sidebar.warning(f"无法解析权重：{line}")
+    return endpoints
+
+
+def render_endpoints(app_cfg: AppConfig) -> None:
+    """同一 provider 的多台本地模型服务与各端点的状态。"""
+    if app_cfg.provider not in LOCAL_PROVIDERS:
+        return
+    section = getattr(app_cfg, app_cfg.provider)
+    with st.sidebar.expander("🖧 多端点负载均衡", expanded=False):
+        text = st.text_area(
+            "端点（每行一个地址，可在后面加权重）",
+            value="\n".join(
+                f"{e['base_url']} {e.get('weight', 1):g}" if isinstance(e, dict) else str(e) for e in section.endpoints
+            ),
+            placeholder=f"{section.base_url} 1\nhttp://192.168.2.130:{'11434' if app_cfg.provider == 'ollama' else '1234/v1'} 2",
+            help="留空时只使用上面的地址；列出多台服务时每次抽取挑选进行中请求最少、已加载模型的一台",
+        )
+        section.endpoints = _parse_endpoints(text)
+        pool = EndpointPool(app_cfg)
+        if not pool.pooled:
+            return
+        if st.button("检查端点", key="check_endpoints"):
+            with st.spinner("正在检查各端点..."):
+                pool.check(force=True)
+        for state in pool.states():
+            st.caption(state.summary())
+
+
+@st.cache_data(ttl=10, show_spinner=False)
+def _model_states(_app_cfg: AppConfig, key: tuple) -> list:
+    """key 为 (provider, 服务地址, 模型)，只用于区分缓存；状态每 10 秒最多查询一次。"""
+    return ModelResidency(_app_cfg).status()
+
+
+def render_residency(app_cfg: AppConfig) -> None:
+    """本地模型的加载状态、常驻时长与手动预加载。"""
+    residency = ModelResidency(app_cfg)
+    if not residency.local:
+        return
+    with st.sidebar.expander("🔥 模型常驻", expanded=False):
+        keep_alive_min = st.number_input(
+            "空闲多久后卸载（分钟，-1 表示一直常驻）",
+            min_value=-1,
+            max_value=24 * 60,
+            value=app_cfg.residency.keep_alive_s // 60 if app_cfg.residency.keep_alive_s > 0 else -1,
+            help="Ollama 通过 keep_alive、LM Studio 通过 ttl 控制；批量任务开始前会自动预加载",
+        )
+        app_cfg.residency.keep_alive_s = int(keep_alive_min) * 60 if keep_alive_min > 0 else -1
+        key = (app_cfg.provider, residency.server, tuple(model for _, model in residency.targets()))
+        if st.button("预加载模型", key="preload_models"):
+            with st.spinner("正在加载模型..."):
+                for r in residency.preload():
+                    if r.ok:
+                        st.success(f"{r.model} 已加载（{r.seconds:.1f}s）")
+                    else:
+                        st.warning(f"{r.model} 加载失败：{r.detail}")
+            _model_states.clear()
+        for state in _model_states(app_cfg, key):
+            st.caption(state.summary())
+
+
 def render_history():
     st.sidebar.markdown("---")
     st.sidebar.subheader("历史记录")
@@ -370,15 +389,48 @@ def render_history():
             if item.summary:
                 st.write("**摘要：**")
                 st.write(item.summary)
+            if item.metrics:
+                st.caption(
+                    f"耗时 {item.metrics.get('total_s', 0):.1f}s · "
+                    f"tokens {item.metrics.get('tokens_in', 0)}/{item.metrics.get('tokens_out', 0)}"
+                )
+                render_profile_downloads(item.metrics.get("profile"), key=item.timestamp)
+
+
+def render_profile_downloads(stored: str, key: str) -> None:
+    """历史记录中保存了性能剖析时，逐个文件提供下载（点击时才读取文件）。"""
+    if not stored:
+        return
+    directory = resolve_profile_path(stored)
+    files = sorted(directory.iterdir()) if directory.is_dir() else []
+    if not files:
+        st.caption(f"性能剖析 {stored} 已被清理")
+        return
+    st.caption(f"🔬 性能剖析：{stored}")
+    for path in files:
+        st.download_button(
+            path.name,
+            data=path.read_bytes,
+            file_name=f"{directory.name}-{path.name}",
+            key=f"profile-{key}-{path.name}",
+        )
 
 
 def main():
     st.title("统一 Web Scraping AI Agent 🕷️")
     st.caption("支持 OpenAI / Ollama / LM Studio，多厂商统一配置，结果本地存储与历史记录浏览")
 
+    warmup = background_warmup()
     app_cfg = AppConfig.load()
     app_cfg = render_provider_settings(app_cfg)
+    auto_route = st.sidebar.checkbox(
+        "🧭 按任务自动选择模型",
+        value=False,
+        help="在 " + " / ".join(app_cfg.routing.candidates) + " 中按页面大小、Schema 复杂度、实测速度、排队情况和当日预算"
+        "为每个任务选择模型（参数见配置文件中的 routing 段），上面选择的厂商仅在未开启时使用",
+    )
     render_history()
+    render_warmup(warmup)
 
     # 高级选项（页面加载）
     st.sidebar.subheader("高级选项")
@@ -393,6 +445,12 @@ def main():
         value=True,
         help="确保 JavaScript 动态内容被正确加载",
     )
+    snapshot = st.sidebar.checkbox(
+        "页面内精简快照",
+        value=False,
+        help="用浏览器获取页面，并在页面内只提取可见文本、链接、表格与表单标签（展开 shadow DOM 与同源 iframe），"
+        "代替传输完整 HTML，传输量与模型输入都更小；快照不保留 class/id，监控模式的 CSS 选择器不可用",
+    )
     wait_time = st.sidebar.slider(
         "额外等待时间（秒）",
         min_value=0,
@@ -401,6 +459,70 @@ def main():
         help="页面加载后的额外等待时间，确保动态内容渲染完成",
     )
 
+    llm_cassette = st.sidebar.selectbox(
+        "LLM 录制/回放",
+        list(CASSETTE_MODES),
+        index=list(CASSETTE_MODES).index(mode_from_env()),
+        help="record：保存模型请求与响应；replay：命中录制时直接回放，不访问模型；"
+        "strict：只回放，遇到未录制的请求报错。用于调试展示逻辑或 Schema 时快速重跑",
+    )
+    polite = st.sidebar.checkbox(
+        "礼貌抓取",
+        value=False,
+        help="按域名限制并发与请求间隔，遇到 429/403 自动退避，遵守 robots.txt；"
+        "在配置文件的 politeness 段中可设置代理池与按域名的参数",
+    )
+    har_mode = st.sidebar.selectbox(
+        "页面 HAR 录制/回放",
+        list(HAR_MODES),
+        index=0,
+        help="record：用 Playwright 获取页面并保存为 HAR 归档；replay：从归档离线回放页面，"
+        "不访问真实站点，归档中缺失的请求会被中止并提示",
+    )
+    profile_mode = st.sidebar.selectbox(
+        "性能剖析",
+        list(PROFILE_MODES),
+        index=list(PROFILE_MODES).index(app_cfg.profiling.mode) if app_cfg.profiling.mode in PROFILE_MODES else 0,
+        help=f"slow：每次运行都采样调用栈（Playwright 运行时同时录制 trace），耗时超过 "
+        f"{app_cfg.profiling.slow_threshold_s:g}s 时保存；always：每次都保存。"
+        "保存的剖析可在侧边栏历史记录中下载，阈值与采样间隔在配置文件的 profiling 段中设置",
+    )
+    app_cfg.coalescing.enabled = st.sidebar.checkbox(
+        "合并相同的进行中请求",
+        value=app_cfg.coalescing.enabled,
+        help="其他会话正在运行相同的请求（URL、登录身份、提示词、Schema、模型与抓取选项都相同）时，"
+        "挂到那一次运行上共享结果，不再重复启动浏览器和调用模型；后台任务同样合并到排队或运行中的相同任务",
+    )
+    in_flight = COALESCER.snapshot()
+    if in_flight:
+        st.sidebar.caption(
+            f"🔗 进行中 {len(in_flight)} 个请求，共 {sum(r['waiters'] for r in in_flight)} 个合并等待 · "
+            f"累计合并 {COALESCER.stats.coalesced} 次（{COALESCER.stats.saved_ratio:.0%}）"
+        )
+    sink_text = st.sidebar.text_area(
+        "结果存储（每行一个，可选）",
+        value="\n".join(app_cfg.sinks.targets),
+        placeholder="jsonl:results.jsonl\nsqlite:results.db\nparquet:results.parquet",
+        height=80,
+        help="抓取结果除了显示在页面上，还会写入这些存储；相对路径位于 results/ 目录下。"
+        "写入按批缓冲，批大小与间隔在配置文件的 sinks 段中设置；Parquet 需要安装 pyarrow",
+    )
+    app_cfg.sinks.targets = _lines(sink_text)
+    if app_cfg.sinks.targets:
+        app_cfg.dedupe.enabled = st.sidebar.checkbox(
+            "写入前去重合并",
+            value=app_cfg.dedupe.enabled,
+            help="按去重键合并重复记录（不填键时只丢弃内容完全相同的记录），较新的非空字段覆盖旧值；"
+            "SQLite 存储按 dedupe_key 覆盖旧行。条目列表、近似距离与索引上限在配置文件的 dedupe 段中设置",
+        )
+        if app_cfg.dedupe.enabled:
+            dedupe_keys = st.sidebar.text_input(
+                "去重键（逗号分隔，留空按内容去重）",
+                value=",".join(app_cfg.dedupe.keys),
+                placeholder="url 或 result.note_id",
+            )
+            app_cfg.dedupe.keys = [k.strip() for k in dedupe_keys.split(",") if k.strip()]
+
     # 登录选项（Playwright）
     st.sidebar.subheader("登录选项（需要登录的网站）")
     need_login = st.sidebar.checkbox("需要登录", value=False)
@@ -427,6 +549,32 @@ def main():
         else True
     )
 
+    # 变化监控：内容未变化时跳过 LLM，复用上次结果
+    st.sidebar.subheader("变化监控")
+    monitor_mode = st.sidebar.checkbox(
+        "监控模式",
+        value=False,
+        help="对比页面内容指纹，未变化时跳过模型抽取并复用上次结果；变化时只发送变化片段",
+    )
+    monitor_selectors = (
+        parse_selectors(
+            st.sidebar.text_input(
+                "监控区域选择器（可选）",
+                value="",
+                help="逗号分隔的 CSS 选择器，只比较这些区域，例如：main, #price",
+            )
+        )
+        if monitor_mode
+        else []
+    )
+    if monitor_mode:
+        monitor_stats = MonitorStore().stats()
+        if monitor_stats.checks:
+            st.sidebar.caption(
+                f"累计检查 {monitor_stats.checks} 次，跳过 {monitor_stats.skips} 次"
+                f"（跳过率 {monitor_stats.skip_rate:.0%}）"
+            )
+
     st.markdown("### 抓取配置")
     col_url, col_prompt = st.columns(2)
     with col_url:
@@ -464,115 +612,360 @@ def main():
         except Exception:
             st.warning("JSON Schema 解析失败，将忽略结构化约束")
             json_schema = None
+    schema_reask = (
+        st.checkbox(
+            "结果无法在本地修复时追问模型一次",
+            value=True,
+            help="抽取结果会先按 Schema 在本地校验和修复（多余文字、未加引号的键、类型转换、缺失字段补 null），"
+            "仍不符合时只把校验错误发给模型修正，不重新抓取页面",
+        )
+        if use_schema
+        else True
+    )
 
     show_raw_html = st.checkbox(
         "显示原始 HTML（调试用）", value=False, help="显示抓取到的原始 HTML 内容，用于调试"
     )
 
+    background = st.checkbox(
+        "后台运行（刷新页面不会中断任务）",
+        value=False,
+        help="提交到本地任务队列，由独立的工作进程执行，可同时运行多个抓取任务",
+    )
+
+    crawl_mode = st.checkbox(
+        "🕸️ 爬取模式（从该 URL 出发跟随链接，逐页抽取）",
+        value=False,
+        help="按范围规则跟随站内链接，每个页面都执行上面的抽取提示；在独立进程中运行，可随时停止并继续",
+    )
+    crawl_config = (
+        render_crawl_options(url, user_prompt, json_schema, app_cfg, polite, auto_route, snapshot, profile_mode)
+        if crawl_mode
+        else None
+    )
+
     st.markdown("---")
     if st.button("🚀 开始抓取", type="primary"):
         if not url or not user_prompt:
             st.warning("请填写 URL 和抓取提示")
-        elif app_cfg.provider == "openai" and not app_cfg.openai.api_key:
+        elif not auto_route and app_cfg.provider == "openai" and not app_cfg.openai.api_key:
             st.warning("请选择 OpenAI 时需要填写 API Key")
+        elif crawl_config is not None:
+            # 爬取进程读取的是本地配置文件，先保存当前侧边栏配置
+            app_cfg.save()
+            with st.spinner("正在准备种子 URL..."):
+                crawler = Crawler.create(crawl_config, app_cfg=app_cfg, reporter=st_reporter)
+            start_crawl_process(crawler.crawl_id)
+            st.success(f"✅ 已开始爬取 {crawler.crawl_id}，待爬 {crawler.stats.enqueued} 个 URL，可在下方“爬取任务”中查看进度")
         else:
-            graph_config = build_graph_config(app_cfg)
-
-            # loader_kwargs 复用原有高级选项配置
-            loader_kwargs = {
-                "load_state": wait_for_load,
-                "requires_js_support": enable_js,
-                "timeout": 60 + wait_time,
-            }
-            graph_config["loader_kwargs"] = loader_kwargs
-
-            with st.spinner("正在抓取并解析网页数据..."):
-                try:
-                    # 如需登录，先用 Playwright 获取登录态页面的 HTML
-                    page_html = None
-                    if need_login:
-                        page_html = asyncio.run(
-                            fetch_html_with_playwright(
-                                url=url,
-                                need_login=need_login,
-                                login_url=login_url,
-                                use_storage=use_storage,
-                                manual_login=manual_login,
-                                headless=headless,
-                                page_wait_strategy=wait_for_load,
-                                page_timeout=60 + wait_time,
-                            )
-                        )
-                        if not page_html:
-                            st.error("❌ 未能获取页面内容，请检查登录状态")
-                            return
-
-                        if page_html and len(page_html) > 250_000:
-                            st.info(
-                                "ℹ️ 页面较大，已自动截断部分 HTML 以适配模型上下文长度（约 250k 字符）"
-                            )
-                            page_html = page_html[:250_000]
-
-                    source = page_html if page_html else url
-                    graph = SmartScraperGraph(
-                        prompt=user_prompt,
-                        source=source,
-                        config=graph_config,
-                        schema=json_schema if json_schema else None,
+            scrape_request = ScrapeRequest(
+                url=url,
+                prompt=user_prompt,
+                schema=json_schema,
+                provider=AUTO if auto_route else app_cfg.provider,
+                wait_for_load=wait_for_load,
+                enable_js=enable_js,
+                wait_time=wait_time,
+                need_login=need_login,
+                login_url=login_url,
+                use_storage=use_storage,
+                manual_login=manual_login,
+                headless=headless,
+                monitor=monitor_mode,
+                monitor_selectors=monitor_selectors,
+                llm_cassette=llm_cassette,
+                har_mode=har_mode,
+                polite=polite,
+                sinks=app_cfg.sinks.targets,
+                schema_reask=schema_reask,
+                snapshot=snapshot,
+                profile=profile_mode,
+            )
+            if background:
+                # 工作进程读取的是本地配置文件，先保存当前侧边栏配置
+                app_cfg.save()
+                if ensure_pool():
+                    st.info("⚙️ 已在后台启动工作进程池")
+                key = coalesce_key(app_cfg, scrape_request) if app_cfg.coalescing.enabled else None
+                job_id, attached = JobStore().attach_or_submit(scrape_request.to_dict(), key)
+                if attached:
+                    st.success(f"🔗 相同的请求已在后台任务 #{job_id} 中排队或运行，已合并到该任务，可在下方“后台任务”中查看进度")
+                else:
+                    st.success(f"✅ 已提交后台任务 #{job_id}，可在下方“后台任务”中查看进度")
+            else:
+                run_in_foreground(app_cfg, scrape_request, show_raw_html)
+
+    render_crawls()
+    render_jobs()
+
+
+def _lines(text: str) -> list:
+    return [line.strip() for line in (text or "").splitlines() if line.strip()]
+
+
+def render_crawl_options(
+    url, prompt, schema, app_cfg: AppConfig, polite: bool, auto_route: bool, snapshot: bool, profile: str
+) -> CrawlConfig:
+    with st.expander("爬取设置", expanded=True):
+        col_left, col_right = st.columns(2)
+        with col_left:
+            extra_seeds = st.text_area("其他种子 URL（每行一个，可选）", value="", height=80)
+            sitemap = st.text_input("sitemap 地址（可选）", placeholder="https://example.com/sitemap.xml")
+            max_depth = st.number_input("最大深度", min_value=0, max_value=10, value=2)
+            max_pages = st.number_input("最大页数", min_value=1, max_value=100_000, value=50)
+            same_domain = st.checkbox("只跟随同域名链接", value=True)
+        with col_right:
+            include = st.text_area("URL 必须匹配的正则（每行一个，可选）", value="", height=80)
+            exclude = st.text_area("排除 URL 的正则（每行一个，可选）", value="", height=80)
+            priority = st.selectbox(
+                "优先级",
+                [BFS, PATTERN],
+                format_func=lambda v: {BFS: "广度优先", PATTERN: "按正则顺序优先"}[v],
+            )
+            priority_patterns = (
+                st.text_area("优先的 URL 正则（按顺序，每行一个）", value="", height=68)
+                if priority == PATTERN
+                else ""
+            )
+            concurrency = st.slider("并发页数", 1, 8, 2)
+            batch_pages = st.number_input(
+                "每次模型调用合并的页数",
+                min_value=1,
+                max_value=64,
+                value=1,
+                help="大于 1 时把多个清洗后的页面合并为一次抽取请求（受模型上下文限制），适合大量小详情页；"
+                "不合格的页面会单独重试",
+            )
+            fetch_mode = st.selectbox(
+                "页面获取方式",
+                [FETCH_BROWSER, FETCH_HTTP],
+                format_func=lambda v: {FETCH_BROWSER: "浏览器渲染（支持 JS）", FETCH_HTTP: "直接请求 HTML（更快）"}[v],
+            )
+    return CrawlConfig(
+        seeds=[url] + _lines(extra_seeds) if url else _lines(extra_seeds),
+        prompt=prompt,
+        schema=schema,
+        provider=AUTO if auto_route else app_cfg.provider,
+        sitemap=sitemap.strip(),
+        same_domain=same_domain,
+        include=_lines(include),
+        exclude=_lines(exclude),
+        max_depth=int(max_depth),
+        max_pages=int(max_pages),
+        priority=priority,
+        priority_patterns=_lines(priority_patterns),
+        concurrency=concurrency,
+        fetch_mode=fetch_mode,
+        batch_pages=int(batch_pages),
+        snapshot=snapshot and fetch_mode == FETCH_BROWSER,
+        profile=profile,
+        polite=polite,
+        sinks=list(app_cfg.sinks.targets),
+    )
+
+
+@st.fragment(run_every=3)
+def render_crawls():
+    """爬取任务列表：读取各爬取目录中的断点状态。"""
+    crawls = list_crawls(limit=5)
+    if not crawls:
+        return
+
+    st.markdown("---")
+    st.markdown("### 爬取任务")
+    for crawl in crawls:
+        stats = crawl.stats
+        state = "运行中" if crawl.running else ("已完成" if stats.finished else "已暂停")
+        with st.container(border=True):
+            st.markdown(f"**{crawl.crawl_id} · {state}** · {', '.join(crawl.seeds)[:80]}")
+            st.caption(
+                f"成功 {stats.pages_done} · 失败 {stats.pages_failed} · robots 拒绝 {stats.disallowed} · "
+                f"待爬 {stats.frontier} · 去重 {stats.duplicates} · "
+                + (f"模型调用 {stats.batch_calls} · " if stats.batch_calls else "")
+                + (
+                    f"前缀缓存命中 {stats.cached_tokens / stats.prompt_tokens:.0%} · 预填充 {stats.prefill_s:.1f}s · "
+                    if stats.prompt_tokens
+                    else ""
+                )
+                + f"更新于 {stats.updated_at}"
+            )
+            if crawl.max_pages:
+                st.progress(min(stats.pages / crawl.max_pages, 1.0))
+            col_action, col_download = st.columns(2)
+            with col_action:
+                if crawl.running:
+                    if st.button("停止", key=f"stop_crawl_{crawl.crawl_id}"):
+                        stop_crawl(crawl.crawl_id)
+                        st.rerun(scope="fragment")
+                elif not stats.finished:
+                    if st.button("继续", key=f"resume_crawl_{crawl.crawl_id}"):
+                        start_crawl_process(crawl.crawl_id)
+                        st.rerun(scope="fragment")
+            with col_download:
+                if crawl.results_path.exists():
+                    st.download_button(
+                        "下载结果 (JSONL)",
+                        data=crawl.results_path.read_bytes(),
+                        file_name=f"{crawl.crawl_id}.jsonl",
+                        mime="application/x-ndjson",
+                        key=f"download_crawl_{crawl.crawl_id}",
                     )
-                    result = graph.run()
 
-                    append_history(
-                        provider=app_cfg.provider,
-                        url=url,
-                        prompt=user_prompt,
-                        result=result,
+
+def render_result(result):
+    if isinstance(result, dict):
+        if "content" in result and isinstance(result["content"], str):
+            st.markdown("#### 内容")
+            st.markdown(result["content"])
+        with st.expander("查看完整 JSON 结果", expanded=False):
+            st.json(result)
+    else:
+        st.write(result)
+
+
+def run_in_foreground(app_cfg: AppConfig, scrape_request: ScrapeRequest, show_raw_html: bool):
+    with st.spinner("正在抓取并解析网页数据..."):
+        try:
+            outcome = run_scrape(app_cfg, scrape_request, reporter=st_reporter)
+            page_html = outcome.page_html
+
+            st.success("✅ 抓取完成")
+            if outcome.coalesced:
+                st.caption("🔗 与其他会话中相同的请求合并，共享了同一次抓取与模型调用")
+            elif outcome.metrics is not None and outcome.metrics.waiters:
+                st.caption(f"🔗 另有 {outcome.metrics.waiters} 个相同的请求合并到了这次运行")
+            st.subheader("📊 抓取结果")
+            if outcome.metrics is not None:
+                stages = " · ".join(
+                    f"{name} {seconds:.2f}s" for name, seconds in outcome.metrics.stages.items()
+                )
+                st.caption(f"总耗时 {outcome.metrics.total_s:.2f}s（{stages}）")
+            if outcome.route is not None:
+                route = outcome.route
+                st.caption(f"自动选择模型：{route.provider}/{route.model}（预计输入 {route.tokens_in} token）")
+                with st.expander("模型选择依据", expanded=False):
+                    for reason in route.reasons:
+                        st.markdown(f"- {reason}")
+                    st.dataframe(
+                        [
+                            {
+                                "provider": c.provider,
+                                "模型": c.model,
+                                "可选": "是" if c.eligible else f"否：{c.note}",
+                                "预计耗时(s)": round(c.predicted_s, 1),
+                                "失败率": f"{c.failure_rate:.0%}",
+                                "花费($)": round(c.cost_usd, 4),
+                                "排队": c.queue,
+                                "评分": round(c.score, 1),
+                            }
+                            for c in route.candidates
+                        ],
+                        use_container_width=True,
+                        hide_index=True,
+                    )
+            if outcome.cassette_stats is not None:
+                cs = outcome.cassette_stats
+                st.caption(f"LLM 录制/回放：命中 {cs.hits} · 未命中 {cs.misses} · 新录制 {cs.recorded}")
+            if outcome.har is not None:
+                st.caption(outcome.har.summary())
+                if outcome.har.misses:
+                    with st.expander("HAR 中缺失的请求", expanded=False):
+                        st.code("\n".join(outcome.har.misses))
+            schema_check = outcome.schema_check
+            if schema_check is not None:
+                label = {
+                    "valid": "直接通过",
+                    "repaired": f"本地修复后通过（{len(schema_check.repairs)} 处）",
+                    "reasked": "追问一次后通过",
+                    "failed": "未通过",
+                }[schema_check.status]
+                st.caption(f"结构化校验：{label}")
+                if schema_check.errors:
+                    with st.expander("Schema 校验错误", expanded=False):
+                        st.code("\n".join(schema_check.errors))
+                elif schema_check.repairs:
+                    with st.expander("本地修复明细", expanded=False):
+                        st.code("\n".join(schema_check.repairs))
+            for stats in outcome.sink_stats:
+                st.caption(f"已写入 {stats.summary()}")
+            for error in outcome.sink_errors:
+                st.warning(f"结果存储写入失败：{error}")
+
+            check = outcome.monitor_check
+            if check is not None and check.diff:
+                with st.expander("查看内容变化（diff）", expanded=False):
+                    st.code(check.diff, language="diff")
+
+            # 调试：显示 HTML
+            if show_raw_html and page_html:
+                with st.expander("🔍 登录后页面 HTML（调试）", expanded=False):
+                    st.code(
+                        page_html[:5000] + "\n... (截断)", language="html"
                     )
 
-                    st.success("✅ 抓取完成")
-                    st.subheader("📊 抓取结果")
+            render_result(outcome.result)
+        except Exception as e:
+            import traceback
+
+            err_text = str(e)
+            st.error(f"抓取失败：{err_text}")
+
+            # 针对常见的本地 LLM / OpenAI 兼容错误给出更友好的提示
+            if "503" in err_text or "InternalServerError" in err_text:
+                st.warning(
+                    "📡 检测到 503 错误：本地 LLM 服务（如 LM Studio 或 Ollama）未就绪、模型未加载或服务器过载。\n\n"
+                    "请检查：\n"
+                    "1. LM Studio / Ollama Server 是否正在运行；\n"
+                    "2. 是否已经在 Server 面板中加载了对应模型；\n"
+                    "3. 统一应用中填写的 Base URL 与实际 Server 地址/端口是否一致。"
+                )
+            elif "Model does not exist" in err_text or "Failed to load model" in err_text:
+                st.warning(
+                    "🧠 当前选择的模型在本地服务中不存在或尚未正确加载。\n\n"
+                    "请在 LM Studio / Ollama 中确认：\n"
+                    "1. 模型已经下载并成功 Load；\n"
+                    "2. Server 页面中当前服务的模型名称，与侧边栏下拉选择的名称完全一致；\n"
+                    "3. 如果刚刚修改了模型，请重新点击侧边栏的“🔍 测试连接”刷新模型列表后再重试。"
+                )
 
-                    # 调试：显示 HTML
-                    if show_raw_html and page_html:
-                        with st.expander("🔍 登录后页面 HTML（调试）", expanded=False):
-                            st.code(
-                                page_html[:5000] + "\n... (截断)", language="html"
-                            )
+            with st.expander("错误详情"):
+                st.code(traceback.format_exc())
 
-                    if isinstance(result, dict):
-                        if "content" in result and isinstance(result["content"], str):
-                            st.markdown("#### 内容")
-                            st.markdown(result["content"])
-                        with st.expander("查看完整 JSON 结果", expanded=False):
-                            st.json(result)
-                    else:
-                        st.write(result)
-                except Exception as e:
-                    import traceback
-
-                    err_text = str(e)
-                    st.error(f"抓取失败：{err_text}")
-
-                    # 针对常见的本地 LLM / OpenAI 兼容错误给出更友好的提示
-                    if "503" in err_text or "InternalServerError" in err_text:
-                        st.warning(
-                            "📡 检测到 503 错误：本地 LLM 服务（如 LM Studio 或 Ollama）未就绪、模型未加载或服务器过载。\n\n"
-                            "请检查：\n"
-                            "1. LM Studio / Ollama Server 是否正在运行；\n"
-                            "2. 是否已经在 Server 面板中加载了对应模型；\n"
-                            "3. 统一应用中填写的 Base URL 与实际 Server 地址/端口是否一致。"
-                        )
-                    elif "Model does not exist" in err_text or "Failed to load model" in err_text:
-                        st.warning(
-                            "🧠 当前选择的模型在本地服务中不存在或尚未正确加载。\n\n"
-                            "请在 LM Studio / Ollama 中确认：\n"
-                            "1. 模型已经下载并成功 Load；\n"
-                            "2. Server 页面中当前服务的模型名称，与侧边栏下拉选择的名称完全一致；\n"
-                            "3. 如果刚刚修改了模型，请重新点击侧边栏的“🔍 测试连接”刷新模型列表后再重试。"
-                        )
-
-                    with st.expander("错误详情"):
-                        st.code(traceback.format_exc())
+
+@st.fragment(run_every=3)
+def render_jobs():
+    """后台任务列表：定时轮询任务库，页面重新加载后依然可见。"""
+    store = JobStore()
+    jobs = store.list_recent(limit=10)
+    if not jobs:
+        return
+
+    st.markdown("---")
+    st.markdown("### 后台任务")
+    counts = store.counts()
+    st.caption(
+        f"排队 {counts.get(QUEUED, 0)} · 运行中 {counts.get(RUNNING, 0)} · "
+        f"完成 {counts.get(DONE, 0)} · 失败 {counts.get(FAILED, 0)} · "
+        f"工作进程 {store.live_workers()}"
+    )
+    for job in jobs:
+        url = job.request.get("url", "")
+        # 结果展示中包含 expander，Streamlit 不允许 expander 嵌套，这里用带边框的容器
+        with st.container(border=True):
+            shared = f" · 🔗 另有 {job.waiters} 个相同提交" if job.waiters else ""
+            st.markdown(f"**#{job.id} · {job.state}** · {url}{shared}")
+            st.caption(f"提交于 {job.created_at} · {job.message}")
+            if job.active:
+                st.progress(min(max(job.progress, 0.0), 1.0))
+                if st.button("取消任务", key=f"cancel_job_{job.id}"):
+                    store.cancel(job.id)
+                    st.rerun(scope="fragment")
+            elif job.state == DONE:
+                render_result(job.result)
+            elif job.state == FAILED and job.error:
+                st.error(job.error.split("\n", 1)[0])
+                with st.expander("错误详情"):
+                    st.code(job.error)
 
 
 if __name__ == "__main__":
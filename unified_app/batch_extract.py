@@ -0,0 +1,373 @@
+"""
+批量抽取：把多个清洗后的小页面打包进一次模型调用。
+
+详情页清洗后往往只有几 KB，逐页调用 SmartScraperGraph 时每页都要付出完整的提示词开销和一次往返。
+批量模式下：
+
+1. 每页按 monitor.normalise_html 去掉脚本/样式等噪声，只保留可见文本
+2. 按模型可接受的输入 token（配置文件 routing.max_input_tokens）依次装箱，每页前加 "=== PAGE n | URL ===" 分隔
+3. 要求模型返回 {"pages": [{"page": n, "result": ...}]}，按编号映射回各自的 URL
+4. 每页结果单独按 JSON Schema 校验与本地修复（见 schema_repair.py）；缺失或不合格的页面对半拆分后重新请求，
+   只重试这些页面，拆到单页仍不合格才记为失败
+
+爬取模式中设置 batch_pages 即可启用（见 crawler.py）。对比批量与逐页调用的吞吐：
+    python -m unified_app.batch_extract --mock-llm --pages 32
+    python -m unified_app.batch_extract https://example.com/a https://example.com/b --prompt "提取标题和价格"
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import time
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from unified_app.config import AppConfig, active_model, build_graph_config
+from unified_app.endpoints import EndpointPool
+from unified_app.llm_cassette import apply_cassette, mode_from_env
+from unified_app.monitor import normalise_html
+from unified_app.prompt_cache import CacheReport, build_messages
+from unified_app.residency import ModelResidency
+from unified_app.router import AUTO, ModelRouter, schema_complexity
+from unified_app.schema_repair import check_and_repair, chat_json, compiled_validator, parse_json_text
+
+
+# 单页清洗后文本的上限，超出部分截断（一页就占满上下文时也只能单独请求）
+MAX_PAGE_CHARS = 60_000
+# 一次请求最多打包的页数：页数越多，模型越容易漏页或串页
+DEFAULT_MAX_PAGES = 16
+# 系统提示、抽取提示与 Schema 之外预留的 token
+PROMPT_OVERHEAD_TOKENS = 300
+DEFAULT_MAX_INPUT_TOKENS = 8_000
+
+_SYSTEM_PROMPT = (
+    "You extract structured data from several web pages at once. "
+    "Each page starts with a line '=== PAGE <n> | <url> ===' and ends where the next page starts. "
+    "Apply the user's instruction to every page separately and never mix data between pages. "
+    'Reply with JSON only: {"pages": [{"page": <n>, "result": <data for page n>}]}, '
+    "with exactly one entry per page."
+)
+
+
+def _estimate_tokens(text: str) -> int:
+    # 与 router.py 相同，按约 3 个字符一个 token 估算
+    return max(1, len(text) // 3)
+
+
+@dataclass
+class BatchPage:
+    url: str
+    text: str
+
+    @classmethod
+    def from_html(cls, url: str, html: str) -> "BatchPage":
+        return cls(url=url, text="\n".join(normalise_html(html))[:MAX_PAGE_CHARS])
+
+    @property
+    def tokens(self) -> int:
+        return _estimate_tokens(self.text)
+
+
+@dataclass
+class PageResult:
+    url: str
+    ok: bool
+    result: Any = None
+    error: str = ""
+    # 开启 JSON Schema 时的校验结果（valid / repaired / failed）
+    schema_status: str = ""
+    # 该页参与过的模型调用次数，大于 1 表示经过拆分重试
+    attempts: int = 0
+
+
+@dataclass
+class BatchStats:
+    pages: int = 0
+    ok: int = 0
+    failed: int = 0
+    calls: int = 0
+    # 拆分后重新请求的页次
+    retried: int = 0
+    tokens_in: int = 0
+    tokens_out: int = 0
+    seconds: float = 0.0
+
+    @property
+    def pages_per_minute(self) -> float:
+        return self.pages * 60 / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.pages} 页 · {self.calls} 次模型调用 · 成功 {self.ok} · 失败 {self.failed} · "
+            f"重试 {self.retried} 页次 · {self.pages_per_minute:.1f} 页/分钟"
+        )
+
+
+def pack(pages: Sequence[BatchPage], max_input_tokens: int, tokens_out_per_page: int, max_pages: int) -> List[List[int]]:
+    """按顺序装箱，返回每批的页面下标；单页超出上限时单独成批。"""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    used = PROMPT_OVERHEAD_TOKENS
+    for i, page in enumerate(pages):
+        # 输出同样占用上下文，按每页预计的输出长度一并计入
+        cost = page.tokens + tokens_out_per_page + 20
+        if current and (used + cost > max_input_tokens or len(current) >= max_pages):
+            batches.append(current)
+            current, used = [], PROMPT_OVERHEAD_TOKENS
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def batch_schema(schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """把单页 Schema 包装为 {"pages": [{"page", "result"}]}，供支持 Schema 约束输出的模型使用。"""
+    result = dict(schema) if schema else {}
+    defs = {k: result.pop(k) for k in ("$defs", "definitions") if k in result}
+    wrapped: Dict[str, Any] = {
+        "type": "object",
+        "properties": {
+            "pages": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"page": {"type": "integer"}, "result": result},
+                    "required": ["page", "result"],
+                },
+            }
+        },
+        "required": ["pages"],
+    }
+    # $ref 指向根节点下的定义，包装后需要放回新的根节点
+    wrapped.update(defs)
+    return wrapped
+
+
+def _messages(prompt: str, schema: Optional[Dict[str, Any]], pages: Sequence[BatchPage]) -> List[Dict[str, str]]:
+    # 系统提示、抽取提示与 Schema 在前且逐字节不变，同一次运行的各批可以复用模型服务的前缀缓存，见 prompt_cache.py
+    instruction = f"Instruction for every page:\n{prompt}"
+    if schema:
+        instruction += "\n\nEach page's result must validate against the JSON Schema below."
+    body = "\n\n".join(f"=== PAGE {n} | {page.url} ===\n{page.text}" for n, page in enumerate(pages, 1))
+    return build_messages(_SYSTEM_PROMPT, instruction, schema, f"{body}\n\n=== END ({len(pages)} pages) ===")
+
+
+def map_results(content: str, count: int) -> Dict[int, Any]:
+    """把模型输出按页码（1 起）映射为 {页码: 结果}；页码缺失时按出现顺序对应。"""
+    value, _ = parse_json_text(content)
+    if isinstance(value, dict) and "pages" in value:
+        value = value["pages"]
+    if isinstance(value, dict):
+        # 也接受 {"1": {...}, "2": {...}}
+        value = [{"page": k, "result": v} for k, v in value.items()]
+    mapped: Dict[int, Any] = {}
+    if not isinstance(value, list):
+        return mapped
+    for position, entry in enumerate(value, 1):
+        if not isinstance(entry, dict) or "result" not in entry:
+            continue
+        try:
+            n = int(entry.get("page", position))
+        except (TypeError, ValueError):
+            n = position
+        if 1 <= n <= count and n not in mapped:
+            mapped[n] = entry["result"]
+    return mapped
+
+
+class BatchExtractor:
+    def __init__(
+        self,
+        graph_config: Dict[str, Any],
+        prompt: str,
+        schema: Optional[Dict[str, Any]] = None,
+        max_input_tokens: int = DEFAULT_MAX_INPUT_TOKENS,
+        max_pages: int = DEFAULT_MAX_PAGES,
+        residency: Optional[ModelResidency] = None,
+        endpoints: Optional[EndpointPool] = None,
+    ) -> None:
+        self.graph_config = graph_config
+        self.residency = residency
+        # 配置了多个端点时每次调用单独挑选一台服务，见 endpoints.py
+        self.endpoints = endpoints
+        self.prompt = prompt
+        self.schema = schema or None
+        # Schema 本身不合法时仍随提示发给模型，但不做逐页校验（与 pipeline.enforce_schema 一致）
+        self.validate = False
+        if self.schema:
+            try:
+                compiled_validator(self.schema)
+                self.validate = True
+            except ValueError:
+                pass
+        self.max_input_tokens = max_input_tokens
+        self.max_pages = max(1, max_pages)
+        self.tokens_out_per_page = ModelRouter.estimate_tokens_out(schema_complexity(self.schema))
+        self.stats = BatchStats()
+        self.cache = CacheReport()
+
+    @classmethod
+    def from_config(
+        cls,
+        app_cfg: AppConfig,
+        prompt: str,
+        schema: Optional[Dict[str, Any]] = None,
+        provider: Optional[str] = None,
+        max_pages: int = DEFAULT_MAX_PAGES,
+    ) -> "BatchExtractor":
+        """provider 为空或 auto 时使用配置文件中的 provider（整批共用一个模型，不逐页路由）。"""
+        cfg = app_cfg
+        if provider and provider not in (AUTO, app_cfg.provider):
+            cfg = copy.deepcopy(app_cfg)
+            cfg.provider = provider  # type: ignore[assignment]
+        graph_config = build_graph_config(cfg)
+        apply_cassette(graph_config, cfg.provider, mode_from_env())
+        limit = int(cfg.routing.max_input_tokens.get(cfg.provider, 0) or DEFAULT_MAX_INPUT_TOKENS)
+        return cls(
+            graph_config,
+            prompt,
+            schema,
+            max_input_tokens=limit,
+            max_pages=max_pages,
+            residency=ModelResidency(cfg),
+            endpoints=EndpointPool(cfg),
+        )
+
+    def extract(self, pages: Sequence[BatchPage]) -> List[PageResult]:
+        """按输入顺序返回每页的结果。"""
+        started = time.perf_counter()
+        results: List[Optional[PageResult]] = [None] * len(pages)
+        for batch in pack(pages, self.max_input_tokens, self.tokens_out_per_page, self.max_pages):
+            self._run(pages, batch, results)
+        self.stats.seconds += time.perf_counter() - started
+        out = [r for r in results if r is not None]
+        self.stats.pages += len(out)
+        self.stats.ok += sum(1 for r in out if r.ok)
+        self.stats.failed += sum(1 for r in out if not r.ok)
+        return out
+
+    def _run(self, pages: Sequence[BatchPage], batch: List[int], results: List[Optional[PageResult]]) -> None:
+        for i in batch:
+            if results[i] is None:
+                results[i] = PageResult(url=pages[i].url, ok=False)
+            results[i].attempts += 1
+
+        self.stats.calls += 1
+        try:
+            with self.endpoints.lease() if self.endpoints is not None else nullcontext() as endpoint:
+                graph_config = endpoint.point(self.graph_config) if endpoint is not None else self.graph_config
+                server = endpoint.url if endpoint is not None else None
+                with self.residency.gate(server) if self.residency is not None else nullcontext():
+                    content, tokens_in, tokens_out = chat_json(
+                        graph_config,
+                        _messages(self.prompt, self.schema, [pages[i] for i in batch]),
+                        batch_schema(self.schema),
+                        cache_report=self.cache,
+                    )
+            self.stats.tokens_in += tokens_in
+            self.stats.tokens_out += tokens_out
+            mapped = map_results(content, len(batch))
+            call_error = "模型输出中缺少该页的结果"
+        except Exception as e:
+            # 整批请求失败（例如超出上下文）时同样拆分重试
+            mapped, call_error = {}, f"{type(e).__name__}: {e}"
+
+        failed: List[int] = []
+        for n, i in enumerate(batch, 1):
+            page = results[i]
+            if n not in mapped:
+                page.error = call_error
+                failed.append(i)
+                continue
+            if not self.validate:
+                page.ok, page.result, page.error = True, mapped[n], ""
+                continue
+            check = check_and_repair(mapped[n], self.schema)
+            page.schema_status = check.status
+            page.result = check.value
+            if check.ok:
+                page.ok, page.error = True, ""
+            else:
+                page.error = "；".join(check.errors[:3])
+                failed.append(i)
+
+        if not failed or len(batch) == 1:
+            return
+        # 只重试不合格的页面：对半拆分，批次越小，模型越不容易漏页或串页
+        self.stats.retried += len(failed)
+        if len(failed) == 1:
+            self._run(pages, failed, results)
+            return
+        middle = len(failed) // 2
+        self._run(pages, failed[:middle], results)
+        self._run(pages, failed[middle:], results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="批量抽取：多个小页面合并为一次模型调用")
+    parser.add_argument("urls", nargs="*", help="要抽取的页面 URL")
+    parser.add_argument("--prompt", default="提取页面标题和正文第一段", help="每页执行的抽取提示")
+    parser.add_argument("--schema", default="", help="JSON Schema 文件路径")
+    parser.add_argument("--max-pages", type=int, default=DEFAULT_MAX_PAGES, help="每次请求最多打包的页数")
+    parser.add_argument("--mock-llm", action="store_true", help="使用本地仿真站点与仿真模型服务，完全离线")
+    parser.add_argument("--pages", type=int, default=32, help="--mock-llm 且未给出 URL 时抽取的仿真页面数")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="仿真模型每次请求的固定延迟")
+    parser.add_argument("--out", type=Path, help="结果写入 JSONL 文件")
+    args = parser.parse_args()
+
+    import httpx
+
+    schema = json.loads(Path(args.schema).read_text(encoding="utf-8")) if args.schema else None
+    servers: List[Any] = []
+    app_cfg = AppConfig.load()
+    urls = list(args.urls)
+    if args.mock_llm:
+        from unified_app.mock_servers import FixtureSite, MockLLMServer, batch_responder
+        from unified_app.service import mock_config_loader
+
+        llm = MockLLMServer(
+            latency_ms=args.llm_latency_ms, per_token_ms=0.05, prefix_cache=True, responder=batch_responder
+        ).start()
+        servers.append(llm)
+        app_cfg = mock_config_loader(llm.url)()
+        if not urls:
+            site = FixtureSite().start()
+            servers.append(site)
+            urls = [f"{site.url}/static/{i}" for i in range(args.pages)]
+    if not urls:
+        parser.error("至少需要一个 URL，或使用 --mock-llm")
+
+    try:
+        pages = []
+        with httpx.Client(timeout=30, follow_redirects=True) as client:
+            for url in urls:
+                resp = client.get(url)
+                resp.raise_for_status()
+                pages.append(BatchPage.from_html(url, resp.text))
+
+        runs = [("批量", args.max_pages)] + ([("逐页", 1)] if args.mock_llm else [])
+        for label, max_pages in runs:
+            extractor = BatchExtractor.from_config(app_cfg, args.prompt, schema, max_pages=max_pages)
+            results = extractor.extract(pages)
+            print(f"{label}（{active_model(app_cfg)}）：{extractor.stats.summary()}")
+            print(f"  提示词缓存：{extractor.cache.summary()}")
+            if label == "批量" and args.out:
+                with open(args.out, "w", encoding="utf-8") as f:
+                    for r in results:
+                        f.write(json.dumps(asdict(r), ensure_ascii=False, default=str) + "\n")
+                print(f"结果已写入 {args.out}")
+            for r in results:
+                if not r.ok:
+                    print(f"  ✗ {r.url}：{r.error}")
+    finally:
+        for server in servers:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
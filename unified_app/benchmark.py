@@ -0,0 +1,412 @@
+"""
+离线端到端基准测试。
+
+启动本地仿真站点与仿真模型服务（见 mock_servers.py），在不同并发度下驱动
+fetch_html_with_playwright、fetch_github_repos、RedBookScrapper 与完整抽取流水线，
+输出吞吐（pages/s）、延迟分位数、峰值 RSS 与 Chromium 进程数，结果为 JSON，可在两次运行之间对比。
+
+用法：
+    python -m unified_app.benchmark --concurrency 1,4,8 --pages 16 --out bench.json
+    python -m unified_app.benchmark --scenarios extract --llm-latency-ms 500 --compare bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from unified_app.mock_servers import FixtureSite, MockLLMServer
+from unified_app.telemetry import percentile
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SCENARIOS = ["fetch_static", "fetch_js", "fetch_large", "fetch_large_snapshot", "github", "redbook", "redbook_enrich", "extract"]
+
+
+def _silent(level: str, message: str) -> None:
+    return None
+
+
+# ---------------------------------------------------------------------------
+# 资源采样
+# ---------------------------------------------------------------------------
+
+
+def _proc_table() -> Dict[int, tuple[int, str, int]]:
+    """读取 /proc，返回 {pid: (ppid, cmdline, rss_bytes)}；非 Linux 平台返回空表。"""
+    table: Dict[int, tuple[int, str, int]] = {}
+    proc = Path("/proc")
+    if not proc.exists():
+        return table
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+            # comm 字段可能包含空格，取最后一个右括号之后的字段
+            fields = stat[stat.rindex(")") + 2 :].split()
+            ppid = int(fields[1])
+            rss = int(fields[21]) * page_size
+            cmdline = (entry / "cmdline").read_bytes().replace(b"\0", b" ").decode("utf-8", "ignore")
+        except (OSError, ValueError, IndexError):
+            continue
+        table[int(entry.name)] = (ppid, cmdline, rss)
+    return table
+
+
+def process_tree_stats(root_pid: Optional[int] = None) -> Dict[str, int]:
+    """统计 root_pid 及其全部子孙进程的 RSS 总和与 Chromium 进程数。"""
+    root_pid = root_pid or os.getpid()
+    table = _proc_table()
+    children: Dict[int, List[int]] = {}
+    for pid, (ppid, _cmd, _rss) in table.items():
+        children.setdefault(ppid, []).append(pid)
+
+    rss = 0
+    chromium = 0
+    stack = [root_pid]
+    seen = set()
+    while stack:
+        pid = stack.pop()
+        if pid in seen or pid not in table:
+            continue
+        seen.add(pid)
+        _ppid, cmd, proc_rss = table[pid]
+        rss += proc_rss
+        if "chrom" in cmd.lower():
+            chromium += 1
+        stack.extend(children.get(pid, []))
+    return {"rss_bytes": rss, "chromium": chromium, "processes": len(seen)}
+
+
+def count_fds(pid: Optional[int] = None) -> int:
+    fd_dir = Path(f"/proc/{pid or os.getpid()}/fd")
+    try:
+        return len(list(fd_dir.iterdir()))
+    except OSError:
+        return -1
+
+
+class ResourceSampler:
+    """后台线程定期采样进程树的 RSS 与 Chromium 进程数，记录峰值。"""
+
+    def __init__(self, interval: float = 0.2) -> None:
+        self.interval = interval
+        self.peak_rss_bytes = 0
+        self.peak_chromium = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            stats = process_tree_stats()
+            self.peak_rss_bytes = max(self.peak_rss_bytes, stats["rss_bytes"])
+            self.peak_chromium = max(self.peak_chromium, stats["chromium"])
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "ResourceSampler":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if not self.peak_rss_bytes:
+            # 无 /proc 时退回到 getrusage（Linux 单位 KB，macOS 单位字节）
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak_rss_bytes = usage if sys.platform == "darwin" else usage * 1024
+
+
+# ---------------------------------------------------------------------------
+# 场景
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class BenchContext:
+    site: FixtureSite
+    llm: MockLLMServer
+    tmp_dir: Path
+    large_kb: int = 1024
+
+
+def _scenario_fetch(path_fmt: str, snapshot: bool = False) -> Callable[[BenchContext, int], Any]:
+    def run(ctx: BenchContext, i: int) -> Any:
+        from unified_app.fetcher import fetch_html_with_playwright
+
+        url = ctx.site.url + path_fmt.format(i=i, kb=ctx.large_kb)
+        html = asyncio.run(
+            fetch_html_with_playwright(
+                url=url,
+                page_wait_strategy="load",
+                page_timeout=30,
+                reporter=_silent,
+                snapshot=snapshot,
+            )
+        )
+        if not html:
+            raise RuntimeError(f"空页面：{url}")
+        return len(html)
+
+    return run
+
+
+def _scenario_github(ctx: BenchContext, i: int) -> Any:
+    from unified_app.github_repos import fetch_github_repos
+
+    repos = asyncio.run(fetch_github_repos(f"user{i}", base_url=ctx.site.url, timeout_sec=30))
+    if not repos:
+        raise RuntimeError("未解析到仓库")
+    return len(repos)
+
+
+def _scenario_redbook(ctx: BenchContext, i: int) -> Any:
+    from unified_app.red_book_scrapper import RedBookScrapper
+
+    scrapper = RedBookScrapper(
+        storage_path=ctx.tmp_dir / f"redbook_{i}.json",
+        headless=True,
+        base_url=ctx.site.url,
+    )
+    try:
+        scrapper.start()
+        posts = scrapper.search_latest(f"关键词{i}", max_results=10)
+    finally:
+        scrapper.close()
+    if not posts:
+        raise RuntimeError("未解析到笔记")
+    return len(posts)
+
+
+def _scenario_redbook_enrich(ctx: BenchContext, i: int) -> Any:
+    from unified_app.red_book_scrapper import EnrichedNoteStore, RedBookScrapper
+
+    scrapper = RedBookScrapper(
+        storage_path=ctx.tmp_dir / f"redbook_enrich_{i}.json",
+        headless=True,
+        base_url=ctx.site.url,
+    )
+    try:
+        scrapper.start()
+        posts = scrapper.search_latest(f"详情{i}", max_results=8)
+        # 仿真站点不需要限速；max_age_s=0 保证每次都真正访问详情页
+        notes = list(
+            scrapper.enrich_notes(
+                posts, max_tabs=4, pace_s=0, max_age_s=0, store=EnrichedNoteStore(ctx.tmp_dir / f"notes_{i}.db")
+            )
+        )
+    finally:
+        scrapper.close()
+    failed = [n for n in notes if not n["enriched"]]
+    if not notes or failed:
+        raise RuntimeError(f"详情补全失败：{failed[0]['error'] if failed else '没有笔记'}")
+    return len(notes)
+
+
+def _scenario_extract(ctx: BenchContext, i: int) -> Any:
+    from unified_app.config import AppConfig, LMStudioConfig
+    from unified_app.pipeline import ScrapeRequest, run_scrape
+
+    cfg = AppConfig(
+        provider="lmstudio",
+        lmstudio=LMStudioConfig(base_url=f"{ctx.llm.url}/v1", model="mock-model", api_key="bench"),
+    )
+    req = ScrapeRequest(
+        url=f"{ctx.site.url}/static/{i}",
+        prompt="提取页面中的商品名称和价格",
+        provider="lmstudio",
+        wait_for_load="load",
+        wait_time=0,
+    )
+    outcome = run_scrape(cfg, req, reporter=_silent, record_history=False)
+    return outcome.result
+
+
+SCENARIO_FUNCS: Dict[str, Callable[[BenchContext, int], Any]] = {
+    "fetch_static": _scenario_fetch("/static/{i}"),
+    "fetch_js": _scenario_fetch("/js/{i}"),
+    "fetch_large": _scenario_fetch("/large/{i}?kb={kb}"),
+    # 与 fetch_large 相同的页面，改为页面内快照，对比传输完整 HTML 的开销
+    "fetch_large_snapshot": _scenario_fetch("/large/{i}?kb={kb}", snapshot=True),
+    "github": _scenario_github,
+    "redbook": _scenario_redbook,
+    "redbook_enrich": _scenario_redbook_enrich,
+    "extract": _scenario_extract,
+}
+
+
+@dataclass
+class BenchResult:
+    scenario: str
+    concurrency: int
+    pages: int
+    errors: int
+    wall_s: float
+    pages_per_s: float
+    latency_ms: Dict[str, float]
+    peak_rss_mb: float
+    peak_chromium: int
+    llm_requests: int = 0
+    error_samples: List[str] = field(default_factory=list)
+
+
+def run_scenario(ctx: BenchContext, scenario: str, concurrency: int, pages: int) -> BenchResult:
+    func = SCENARIO_FUNCS[scenario]
+    latencies: List[float] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+    llm_before = sum(ctx.llm.requests.values())
+
+    def one(i: int) -> None:
+        started = time.perf_counter()
+        try:
+            func(ctx, i)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}"[:300])
+            return
+        with lock:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    with ResourceSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(pages)))
+        wall = time.perf_counter() - started
+
+    return BenchResult(
+        scenario=scenario,
+        concurrency=concurrency,
+        pages=pages,
+        errors=len(errors),
+        wall_s=round(wall, 3),
+        pages_per_s=round(len(latencies) / wall, 3) if wall else 0.0,
+        latency_ms={
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "max": round(max(latencies), 1) if latencies else 0.0,
+        },
+        peak_rss_mb=round(sampler.peak_rss_bytes / 1024 / 1024, 1),
+        peak_chromium=sampler.peak_chromium,
+        llm_requests=sum(ctx.llm.requests.values()) - llm_before,
+        error_samples=errors[:3],
+    )
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=str(PROJECT_ROOT),
+            capture_output=True,
+            text=True,
+            timeout=10,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """返回吞吐下降超过 tolerance（比例）的场景说明列表，同时打印对比表。"""
+    base = {(r["scenario"], r["concurrency"]): r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"{'scenario':<14}{'conc':>5}{'pages/s':>12}{'Δ':>9}{'p95 ms':>12}{'Δ':>9}")
+    for r in current.get("results", []):
+        old = base.get((r["scenario"], r["concurrency"]))
+        if old is None:
+            continue
+        d_tp = (r["pages_per_s"] - old["pages_per_s"]) / old["pages_per_s"] if old["pages_per_s"] else 0.0
+        old_p95 = old["latency_ms"]["p95"]
+        d_p95 = (r["latency_ms"]["p95"] - old_p95) / old_p95 if old_p95 else 0.0
+        print(
+            f"{r['scenario']:<14}{r['concurrency']:>5}{r['pages_per_s']:>12.3f}{d_tp:>+9.1%}"
+            f"{r['latency_ms']['p95']:>12.1f}{d_p95:>+9.1%}"
+        )
+        if d_tp < -tolerance:
+            regressions.append(f"{r['scenario']}@{r['concurrency']} 吞吐下降 {-d_tp:.1%}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="离线端到端基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"逗号分隔，可选：{','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4", help="逗号分隔的并发度列表")
+    parser.add_argument("--pages", type=int, default=8, help="每个场景、每个并发度处理的页面数")
+    parser.add_argument("--site-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-per-token-ms", type=float, default=0.0)
+    parser.add_argument("--large-kb", type=int, default=1024)
+    parser.add_argument("--out", type=Path, help="结果 JSON 输出路径（默认打印到标准输出）")
+    parser.add_argument("--compare", type=Path, help="与之前的结果 JSON 对比")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的吞吐下降比例")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIO_FUNCS]
+    if unknown:
+        parser.error(f"未知场景：{', '.join(unknown)}")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    results: List[BenchResult] = []
+    with tempfile.TemporaryDirectory() as tmp, FixtureSite(
+        latency_ms=args.site_latency_ms
+    ) as site, MockLLMServer(
+        latency_ms=args.llm_latency_ms, per_token_ms=args.llm_per_token_ms
+    ) as llm:
+        ctx = BenchContext(site=site, llm=llm, tmp_dir=Path(tmp), large_kb=args.large_kb)
+        for scenario in scenarios:
+            for level in levels:
+                result = run_scenario(ctx, scenario, level, args.pages)
+                results.append(result)
+                print(
+                    f"[{scenario} x{level}] {result.pages_per_s} pages/s, "
+                    f"p95 {result.latency_ms['p95']} ms, errors {result.errors}, "
+                    f"peak RSS {result.peak_rss_mb} MB, chromium {result.peak_chromium}",
+                    file=sys.stderr,
+                )
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "results": [asdict(r) for r in results],
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        args.out.write_text(text, encoding="utf-8")
+        print(f"结果已写入 {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("性能回退：" + "；".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+合并进行中的相同抓取请求。
+
+几个会话几乎同时对同一 URL 发起相同的抓取时，各自启动浏览器、各自调用模型，恰好在负载最高时
+重复消耗浏览器与模型容量。这里按请求键把它们合并：第一个请求（leader）真正执行，之后到达的相同请求
+（waiter）挂到同一次运行上等待，结束后全部拿到同一份结果（或同一个异常）。
+
+请求键由以下内容计算（见 coalesce_key）：
+
+- 规范化后的 URL：协议与域名小写、去掉默认端口与片段（#...）、查询参数排序
+- 登录身份：是否需要登录、登录页、以及所用登录态文件的内容摘要（不同账号的登录态不会合并）
+- 提示词、JSON Schema、provider/model（含服务地址）
+- 其他会改变结果或副作用的选项：等待策略、快照、监控、录制/回放、礼貌抓取、结果存储、是否记录历史等
+
+手动登录的请求需要在弹出的浏览器中操作，不参与合并。
+
+同一进程内的会话（Streamlit 的各个会话、抓取服务的各个线程）通过 RequestCoalescer 合并；
+后台任务在不同的工作进程中执行，提交时由 JobStore 按同一个键挂到排队或运行中的任务上（见 jobs.py）。
+合并的等待数记录在运行指标的 waiters 中（见 telemetry.py），运行中的键与等待数可通过 COALESCER.snapshot() 查看。
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# 等待者转发 leader 日志与进度的轮询间隔（秒）
+RELAY_INTERVAL_S = 0.2
+
+
+def normalise_url(url: str) -> str:
+    """协议与域名小写、去掉默认端口与片段、查询参数按键排序；路径为空时补 /。"""
+    parts = urlsplit((url or "").strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    if parts.username:
+        host = f"{parts.username}@{host}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def _file_digest(path: Path) -> str:
+    try:
+        return hashlib.sha256(path.read_bytes()).hexdigest()[:16]
+    except OSError:
+        return ""
+
+
+def login_identity(req: Any) -> Optional[Dict[str, Any]]:
+    """登录身份；不需要登录时为 None。与 fetcher 一致，使用工作目录下的 login_state.json。"""
+    if not req.need_login:
+        return None
+    return {
+        "login_url": normalise_url(req.login_url) if req.login_url else "",
+        "storage": _file_digest(Path("login_state.json")) if req.use_storage else "",
+    }
+
+
+def coalesce_key(app_cfg: Any, req: Any, record_history: bool = True) -> Optional[str]:
+    """
+    计算请求键（十六进制摘要）；手动登录的请求返回 None（不合并）。
+    app_cfg 为调用方的配置（provider 为空时按配置文件中的 provider），req 为 ScrapeRequest。
+    """
+    from unified_app.config import active_model
+    from unified_app.pipeline import resolve_config
+    from unified_app.router import AUTO
+
+    if req.need_login and req.manual_login:
+        return None
+    cfg = resolve_config(app_cfg, req)
+    if req.provider == AUTO:
+        # 自动选择在获取页面之后才确定模型，候选范围相同的请求视为同一模型
+        model: Dict[str, Any] = {"provider": AUTO, "candidates": list(cfg.routing.candidates)}
+    else:
+        section = getattr(cfg, cfg.provider, None)
+        model = {
+            "provider": cfg.provider,
+            "model": active_model(cfg),
+            "base_url": getattr(section, "base_url", ""),
+        }
+    material = {
+        "url": normalise_url(req.url),
+        "login": login_identity(req),
+        "prompt": (req.prompt or "").strip(),
+        "schema": req.schema,
+        "model": model,
+        "options": {
+            "wait_for_load": req.wait_for_load,
+            "enable_js": req.enable_js,
+            "wait_time": req.wait_time,
+            "monitor": req.monitor,
+            "monitor_selectors": list(req.monitor_selectors),
+            "llm_cassette": req.llm_cassette,
+            "har_mode": req.har_mode,
+            "polite": req.polite,
+            "sinks": sorted(req.sinks),
+            "schema_reask": req.schema_reask,
+            "snapshot": req.snapshot,
+            "record_history": record_history,
+        },
+    }
+    text = json.dumps(material, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Flight:
+    """一次正在运行、可供相同请求挂靠的执行。"""
+
+    key: str
+    url: str = ""
+    started: float = field(default_factory=time.time)
+    # 挂到这次运行上的等待者数量（不含 leader 本身）
+    waiters: int = 0
+    # leader 的日志与最新进度，等待者在自己的线程中转发给各自的 reporter / progress
+    log: List[Tuple[str, str]] = field(default_factory=list)
+    progress: Optional[Tuple[float, str]] = None
+    outcome: Any = None
+    error: Optional[BaseException] = None
+    # leader 被中断（Streamlit 停止/重跑、KeyboardInterrupt 等）时为 True，等待者重新选出 leader
+    abandoned: bool = False
+    done: threading.Event = field(default_factory=threading.Event)
+
+    def reporter(self, inner: Callable[[str, str], None]) -> Callable[[str, str], None]:
+        def report(level: str, message: str) -> None:
+            self.log.append((level, message))
+            inner(level, message)
+
+        return report
+
+    def progress_fn(self, inner: Callable[[float, str], None]) -> Callable[[float, str], None]:
+        def progress(fraction: float, message: str) -> None:
+            self.progress = (fraction, message)
+            inner(fraction, message)
+
+        return progress
+
+
+@dataclass
+class CoalesceStats:
+    # 真正执行的运行数、挂到已有运行上的请求数、重新选出 leader 的次数
+    leaders: int = 0
+    coalesced: int = 0
+    abandoned: int = 0
+
+    @property
+    def saved_ratio(self) -> float:
+        total = self.leaders + self.coalesced
+        return self.coalesced / total if total else 0.0
+
+
+class RequestCoalescer:
+    """进程内的请求合并表：键 -> 正在运行的 Flight。"""
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.stats = CoalesceStats()
+
+    def run(
+        self,
+        key: str,
+        func: Callable[[Flight], Any],
+        reporter: Callable[[str, str], None],
+        progress: Callable[[float, str], None],
+        url: str = "",
+    ) -> Tuple[Any, Flight, bool]:
+        """
+        没有相同的运行时执行 func(flight) 并返回 (结果, flight, False)；
+        已有相同的运行时等待其结束，返回 (同一结果, flight, True)，leader 抛出的异常同样在这里抛出。
+        返回时 flight.waiters 为最终的等待数。
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight(key=key, url=url)
+                    self.stats.leaders += 1
+                else:
+                    flight.waiters += 1
+                    self.stats.coalesced += 1
+            if leader:
+                return self._lead(flight, func), flight, False
+            reporter("info", f"🔗 其他会话正在运行相同的请求（共 {flight.waiters} 个等待），将直接使用其结果")
+            self._follow(flight, reporter, progress)
+            if flight.abandoned:
+                reporter("warning", "⚠️ 正在运行的相同请求被中断，重新发起")
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.outcome, flight, True
+
+    def _lead(self, flight: Flight, func: Callable[[Flight], Any]) -> Any:
+        try:
+            flight.outcome = func(flight)
+            return flight.outcome
+        except Exception as e:
+            flight.error = e
+            raise
+        except BaseException:
+            flight.abandoned = True
+            with self._lock:
+                self.stats.abandoned += 1
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(flight.key, None)
+            flight.done.set()
+
+    @staticmethod
+    def _follow(
+        flight: Flight, reporter: Callable[[str, str], None], progress: Callable[[float, str], None]
+    ) -> None:
+        """在等待者自己的线程中转发 leader 的日志与进度（Streamlit 的输出只能在各自会话的线程中写）。"""
+        seen = 0
+        last_progress = None
+        while True:
+            finished = flight.done.wait(RELAY_INTERVAL_S)
+            for level, message in flight.log[seen:]:
+                reporter(level, message)
+            seen = len(flight.log)
+            if flight.progress is not None and flight.progress != last_progress:
+                last_progress = flight.progress
+                progress(*last_progress)
+            if finished:
+                return
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """正在运行的键及其等待数，按等待数从多到少。"""
+        now = time.time()
+        with self._lock:
+            flights = list(self._flights.values())
+        rows = [
+            {"key": f.key[:12], "url": f.url, "waiters": f.waiters, "running_s": round(now - f.started, 1)}
+            for f in flights
+        ]
+        return sorted(rows, key=lambda r: -r["waiters"])
+
+
+# 进程内共享的合并表：Streamlit 的所有会话运行在同一个进程中
+COALESCER = RequestCoalescer()
+
+
+def share_outcome(outcome: Any) -> Any:
+    """等待者拿到的结果：浅拷贝并标记为合并所得，避免改动 leader 持有的对象。"""
+    shared = copy.copy(outcome)
+    shared.coalesced = True
+    return shared
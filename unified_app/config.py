@@ -3,7 +3,7 @@ from __future__ import annotations
 import json
 from dataclasses import dataclass, asdict, field
 from pathlib import Path
-from typing import Literal, Optional, Dict, Any
+from typing import Literal, Optional, Dict, Any, List
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -23,6 +23,9 @@ class OpenAIConfig:
 class OllamaConfig:
     base_url: str = "http://localhost:11434"
     model: str = "ollama/llama3.2"
+    # 多台 Ollama 服务时的端点池，例如 [{"base_url": "http://gpu-2:11434", "weight": 2}]；
+    # 为空时只使用 base_url，见 endpoints.py
+    endpoints: List[Dict[str, Any]] = field(default_factory=list)
 
 
 @dataclass
@@ -30,6 +33,105 @@ class LMStudioConfig:
     base_url: str = "http://192.168.2.129:1234/v1"
     model: str = "qwen/qwen3-4b-2507"
     api_key: str = ""  # LM Studio usually accepts any string
+    # 多台 LM Studio 服务时的端点池，格式同 OllamaConfig.endpoints
+    endpoints: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass
+class PolitenessConfig:
+    # 同一域名同时进行的抓取数与两次请求之间的最小间隔（秒）
+    max_concurrency: int = 2
+    min_delay_s: float = 1.0
+    # 遇到 429/403 后间隔按 backoff_factor 倍增，最长不超过 max_delay_s
+    max_delay_s: float = 120.0
+    backoff_factor: float = 2.0
+    respect_robots: bool = True
+    user_agent: str = "unified-scraper"
+    # 代理服务器列表，例如 "http://127.0.0.1:7890"，为空时直连
+    proxies: List[str] = field(default_factory=list)
+    # 按域名覆盖上面的限速参数，例如 {"github.com": {"min_delay_s": 3}}
+    domain_overrides: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+
+@dataclass
+class SinkConfig:
+    # 默认写入的结果存储，例如 ["jsonl:results.jsonl", "sqlite:results.db"]，见 sinks.py
+    targets: List[str] = field(default_factory=list)
+    # 缓冲攒够 flush_rows 条或超过 flush_interval_s 秒后批量落盘
+    flush_rows: int = 500
+    flush_interval_s: float = 5.0
+
+
+@dataclass
+class DedupeConfig:
+    # 写入结果存储前去重：按键去重时合并字段，不填键时只丢弃内容完全相同的记录，见 dedupe.py
+    enabled: bool = False
+    # 去重键的字段路径（点号分隔），例如 ["url"]、["result.note_id"]；为空时按抽取结果内容去重
+    keys: List[str] = field(default_factory=list)
+    # 按结果中的条目列表去重（例如 "products"），键路径相对于条目
+    items: str = ""
+    # 不填键时统计近似重复的 SimHash 汉明距离，0 表示不统计；近似重复只计数，不丢弃也不合并
+    max_distance: int = 0
+    # 判断新旧的字段路径，为空时后到的记录较新
+    newest_by: str = ""
+    # 索引最多保存的键数量（每个键约百余字节）与保留完整记录用于合并的最近条数
+    max_keys: int = 1_000_000
+    window: int = 10_000
+
+
+@dataclass
+class ProfilingConfig:
+    # off：不剖析；slow：每次运行都采样，耗时超过 slow_threshold_s 时保存；always：每次都保存。见 profiling.py
+    mode: str = "off"
+    slow_threshold_s: float = 60.0
+    # 调用栈采样间隔（毫秒）与 Playwright 运行时是否同时录制 trace
+    interval_ms: float = 10.0
+    playwright_trace: bool = True
+    # profiles/ 下最多保留的剖析目录数
+    keep: int = 50
+
+
+@dataclass
+class CoalescingConfig:
+    # 合并进行中的相同抓取请求：相同的请求挂到正在运行的那一次上，共享结果。见 coalesce.py
+    enabled: bool = True
+
+
+@dataclass
+class RoutingConfig:
+    # 抓取请求的 provider 为 "auto" 时参与选择的 provider，按各自配置段中的模型
+    candidates: List[str] = field(default_factory=lambda: ["lmstudio", "ollama", "openai"])
+    # 各 provider 可接受的最大输入 token 数，超出的任务不会路由过去
+    max_input_tokens: Dict[str, int] = field(
+        default_factory=lambda: {"lmstudio": 8_000, "ollama": 8_000, "openai": 120_000}
+    )
+    # 每百万 token 的价格（美元）：[输入, 输出]，未列出的 provider 视为免费
+    prices_per_mtok: Dict[str, List[float]] = field(default_factory=lambda: {"openai": [2.5, 10.0]})
+    # 每天（本地时间）在付费 provider 上的花费上限
+    daily_budget_usd: float = 5.0
+    # 1 美元相当于多少秒的等待：越大越倾向于更慢但免费的本地模型
+    seconds_per_usd: float = 600.0
+
+
+@dataclass
+class ResidencyConfig:
+    # 本地模型空闲多久后卸载（秒）：Ollama 的 keep_alive、LM Studio 的 ttl；-1 表示一直常驻（仅 Ollama）
+    keep_alive_s: int = 1800
+    # 爬取、工作进程池等批量任务开始前预加载模型
+    preload_before_batch: bool = True
+    # 同一本地服务上另一个模型仍有请求在运行时，最多等待多久再开始（避免两个模型来回换入换出）
+    max_swap_wait_s: float = 120.0
+
+
+@dataclass
+class BalancingConfig:
+    # 端点池的健康检查间隔（秒）：检查服务是否可达、有哪些模型、哪些已加载
+    health_check_interval_s: float = 30.0
+    # 连续失败多少次后暂时移出端点池，移出多久（秒）后重新检查，检查通过才重新加入
+    eject_after_failures: int = 3
+    eject_s: float = 60.0
+    # 只把请求发给已加载当前模型的端点；没有时退而使用已下载该模型的端点
+    prefer_loaded: bool = True
 
 
 @dataclass
@@ -38,6 +140,14 @@ class AppConfig:
     openai: OpenAIConfig = field(default_factory=OpenAIConfig)
     ollama: OllamaConfig = field(default_factory=OllamaConfig)
     lmstudio: LMStudioConfig = field(default_factory=LMStudioConfig)
+    politeness: PolitenessConfig = field(default_factory=PolitenessConfig)
+    sinks: SinkConfig = field(default_factory=SinkConfig)
+    dedupe: DedupeConfig = field(default_factory=DedupeConfig)
+    profiling: ProfilingConfig = field(default_factory=ProfilingConfig)
+    coalescing: CoalescingConfig = field(default_factory=CoalescingConfig)
+    routing: RoutingConfig = field(default_factory=RoutingConfig)
+    residency: ResidencyConfig = field(default_factory=ResidencyConfig)
+    balancing: BalancingConfig = field(default_factory=BalancingConfig)
 
     @classmethod
     def load(cls, path: Path = CONFIG_PATH) -> "AppConfig":
@@ -58,6 +168,14 @@ class AppConfig:
             openai=_load_section(OpenAIConfig, "openai"),
             ollama=_load_section(OllamaConfig, "ollama"),
             lmstudio=_load_section(LMStudioConfig, "lmstudio"),
+            politeness=_load_section(PolitenessConfig, "politeness"),
+            sinks=_load_section(SinkConfig, "sinks"),
+            dedupe=_load_section(DedupeConfig, "dedupe"),
+            profiling=_load_section(ProfilingConfig, "profiling"),
+            coalescing=_load_section(CoalescingConfig, "coalescing"),
+            routing=_load_section(RoutingConfig, "routing"),
+            residency=_load_section(ResidencyConfig, "residency"),
+            balancing=_load_section(BalancingConfig, "balancing"),
         )
 
     def save(self, path: Path = CONFIG_PATH) -> None:
@@ -66,10 +184,24 @@ class AppConfig:
             "openai": asdict(self.openai),
             "ollama": asdict(self.ollama),
             "lmstudio": asdict(self.lmstudio),
+            "politeness": asdict(self.politeness),
+            "sinks": asdict(self.sinks),
+            "dedupe": asdict(self.dedupe),
+            "profiling": asdict(self.profiling),
+            "coalescing": asdict(self.coalescing),
+            "routing": asdict(self.routing),
+            "residency": asdict(self.residency),
+            "balancing": asdict(self.balancing),
         }
         path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
+def active_model(app_config: AppConfig) -> str:
+    """当前 provider 对应的模型名称。"""
+    section = getattr(app_config, app_config.provider, None)
+    return getattr(section, "model", "") if section is not None else ""
+
+
 def build_graph_config(app_config: AppConfig) -> Dict[str, Any]:
     """
     Build a SmartScraperGraph-compatible config dict based on current provider.
@@ -94,6 +226,8 @@ def build_graph_config(app_config: AppConfig) -> Dict[str, Any]:
                 "temperature": 0,
                 "format": "json",
                 "base_url": app_config.ollama.base_url,
+                # 每个请求都会重置 Ollama 的卸载计时，不指定时按服务端默认的 5 分钟
+                "keep_alive": app_config.residency.keep_alive_s,
             },
             "embeddings": {
                 "model": "ollama/nomic-embed-text",
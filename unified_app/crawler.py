@@ -0,0 +1,888 @@
+"""
+爬取模式：从种子 URL（或 sitemap）出发，按范围规则跟随链接，逐页执行抽取提示。
+
+- URL 规范化：小写协议与主机、去掉默认端口与 #片段、排序查询参数、去掉常见跟踪参数
+- 去重：布隆过滤器（默认按 100 万个 URL、1% 误判率预留约 1.2 MB），误判只会让极少数 URL 被跳过
+- 范围：同域名、包含/排除正则、最大深度、最大页数
+- 优先级：广度优先（bfs），或按 priority_patterns 的顺序优先（pattern），同级再按深度
+- 断点续爬：配置、布隆过滤器与统计定期写入 crawls/<crawl_id>/，待爬队列保存在 frontier.db 中，
+  每次断点只插入新入队的 URL、删除已完成的 URL，不重写整个队列；中断后用 resume 继续。
+  每页结果缓冲后随断点一起追加到 results.jsonl，断点记录此时 results.jsonl 的长度（results_offset），
+  续爬时只需读取这之后追加的结果来跳过已完成的页面；结果可同时写入 sinks 中配置的其他结果存储（见 sinks.py）
+- 批量抽取：batch_pages 大于 1 时，抓取到的页面先清洗为文本并暂存，攒够一批后合并为一次模型调用（见 batch_extract.py）
+
+命令行：
+    python -m unified_app.crawler start --seed https://example.com --prompt "提取标题" --max-pages 200
+    python -m unified_app.crawler resume <crawl_id>
+    python -m unified_app.crawler list
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import heapq
+import json
+import math
+import os
+import posixpath
+import re
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+from xml.etree import ElementTree
+
+from unified_app.batch_extract import BatchExtractor, BatchPage
+from unified_app.config import AppConfig
+from unified_app.fetcher import Reporter, print_reporter
+from unified_app.localstate import connect_sqlite, pid_alive
+from unified_app.profiling import OFF as PROFILE_OFF, RunProfiler, relative_path
+from unified_app.residency import preload_for_batch
+from unified_app.sinks import JsonlSink, SinkSet, make_record
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+CRAWL_DIR = PROJECT_ROOT / "crawls"
+
+BFS = "bfs"
+PATTERN = "pattern"
+FETCH_BROWSER = "browser"
+FETCH_HTTP = "http"
+
+# 每处理这么多页（或经过这么多秒）保存一次断点
+CHECKPOINT_PAGES = 20
+CHECKPOINT_SECONDS = 10
+SITEMAP_LIMIT = 50_000
+
+_TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid|spm|from|share_source|xsec_source)$", re.I)
+_SKIP_EXTENSIONS = (
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg", ".ico", ".css", ".js", ".pdf",
+    ".zip", ".gz", ".tar", ".mp3", ".mp4", ".avi", ".mov", ".woff", ".woff2", ".ttf", ".xml",
+)
+
+
+def canonicalize_url(url: str, base: Optional[str] = None) -> Optional[str]:
+    """返回规范化后的绝对 URL；非 http(s) 链接返回 None。"""
+    if base:
+        url = urljoin(base, url.strip())
+    parts = urlparse(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    port = parts.port
+    netloc = host if port is None or (scheme, port) in (("http", 80), ("https", 443)) else f"{host}:{port}"
+    path = parts.path or "/"
+    # 解析 ./ 与 ../，折叠重复的斜杠，保留末尾斜杠的语义
+    trailing = path.endswith("/")
+    path = posixpath.normpath(re.sub(r"/{2,}", "/", path))
+    if path == ".":
+        path = "/"
+    if trailing and not path.endswith("/"):
+        path += "/"
+    query = urlencode(
+        sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _TRACKING_PARAMS.match(k))
+    )
+    return urlunparse((scheme, netloc, path, "", query, ""))
+
+
+class BloomFilter:
+    """按容量与误判率确定位数组大小；k 个哈希由一次 blake2b 摘要经双重哈希派生。"""
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.01) -> None:
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def add(self, item: str) -> bool:
+        """加入集合；返回 False 表示（很可能）已经存在。"""
+        added = False
+        for p in self._positions(item):
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def save(self, path: Path) -> None:
+        header = json.dumps(
+            {"capacity": self.capacity, "error_rate": self.error_rate, "count": self.count}
+        ).encode("utf-8")
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(len(header).to_bytes(4, "little") + header + bytes(self.bits))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "BloomFilter":
+        raw = path.read_bytes()
+        n = int.from_bytes(raw[:4], "little")
+        meta = json.loads(raw[4:4 + n])
+        bloom = cls(meta["capacity"], meta["error_rate"])
+        bloom.bits = bytearray(raw[4 + n:])
+        bloom.count = meta["count"]
+        return bloom
+
+
+class FrontierStore:
+    """
+    待爬队列的持久化副本（crawls/<crawl_id>/frontier.db），内存中的堆仍是调度的依据。
+    URL 入队时插入一行，页面完成（写入 results.jsonl）后删除，抓取中的页面仍留在表中，
+    续爬时会重新处理。断点只提交两次断点之间的增量。
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = connect_sqlite(self.path)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS frontier (
+                seq INTEGER PRIMARY KEY,
+                p0 INTEGER NOT NULL,
+                p1 INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                depth INTEGER NOT NULL
+            )
+            """
+        )
+        return conn
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def apply(self, added: List[Tuple[int, int, int, str, int]], completed: List[int]) -> None:
+        """在一个事务中插入新入队的 (seq, p0, p1, url, depth) 并删除已完成的 seq。"""
+        if not added and not completed:
+            return
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR REPLACE INTO frontier VALUES (?, ?, ?, ?, ?)", added)
+            conn.executemany("DELETE FROM frontier WHERE seq = ?", [(seq,) for seq in completed])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def load(self) -> List[Tuple[int, int, int, str, int]]:
+        conn = self._connect()
+        try:
+            return [tuple(row) for row in conn.execute("SELECT seq, p0, p1, url, depth FROM frontier")]
+        finally:
+            conn.close()
+
+
+@dataclass
+class CrawlConfig:
+    seeds: List[str] = field(default_factory=list)
+    prompt: str = ""
+    schema: Optional[Dict[str, Any]] = None
+    provider: Optional[str] = None
+    sitemap: str = ""
+    same_domain: bool = True
+    include: List[str] = field(default_factory=list)
+    exclude: List[str] = field(default_factory=list)
+    max_depth: int = 2
+    max_pages: int = 100
+    priority: str = BFS
+    priority_patterns: List[str] = field(default_factory=list)
+    concurrency: int = 1
+    # browser：Playwright 渲染（支持 JS）；http：直接请求 HTML，速度快但不执行 JS
+    fetch_mode: str = FETCH_BROWSER
+    polite: bool = True
+    expected_urls: int = 1_000_000
+    # 除 results.jsonl 外额外写入的结果存储，例如 ["sqlite:crawl.db"]
+    sinks: List[str] = field(default_factory=list)
+    # 大于 1 时把最多这么多页合并为一次模型调用（受模型上下文限制），适合大量小详情页
+    batch_pages: int = 0
+    # browser 模式下在页面内生成精简快照代替完整 HTML，见 snapshot.py
+    snapshot: bool = False
+    # 每页的性能剖析模式（off / slow / always），为空时使用配置文件 profiling 段的 mode，见 profiling.py
+    profile: str = ""
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CrawlConfig":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+
+@dataclass
+class CrawlStats:
+    pages_done: int = 0
+    pages_failed: int = 0
+    disallowed: int = 0
+    enqueued: int = 0
+    duplicates: int = 0
+    out_of_scope: int = 0
+    frontier: int = 0
+    started_at: str = ""
+    updated_at: str = ""
+    finished: bool = False
+    # 批量抽取的模型调用次数（含拆分重试）、输入 token、其中命中前缀缓存的 token 与预填充耗时
+    batch_calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    prefill_s: float = 0.0
+
+    @property
+    def pages(self) -> int:
+        return self.pages_done + self.pages_failed
+
+
+@dataclass
+class CrawlPage:
+    url: str
+    depth: int
+    ok: bool
+    result: Any = None
+    error: str = ""
+    links: int = 0
+    elapsed_s: float = 0.0
+    fetched_at: str = ""
+    # 该页保存了性能剖析时的目录
+    profile: str = ""
+
+
+def _quiet_reporter(level: str, message: str) -> None:
+    return None
+
+
+class CrawlScope:
+    def __init__(self, config: CrawlConfig, seeds: Iterable[str]) -> None:
+        self.config = config
+        self.hosts = {self._host(u) for u in seeds}
+        self.include = [re.compile(p) for p in config.include]
+        self.exclude = [re.compile(p) for p in config.exclude]
+        self.priority_patterns = [re.compile(p) for p in config.priority_patterns]
+
+    @staticmethod
+    def _host(url: str) -> str:
+        host = urlparse(url).netloc
+        return host[4:] if host.startswith("www.") else host
+
+    def allows(self, url: str, depth: int, seed: bool = False) -> bool:
+        """seed 为 True 时不要求匹配 include 规则（种子本身可能是列表页）。"""
+        if depth > self.config.max_depth:
+            return False
+        if self.config.same_domain and self._host(url) not in self.hosts:
+            return False
+        if urlparse(url).path.lower().endswith(_SKIP_EXTENSIONS):
+            return False
+        if not seed and self.include and not any(p.search(url) for p in self.include):
+            return False
+        return not any(p.search(url) for p in self.exclude)
+
+    def priority(self, url: str, depth: int) -> Tuple[int, int]:
+        if self.config.priority == PATTERN:
+            for i, p in enumerate(self.priority_patterns):
+                if p.search(url):
+                    return (i, depth)
+            return (len(self.priority_patterns), depth)
+        return (depth, 0)
+
+
+def extract_links(html: str, base_url: str) -> List[str]:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html or "", "lxml")
+    base_tag = soup.find("base", href=True)
+    base = urljoin(base_url, base_tag["href"]) if base_tag else base_url
+    links: List[str] = []
+    for a in soup.find_all("a", href=True):
+        href = a["href"].strip()
+        if not href or href.startswith(("javascript:", "mailto:", "tel:", "#")):
+            continue
+        canonical = canonicalize_url(href, base)
+        if canonical:
+            links.append(canonical)
+    return list(dict.fromkeys(links))
+
+
+def load_sitemap(url: str, limit: int = SITEMAP_LIMIT, _depth: int = 0) -> List[str]:
+    """读取 sitemap（支持 sitemap 索引与 .gz），返回其中的页面 URL。"""
+    import httpx
+
+    resp = httpx.get(url, timeout=30, follow_redirects=True)
+    resp.raise_for_status()
+    content = resp.content
+    if content[:2] == b"\x1f\x8b":
+        content = gzip.decompress(content)
+    root = ElementTree.fromstring(content)
+    locs = [el.text.strip() for el in root.iter() if el.tag.endswith("loc") and el.text]
+    if root.tag.endswith("sitemapindex"):
+        urls: List[str] = []
+        for child in locs:
+            if len(urls) >= limit or _depth >= 2:
+                break
+            urls.extend(load_sitemap(child, limit - len(urls), _depth + 1))
+        return urls[:limit]
+    return locs[:limit]
+
+
+class Crawler:
+    def __init__(
+        self,
+        config: CrawlConfig,
+        crawl_id: Optional[str] = None,
+        directory: Path = CRAWL_DIR,
+        app_cfg: Optional[AppConfig] = None,
+        reporter: Reporter = print_reporter,
+    ) -> None:
+        self.config = config
+        self.crawl_id = crawl_id or datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        self.dir = Path(directory) / self.crawl_id
+        self.app_cfg = app_cfg or AppConfig.load()
+        self.reporter = reporter
+        self.stats = CrawlStats()
+        self.seen = BloomFilter(config.expected_urls)
+        self.scope = CrawlScope(config, config.seeds)
+        self._frontier: List[Tuple[Tuple[int, int], int, str, int]] = []
+        self._seq = 0
+        # 正在抓取（或等待批量抽取）的页面：url -> (depth, seq)
+        self._in_flight: Dict[str, Tuple[int, int]] = {}
+        self.frontier_store = FrontierStore(self.dir / "frontier.db")
+        # 自上次断点以来新入队的 URL 与已完成页面的 seq，断点时提交到 frontier.db
+        self._added: List[Tuple[int, int, int, str, int]] = []
+        self._completed: List[int] = []
+        self._lock = threading.Lock()
+        self._last_checkpoint = time.monotonic()
+        self._pages_since_checkpoint = 0
+        self._running = False
+        self._results: Optional[JsonlSink] = None
+        self._sinks: Optional[SinkSet] = None
+        self._extractor: Optional[BatchExtractor] = None
+        # 批量抽取模式下已抓取、等待合并抽取的页面
+        self._pending: List[Tuple[CrawlPage, BatchPage]] = []
+        self._politeness = None
+        if config.polite:
+            from unified_app.politeness import PolitenessScheduler
+
+            self._politeness = PolitenessScheduler.from_config(self.app_cfg.politeness)
+
+    # ---- 状态持久化 ----
+
+    @property
+    def results_path(self) -> Path:
+        return self.dir / "results.jsonl"
+
+    def _push(self, url: str, depth: int) -> None:
+        self._seq += 1
+        priority = self.scope.priority(url, depth)
+        heapq.heappush(self._frontier, (priority, self._seq, url, depth))
+        self._added.append((self._seq, priority[0], priority[1], url, depth))
+
+    def _offer(self, url: str, depth: int, seed: bool = False) -> None:
+        if not self.scope.allows(url, depth, seed):
+            self.stats.out_of_scope += 1
+            return
+        if not self.seen.add(url):
+            self.stats.duplicates += 1
+            return
+        self.stats.enqueued += 1
+        self._push(url, depth)
+
+    def seed(self) -> None:
+        seeds = [u for u in (canonicalize_url(s) for s in self.config.seeds) if u]
+        if self.config.sitemap:
+            try:
+                sitemap_urls = [u for u in (canonicalize_url(s) for s in load_sitemap(self.config.sitemap)) if u]
+                self.reporter("info", f"🗺️ sitemap 中读取到 {len(sitemap_urls)} 个 URL")
+                seeds.extend(sitemap_urls)
+            except Exception as e:
+                self.reporter("warning", f"⚠️ sitemap 读取失败：{e}")
+        # 同域名范围以种子（含 sitemap 所在站点）为准
+        self.scope = CrawlScope(self.config, seeds + ([self.config.sitemap] if self.config.sitemap else []))
+        for url in seeds:
+            self._offer(url, 0, seed=True)
+
+    def checkpoint(self) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            # 先把缓冲的结果落盘，再从 frontier.db 删除这些页面；
+            # 两步之间中断时，续爬会从上次的 results_offset 起读到这些结果并跳过对应页面
+            if self._results is not None:
+                self._results.flush()
+            if self._sinks:
+                self._sinks.flush()
+            results_offset = self.results_path.stat().st_size if self.results_path.exists() else 0
+            added, self._added = self._added, []
+            completed, self._completed = self._completed, []
+            self.stats.frontier = len(self._frontier) + len(self._in_flight)
+            self.stats.updated_at = datetime.now().isoformat(timespec="seconds")
+            state = {
+                "stats": asdict(self.stats),
+                "hosts": sorted(self.scope.hosts),
+                "results_offset": results_offset,
+                # 只有正在运行 run() 的进程才记录 PID，stop_crawl 据此发送停止信号
+                "pid": os.getpid() if self._running else None,
+                "heartbeat": time.time(),
+            }
+        (self.dir / "config.json").write_text(
+            json.dumps(asdict(self.config), ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        self.seen.save(self.dir / "seen.bloom")
+        self.frontier_store.apply(added, completed)
+        tmp = self.dir / "state.tmp"
+        tmp.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.dir / "state.json")
+        self._last_checkpoint = time.monotonic()
+        self._pages_since_checkpoint = 0
+
+    @classmethod
+    def create(cls, config: CrawlConfig, directory: Path = CRAWL_DIR, **kwargs: Any) -> "Crawler":
+        crawler = cls(config, directory=directory, **kwargs)
+        crawler.stats.started_at = datetime.now().isoformat(timespec="seconds")
+        crawler.seed()
+        crawler.checkpoint()
+        return crawler
+
+    @classmethod
+    def resume(cls, crawl_id: str, directory: Path = CRAWL_DIR, **kwargs: Any) -> "Crawler":
+        crawl_dir = Path(directory) / crawl_id
+        config = CrawlConfig.from_dict(json.loads((crawl_dir / "config.json").read_text(encoding="utf-8")))
+        crawler = cls(config, crawl_id=crawl_id, directory=directory, **kwargs)
+        state = json.loads((crawl_dir / "state.json").read_text(encoding="utf-8"))
+        crawler.stats = CrawlStats(**state["stats"])
+        crawler.seen = BloomFilter.load(crawl_dir / "seen.bloom")
+        crawler.scope.hosts = set(state.get("hosts") or crawler.scope.hosts)
+        # 上次断点之后才写入 results.jsonl 的页面已经完成，不再重复抓取；只需读取断点之后追加的部分
+        done: Set[str] = set()
+        if crawler.results_path.exists():
+            with open(crawler.results_path, "rb") as f:
+                f.seek(int(state.get("results_offset") or 0))
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["url"])
+                    except Exception:
+                        continue
+        for seq, p0, p1, url, depth in crawler.frontier_store.load():
+            crawler._seq = max(crawler._seq, seq)
+            if url in done:
+                crawler._completed.append(seq)
+            else:
+                heapq.heappush(crawler._frontier, ((p0, p1), seq, url, depth))
+        crawler.stats.finished = False
+        return crawler
+
+    # ---- 抓取 ----
+
+    @staticmethod
+    def _http_get(url: str, lease: Any = None) -> str:
+        import httpx
+
+        resp = httpx.get(url, timeout=30, follow_redirects=True)
+        if lease is not None:
+            lease.record(resp.status_code, resp.headers.get("retry-after"))
+        resp.raise_for_status()
+        # 非 HTML 响应（图片、下载等）不抽取也不解析链接
+        if "html" not in resp.headers.get("content-type", "html"):
+            return ""
+        return resp.text
+
+    def _fetch(self, url: str, profiler: Optional[RunProfiler] = None) -> str:
+        if self.config.fetch_mode == FETCH_HTTP:
+            if self._politeness is None:
+                return self._http_get(url)
+            with self._politeness.slot(url) as lease:
+                return self._http_get(url, lease)
+
+        from unified_app.fetcher import fetch_html_with_playwright
+
+        return asyncio.run(
+            fetch_html_with_playwright(
+                url,
+                page_wait_strategy="domcontentloaded",
+                page_timeout=60,
+                reporter=_quiet_reporter,
+                politeness=self._politeness,
+                snapshot=self.config.snapshot,
+                profiler=profiler,
+            )
+        ) or ""
+
+    def _process(self, url: str, depth: int) -> Tuple[CrawlPage, List[str], Optional[BatchPage]]:
+        """抓取并抽取一页；批量抽取模式下只抓取，返回清洗后的页面等待合并抽取。"""
+        started = time.perf_counter()
+        page = CrawlPage(url=url, depth=depth, ok=False, fetched_at=datetime.now().isoformat(timespec="seconds"))
+        links: List[str] = []
+        pending = None
+        # 每页单独剖析（在各自的工作线程中采样），页面抽取由这里统一剖析，不再在 run_scrape 中重复
+        profiler = RunProfiler.from_config(self.app_cfg.profiling, self.config.profile, label=url).start()
+        try:
+            html = self._fetch(url, profiler)
+            links = extract_links(html, url) if depth < self.config.max_depth else []
+            page.links = len(links)
+            if self._extractor is not None and html:
+                pending = BatchPage.from_html(url, html)
+            elif self.config.prompt and html:
+                from unified_app.pipeline import ScrapeRequest, run_scrape
+
+                outcome = run_scrape(
+                    self.app_cfg,
+                    ScrapeRequest(
+                        url=url,
+                        prompt=self.config.prompt,
+                        schema=self.config.schema,
+                        provider=self.config.provider,
+                        profile=PROFILE_OFF,
+                    ),
+                    reporter=_quiet_reporter,
+                    record_history=False,
+                    page_html=html,
+                )
+                page.result = outcome.result
+            page.ok = True
+        except Exception as e:
+            page.error = f"{type(e).__name__}: {e}"
+        page.elapsed_s = time.perf_counter() - started
+        saved = profiler.finish(page.elapsed_s)
+        if saved is not None:
+            page.profile = relative_path(saved)
+        return page, links, pending
+
+    def _offer_links(self, page: CrawlPage, links: List[str]) -> None:
+        with self._lock:
+            for link in links:
+                self._offer(link, page.depth + 1)
+
+    def _flush_batch(self, on_page: Optional[Callable[[CrawlPage, CrawlStats], None]]) -> None:
+        batch, self._pending = self._pending, []
+        cache = self._extractor.cache
+        before = (self._extractor.stats.calls, cache.prompt_tokens, cache.cached_tokens, cache.prefill_s)
+        started = time.perf_counter()
+        results = self._extractor.extract([pending for _, pending in batch])
+        share = (time.perf_counter() - started) / len(batch)
+        with self._lock:
+            self.stats.batch_calls += self._extractor.stats.calls - before[0]
+            self.stats.prompt_tokens += cache.prompt_tokens - before[1]
+            self.stats.cached_tokens += cache.cached_tokens - before[2]
+            self.stats.prefill_s = round(self.stats.prefill_s + cache.prefill_s - before[3], 3)
+        for (page, _), result in zip(batch, results):
+            page.ok, page.result, page.error = result.ok, result.result, result.error
+            page.elapsed_s += share
+            self._record(page, [])
+            if on_page is not None:
+                on_page(page, self.stats)
+
+    def _record(self, page: CrawlPage, links: List[str]) -> None:
+        from unified_app.politeness import RobotsDisallowed
+
+        with self._lock:
+            _, seq = self._in_flight.pop(page.url, (page.depth, None))
+            if seq is not None:
+                self._completed.append(seq)
+            if page.ok:
+                self.stats.pages_done += 1
+                for link in links:
+                    self._offer(link, page.depth + 1)
+            elif page.error.startswith(RobotsDisallowed.__name__):
+                self.stats.disallowed += 1
+            else:
+                self.stats.pages_failed += 1
+            self._results.write(asdict(page))
+            if self._sinks:
+                self._sinks.write(
+                    make_record(
+                        "crawl",
+                        page.url,
+                        page.result,
+                        crawl_id=self.crawl_id,
+                        depth=page.depth,
+                        ok=page.ok,
+                        error=page.error,
+                    )
+                )
+            self._pages_since_checkpoint += 1
+
+    def run(
+        self,
+        on_page: Optional[Callable[[CrawlPage, CrawlStats], None]] = None,
+        stop: Optional[threading.Event] = None,
+    ) -> CrawlStats:
+        """按优先级处理待爬队列，直到队列为空、达到最大页数或 stop 被设置。"""
+        stop = stop or threading.Event()
+        # 结果与断点同步落盘：攒够一次断点的页数或时间间隔才写出
+        self._results = JsonlSink(
+            self.results_path, flush_rows=CHECKPOINT_PAGES, flush_interval_s=CHECKPOINT_SECONDS
+        )
+        self._sinks = SinkSet.from_config(self.app_cfg.sinks, self.config.sinks, self.app_cfg.dedupe)
+        try:
+            if self.config.prompt:
+                # 第一页抽取前把本地模型加载好，并按配置延长常驻时间，爬取过程中不会因空闲被卸载
+                preload_for_batch(self.app_cfg, self.config.provider, self.reporter)
+            if self.config.batch_pages > 1 and self.config.prompt:
+                self._extractor = BatchExtractor.from_config(
+                    self.app_cfg,
+                    self.config.prompt,
+                    self.config.schema,
+                    provider=self.config.provider,
+                    max_pages=self.config.batch_pages,
+                )
+            # 先写一次断点，记录当前进程的 PID，便于界面判断爬取是否在运行
+            self._running = True
+            self.checkpoint()
+            budget = self.config.max_pages - self.stats.pages - self.stats.disallowed
+            running: Dict[Future, str] = {}
+            with ThreadPoolExecutor(max_workers=max(1, self.config.concurrency)) as pool:
+                try:
+                    while True:
+                        with self._lock:
+                            while (
+                                not stop.is_set()
+                                and self._frontier
+                                and len(running) < max(1, self.config.concurrency)
+                                and budget > 0
+                            ):
+                                _, seq, url, depth = heapq.heappop(self._frontier)
+                                self._in_flight[url] = (depth, seq)
+                                running[pool.submit(self._process, url, depth)] = url
+                                budget -= 1
+                        if not running:
+                            # 没有可抓取的页面了，剩余的暂存页面不足一批也一并抽取
+                            if self._pending:
+                                self._flush_batch(on_page)
+                            break
+                        finished, _ = wait(list(running), timeout=1.0, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            running.pop(future)
+                            page, links, pending = future.result()
+                            if pending is None:
+                                self._record(page, links)
+                                if on_page is not None:
+                                    on_page(page, self.stats)
+                                continue
+                            # 链接在抓取后立即入队，不必等到这一批抽取完成；页面在抽取前仍算作进行中，中断后会重新抓取
+                            self._offer_links(page, links)
+                            self._pending.append((page, pending))
+                        if len(self._pending) >= self.config.batch_pages > 1:
+                            self._flush_batch(on_page)
+                        if (
+                            self._pages_since_checkpoint >= CHECKPOINT_PAGES
+                            or time.monotonic() - self._last_checkpoint >= CHECKPOINT_SECONDS
+                        ):
+                            self.checkpoint()
+                finally:
+                    stop.set()
+                    for future in running:
+                        future.cancel()
+                with self._lock:
+                    self.stats.finished = (not self._frontier and not self._in_flight) or budget <= 0
+        finally:
+            # 异常退出时同样清除运行标记、写出缓冲的结果并关闭存储，否则界面会一直显示爬取在运行
+            self._running = False
+            try:
+                self.checkpoint()
+            finally:
+                self._results.close()
+                self._sinks.close()
+                for error in self._sinks.errors:
+                    self.reporter("warning", f"⚠️ 结果存储写入失败：{error}")
+                if self._sinks and self._sinks.dedupe_stats is not None:
+                    self.reporter("info", self._sinks.dedupe_stats.summary())
+                self._results = self._sinks = None
+                self._extractor = None
+        return self.stats
+
+
+@dataclass
+class CrawlSummary:
+    crawl_id: str
+    seeds: List[str]
+    prompt: str
+    max_pages: int
+    stats: CrawlStats
+    running: bool
+    directory: Path = CRAWL_DIR
+
+    @property
+    def results_path(self) -> Path:
+        return self.directory / self.crawl_id / "results.jsonl"
+
+
+def list_crawls(directory: Path = CRAWL_DIR, limit: int = 20) -> List[CrawlSummary]:
+    summaries = []
+    if not Path(directory).exists():
+        return summaries
+    for crawl_dir in sorted(Path(directory).iterdir(), reverse=True)[:limit]:
+        try:
+            config = json.loads((crawl_dir / "config.json").read_text(encoding="utf-8"))
+            state = json.loads((crawl_dir / "state.json").read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        stats = CrawlStats(**state["stats"])
+        summaries.append(CrawlSummary(
+            crawl_id=crawl_dir.name,
+            seeds=config.get("seeds", []),
+            prompt=config.get("prompt", ""),
+            max_pages=config.get("max_pages", 0),
+            stats=stats,
+            running=not stats.finished and pid_alive(state.get("pid")),
+            directory=Path(directory),
+        ))
+    return summaries
+
+
+def start_crawl_process(crawl_id: str, directory: Path = CRAWL_DIR) -> None:
+    """在独立进程中运行（或继续）爬取，关闭页面不影响进度。"""
+    crawl_dir = Path(directory) / crawl_id
+    log = open(crawl_dir / "crawl.log", "a", encoding="utf-8")
+    subprocess.Popen(
+        [sys.executable, "-m", "unified_app.crawler", "--dir", str(directory), "resume", crawl_id],
+        cwd=str(PROJECT_ROOT),
+        stdout=log,
+        stderr=subprocess.STDOUT,
+        start_new_session=True,
+    )
+
+
+def stop_crawl(crawl_id: str, directory: Path = CRAWL_DIR) -> bool:
+    """通知爬取进程保存断点后退出。"""
+    try:
+        state = json.loads((Path(directory) / crawl_id / "state.json").read_text(encoding="utf-8"))
+    except Exception:
+        return False
+    pid = state.get("pid")
+    if not pid_alive(pid) or pid == os.getpid():
+        return False
+    os.kill(pid, signal.SIGTERM)
+    return True
+
+
+def _run_cli(crawler: Crawler) -> None:
+    stop = threading.Event()
+
+    def handle_signal(signum: int, frame: Any) -> None:
+        print("收到停止信号，正在保存断点...", flush=True)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    def on_page(page: CrawlPage, stats: CrawlStats) -> None:
+        mark = "✓" if page.ok else "✗"
+        print(
+            f"{mark} [{stats.pages}] d={page.depth} {page.url} "
+            f"({page.elapsed_s:.1f}s, {page.links} 个链接){' ' + page.error if page.error else ''}",
+            flush=True,
+        )
+
+    stats = crawler.run(on_page=on_page, stop=stop)
+    state = "已完成" if stats.finished else f"已暂停，继续：python -m unified_app.crawler resume {crawler.crawl_id}"
+    print(
+        f"{crawler.crawl_id}：成功 {stats.pages_done}，失败 {stats.pages_failed}，"
+        f"robots 拒绝 {stats.disallowed}，待爬 {stats.frontier}，{state}",
+        flush=True,
+    )
+    if stats.batch_calls:
+        print(
+            f"批量抽取：{stats.batch_calls} 次模型调用，输入 {stats.prompt_tokens} token，"
+            f"命中前缀缓存 {stats.cached_tokens} token，预填充 {stats.prefill_s:.2f}s",
+            flush=True,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="跟随链接的爬取模式")
+    parser.add_argument("--dir", type=Path, default=CRAWL_DIR, help="爬取状态目录")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    start = sub.add_parser("start", help="开始新的爬取")
+    start.add_argument("--seed", action="append", default=[], help="种子 URL，可重复")
+    start.add_argument("--sitemap", default="", help="从 sitemap 读取种子")
+    start.add_argument("--prompt", default="", help="每页执行的抽取提示，留空则只爬取链接")
+    start.add_argument("--schema", default="", help="JSON Schema 文件路径")
+    start.add_argument("--provider", default=None)
+    start.add_argument("--max-depth", type=int, default=2)
+    start.add_argument("--max-pages", type=int, default=100)
+    start.add_argument("--include", action="append", default=[], help="URL 必须匹配的正则，可重复")
+    start.add_argument("--exclude", action="append", default=[], help="排除 URL 的正则，可重复")
+    start.add_argument("--priority", choices=[BFS, PATTERN], default=BFS)
+    start.add_argument("--priority-pattern", action="append", default=[], help="按顺序优先的 URL 正则")
+    start.add_argument("--concurrency", type=int, default=1)
+    start.add_argument("--fetch", choices=[FETCH_BROWSER, FETCH_HTTP], default=FETCH_BROWSER)
+    start.add_argument("--all-domains", action="store_true", help="允许跟随到其他域名")
+    start.add_argument("--no-polite", action="store_true", help="不使用按域名限速与 robots.txt")
+    start.add_argument("--expected-urls", type=int, default=1_000_000, help="去重过滤器预留的 URL 数")
+    start.add_argument("--sink", action="append", default=[], help="额外写入的结果存储，例如 sqlite:crawl.db，可重复")
+    start.add_argument("--batch-pages", type=int, default=0, help="每次模型调用最多合并的页数（大于 1 时启用批量抽取）")
+    start.add_argument("--snapshot", action="store_true", help="浏览器模式下用页面内精简快照代替完整 HTML")
+    start.add_argument("--profile", choices=["off", "slow", "always"], default="", help="每页的性能剖析模式，默认使用配置文件")
+
+    resume = sub.add_parser("resume", help="继续中断的爬取")
+    resume.add_argument("crawl_id")
+
+    sub.add_parser("list", help="列出最近的爬取")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for s in list_crawls(args.dir):
+            state = "运行中" if s.running else ("已完成" if s.stats.finished else "已暂停")
+            print(
+                f"{s.crawl_id}  {state}  成功 {s.stats.pages_done}  失败 {s.stats.pages_failed}  "
+                f"待爬 {s.stats.frontier}  {', '.join(s.seeds)[:60]}"
+            )
+        return
+
+    if args.command == "resume":
+        _run_cli(Crawler.resume(args.crawl_id, directory=args.dir))
+        return
+
+    if not args.seed and not args.sitemap:
+        parser.error("至少需要 --seed 或 --sitemap")
+    config = CrawlConfig(
+        seeds=args.seed,
+        prompt=args.prompt,
+        schema=json.loads(Path(args.schema).read_text(encoding="utf-8")) if args.schema else None,
+        provider=args.provider,
+        sitemap=args.sitemap,
+        same_domain=not args.all_domains,
+        include=args.include,
+        exclude=args.exclude,
+        max_depth=args.max_depth,
+        max_pages=args.max_pages,
+        priority=args.priority,
+        priority_patterns=args.priority_pattern,
+        concurrency=args.concurrency,
+        fetch_mode=args.fetch,
+        polite=not args.no_polite,
+        expected_urls=args.expected_urls,
+        sinks=args.sink,
+        batch_pages=args.batch_pages,
+        snapshot=args.snapshot,
+        profile=args.profile,
+    )
+    crawler = Crawler.create(config, directory=args.dir)
+    print(f"爬取 ID：{crawler.crawl_id}（{crawler.dir}）", flush=True)
+    _run_cli(crawler)
+
+
+if __name__ == "__main__":
+    main()
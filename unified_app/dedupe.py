@@ -0,0 +1,385 @@
+"""
+抽取结果的流式去重与合并。
+
+分页 / 批量抓取时，同一条目常常出现多次：同一商品出现在多个列表页、多次抓取同一用户的仓库、
+小红书的多个关键词搜到同一篇笔记。RecordMerger 位于结果存储（sinks.py）之前，逐条处理记录：
+
+- 去重键：keys 中的字段路径（点号分隔，例如 "url"、"result.note_id"）组合成键；
+  keys 为空时以抽取结果内容的摘要为键，只丢弃内容完全相同的重复，不做合并
+- 近似重复（仅 keys 为空且 max_distance > 0 时）：内容的 SimHash 指纹与已有记录的汉明距离不超过 max_distance
+  时计入统计，记录照常输出。内容相近的不同记录（例如描述相同、标题和价格不同的商品）不能合并
+- 按键判定的重复记录做字段级合并：较新记录中的非空值覆盖旧值，空值（None / "" / [] / {}）不覆盖；
+  默认后到的记录较新，设置 newest_by 后按该字段比较
+- 合并后抽取结果（record["result"]）没有变化的重复记录直接丢弃，url、耗时等附加字段不同也不算变化；
+  有变化时输出合并后的完整记录（带相同的 dedupe_key），
+  SQLite 存储按 dedupe_key 覆盖旧行，JSONL / Parquet 中同一键以最后一行为准
+- 设置 items（例如 "products"）时按结果中的条目列表去重，列表页之间重叠的条目只保留一份，
+  此时键路径相对于条目本身
+
+内存有上限：索引只保存 8 字节的键哈希与内容摘要（近似检测时再加 8 字节指纹），最多 max_keys 个，超出后淘汰最早的键；
+完整记录只保留最近 window 条用于字段级合并。已淘汰出窗口的键再次出现时，内容相同仍会去重，
+内容不同则按新记录原样输出。
+
+统计已有结果文件的重复率，或合并后写入新的存储：
+    python -m unified_app.dedupe results/results.jsonl --key url
+    python -m unified_app.dedupe results/crawl.jsonl --items products --key id --out sqlite:merged.db
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+DEFAULT_MAX_KEYS = 1_000_000
+DEFAULT_WINDOW = 10_000
+# 没有 result 字段的记录按整条记录计算内容摘要，但不包含这些每次写入都会变化的顶层字段
+VOLATILE_FIELDS = ("written_at", "dedupe_key")
+
+_TOKEN = re.compile(r"[a-z0-9]+|[^\sa-z0-9]", re.IGNORECASE)
+
+
+def _hash64(data: str) -> int:
+    return int.from_bytes(hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or (isinstance(value, (list, dict)) and not value)
+
+
+def record_content(record: Any) -> Any:
+    """记录的内容：sinks.make_record 生成的记录取抽取结果 result，其他记录取去掉易变字段后的整条记录。"""
+    if isinstance(record, dict):
+        if "result" in record:
+            return record["result"]
+        return {k: v for k, v in record.items() if k not in VOLATILE_FIELDS}
+    return record
+
+
+def get_path(record: Any, path: str) -> Any:
+    """按点号分隔的路径取值，中间任何一层不存在时返回 None。"""
+    value = record
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+def merge_fields(older: Any, newer: Any) -> Any:
+    """字段级合并：dict 逐键递归合并，其他类型取较新的非空值。"""
+    if isinstance(older, dict) and isinstance(newer, dict):
+        merged = dict(older)
+        for key, value in newer.items():
+            merged[key] = merge_fields(older.get(key), value) if key in older else value
+        return merged
+    return older if _is_empty(newer) else newer
+
+
+def _text_of(value: Any, out: List[str]) -> None:
+    if isinstance(value, dict):
+        for key in sorted(value):
+            _text_of(value[key], out)
+    elif isinstance(value, list):
+        for item in value:
+            _text_of(item, out)
+    elif value is not None:
+        out.append(str(value))
+
+
+def simhash(value: Any) -> int:
+    """
+    64 位 SimHash：以去重后的词（英文单词、数字、单个汉字）为特征，内容相近的记录指纹的汉明距离小。
+    抽取结果通常较短，用 n-gram 时改动一个词会影响多个特征，不利于召回。
+    """
+    parts: List[str] = []
+    _text_of(value, parts)
+    weights = [0] * 64
+    for token in set(_TOKEN.findall(" ".join(parts).lower())):
+        h = _hash64(token)
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+@dataclass
+class DedupeStats:
+    seen: int = 0
+    unique: int = 0
+    duplicates: int = 0
+    # 重复但合并后有新内容、作为更新输出的条数（其余重复被丢弃）
+    updated: int = 0
+    # 与已有记录内容相近但不相同的新记录，只统计，照常输出（不计入 duplicates）
+    near_duplicates: int = 0
+    # 因超过 max_keys 被淘汰出索引的键
+    evicted: int = 0
+    index_keys: int = 0
+
+    @property
+    def duplicate_rate(self) -> float:
+        return self.duplicates / self.seen if self.seen else 0.0
+
+    @property
+    def dropped(self) -> int:
+        return self.duplicates - self.updated
+
+    def summary(self) -> str:
+        if not self.seen:
+            return "去重：没有记录"
+        text = (
+            f"去重：{self.seen} 条中重复 {self.duplicates} 条（{self.duplicate_rate:.1%}），"
+            f"保留 {self.unique} 条，合并更新 {self.updated} 条，丢弃 {self.dropped} 条"
+        )
+        if self.near_duplicates:
+            text += f"，另有近似重复 {self.near_duplicates} 条（内容不同，照常保留）"
+        if self.evicted:
+            text += f"，索引已淘汰 {self.evicted} 个键"
+        return text
+
+
+class RecordMerger:
+    """流式去重合并，feed() 返回需要写出的记录（新记录或合并后的更新），重复且无变化时返回 None。线程安全。"""
+
+    def __init__(
+        self,
+        keys: Sequence[str] = (),
+        items: str = "",
+        max_distance: int = 0,
+        newest_by: str = "",
+        max_keys: int = DEFAULT_MAX_KEYS,
+        window: int = DEFAULT_WINDOW,
+    ) -> None:
+        self.keys = [k.strip() for k in keys if k and k.strip()]
+        self.items = items.strip()
+        self.max_distance = max(0, min(max_distance, 15))
+        self.newest_by = newest_by.strip()
+        self.max_keys = max(1, max_keys)
+        self.window = max(0, window)
+        self.stats = DedupeStats()
+        # 键哈希 -> 合并后内容的摘要；按插入顺序淘汰
+        self._index: Dict[int, int] = {}
+        # 最近的键哈希 -> 合并后的完整记录，用于字段级合并
+        self._recent: "OrderedDict[int, Any]" = OrderedDict()
+        # 近似检测：64 位指纹切成 max_distance + 1 段，距离不超过 max_distance 的两个指纹至少有一段相同
+        self._near = not self.keys and self.max_distance > 0
+        self._bands = self.max_distance + 1
+        self._band_bits = 64 // self._bands
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(self._bands)]
+        # 内容摘要（键）-> SimHash 指纹，淘汰键时据此移出分段索引
+        self._fingerprints: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Any) -> Optional["RecordMerger"]:
+        """config 为 DedupeConfig；未启用时返回 None。"""
+        if config is None or not config.enabled:
+            return None
+        return cls(
+            keys=config.keys,
+            items=config.items,
+            max_distance=config.max_distance,
+            newest_by=config.newest_by,
+            max_keys=config.max_keys,
+            window=config.window,
+        )
+
+    # ---- 键与指纹 ----
+
+    def _band_values(self, fingerprint: int) -> List[int]:
+        mask = (1 << self._band_bits) - 1
+        return [fingerprint >> (i * self._band_bits) & mask for i in range(self._bands)]
+
+    def _note_near(self, key: int, content: Any) -> bool:
+        """记录新内容的指纹，返回是否与已有内容的指纹距离不超过 max_distance。只用于统计。"""
+        fingerprint = simhash(content)
+        near = False
+        for bucket, value in zip(self._buckets, self._band_values(fingerprint)):
+            members = bucket.setdefault(value, [])
+            near = near or any(bin(c ^ fingerprint).count("1") <= self.max_distance for c in members)
+            members.append(fingerprint)
+        self._fingerprints[key] = fingerprint
+        return near
+
+    def _key(self, entry: Any, content: Any) -> Optional[int]:
+        if self.keys:
+            values = [get_path(entry, k) for k in self.keys]
+            if all(_is_empty(v) for v in values):
+                # 缺少去重键的记录不参与去重
+                return None
+            return _hash64(_canonical(values))
+        if _is_empty(content):
+            # 没有抽取结果（例如失败的页面）时无法判断内容是否重复
+            return None
+        return _hash64(_canonical(content))
+
+    # ---- 索引 ----
+
+    def _remember(self, key: int, digest: int, merged: Any) -> None:
+        if key not in self._index:
+            if len(self._index) >= self.max_keys:
+                self._evict(next(iter(self._index)))
+        self._index[key] = digest
+        # 按内容去重时不做合并，不需要保留完整记录
+        if self.window and self.keys:
+            self._recent[key] = merged
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.window:
+                self._recent.popitem(last=False)
+        self.stats.index_keys = len(self._index)
+
+    def _evict(self, key: int) -> None:
+        del self._index[key]
+        self._recent.pop(key, None)
+        self.stats.evicted += 1
+        fingerprint = self._fingerprints.pop(key, None)
+        if fingerprint is not None:
+            for bucket, value in zip(self._buckets, self._band_values(fingerprint)):
+                members = bucket.get(value)
+                if members and fingerprint in members:
+                    members.remove(fingerprint)
+                    if not members:
+                        del bucket[value]
+
+    # ---- 合并 ----
+
+    def _is_newer(self, incoming: Any, existing: Any) -> bool:
+        if not self.newest_by:
+            return True
+        new_value, old_value = get_path(incoming, self.newest_by), get_path(existing, self.newest_by)
+        if _is_empty(new_value) or _is_empty(old_value):
+            return not _is_empty(new_value) or _is_empty(old_value)
+        try:
+            return new_value >= old_value
+        except TypeError:
+            return str(new_value) >= str(old_value)
+
+    def _merge_entry(self, entry: Any, content: Any, digest_of: Any) -> Tuple[Any, Optional[int]]:
+        """处理一条记录（或条目），返回 (需要输出的内容或 None, 键)。"""
+        self.stats.seen += 1
+        key = self._key(entry, content)
+        if key is None:
+            self.stats.unique += 1
+            return entry, None
+        digest = _hash64(_canonical(digest_of(entry)))
+        if key not in self._index:
+            self.stats.unique += 1
+            if self._near:
+                self.stats.near_duplicates += int(self._note_near(key, content))
+            self._remember(key, digest, entry)
+            return entry, key
+
+        self.stats.duplicates += 1
+        if not self.keys:
+            # 键就是内容摘要：内容完全相同，直接丢弃
+            return None, key
+        existing = self._recent.get(key)
+        if existing is None:
+            # 已淘汰出合并窗口：内容相同则丢弃，否则按新记录原样输出
+            merged = entry
+        elif self._is_newer(entry, existing):
+            merged = merge_fields(existing, entry)
+        else:
+            merged = merge_fields(entry, existing)
+        merged_digest = _hash64(_canonical(digest_of(merged)))
+        if merged_digest == self._index[key]:
+            if existing is not None:
+                self._recent.move_to_end(key)
+            return None, key
+        self.stats.updated += 1
+        self._remember(key, merged_digest, merged)
+        return merged, key
+
+    def feed(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if self.items:
+                return self._feed_items(record)
+            # 内容摘要只看抽取结果：不同页面（url 不同）抽到相同的结果也是重复，直接丢弃
+            merged, key = self._merge_entry(record, record_content(record), record_content)
+            if merged is None:
+                return None
+            if key is not None and isinstance(merged, dict):
+                merged = {**merged, "dedupe_key": f"{key:016x}"}
+            return merged
+
+    def _feed_items(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        result = record.get("result") if isinstance(record, dict) else None
+        items = result if isinstance(result, list) else get_path(result, self.items)
+        if not isinstance(items, list):
+            return record
+        kept = []
+        for item in items:
+            merged, _ = self._merge_entry(item, item, lambda i: i)
+            if merged is not None:
+                kept.append(merged)
+        if len(kept) == len(items) and all(a is b for a, b in zip(kept, items)):
+            return record
+        record = copy.copy(record)
+        if isinstance(result, list):
+            record["result"] = kept
+        else:
+            record["result"] = _set_path(result, self.items, kept)
+        return record
+
+    def feed_many(self, records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [r for r in (self.feed(record) for record in records) if r is not None]
+
+
+def _set_path(value: Dict[str, Any], path: str, new: Any) -> Dict[str, Any]:
+    """返回替换了 path 处取值的浅拷贝，不修改原对象。"""
+    head, _, rest = path.partition(".")
+    copied = dict(value)
+    copied[head] = _set_path(value.get(head) or {}, rest, new) if rest else new
+    return copied
+
+
+def _read_jsonl(path: Path) -> Iterable[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def main() -> None:
+    from unified_app.sinks import SinkSet
+
+    parser = argparse.ArgumentParser(description="统计 JSONL 结果文件的重复率，可选合并后写入新的结果存储")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--key", action="append", default=[], help="去重键的字段路径，可重复；不指定时只丢弃内容完全相同的记录")
+    parser.add_argument("--items", default="", help="按结果中的条目列表去重，例如 products")
+    parser.add_argument("--max-distance", type=int, default=0, help="不指定 --key 时统计近似重复的 SimHash 汉明距离，0 表示不统计")
+    parser.add_argument("--newest-by", default="", help="判断新旧的字段路径，默认后出现的记录较新")
+    parser.add_argument("--max-keys", type=int, default=DEFAULT_MAX_KEYS)
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    parser.add_argument("--out", action="append", default=[], help="合并结果写入的存储，例如 sqlite:merged.db")
+    args = parser.parse_args()
+
+    merger = RecordMerger(args.key, args.items, args.max_distance, args.newest_by, args.max_keys, args.window)
+    with SinkSet.open(args.out, dedupe=merger) as sinks:
+        # 没有 --out 时只统计重复率
+        for record in _read_jsonl(args.path):
+            sinks.write(record)
+    print(merger.stats.summary())
+    for stats in sinks.stats:
+        print(f"已写入 {stats.summary()}")
+    for error in sinks.errors:
+        print(f"写入失败：{error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Ollama 向量（embeddings）的持久化缓存。
+
+同一台本地服务器上反复抓取相同页面时，相同的文本块不必每次重新计算向量。
+缓存以 “模型 + 文本块内容哈希” 为键，每个模型一个目录：
+
+- vectors.f32：连续存放的 float32 向量（行数 × 维度），读取时通过 numpy.memmap 映射，不整体载入内存
+- keys.bin：与 vectors.f32 按行对应的 16 字节内容哈希，只追加
+- meta.json：模型名与向量维度
+
+查找按批进行，只有未命中的文本块会被合并成一次 /api/embed 请求发给 Ollama。
+写入时先追加向量、再追加键，键文件决定有效行数，进程中途退出也不会读到半行数据；
+多个工作进程共用同一目录时通过文件锁串行化追加。
+
+CachedOllamaEmbeddings 实现了 langchain 的 Embeddings 接口，可以直接替换 OllamaEmbeddings。
+
+使用方：使用 Ollama 抓取超过 pipeline.MAX_HTML_CHARS 的大页面时，pipeline 不再直接截掉页面后半部分，
+而是把页面文本切块、与提示词一起向量化，按相似度挑出最相关的文本块交给模型（见 select_relevant_text）。
+反复抓取同一页面时，未变化的文本块直接命中缓存。
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from unified_app.localstate import file_lock
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+EMBED_CACHE_DIR = PROJECT_ROOT / "embedding_cache"
+
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+# 每次 /api/embed 请求最多包含的文本块数
+EMBED_BATCH_SIZE = 32
+
+# 大页面检索：每个文本块的字符数，以及挑出的文本块总字符数上限
+RETRIEVE_CHUNK_CHARS = 1_500
+RETRIEVE_BUDGET_CHARS = 40_000
+
+_KEY_BYTES = 16
+
+
+def chunk_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()[:_KEY_BYTES]
+
+
+def _model_slug(model: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+
+
+@dataclass
+class EmbeddingCacheStats:
+    hits: int = 0
+    misses: int = 0
+    rows: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class _ModelShard:
+    """单个模型的向量文件。"""
+
+    def __init__(self, directory: Path, model: str) -> None:
+        self.directory = directory
+        self.model = model
+        self.vectors_path = directory / "vectors.f32"
+        self.keys_path = directory / "keys.bin"
+        self.meta_path = directory / "meta.json"
+        self.lock_path = directory / ".lock"
+        self.dim: Optional[int] = None
+        self.index: Dict[bytes, int] = {}
+        self._keys_size = 0
+        self._matrix: Optional[np.memmap] = None
+        if self.meta_path.exists():
+            self.dim = int(json.loads(self.meta_path.read_text(encoding="utf-8"))["dim"])
+
+    def refresh(self) -> None:
+        """其他进程追加了新行时，重新读取键并重新映射向量文件。"""
+        if self.dim is None:
+            if not self.meta_path.exists():
+                return
+            self.dim = int(json.loads(self.meta_path.read_text(encoding="utf-8"))["dim"])
+        if not self.keys_path.exists():
+            return
+        size = self.keys_path.stat().st_size
+        if size == self._keys_size and self._matrix is not None:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_size)
+            tail = f.read(size - self._keys_size)
+        start = self._keys_size // _KEY_BYTES
+        for i in range(len(tail) // _KEY_BYTES):
+            self.index[tail[i * _KEY_BYTES:(i + 1) * _KEY_BYTES]] = start + i
+        self._keys_size = start * _KEY_BYTES + (len(tail) // _KEY_BYTES) * _KEY_BYTES
+        rows = self._keys_size // _KEY_BYTES
+        self._matrix = (
+            np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            if rows
+            else None
+        )
+
+    @property
+    def rows(self) -> int:
+        return self._keys_size // _KEY_BYTES
+
+    def lookup(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        self.refresh()
+        out: List[Optional[np.ndarray]] = []
+        for key in keys:
+            row = self.index.get(key)
+            out.append(np.array(self._matrix[row]) if row is not None and self._matrix is not None else None)
+        return out
+
+    def append(self, keys: Sequence[bytes], vectors: np.ndarray) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with file_lock(self.lock_path):
+            if self.dim is None:
+                if self.meta_path.exists():
+                    self.dim = int(json.loads(self.meta_path.read_text(encoding="utf-8"))["dim"])
+                else:
+                    self.dim = int(vectors.shape[1])
+                    self.meta_path.write_text(
+                        json.dumps({"model": self.model, "dim": self.dim}), encoding="utf-8"
+                    )
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不一致：缓存为 {self.dim}，本次为 {vectors.shape[1]}")
+            self.refresh()
+            fresh = [(k, i) for i, k in enumerate(keys) if k not in self.index]
+            if not fresh:
+                return
+            rows = self.rows
+            # 截掉上次中途退出时可能残留的半截向量或半个键
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(rows * self.dim * 4)
+                f.write(vectors[[i for _, i in fresh]].tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.truncate(rows * _KEY_BYTES)
+                f.write(b"".join(k for k, _ in fresh))
+            self.refresh()
+
+
+class EmbeddingCache:
+    """按模型分目录的向量缓存，可在线程间共享。"""
+
+    def __init__(self, directory: Path = EMBED_CACHE_DIR) -> None:
+        self.directory = Path(directory)
+        self.stats = EmbeddingCacheStats()
+        self._shards: Dict[str, _ModelShard] = {}
+        self._lock = threading.Lock()
+
+    def _shard(self, model: str) -> _ModelShard:
+        shard = self._shards.get(model)
+        if shard is None:
+            shard = _ModelShard(self.directory / _model_slug(model), model)
+            self._shards[model] = shard
+        return shard
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            found = self._shard(model).lookup([chunk_key(t) for t in texts])
+            hits = sum(1 for v in found if v is not None)
+            self.stats.hits += hits
+            self.stats.misses += len(found) - hits
+            return found
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        if not texts:
+            return
+        with self._lock:
+            shard = self._shard(model)
+            shard.append([chunk_key(t) for t in texts], np.asarray(vectors, dtype=np.float32))
+            self.stats.rows = shard.rows
+
+    def model_stats(self) -> List[Dict[str, Any]]:
+        rows = []
+        if not self.directory.exists():
+            return rows
+        for meta_path in sorted(self.directory.glob("*/meta.json")):
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            keys_path = meta_path.parent / "keys.bin"
+            count = keys_path.stat().st_size // _KEY_BYTES if keys_path.exists() else 0
+            rows.append({
+                "model": meta.get("model", meta_path.parent.name),
+                "dim": meta["dim"],
+                "rows": count,
+                "bytes": count * int(meta["dim"]) * 4,
+            })
+        return rows
+
+
+class CachedOllamaEmbeddings(Embeddings):
+    """先查缓存，再把未命中的文本块分批发给 Ollama 的 /api/embed。"""
+
+    def __init__(
+        self,
+        model: str = DEFAULT_EMBED_MODEL,
+        base_url: str = DEFAULT_OLLAMA_URL,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = EMBED_BATCH_SIZE,
+        timeout: float = 120.0,
+        client: Optional[httpx.Client] = None,
+    ) -> None:
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.cache = cache or EmbeddingCache()
+        self.batch_size = max(1, batch_size)
+        self.client = client or httpx.Client(timeout=timeout)
+
+    def _embed_remote(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            resp = self.client.post(
+                f"{self.base_url}/api/embed",
+                json={"model": self.model, "input": batch},
+            )
+            resp.raise_for_status()
+            vectors.extend(resp.json()["embeddings"])
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        found = self.cache.get_many(self.model, texts)
+        # 同一批中重复的文本块只请求一次
+        missing = list(dict.fromkeys(t for t, v in zip(texts, found) if v is None))
+        computed: Dict[str, List[float]] = {}
+        if missing:
+            vectors = self._embed_remote(missing)
+            self.cache.put_many(self.model, missing, vectors)
+            computed = dict(zip(missing, vectors))
+        return [v.tolist() if v is not None else computed[t] for t, v in zip(texts, found)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def close(self) -> None:
+        self.client.close()
+
+
+# 进程内共享的缓存与客户端：(服务地址, 模型) -> 客户端；
+# 长时间运行的服务每次抓取都复用同一个 httpx 连接池与缓存索引，不会逐次泄漏
+_SHARED_CACHE: Optional[EmbeddingCache] = None
+_SHARED_EMBEDDERS: Dict[Tuple[str, str], CachedOllamaEmbeddings] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_embeddings(model: str, base_url: str = DEFAULT_OLLAMA_URL) -> CachedOllamaEmbeddings:
+    global _SHARED_CACHE
+    key = (base_url.rstrip("/"), model)
+    with _SHARED_LOCK:
+        embedder = _SHARED_EMBEDDERS.get(key)
+        if embedder is None:
+            if _SHARED_CACHE is None:
+                _SHARED_CACHE = EmbeddingCache()
+            embedder = _SHARED_EMBEDDERS[key] = CachedOllamaEmbeddings(model, base_url, cache=_SHARED_CACHE)
+        return embedder
+
+
+def embeddings_from_config(
+    graph_config: Dict[str, Any], cache: Optional[EmbeddingCache] = None
+) -> Optional[CachedOllamaEmbeddings]:
+    """
+    根据 build_graph_config 中的 embeddings 配置返回带缓存的 Ollama 向量客户端；
+    没有配置或不是 ollama 模型时返回 None。
+    不传 cache 时返回进程内共享的客户端（见 shared_embeddings），不需要关闭；
+    传入 cache 时新建客户端，由调用方负责 close()。
+    """
+    cfg = graph_config.get("embeddings") or {}
+    model = str(cfg.get("model") or "")
+    if not model.startswith("ollama/"):
+        return None
+    base_url = cfg.get("base_url") or DEFAULT_OLLAMA_URL
+    if cache is None:
+        return shared_embeddings(model.split("/", 1)[1], base_url)
+    return CachedOllamaEmbeddings(model=model.split("/", 1)[1], base_url=base_url, cache=cache)
+
+
+def chunk_blocks(blocks: Sequence[str], size: int = RETRIEVE_CHUNK_CHARS) -> List[str]:
+    """把相邻的文本行拼成约 size 字符的文本块；单行超长时按 size 切开。"""
+    chunks: List[str] = []
+    current: List[str] = []
+    length = 0
+    for block in blocks:
+        for start in range(0, len(block), size):
+            piece = block[start:start + size]
+            if current and length + len(piece) > size:
+                chunks.append("\n".join(current))
+                current, length = [], 0
+            current.append(piece)
+            length += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def select_relevant_text(
+    embedder: Embeddings,
+    query: str,
+    html: str,
+    budget: int = RETRIEVE_BUDGET_CHARS,
+) -> Tuple[str, int, int]:
+    """
+    大页面检索：把页面可见文本切块，按与 query（提示词）的余弦相似度从高到低挑选文本块，
+    总长度不超过 budget，按原文顺序拼接。返回 (文本, 选中块数, 总块数)。
+    """
+    from unified_app.monitor import normalise_html
+
+    chunks = chunk_blocks(normalise_html(html))
+    if not chunks:
+        return "", 0, 0
+    vectors = np.asarray(embedder.embed_documents(chunks), dtype=np.float32)
+    target = np.asarray(embedder.embed_query(query), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(target) or 1.0)
+    scores = vectors @ target / np.where(norms == 0, 1.0, norms)
+
+    picked: List[int] = []
+    used = 0
+    for idx in np.argsort(-scores):
+        if used + len(chunks[idx]) > budget and picked:
+            continue
+        picked.append(int(idx))
+        used += len(chunks[idx])
+    picked.sort()
+    return "\n\n---\n\n".join(chunks[i] for i in picked), len(picked), len(chunks)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="查看向量缓存占用")
+    parser.add_argument("--dir", default=str(EMBED_CACHE_DIR), help="缓存目录")
+    args = parser.parse_args()
+
+    rows = EmbeddingCache(Path(args.dir)).model_stats()
+    if not rows:
+        print("缓存为空")
+        return
+    for row in rows:
+        print(f"{row['model']}: {row['rows']} 条 × {row['dim']} 维，{row['bytes'] / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""
+多端点负载均衡：同一 provider 的多台本地模型服务（LM Studio / Ollama）。
+
+OllamaConfig / LMStudioConfig 的 endpoints 列出多台服务时，每次模型调用前由 EndpointPool 挑选一台：
+
+- 只考虑健康的端点：连续失败 eject_after_failures 次或健康检查失败的端点暂时移出端点池，
+  eject_s 秒后重新检查，通过才重新加入；全部被移出时仍按下面的规则挑一台尝试
+- 跳过明确没有当前模型的端点；prefer_loaded 开启时优先选择已加载该模型的端点，
+  都未加载时才选择只下载了该模型的端点（会触发一次加载）。查询不到模型列表的端点视为可用
+- 在剩下的端点中选择 (进行中的请求数 + 1) / 权重 最小的一台，权重相同时即未完成请求最少的一台
+- 健康检查每 health_check_interval_s 秒由首个发现到期的进程执行：Ollama 查询 /api/tags 与 /api/ps，
+  LM Studio 查询 /api/v0/models（旧版本退回 /v1/models，此时不知道加载状态）
+
+进行中的请求与各端点的统计保存在 endpoints.db 中，工作进程池、爬取进程与界面共享同一份数据。
+只配置了一个端点（默认情况）或使用云端 provider 时直接使用 base_url，不读写状态库。
+
+查看各端点状态：
+    python -m unified_app.endpoints
+    python -m unified_app.endpoints --check
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from unified_app.config import AppConfig
+from unified_app.localstate import connect_sqlite, pid_alive
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+ENDPOINTS_DB_PATH = PROJECT_ROOT / "endpoints.db"
+
+LOCAL_PROVIDERS = ("ollama", "lmstudio")
+PROBE_TIMEOUT = 3
+# 登记超过该时长视为进程异常退出后的残留
+IN_FLIGHT_MAX_AGE_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS endpoints (
+    provider TEXT NOT NULL,
+    url TEXT NOT NULL,
+    -- NULL 表示还没有检查过
+    healthy INTEGER,
+    failures INTEGER NOT NULL DEFAULT 0,
+    -- 大于 0 表示已移出端点池：到期前不使用，到期后等待重新检查
+    ejected_until REAL NOT NULL DEFAULT 0,
+    checked_at REAL NOT NULL DEFAULT 0,
+    -- JSON 数组，NULL 表示服务不提供该信息
+    available TEXT,
+    loaded TEXT,
+    requests INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    busy_s REAL NOT NULL DEFAULT 0,
+    last_error TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (provider, url)
+);
+CREATE TABLE IF NOT EXISTS in_flight (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    provider TEXT NOT NULL,
+    url TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_in_flight_url ON in_flight(provider, url);
+"""
+
+
+def _server_root(base_url: str) -> str:
+    base = base_url.rstrip("/")
+    return base.rsplit("/v1", 1)[0] if base.endswith("/v1") else base
+
+
+def _model_names(names: List[str]) -> Set[str]:
+    # 未写标签时 Ollama 默认使用 latest
+    return {n for name in names if name for n in (name, name.split(":latest", 1)[0])}
+
+
+def _describe(e: Exception) -> str:
+    return f"{type(e).__name__}: {(str(e).splitlines() or [''])[0]}"[:200]
+
+
+@dataclass
+class Endpoint:
+    provider: str
+    # 云端 provider 为空
+    url: str
+    weight: float = 1.0
+
+    def apply(self, app_cfg: AppConfig) -> AppConfig:
+        """指向该端点的配置副本；已经指向该端点时原样返回。"""
+        section = getattr(app_cfg, self.provider, None)
+        if not self.url or section is None or section.base_url.rstrip("/") == self.url:
+            return app_cfg
+        cfg = copy.deepcopy(app_cfg)
+        getattr(cfg, self.provider).base_url = self.url
+        return cfg
+
+    def point(self, graph_config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        把 build_graph_config 生成的配置改为指向该端点。浅拷贝：
+        录制/回放注入的 transport 与 http_client 保持共用，原配置不受影响。
+        """
+        if not self.url:
+            return graph_config
+        pointed = dict(graph_config)
+        for key in ("llm", "embeddings"):
+            section = pointed.get(key)
+            if isinstance(section, dict) and "base_url" in section:
+                pointed[key] = {**section, "base_url": self.url}
+        return pointed
+
+
+@dataclass
+class EndpointState:
+    url: str
+    weight: float
+    # None 表示还没有检查过
+    healthy: Optional[bool] = None
+    ejected: bool = False
+    in_flight: int = 0
+    requests: int = 0
+    errors: int = 0
+    avg_s: float = 0.0
+    # 当前模型在该端点上的状态：loaded / available / missing / unknown
+    model_state: str = "unknown"
+    checked_at: str = ""
+    last_error: str = ""
+
+    def summary(self) -> str:
+        if self.ejected:
+            state = "已移出"
+        else:
+            state = {True: "健康", False: "不可用", None: "未检查"}[self.healthy]
+        model = {"loaded": "模型已加载", "available": "模型未加载", "missing": "没有该模型", "unknown": "模型状态未知"}[
+            self.model_state
+        ]
+        parts = [state, model, f"权重 {self.weight:g}", f"进行中 {self.in_flight}", f"{self.requests} 次请求"]
+        if self.requests:
+            parts.append(f"平均 {self.avg_s:.2f}s")
+        if self.errors:
+            parts.append(f"失败 {self.errors}")
+        if self.last_error and (self.ejected or self.healthy is False):
+            parts.append(self.last_error)
+        return f"{self.url}：" + " · ".join(parts)
+
+
+class EndpointPool:
+    def __init__(self, app_cfg: AppConfig, provider: Optional[str] = None, path: Path = ENDPOINTS_DB_PATH) -> None:
+        self.app_cfg = app_cfg
+        self.provider = provider or app_cfg.provider
+        self.config = app_cfg.balancing
+        self.path = Path(path)
+        self._initialised = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # 只配置一个端点时用不到状态库，首次使用时才创建
+        conn = connect_sqlite(self.path)
+        if not self._initialised:
+            conn.executescript(_SCHEMA)
+            self._initialised = True
+        return conn
+
+    def endpoints(self) -> List[Endpoint]:
+        """配置中的端点；未配置 endpoints 时只有 base_url 一个，云端 provider 为一个空地址。"""
+        section = getattr(self.app_cfg, self.provider, None)
+        if self.provider not in LOCAL_PROVIDERS or section is None:
+            return [Endpoint(self.provider, "")]
+        endpoints: List[Endpoint] = []
+        for item in section.endpoints or []:
+            url, weight = (item, 1.0) if isinstance(item, str) else (item.get("base_url") or "", item.get("weight", 1.0))
+            url = str(url).strip().rstrip("/")
+            if url and url not in {e.url for e in endpoints}:
+                endpoints.append(Endpoint(self.provider, url, max(float(weight or 0), 0.01)))
+        return endpoints or [Endpoint(self.provider, section.base_url.rstrip("/"))]
+
+    @property
+    def pooled(self) -> bool:
+        return len(self.endpoints()) > 1
+
+    @property
+    def model(self) -> str:
+        section = getattr(self.app_cfg, self.provider, None)
+        model = getattr(section, "model", "") if section is not None else ""
+        return model.split("/", 1)[-1] if self.provider == "ollama" else model
+
+    # ---- 健康检查 ----
+
+    def _probe(self, endpoint: Endpoint) -> Tuple[Optional[List[str]], Optional[List[str]]]:
+        """返回 (已下载的模型, 已加载的模型)，服务不提供的一项为 None；服务不可达时抛出异常。"""
+        import httpx
+
+        root = _server_root(endpoint.url)
+        if self.provider == "ollama":
+            resp = httpx.get(f"{root}/api/tags", timeout=PROBE_TIMEOUT)
+            resp.raise_for_status()
+            available = [m.get("name") or m.get("model") or "" for m in resp.json().get("models") or []]
+            loaded: Optional[List[str]] = None
+            try:
+                resp = httpx.get(f"{root}/api/ps", timeout=PROBE_TIMEOUT)
+                resp.raise_for_status()
+                loaded = [m.get("name") or m.get("model") or "" for m in resp.json().get("models") or []]
+            except httpx.HTTPStatusError:
+                pass
+            return available, loaded
+        resp = httpx.get(f"{root}/api/v0/models", timeout=PROBE_TIMEOUT)
+        if resp.status_code == 404:
+            resp = httpx.get(f"{endpoint.url}/models", timeout=PROBE_TIMEOUT)
+            resp.raise_for_status()
+            return [m.get("id", "") for m in resp.json().get("data") or []], None
+        resp.raise_for_status()
+        data = resp.json().get("data") or []
+        return [m.get("id", "") for m in data], [m.get("id", "") for m in data if m.get("state") == "loaded"]
+
+    def _sync_rows(self, conn: sqlite3.Connection, endpoints: List[Endpoint]) -> Dict[str, sqlite3.Row]:
+        conn.executemany(
+            "INSERT OR IGNORE INTO endpoints (provider, url) VALUES (?, ?)",
+            [(self.provider, e.url) for e in endpoints],
+        )
+        rows = conn.execute("SELECT * FROM endpoints WHERE provider = ?", (self.provider,)).fetchall()
+        return {r["url"]: r for r in rows}
+
+    def _claim_check(self, conn: sqlite3.Connection, row: sqlite3.Row, now: float, force: bool) -> bool:
+        """到期的检查只由一个进程执行：用旧的 checked_at 做条件更新，更新成功的进程负责检查。"""
+        ejected_until = row["ejected_until"]
+        if not force:
+            if ejected_until > now:
+                return False
+            if not ejected_until and now - row["checked_at"] < self.config.health_check_interval_s:
+                return False
+        # 被移出的端点在检查期间保持移出状态
+        cur = conn.execute(
+            "UPDATE endpoints SET checked_at = ?, ejected_until = ? WHERE provider = ? AND url = ? AND checked_at = ?",
+            (now, now + self.config.eject_s if ejected_until else 0, self.provider, row["url"], row["checked_at"]),
+        )
+        return cur.rowcount == 1
+
+    def check(self, force: bool = False) -> int:
+        """检查到期的端点（force 时检查全部），返回实际检查的端点数。"""
+        endpoints = self.endpoints()
+        if self.provider not in LOCAL_PROVIDERS:
+            return 0
+        now = time.time()
+        with self._connect() as conn:
+            rows = self._sync_rows(conn, endpoints)
+            due = [e for e in endpoints if self._claim_check(conn, rows[e.url], now, force)]
+        for endpoint in due:
+            try:
+                available, loaded = self._probe(endpoint)
+            except Exception as e:
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE endpoints SET healthy = 0, ejected_until = ?, last_error = ? WHERE provider = ? AND url = ?",
+                        (time.time() + self.config.eject_s, _describe(e), self.provider, endpoint.url),
+                    )
+                continue
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE endpoints SET healthy = 1, failures = 0, ejected_until = 0, available = ?, loaded = ?, "
+                    "last_error = '' WHERE provider = ? AND url = ?",
+                    (
+                        json.dumps(available) if available is not None else None,
+                        json.dumps(loaded) if loaded is not None else None,
+                        self.provider,
+                        endpoint.url,
+                    ),
+                )
+        return len(due)
+
+    # ---- 挑选端点 ----
+
+    def _has_model(self, row: Optional[sqlite3.Row], column: str) -> Optional[bool]:
+        if row is None or row[column] is None:
+            return None
+        names = _model_names(json.loads(row[column]))
+        return self.model in names or self.model.split(":latest", 1)[0] in names
+
+    def _cleanup(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute("SELECT id, pid, started_at FROM in_flight").fetchall()
+        now = time.time()
+        stale = [r["id"] for r in rows if now - r["started_at"] > IN_FLIGHT_MAX_AGE_SECONDS or not pid_alive(r["pid"])]
+        if stale:
+            conn.execute("DELETE FROM in_flight WHERE id IN (%s)" % ",".join("?" * len(stale)), stale)
+
+    def _in_flight(self, conn: sqlite3.Connection) -> Dict[str, int]:
+        rows = conn.execute(
+            "SELECT url, COUNT(*) AS n FROM in_flight WHERE provider = ? GROUP BY url", (self.provider,)
+        ).fetchall()
+        return {r["url"]: r["n"] for r in rows}
+
+    def _choose(self, conn: sqlite3.Connection, endpoints: List[Endpoint]) -> Endpoint:
+        rows = self._sync_rows(conn, endpoints)
+        # 全部被移出时仍要尝试，不能让整批任务直接失败
+        candidates = [e for e in endpoints if not rows[e.url]["ejected_until"]] or endpoints
+        candidates = [e for e in candidates if self._has_model(rows[e.url], "available") is not False] or candidates
+        if self.config.prefer_loaded:
+            candidates = [e for e in candidates if self._has_model(rows[e.url], "loaded")] or candidates
+        in_flight = self._in_flight(conn)
+
+        def cost(item: Tuple[int, Endpoint]) -> Tuple[float, float, int]:
+            index, endpoint = item
+            row = rows[endpoint.url]
+            avg_s = row["busy_s"] / row["requests"] if row["requests"] else 0.0
+            return (in_flight.get(endpoint.url, 0) + 1) / endpoint.weight, avg_s, index
+
+        return min(enumerate(candidates), key=cost)[1]
+
+    def _release(self, slot_id: int, endpoint: Endpoint, seconds: float, error: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM in_flight WHERE id = ?", (slot_id,))
+            if not error:
+                conn.execute(
+                    "UPDATE endpoints SET requests = requests + 1, busy_s = busy_s + ?, failures = 0 "
+                    "WHERE provider = ? AND url = ?",
+                    (seconds, self.provider, endpoint.url),
+                )
+                # 请求成功说明模型现在已加载，不必等到下一次检查
+                row = conn.execute(
+                    "SELECT loaded FROM endpoints WHERE provider = ? AND url = ?", (self.provider, endpoint.url)
+                ).fetchone()
+                if row is not None and row["loaded"] is not None and not self._has_model(row, "loaded"):
+                    conn.execute(
+                        "UPDATE endpoints SET loaded = ? WHERE provider = ? AND url = ?",
+                        (json.dumps(json.loads(row["loaded"]) + [self.model]), self.provider, endpoint.url),
+                    )
+                return
+            conn.execute(
+                "UPDATE endpoints SET requests = requests + 1, errors = errors + 1, busy_s = busy_s + ?, "
+                "failures = failures + 1, last_error = ? WHERE provider = ? AND url = ?",
+                (seconds, error, self.provider, endpoint.url),
+            )
+            conn.execute(
+                "UPDATE endpoints SET healthy = 0, ejected_until = ? "
+                "WHERE provider = ? AND url = ? AND failures >= ? AND ejected_until = 0",
+                (time.time() + self.config.eject_s, self.provider, endpoint.url, self.config.eject_after_failures),
+            )
+
+    @contextmanager
+    def _lease(self, endpoints: List[Endpoint]) -> Iterator[Endpoint]:
+        self.check()
+        conn = self._connect()
+        try:
+            # 挑选与登记在同一个写事务中完成，并发的调用不会同时看到同一个“最空闲”的端点
+            conn.execute("BEGIN IMMEDIATE")
+            self._cleanup(conn)
+            endpoint = self._choose(conn, endpoints)
+            slot_id = conn.execute(
+                "INSERT INTO in_flight (provider, url, pid, started_at) VALUES (?, ?, ?, ?)",
+                (self.provider, endpoint.url, os.getpid(), time.time()),
+            ).lastrowid
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        started = time.perf_counter()
+        error = "interrupted"
+        try:
+            yield endpoint
+            error = ""
+        except Exception as e:
+            error = _describe(e)
+            raise
+        finally:
+            self._release(slot_id, endpoint, time.perf_counter() - started, error)
+
+    def lease(self):
+        """
+        挑选一个端点并登记为进行中，退出时记录耗时与成败；with 块内抛出的异常计为该端点的一次失败。
+        只有一个端点时直接返回它，不读写状态库。
+        """
+        endpoints = self.endpoints()
+        if len(endpoints) == 1:
+            return nullcontext(endpoints[0])
+        return self._lease(endpoints)
+
+    # ---- 状态 ----
+
+    def states(self) -> List[EndpointState]:
+        endpoints = self.endpoints()
+        if self.provider not in LOCAL_PROVIDERS:
+            return []
+        with self._connect() as conn:
+            self._cleanup(conn)
+            rows = self._sync_rows(conn, endpoints)
+            in_flight = self._in_flight(conn)
+        states = []
+        for endpoint in endpoints:
+            row = rows[endpoint.url]
+            loaded, available = self._has_model(row, "loaded"), self._has_model(row, "available")
+            if loaded:
+                model_state = "loaded"
+            elif available is False:
+                model_state = "missing"
+            elif available or loaded is False:
+                model_state = "available"
+            else:
+                model_state = "unknown"
+            states.append(
+                EndpointState(
+                    url=endpoint.url,
+                    weight=endpoint.weight,
+                    healthy=None if row["healthy"] is None else bool(row["healthy"]),
+                    ejected=bool(row["ejected_until"]),
+                    in_flight=in_flight.get(endpoint.url, 0),
+                    requests=row["requests"],
+                    errors=row["errors"],
+                    avg_s=row["busy_s"] / row["requests"] if row["requests"] else 0.0,
+                    model_state=model_state,
+                    checked_at=datetime.fromtimestamp(row["checked_at"]).strftime("%H:%M:%S") if row["checked_at"] else "",
+                    last_error=row["last_error"],
+                )
+            )
+        return states
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="多端点负载均衡：各端点状态")
+    parser.add_argument("--provider", choices=LOCAL_PROVIDERS, help="默认使用配置文件中的 provider")
+    parser.add_argument("--check", action="store_true", help="立即检查全部端点")
+    args = parser.parse_args()
+
+    pool = EndpointPool(AppConfig.load(), args.provider)
+    if pool.provider not in LOCAL_PROVIDERS:
+        print(f"{pool.provider} 为云端模型，没有端点池")
+        return
+    if not pool.pooled:
+        print(f"{pool.provider} 只配置了一个端点：{pool.endpoints()[0].url}（在配置文件的 endpoints 中列出多台服务即可启用）")
+    if args.check:
+        pool.check(force=True)
+    for state in pool.states():
+        print(state.summary())
+
+
+if __name__ == "__main__":
+    main()
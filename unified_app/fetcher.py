@@ -0,0 +1,214 @@
+"""
+Playwright 页面抓取。
+
+与 Streamlit 解耦：进度提示通过 reporter 回调输出，
+UI 中传入写到页面上的 reporter，后台任务中则写入任务状态。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from unified_app.har import HarSession
+from unified_app.politeness import PolitenessScheduler
+from unified_app.profiling import RunProfiler
+from unified_app.telemetry import RunRecorder, timed
+
+
+# reporter(level, message)，level 取值：info / warning / success / error
+Reporter = Callable[[str, str], None]
+
+
+def print_reporter(level: str, message: str) -> None:
+    print(f"[{level}] {message}")
+
+
+async def fetch_html_with_playwright(
+    url: str,
+    need_login: bool = False,
+    login_url: str | None = None,
+    use_storage: bool = True,
+    manual_login: bool = False,
+    headless: bool = True,
+    page_wait_strategy: str = "domcontentloaded",
+    page_timeout: int = 60,
+    reporter: Reporter = print_reporter,
+    recorder: Optional[RunRecorder] = None,
+    har: Optional[HarSession] = None,
+    politeness: Optional[PolitenessScheduler] = None,
+    snapshot: bool = False,
+    profiler: Optional[RunProfiler] = None,
+):
+    """
+    复用原有 LM Studio demo 中的 Playwright 登录抓取逻辑。
+    传入 recorder 时记录浏览器启动、登录、导航、固定等待和读取 HTML 各阶段耗时；
+    传入 har 时按其模式录制 HAR 或从 HAR 离线回放；
+    传入 politeness 时按域名限速、遵守 robots.txt 并从代理池中选择代理；
+    snapshot 为 True 时在页面内生成精简快照代替 page.content()（见 snapshot.py），返回渲染后的精简 HTML；
+    传入 profiler 时在 context 上录制 Playwright trace（见 profiling.py）。
+    """
+    # 延迟导入：只查看历史或配置的页面不需要加载 Playwright
+    from playwright.async_api import async_playwright, TimeoutError
+
+    storage_state_path = "login_state.json" if need_login and use_storage else None
+
+    async with async_playwright() as p:
+        lease = None
+        browser = None
+        context = None
+        try:
+            if politeness is not None:
+                # 按域名限速：等待该域名的空闲名额（robots.txt 不允许时直接抛出 RobotsDisallowed）
+                with timed(recorder, "politeness_wait"):
+                    lease = await politeness.acquire_async(url)
+
+            if need_login:
+                reporter("info", "🔑 启动带登录的浏览器...")
+            with timed(recorder, "browser_launch"):
+                browser = await p.chromium.launch(headless=headless)
+
+            # 读取存储状态
+            context_options = {"accept_downloads": False}
+            if storage_state_path and os.path.exists(storage_state_path):
+                try:
+                    raw_state = Path(storage_state_path).read_text(encoding="utf-8").strip()
+                    if raw_state:
+                        json.loads(raw_state)
+                        context_options["storage_state"] = storage_state_path
+                        reporter("info", "🔑 检测到保存的登录状态，将自动使用")
+                    else:
+                        reporter("warning", "⚠️ 检测到空的 login_state.json，已忽略并删除，请重新登录")
+                        os.remove(storage_state_path)
+                except Exception:
+                    reporter("warning", "⚠️ 登录状态文件不可用，已忽略")
+
+            if lease is not None:
+                # 使用代理池时，每个 context 绑定一个代理
+                context_options.update(lease.context_options())
+            if har is not None:
+                context_options.update(har.context_options())
+            context = await browser.new_context(**context_options)
+
+            if har is not None:
+                await har.attach(context)
+            if profiler is not None:
+                await profiler.start_trace_async(context)
+            page = await context.new_page()
+
+            if need_login:
+                login_started = time.perf_counter()
+                target_login_url = login_url if login_url else url
+                reporter("info", f"🔐 正在访问登录页面: {target_login_url}")
+                try:
+                    await page.goto(
+                        target_login_url,
+                        wait_until=page_wait_strategy,
+                        timeout=page_timeout * 1000,
+                    )
+                except TimeoutError:
+                    reporter("warning", "⚠️ 登录页加载超时，改用 domcontentloaded 再试")
+                    await page.goto(
+                        target_login_url,
+                        wait_until="domcontentloaded",
+                        timeout=page_timeout * 1000,
+                    )
+                await page.wait_for_timeout(2000)
+
+                if manual_login:
+                    reporter(
+                        "warning",
+                        "⚠️ 手动登录模式开启，请在弹出的浏览器中完成登录。",
+                    )
+                    # 这里沿用原 demo 的简化逻辑：等待用户在浏览器中完成登录
+                    waited = 0
+                    interval = 3000
+                    while waited < 300_000:
+                        await page.wait_for_timeout(interval)
+                        waited += interval
+                        cur = page.url
+                        reporter("info", f"📍 当前页面: {cur}")
+                        if "/login" not in cur and "signin" not in cur:
+                            reporter("success", "✅ 检测到已登录，继续抓取页面")
+                            break
+                    else:
+                        reporter("error", "❌ 登录超时，请重试")
+                        return None
+
+                    if storage_state_path:
+                        await context.storage_state(path=storage_state_path)
+                        reporter("success", "✅ 登录状态已保存到 login_state.json")
+                if recorder is not None:
+                    recorder.since("login", login_started)
+
+            # 访问目标页
+            reporter("info", f"🌐 正在访问: {url}")
+            target_wait_until = (
+                "domcontentloaded" if "github.com" in url else page_wait_strategy
+            )
+            with timed(recorder, "navigate"):
+                try:
+                    response = await page.goto(
+                        url,
+                        wait_until=target_wait_until,
+                        timeout=page_timeout * 1000,
+                    )
+                except TimeoutError:
+                    reporter("warning", "⚠️ 页面加载超时，改用 domcontentloaded 再试")
+                    response = await page.goto(
+                        url,
+                        wait_until="domcontentloaded",
+                        timeout=page_timeout * 1000,
+                    )
+            if lease is not None and response is not None:
+                # 回报状态码，429/403 会让该域名后续请求自动退避
+                lease.record(response.status, response.headers.get("retry-after"))
+
+            with timed(recorder, "settle_wait"):
+                await page.wait_for_timeout(2000)
+            if snapshot:
+                from unified_app.snapshot import take_snapshot
+
+                with timed(recorder, "page_snapshot"):
+                    page_snapshot = await take_snapshot(page)
+                if recorder is not None:
+                    recorder.metrics.bytes_fetched += page_snapshot.transfer_bytes
+                    recorder.metrics.html_bytes += page_snapshot.html_bytes
+                reporter("success", f"✅ 已获取页面快照：{page_snapshot.summary()}")
+                return page_snapshot.to_html()
+
+            with timed(recorder, "page_content"):
+                html = await page.content()
+            if recorder is not None:
+                html_bytes = len(html.encode("utf-8"))
+                recorder.metrics.bytes_fetched += html_bytes
+                recorder.metrics.html_bytes += html_bytes
+            reporter("success", "✅ 已获取页面 HTML")
+            return html
+        except BaseException as e:
+            if lease is not None:
+                lease.error = type(e).__name__
+            raise
+        finally:
+            # 先关闭 context，HAR 录制在 context 关闭时写入；
+            # 逐层 try/finally：context 关闭失败（如浏览器已崩溃）时仍要关闭浏览器并归还域名名额，
+            # 否则长时间运行的进程会残留 Chromium 进程
+            try:
+                if context is not None:
+                    try:
+                        if profiler is not None:
+                            await profiler.stop_trace_async(context)
+                    finally:
+                        await context.close()
+            finally:
+                try:
+                    if browser is not None:
+                        await browser.close()
+                finally:
+                    if lease is not None:
+                        politeness.release(lease)
+            if har is not None and har.misses:
+                reporter("warning", f"⚠️ {len(har.misses)} 个请求不在 HAR 归档中，已中止")
@@ -0,0 +1,154 @@
+"""
+GitHub 用户/组织仓库列表抓取（不依赖 Streamlit，供 table_exporter.py 与基准测试共用）。
+"""
+
+from typing import Optional
+from urllib.parse import urlparse
+
+from unified_app.har import HarSession
+from unified_app.politeness import Lease, PolitenessScheduler
+from unified_app.profiling import RunProfiler
+
+
+GITHUB_BASE_URL = "https://github.com"
+
+
+def normalize_username(input_str: str) -> str:
+    """从输入中提取 GitHub 用户名或组织名"""
+    input_str = (input_str or "").strip()
+    if not input_str:
+        return ""
+    if input_str.startswith("http"):
+        try:
+            p = urlparse(input_str)
+            parts = [p for p in p.path.split("/") if p]
+            if parts:
+                return parts[0]
+            return ""
+        except Exception:
+            return input_str
+    # 允许直接输入包含额外路径，如 "username?tab=repositories"
+    return input_str.split("/")[0].split("?")[0]
+
+async def fetch_github_repos(
+    username: str,
+    headless: bool = True,
+    timeout_sec: int = 30,
+    base_url: str = GITHUB_BASE_URL,
+    har: Optional[HarSession] = None,
+    politeness: Optional[PolitenessScheduler] = None,
+    profiler: Optional[RunProfiler] = None,
+):
+    """
+    使用 Playwright 抓取 GitHub 用户/组织的仓库信息，返回 list[dict]；
+    传入 har 时录制或回放 HAR，传入 politeness 时按域名限速并使用代理池，
+    传入 profiler 时录制 Playwright trace（见 profiling.py）。
+    """
+    base_url = base_url.rstrip("/")
+    target_url = f"{base_url}/{username}?tab=repositories"
+    if politeness is None:
+        return await _fetch_repos_page(target_url, username, base_url, headless, timeout_sec, har, profiler=profiler)
+    async with politeness.aslot(target_url) as lease:
+        return await _fetch_repos_page(target_url, username, base_url, headless, timeout_sec, har, lease, profiler)
+
+
+async def _fetch_repos_page(
+    target_url: str,
+    username: str,
+    base_url: str,
+    headless: bool,
+    timeout_sec: int,
+    har: Optional[HarSession],
+    lease: Optional[Lease] = None,
+    profiler: Optional[RunProfiler] = None,
+):
+    from playwright.async_api import async_playwright, TimeoutError
+
+    context_options = {}
+    if lease is not None:
+        context_options.update(lease.context_options())
+    if har is not None:
+        context_options.update(har.context_options())
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=headless)
+        context = None
+        try:
+            context = await browser.new_context(**context_options)
+            if har is not None:
+                await har.attach(context)
+            if profiler is not None:
+                await profiler.start_trace_async(context)
+            page = await context.new_page()
+            try:
+                response = await page.goto(target_url, wait_until="domcontentloaded", timeout=timeout_sec * 1000)
+            except TimeoutError:
+                # 退回到简单加载等待
+                response = await page.goto(target_url, wait_until="load", timeout=timeout_sec * 1000)
+            if lease is not None and response is not None:
+                lease.record(response.status, response.headers.get("retry-after"))
+            # 等待仓库列表出现（有些页面会懒加载）
+            try:
+                await page.wait_for_selector('[data-testid="repository-list"], .repo-list', timeout=8000)
+            except Exception:
+                # 允许继续尝试，即使选择器没出现
+                pass
+
+            # 在页面上下文中抽取结构化仓库信息
+            repos = await page.evaluate(
+                """([user, base]) => {
+                    const containers = Array.from(document.querySelectorAll(
+                        '[data-testid="repository-list"] li, [data-testid="results-list"] li, article, li'
+                    ));
+                    const data = [];
+                    for (const el of containers) {
+                        // 尝试定位与用户名相关的链接
+                        const link = el.querySelector(`a[href*="/${user}/"]`);
+                        if (!link) continue;
+                        const name = link.textContent.trim();
+                        if (!name) continue;
+                        const href = link.getAttribute('href') || '';
+                        const descEl = el.querySelector('p, .repo-description, [itemprop="description"]');
+                        const langEl = el.querySelector('[itemprop="programmingLanguage"], .repo-language-color + span, [data-testid="repo-card-language"]');
+                        const starEl = el.querySelector('a[href$="/stargazers"], [data-testid="stargazers"]');
+                        data.push({
+                            "name": name,
+                            "url": href.startsWith('http') ? href : `${base}${href}`,
+                            "description": descEl ? descEl.textContent.trim() : "",
+                            "language": langEl ? langEl.textContent.trim() : "",
+                            "stars": starEl ? starEl.textContent.trim() : ""
+                        });
+                    }
+                    // 去重并返回
+                    const seen = new Set();
+                    return data.filter(item => {
+                        if (!item.name) return false;
+                        if (seen.has(item.url)) return false;
+                        seen.add(item.url);
+                        return true;
+                    });
+                }""",
+                [username, base_url],
+            )
+
+            return repos
+        finally:
+            # 导航或页面脚本出错时同样要关闭浏览器，否则长时间运行的进程会残留 Chromium 进程；
+            # HAR 录制在 context 关闭时写入
+            try:
+                if context is not None:
+                    try:
+                        if profiler is not None:
+                            await profiler.stop_trace_async(context)
+                    finally:
+                        await context.close()
+            finally:
+                await browser.close()
+
+def repos_to_dataframe(repos_list):
+    """将抓取到的仓库列表转换为 pandas.DataFrame"""
+    # pandas 导入较慢，只在展示结果时才需要
+    import pandas as pd
+
+    if not repos_list:
+        return pd.DataFrame()
+    return pd.DataFrame(repos_list)
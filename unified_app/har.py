@@ -0,0 +1,99 @@
+"""
+页面抓取的 HAR 录制与离线回放。
+
+- record：创建浏览器 context 时开启 Playwright 的 HAR 录制，context 关闭时写入归档
+- replay：用 route_from_har 从归档中返回响应，不访问真实站点；
+  归档里没有的请求会被中止并记录到 HarSession.misses 中
+
+归档按 URL（或调用方给出的名称）保存为 har_archives/<hash>.har.zip，
+zip 格式会把响应正文作为独立文件压缩存储，比内嵌 base64 的 .har 更紧凑。
+"""
+
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+HAR_DIR = PROJECT_ROOT / "har_archives"
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (OFF, RECORD, REPLAY)
+
+
+def har_path_for(key: str, directory: Path = HAR_DIR) -> Path:
+    """key 一般是目标 URL；文件名带上域名，方便在目录中辨认。"""
+    host = urlparse(key).netloc.replace(":", "_") or "local"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return directory / f"{host}-{digest}.har.zip"
+
+
+@dataclass
+class HarSession:
+    mode: str
+    path: Path
+    # 回放时归档中缺失的请求 URL
+    misses: List[str] = field(default_factory=list)
+
+    @classmethod
+    def for_key(cls, mode: str, key: str, directory: Path = HAR_DIR) -> Optional["HarSession"]:
+        if mode not in MODES:
+            raise ValueError(f"未知的 HAR 模式：{mode}")
+        if mode == OFF:
+            return None
+        return cls(mode=mode, path=har_path_for(key, directory))
+
+    def context_options(self) -> Dict[str, Any]:
+        """需要合并到 browser.new_context(...) 参数中的选项。"""
+        if self.mode != RECORD:
+            return {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        return {
+            "record_har_path": str(self.path),
+            "record_har_content": "attach",
+            "record_har_mode": "full",
+        }
+
+    def _check_archive(self) -> None:
+        if not self.path.exists():
+            raise FileNotFoundError(f"HAR 归档不存在：{self.path}，请先用 record 模式抓取一次")
+
+    async def attach(self, context: Any) -> None:
+        """在异步 API 的 context 上启用回放（record 模式无需额外操作）。"""
+        if self.mode != REPLAY:
+            return
+        self._check_archive()
+
+        async def on_miss(route: Any) -> None:
+            self.misses.append(route.request.url)
+            await route.abort()
+
+        # 路由按注册的逆序匹配：先注册兜底处理，HAR 未命中时才会落到这里
+        await context.route("**/*", on_miss)
+        await context.route_from_har(str(self.path), not_found="fallback")
+
+    def attach_sync(self, context: Any) -> None:
+        """同步 API（RedBookScrapper）版本的 attach。"""
+        if self.mode != REPLAY:
+            return
+        self._check_archive()
+
+        def on_miss(route: Any) -> None:
+            self.misses.append(route.request.url)
+            route.abort()
+
+        context.route("**/*", on_miss)
+        context.route_from_har(str(self.path), not_found="fallback")
+
+    def summary(self) -> str:
+        if self.mode == RECORD:
+            return f"已录制 HAR：{self.path}"
+        if not self.misses:
+            return f"已从 HAR 回放：{self.path}"
+        return f"已从 HAR 回放：{self.path}，{len(self.misses)} 个请求不在归档中"
@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import json
-from dataclasses import dataclass, asdict
+import os
+from dataclasses import dataclass, asdict, field
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from unified_app.localstate import file_lock
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -19,6 +22,8 @@ class HistoryItem:
     url: str
     prompt: str
     summary: str
+    # 阶段耗时、抓取字节数、token 用量等运行指标，见 telemetry.RunMetrics
+    metrics: Dict[str, Any] = field(default_factory=dict)
 
 
 def _now_iso() -> str:
@@ -40,6 +45,7 @@ def load_history(path: Path = HISTORY_PATH) -> List[HistoryItem]:
                         url=item.get("url", ""),
                         prompt=item.get("prompt", ""),
                         summary=item.get("summary", ""),
+                        metrics=item.get("metrics") or {},
                     )
                 )
             except Exception:
@@ -49,15 +55,18 @@ def load_history(path: Path = HISTORY_PATH) -> List[HistoryItem]:
         return []
 
 
+def _lock_path(path: Path) -> Path:
+    return path.with_name(path.name + ".lock")
+
+
 def append_history(
     provider: str,
     url: str,
     prompt: str,
     result: Any,
     path: Path = HISTORY_PATH,
+    metrics: Optional[Dict[str, Any]] = None,
 ) -> None:
-    items = load_history(path)
-
     # Try to build a short summary from result
     summary = ""
     try:
@@ -71,19 +80,19 @@ def append_history(
     except Exception:
         summary = ""
 
-    items.insert(
-        0,
-        HistoryItem(
-            timestamp=_now_iso(),
-            provider=provider,
-            url=url,
-            prompt=prompt,
-            summary=summary,
-        ),
+    item = HistoryItem(
+        timestamp=_now_iso(),
+        provider=provider,
+        url=url,
+        prompt=prompt,
+        summary=summary,
+        metrics=metrics or {},
     )
-    items = items[:MAX_HISTORY]
-    data = [asdict(i) for i in items]
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-
-
-
+    # 工作进程池、抓取服务与 UI 会同时追加历史：读-改-写在 sidecar 文件锁内串行化（见 localstate.file_lock），
+    # 先写临时文件再 os.replace，读取方不会读到写了一半的文件
+    with file_lock(_lock_path(path)):
+        items = [item] + load_history(path)
+        data = [asdict(i) for i in items[:MAX_HISTORY]]
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
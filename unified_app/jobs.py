@@ -0,0 +1,564 @@
+"""
+持久化后台任务队列。
+
+任务保存在本地 SQLite（jobs.db）中，由独立的工作进程池执行抓取与抽取，
+与 Streamlit 的脚本重跑解耦：刷新页面或修改控件不会中断正在运行的任务，
+结果在浏览器重新加载后依然可以查看。
+
+启动工作进程池：
+    python -m unified_app.jobs --processes 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from unified_app.localstate import connect_sqlite, pid_alive
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+JOBS_DB_PATH = PROJECT_ROOT / "jobs.db"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# 工作进程心跳超过该秒数未更新即视为已退出
+WORKER_STALE_SECONDS = 15
+# ensure_pool 启动进程池后，在这段时间内（工作进程尚未写入心跳）其他调用方不再重复启动
+POOL_LAUNCH_GRACE_S = 30
+POLL_INTERVAL = 1.0
+DEFAULT_PROCESSES = max(1, min(4, os.cpu_count() or 1))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL,
+    request TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker_pid INTEGER,
+    schedule_id TEXT,
+    run_id INTEGER,
+    not_before REAL,
+    coalesce_key TEXT,
+    waiters INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, id);
+CREATE TABLE IF NOT EXISTS workers (
+    pid INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS launcher (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    pid INTEGER,
+    launched_at REAL NOT NULL
+);
+"""
+
+_MIGRATIONS = {
+    "schedule_id": "TEXT",
+    "run_id": "INTEGER",
+    "not_before": "REAL",
+    "coalesce_key": "TEXT",
+    "waiters": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+@dataclass
+class Job:
+    id: int
+    state: str
+    request: Dict[str, Any]
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    progress: float = 0.0
+    message: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    worker_pid: Optional[int] = None
+    schedule_id: Optional[str] = None
+    run_id: Optional[int] = None
+    # 合并相同请求时挂到这个任务上的其他提交数，见 attach_or_submit
+    waiters: int = 0
+
+    @property
+    def active(self) -> bool:
+        return self.state in ACTIVE_STATES
+
+
+def _now_iso() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class JobStore:
+    """任务状态的唯一来源，UI 与工作进程都通过它读写。"""
+
+    def __init__(self, path: Path = JOBS_DB_PATH) -> None:
+        self.path = Path(path)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            # 兼容旧版本创建的任务库：补齐后来新增的列
+            existing = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+            for column, ddl in _MIGRATIONS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_run ON jobs(run_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_coalesce ON jobs(coalesce_key, state)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(self.path)
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Job:
+        result = None
+        if row["result"] is not None:
+            try:
+                result = json.loads(row["result"])
+            except Exception:
+                result = row["result"]
+        return Job(
+            id=row["id"],
+            state=row["state"],
+            request=json.loads(row["request"]),
+            created_at=row["created_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"],
+            progress=row["progress"],
+            message=row["message"],
+            result=result,
+            error=row["error"],
+            cancel_requested=bool(row["cancel_requested"]),
+            worker_pid=row["worker_pid"],
+            schedule_id=row["schedule_id"],
+            run_id=row["run_id"],
+            waiters=row["waiters"] or 0,
+        )
+
+    # ---- 提交与查询（UI 侧） ----
+
+    def submit(
+        self,
+        request: Dict[str, Any],
+        schedule_id: Optional[str] = None,
+        run_id: Optional[int] = None,
+        not_before: Optional[float] = None,
+    ) -> int:
+        """not_before 为 Unix 时间戳，在此之前任务不会被领取。"""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO jobs (state, request, created_at, schedule_id, run_id, not_before) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    QUEUED,
+                    json.dumps(request, ensure_ascii=False),
+                    _now_iso(),
+                    schedule_id,
+                    run_id,
+                    not_before,
+                ),
+            )
+            return int(cur.lastrowid)
+
+    def attach_or_submit(self, request: Dict[str, Any], coalesce_key: Optional[str]) -> Tuple[int, bool]:
+        """
+        已有相同请求键的任务在排队或运行时挂到该任务上（等待数加一），返回 (任务 ID, True)；
+        否则提交新任务并记录请求键，返回 (任务 ID, False)。coalesce_key 为 None 时总是提交新任务。
+        """
+        if coalesce_key is None:
+            return self.submit(request), False
+        conn = self._connect()
+        try:
+            # 查找与插入在同一个写事务中，两个会话同时提交时只会创建一个任务
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE coalesce_key = ? AND state IN (?, ?) AND cancel_requested = 0 "
+                "ORDER BY id LIMIT 1",
+                (coalesce_key, *ACTIVE_STATES),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET waiters = waiters + 1 WHERE id = ?", (row["id"],))
+                job_id, attached = int(row["id"]), True
+            else:
+                cur = conn.execute(
+                    "INSERT INTO jobs (state, request, created_at, coalesce_key) VALUES (?, ?, ?, ?)",
+                    (QUEUED, json.dumps(request, ensure_ascii=False), _now_iso(), coalesce_key),
+                )
+                job_id, attached = int(cur.lastrowid), False
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return job_id, attached
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_recent(self, limit: int = 20) -> List[Job]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    def cancel(self, job_id: int) -> None:
+        """
+        排队中的任务直接取消；运行中的任务由所属工作进程终止。
+        有其他提交挂在该任务上时只减少一个等待数，任务继续为其余的提交运行。
+        """
+        with self._connect() as conn:
+            released = conn.execute(
+                "UPDATE jobs SET waiters = waiters - 1 WHERE id = ? AND waiters > 0 AND state IN (?, ?)",
+                (job_id, *ACTIVE_STATES),
+            ).rowcount
+            if released:
+                return
+            conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, message = '已取消' "
+                "WHERE id = ? AND state = ?",
+                (CANCELLED, _now_iso(), job_id, QUEUED),
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND state = ?",
+                (job_id, RUNNING),
+            )
+
+    # ---- 执行状态（工作进程侧） ----
+
+    def claim_next(self, worker_pid: int) -> Optional[Job]:
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE 获取写锁，保证同一任务只会被一个工作进程领取
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE state = ? AND (not_before IS NULL OR not_before <= ?) "
+                "ORDER BY id LIMIT 1",
+                (QUEUED, time.time()),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = ?, started_at = ?, worker_pid = ?, message = '已开始' "
+                "WHERE id = ?",
+                (RUNNING, _now_iso(), worker_pid, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return self.get(row["id"])
+
+    def update_progress(self, job_id: int, progress: Optional[float], message: str) -> None:
+        with self._connect() as conn:
+            if progress is None:
+                conn.execute("UPDATE jobs SET message = ? WHERE id = ?", (message, job_id))
+            else:
+                conn.execute(
+                    "UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+                    (progress, message, job_id),
+                )
+
+    def _finish(self, job_id: int, state: str, **fields: Any) -> None:
+        fields["state"] = state
+        fields["finished_at"] = _now_iso()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND state = ?",
+                (*fields.values(), job_id, RUNNING),
+            )
+
+    def mark_done(self, job_id: int, result: Any, message: str = "完成") -> None:
+        self._finish(
+            job_id,
+            DONE,
+            progress=1.0,
+            message=message,
+            result=json.dumps(result, ensure_ascii=False, default=str),
+        )
+
+    def mark_failed(self, job_id: int, error: str) -> None:
+        self._finish(job_id, FAILED, message="失败", error=error)
+
+    def mark_cancelled(self, job_id: int) -> None:
+        self._finish(job_id, CANCELLED, message="已取消")
+
+    def is_cancel_requested(self, job_id: int) -> bool:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def fail_orphaned(self) -> int:
+        """把工作进程已不存在的 running 任务标记为失败。"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, worker_pid FROM jobs WHERE state = ?", (RUNNING,)
+            ).fetchall()
+        orphaned = [r["id"] for r in rows if not pid_alive(r["worker_pid"])]
+        for job_id in orphaned:
+            self.mark_failed(job_id, "工作进程异常退出")
+        return len(orphaned)
+
+    # ---- 工作进程心跳 ----
+
+    def heartbeat(self, pid: int) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO workers (pid, started_at, heartbeat) VALUES (?, ?, ?) "
+                "ON CONFLICT(pid) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (pid, _now_iso(), time.time()),
+            )
+
+    def unregister(self, pid: int) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+
+    def live_workers(self) -> int:
+        cutoff = time.time() - WORKER_STALE_SECONDS
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT pid FROM workers WHERE heartbeat >= ?", (cutoff,)
+            ).fetchall()
+        return sum(1 for r in rows if pid_alive(r["pid"]))
+
+    def claim_launch(self) -> bool:
+        """
+        决定由谁启动进程池：没有存活的工作进程、且最近没有其他调用方正在启动时，
+        记录一条启动记录并返回 True。检查与记录在同一个写事务中，
+        多个会话或调度器同时调用时只有一个会启动进程池。
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cutoff = time.time() - WORKER_STALE_SECONDS
+            pids = [r["pid"] for r in conn.execute("SELECT pid FROM workers WHERE heartbeat >= ?", (cutoff,))]
+            row = conn.execute("SELECT pid, launched_at FROM launcher WHERE id = 1").fetchone()
+            launching = (
+                row is not None
+                and time.time() - row["launched_at"] < POOL_LAUNCH_GRACE_S
+                # pid 为空表示启动方还没来得及记录进程号
+                and (row["pid"] is None or pid_alive(row["pid"]))
+            )
+            if any(pid_alive(pid) for pid in pids) or launching:
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO launcher (id, pid, launched_at) VALUES (1, NULL, ?)", (time.time(),)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return True
+
+    def record_launch(self, pid: int) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE launcher SET pid = ? WHERE id = 1", (pid,))
+
+    def active_for_schedule(self, schedule_id: str) -> int:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS n FROM jobs WHERE schedule_id = ? AND state IN (?, ?)",
+                (schedule_id, *ACTIVE_STATES),
+            ).fetchone()
+        return int(row["n"])
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT state, COUNT(*) AS n FROM jobs GROUP BY state"
+            ).fetchall()
+        return {r["state"]: r["n"] for r in rows}
+
+
+def _execute_job(job_id: int, db_path: str) -> None:
+    """在独立子进程中执行单个任务，便于取消时连同浏览器进程一起终止。"""
+    if hasattr(os, "setpgrp"):
+        # 成为进程组组长，取消时可以一并结束 Playwright 启动的浏览器
+        os.setpgrp()
+
+    from unified_app.config import AppConfig
+    from unified_app.pipeline import ScrapeRequest, run_scrape
+
+    store = JobStore(Path(db_path))
+    job = store.get(job_id)
+    if job is None:
+        return
+
+    def reporter(level: str, message: str) -> None:
+        store.update_progress(job_id, None, message)
+
+    def progress(fraction: float, message: str) -> None:
+        store.update_progress(job_id, fraction, message)
+
+    try:
+        outcome = run_scrape(
+            AppConfig.load(),
+            ScrapeRequest.from_dict(job.request),
+            reporter=reporter,
+            progress=progress,
+        )
+        store.mark_done(
+            job_id,
+            outcome.result,
+            message="内容未变化，已复用上次结果" if outcome.skipped else "完成",
+        )
+    except Exception as e:
+        store.mark_failed(job_id, f"{e}\n\n{traceback.format_exc()}")
+
+
+def _terminate(proc: mp.Process) -> None:
+    if proc.pid and hasattr(os, "killpg"):
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    else:
+        proc.terminate()
+    proc.join(5)
+    if proc.is_alive():
+        proc.kill()
+        proc.join()
+
+
+def worker_loop(db_path: Path = JOBS_DB_PATH, poll_interval: float = POLL_INTERVAL) -> None:
+    store = JobStore(db_path)
+    pid = os.getpid()
+    try:
+        while True:
+            store.heartbeat(pid)
+            job = store.claim_next(pid)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+
+            child = mp.Process(target=_execute_job, args=(job.id, str(db_path)), daemon=False)
+            child.start()
+            while child.is_alive():
+                child.join(poll_interval)
+                store.heartbeat(pid)
+                if store.is_cancel_requested(job.id):
+                    _terminate(child)
+                    store.mark_cancelled(job.id)
+                    break
+            # 子进程异常退出（崩溃或被杀）时，任务仍处于 running，需要补记失败
+            if child.exitcode not in (0, None):
+                store.mark_failed(job.id, f"任务进程异常退出（exit code {child.exitcode}）")
+    finally:
+        store.unregister(pid)
+
+
+def _preload_models() -> None:
+    from unified_app.config import AppConfig
+    from unified_app.residency import preload_for_batch
+
+    try:
+        results = preload_for_batch(AppConfig.load())
+    except Exception as e:
+        print(f"预加载模型失败：{e}")
+        return
+    for r in results:
+        print(f"预加载 {r.model} @ {r.server}：{'%.1fs，%s' % (r.seconds, r.detail) if r.ok else '失败，' + r.detail}")
+
+
+def run_pool(processes: int = DEFAULT_PROCESSES, db_path: Path = JOBS_DB_PATH) -> None:
+    store = JobStore(db_path)
+    orphaned = store.fail_orphaned()
+    if orphaned:
+        print(f"已将 {orphaned} 个遗留的运行中任务标记为失败")
+
+    workers = [
+        mp.Process(target=worker_loop, args=(db_path,), name=f"scrape-worker-{i}")
+        for i in range(processes)
+    ]
+    for w in workers:
+        w.start()
+    print(f"已启动 {processes} 个工作进程，任务库：{db_path}")
+
+    # 工作进程先启动并写入心跳（ensure_pool 据此判断进程池已存在），模型在后台线程中预加载；
+    # 预加载期间领取的任务照常执行，各任务进程通过 residency.db 协调，不会交替换入两个模型
+    threading.Thread(target=_preload_models, name="preload-models", daemon=True).start()
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        for w in workers:
+            w.terminate()
+        for w in workers:
+            w.join()
+
+
+def ensure_pool(processes: int = DEFAULT_PROCESSES, db_path: Path = JOBS_DB_PATH) -> bool:
+    """
+    如果没有存活的工作进程，则在后台启动一个进程池。
+    返回 True 表示本次新启动了进程池。
+    """
+    store = JobStore(db_path)
+    if not store.claim_launch():
+        return False
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "unified_app.jobs",
+            "--processes",
+            str(processes),
+            "--db",
+            str(db_path),
+        ],
+        cwd=str(PROJECT_ROOT),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    store.record_launch(proc.pid)
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="统一抓取应用的后台任务工作进程池")
+    parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES)
+    parser.add_argument("--db", type=Path, default=JOBS_DB_PATH)
+    args = parser.parse_args()
+    run_pool(args.processes, args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+LLM 调用的录制/回放。
+
+在 LLM 客户端的 HTTP 层（httpx transport）拦截请求，三个 provider 共用：
+OpenAI / LM Studio 通过 ChatOpenAI 的 http_client / http_async_client 注入，
+Ollama 通过 ChatOllama 的 sync_client_kwargs / async_client_kwargs 注入。
+
+模式：
+- off：不拦截
+- record：照常请求模型，并把请求/响应对保存到 cassette 目录（只保存 2xx 响应）
+- replay：命中已录制的请求时直接返回，不发起网络请求；未命中时请求模型并补录
+- strict：只回放，遇到未录制的请求直接报错（适合回归测试）
+
+请求以 “HTTP 方法 + 路径 + 规范化后的 JSON 请求体” 的哈希为键，不包含主机名与鉴权头，
+因此更换 LM Studio / Ollama 服务器地址后仍能命中。
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import httpx
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+CASSETTE_DIR = PROJECT_ROOT / "llm_cassettes"
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+STRICT = "strict"
+MODES = (OFF, RECORD, REPLAY, STRICT)
+
+# 环境变量可以在不修改代码和界面的情况下切换模式，例如在 CI 中设置为 strict
+ENV_MODE = "SCRAPER_LLM_CASSETTE"
+ENV_DIR = "SCRAPER_LLM_CASSETTE_DIR"
+
+
+class CassetteMiss(RuntimeError):
+    """strict 模式下遇到未录制的请求。"""
+
+
+@dataclass
+class CassetteStats:
+    hits: int = 0
+    misses: int = 0
+    recorded: int = 0
+
+
+def mode_from_env(default: str = OFF) -> str:
+    mode = os.environ.get(ENV_MODE, default).strip().lower()
+    return mode if mode in MODES else default
+
+
+# 只影响模型常驻时长、不影响输出的字段，不参与匹配
+_IGNORED_BODY_KEYS = ("keep_alive", "ttl")
+
+
+def _canonical_body(content: bytes) -> str:
+    if not content:
+        return ""
+    try:
+        body = json.loads(content)
+    except Exception:
+        return hashlib.sha256(content).hexdigest()
+    if isinstance(body, dict):
+        body = {k: v for k, v in body.items() if k not in _IGNORED_BODY_KEYS}
+    return json.dumps(body, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+class CassetteStore:
+    """每个请求/响应对保存为一个 JSON 文件，便于查看与在版本库中对比。"""
+
+    def __init__(self, directory: Optional[Path] = None) -> None:
+        self.directory = Path(directory or os.environ.get(ENV_DIR) or CASSETTE_DIR)
+        self.stats = CassetteStats()
+        self._lock = threading.Lock()
+
+    def key_for(self, request: httpx.Request) -> str:
+        payload = "\n".join([request.method, request.url.path, _canonical_body(request.content)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return None
+
+    def put(self, key: str, request: httpx.Request, response: httpx.Response) -> None:
+        body = response.content
+        try:
+            body_field: Dict[str, Any] = {"text": body.decode("utf-8")}
+        except UnicodeDecodeError:
+            body_field = {"base64": base64.b64encode(body).decode("ascii")}
+        entry = {
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "request": {
+                "method": request.method,
+                "path": request.url.path,
+                "body": _canonical_body(request.content),
+            },
+            "response": {
+                "status": response.status_code,
+                "headers": {
+                    k: v
+                    for k, v in response.headers.items()
+                    if k.lower() in ("content-type", "x-request-id")
+                },
+                **body_field,
+            },
+        }
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 多个工作进程可能同时录制同一个键，临时文件按进程与线程区分，各自 replace 不会互相删掉对方的临时文件
+        tmp = path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(entry, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp.replace(path)
+        with self._lock:
+            self.stats.recorded += 1
+
+    def to_response(self, entry: Dict[str, Any], request: httpx.Request) -> httpx.Response:
+        data = entry["response"]
+        if "base64" in data:
+            content = base64.b64decode(data["base64"])
+        else:
+            content = data.get("text", "").encode("utf-8")
+        return httpx.Response(
+            status_code=data["status"],
+            headers=data.get("headers") or {},
+            content=content,
+            request=request,
+        )
+
+    def lookup(self, request: httpx.Request, mode: str) -> tuple[str, Optional[httpx.Response]]:
+        key = self.key_for(request)
+        if mode in (REPLAY, STRICT):
+            entry = self.get(key)
+            if entry is not None:
+                with self._lock:
+                    self.stats.hits += 1
+                return key, self.to_response(entry, request)
+            with self._lock:
+                self.stats.misses += 1
+            if mode == STRICT:
+                raise CassetteMiss(
+                    f"未录制的 LLM 请求：{request.method} {request.url.path}（key={key[:12]}），"
+                    "请先用 record 模式运行一次"
+                )
+        return key, None
+
+
+class CassetteTransport(httpx.BaseTransport):
+    def __init__(self, store: CassetteStore, mode: str, inner: Optional[httpx.BaseTransport] = None) -> None:
+        self.store = store
+        self.mode = mode
+        self.inner = inner or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        key, cached = self.store.lookup(request, self.mode)
+        if cached is not None:
+            return cached
+        response = self.inner.handle_request(request)
+        response.read()
+        # 只录制成功的响应：401/429 等错误录进去后，回放时会一直返回同样的错误
+        if response.is_success:
+            self.store.put(key, request, response)
+        return response
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, store: CassetteStore, mode: str, inner: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        self.store = store
+        self.mode = mode
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        key, cached = self.store.lookup(request, self.mode)
+        if cached is not None:
+            return cached
+        response = await self.inner.handle_async_request(request)
+        await response.aread()
+        # 只录制成功的响应：401/429 等错误录进去后，回放时会一直返回同样的错误
+        if response.is_success:
+            self.store.put(key, request, response)
+        return response
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+def apply_cassette(
+    graph_config: Dict[str, Any],
+    provider: str,
+    mode: str,
+    store: Optional[CassetteStore] = None,
+) -> Optional[CassetteStore]:
+    """
+    把录制/回放 transport 注入 build_graph_config 生成的配置（原地修改）。
+    mode 为 off 时不做任何修改并返回 None。
+    """
+    if mode not in MODES:
+        raise ValueError(f"未知的录制/回放模式：{mode}")
+    if mode == OFF or "llm" not in graph_config:
+        return None
+
+    store = store or CassetteStore()
+    llm = graph_config["llm"]
+    if provider == "ollama":
+        llm["sync_client_kwargs"] = {"transport": CassetteTransport(store, mode)}
+        llm["async_client_kwargs"] = {"transport": AsyncCassetteTransport(store, mode)}
+    else:
+        # openai 与 lmstudio 都走 ChatOpenAI
+        llm["http_client"] = httpx.Client(transport=CassetteTransport(store, mode))
+        llm["http_async_client"] = httpx.AsyncClient(transport=AsyncCassetteTransport(store, mode))
+    return store
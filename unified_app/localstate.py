@@ -0,0 +1,107 @@
+"""
+本地状态文件的公共工具。
+
+多个工作进程、抓取服务与 Streamlit 会同时读写项目目录下的状态文件与 SQLite 状态库：
+
+- file_lock：JSON 等状态文件读-改-写时的跨进程互斥锁
+- connect_sqlite：各状态库（jobs.db、politeness.db、routing.db 等）统一的连接参数
+- pid_alive：判断记录在状态库中的进程是否仍在运行，用于清理崩溃进程遗留的租约与计数
+
+平台差异只在这一处处理。
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+try:
+    import msvcrt
+except ImportError:  # POSIX
+    msvcrt = None  # type: ignore[assignment]
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """
+    以 path 为锁文件（sidecar）的跨进程排他锁：POSIX 上用 fcntl.flock，Windows 上用 msvcrt.locking；
+    两者都不可用时不加锁。
+    """
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK 重试约 10 秒仍拿不到锁时抛出 OSError，继续等待
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            yield
+
+
+def connect_sqlite(path: Path) -> sqlite3.Connection:
+    """
+    自动提交模式（写事务由调用方显式 BEGIN IMMEDIATE）、WAL 与 synchronous=NORMAL，
+    多个进程可以同时读、依次写；行以 sqlite3.Row 返回。
+    """
+    conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    """进程是否仍在运行。Windows 上 os.kill(pid, 0) 会向目标进程发送 CTRL_C_EVENT，改为查询进程退出码。"""
+    if not pid:
+        return False
+    if os.name == "nt":
+        return _windows_pid_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _windows_pid_alive(pid: int) -> bool:
+    import ctypes
+
+    process_query_limited_information = 0x1000
+    still_active = 259
+    error_access_denied = 5
+    kernel32 = ctypes.windll.kernel32  # type: ignore[attr-defined]
+    handle = kernel32.OpenProcess(process_query_limited_information, False, pid)
+    if not handle:
+        # 没有权限打开说明进程存在（属于其他用户）
+        return kernel32.GetLastError() == error_access_denied
+    try:
+        code = ctypes.c_ulong()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+            return True
+        return code.value == still_active
+    finally:
+        kernel32.CloseHandle(handle)
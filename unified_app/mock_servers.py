@@ -0,0 +1,552 @@
+"""
+本地仿真服务：离线基准测试、浸泡测试与开发调试使用，不访问任何外部网站或模型。
+
+- FixtureSite：静态页、JS 渲染页、大页面、仿 GitHub 仓库列表（分页）、仿小红书搜索结果与笔记详情页，
+  以及 robots.txt / sitemap.xml、指定状态码、慢响应等辅助路由
+- MockLLMServer：兼容 OpenAI（/v1/chat/completions、/v1/models、/v1/embeddings）与
+  Ollama（/api/chat、/api/generate、/api/embed、/api/embeddings、/api/tags、/api/ps）的模型服务，
+  延迟与失败率可配置
+
+单独启动：
+    python -m unified_app.mock_servers --site-port 8765 --llm-port 8766 --llm-latency-ms 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import html
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+REPOS_PER_PAGE = 30
+NOTES_PER_PAGE = 20
+
+
+class _Server:
+    """在后台线程中运行的 ThreadingHTTPServer，可作为上下文管理器使用。"""
+
+    handler_cls: type = BaseHTTPRequestHandler
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0) -> None:
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def count(self, route: str) -> None:
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def start(self) -> "_Server":
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self.handler_cls)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self  # type: ignore[attr-defined]
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def owner(self) -> Any:
+        return self.server.owner  # type: ignore[attr-defined]
+
+    def log_message(self, format: str, *args: Any) -> None:
+        return
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_html(self, status: int, text: str) -> None:
+        self._send(status, text.encode("utf-8"), "text/html; charset=utf-8")
+
+    def _send_json(self, status: int, data: Any) -> None:
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+        except Exception:
+            return {}
+
+    def _sleep_latency(self) -> None:
+        if self.owner.latency_ms:
+            time.sleep(self.owner.latency_ms / 1000)
+
+
+# ---------------------------------------------------------------------------
+# 仿真站点
+# ---------------------------------------------------------------------------
+
+
+def _page(title: str, body: str, head: str = "") -> str:
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<title>{html.escape(title)}</title>{head}</head><body>{body}</body></html>"
+    )
+
+
+def _static_page(n: int) -> str:
+    rows = "".join(
+        f"<tr><td>商品 {n}-{i}</td><td>{(n * 7 + i * 13) % 500 + 9.9:.2f}</td></tr>" for i in range(10)
+    )
+    links = "".join(f"<li><a href='/static/{n + k}'>第 {n + k} 页</a></li>" for k in (1, 2, 3))
+    body = (
+        f"<header><nav><a href='/'>首页</a></nav></header>"
+        f"<main><h1>静态页面 {n}</h1>"
+        + "".join(f"<p>第 {n} 页第 {i} 段：这是用于基准测试的固定文本内容。</p>" for i in range(8))
+        + f"<table><thead><tr><th>名称</th><th>价格</th></tr></thead><tbody>{rows}</tbody></table>"
+        f"<ul class='related'>{links}</ul></main>"
+        f"<footer>© fixture</footer>"
+    )
+    return _page(f"静态页面 {n}", body)
+
+
+def _js_page(n: int) -> str:
+    script = (
+        "<script>setTimeout(function(){var ul=document.getElementById('items');"
+        f"for(var i=0;i<20;i++){{var li=document.createElement('li');"
+        f"li.textContent='动态条目 {n}-'+i;ul.appendChild(li);}}"
+        "document.getElementById('status').textContent='rendered';},100);</script>"
+    )
+    body = f"<main><h1>JS 渲染页面 {n}</h1><p id='status'>loading</p><ul id='items'></ul></main>{script}"
+    return _page(f"JS 页面 {n}", body)
+
+
+def _large_page(n: int, kb: int) -> str:
+    # 大量内联脚本与样式 + 正文，模拟真实站点 HTML 中噪声远多于正文的情况
+    noise = "<style>" + (".c{color:#123456;margin:0 auto;}" * 40) + "</style>"
+    noise += "<script>var data=" + json.dumps(["x" * 64] * 40) + ";</script>"
+    para = f"<p>大页面 {n} 的正文段落，包含若干可抽取的信息。</p>"
+    chunks: List[str] = []
+    size = 0
+    i = 0
+    while size < kb * 1024:
+        block = f"<section id='s{i}'>{noise}<h2>小节 {i}</h2>{para * 5}</section>"
+        chunks.append(block)
+        size += len(block.encode("utf-8"))
+        i += 1
+    return _page(f"大页面 {n}", "<main>" + "".join(chunks) + "</main>")
+
+
+def _github_page(user: str, page: int, total: int) -> str:
+    start = (page - 1) * REPOS_PER_PAGE
+    items = []
+    for i in range(start, min(start + REPOS_PER_PAGE, total)):
+        items.append(
+            "<li>"
+            f"<h3><a href='/{user}/repo-{i}'>repo-{i}</a></h3>"
+            f"<p itemprop='description'>{user} 的第 {i} 个仓库</p>"
+            f"<span itemprop='programmingLanguage'>{['Python', 'Go', 'Rust', 'TypeScript'][i % 4]}</span>"
+            f"<a href='/{user}/repo-{i}/stargazers'>{(i * 37) % 1000}</a>"
+            "</li>"
+        )
+    pager = ""
+    if start + REPOS_PER_PAGE < total:
+        pager = f"<a rel='next' href='/{user}?tab=repositories&page={page + 1}'>Next</a>"
+    body = f"<div data-testid='repository-list'><ul>{''.join(items)}</ul></div>{pager}"
+    return _page(f"{user} repositories", body)
+
+
+def _note_id(keyword: str, i: int) -> str:
+    return hashlib.md5(f"{keyword}-{i}".encode("utf-8")).hexdigest()[:24]
+
+
+def _redbook_search(keyword: str, page: int) -> str:
+    start = (page - 1) * NOTES_PER_PAGE
+    cards = "".join(
+        f"<div class='note-item'><a href='/explore/{_note_id(keyword, i)}'>"
+        f"<span class='title'>{html.escape(keyword)} 笔记 {i}</span></a></div>"
+        for i in range(start, start + NOTES_PER_PAGE)
+    )
+    return _page(f"{keyword} - 搜索", f"<div class='feeds-container'>{cards}</div>")
+
+
+def _redbook_note(note_id: str) -> str:
+    seed = int(note_id[:8], 16) if all(c in "0123456789abcdef" for c in note_id[:8]) else len(note_id)
+    tags = "".join(f"<a class='tag' href='/search_result?keyword=t{k}'>#标签{k}</a>" for k in range(seed % 3 + 1))
+    body = (
+        "<div class='note-container'>"
+        f"<div id='detail-title'>笔记 {note_id}</div>"
+        f"<div id='detail-desc'><span>这是笔记 {note_id} 的正文内容。</span>{tags}</div>"
+        f"<span class='date'>2026-0{seed % 9 + 1}-1{seed % 9} 上海</span>"
+        "<div class='interactions'>"
+        f"<span class='like-wrapper'><span class='count'>{seed % 5000}</span></span>"
+        f"<span class='collect-wrapper'><span class='count'>{seed % 800}</span></span>"
+        f"<span class='chat-wrapper'><span class='count'>{seed % 120}</span></span>"
+        "</div></div>"
+    )
+    return _page(f"笔记 {note_id}", body)
+
+
+class _SiteHandler(_Handler):
+    def do_HEAD(self) -> None:
+        self.do_GET()
+
+    def do_GET(self) -> None:
+        parsed = urlparse(self.path)
+        path = parsed.path
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        parts = [p for p in path.split("/") if p]
+        self._sleep_latency()
+
+        def num(idx: int, default: int = 0) -> int:
+            try:
+                return int(parts[idx])
+            except (IndexError, ValueError):
+                return default
+
+        route = parts[0] if parts else "index"
+        self.owner.count(route)
+
+        if not parts:
+            links = "".join(f"<li><a href='/static/{i}'>静态页面 {i}</a></li>" for i in range(20))
+            links += "".join(f"<li><a href='/js/{i}'>JS 页面 {i}</a></li>" for i in range(5))
+            self._send_html(200, _page("仿真站点首页", f"<h1>仿真站点</h1><ul>{links}</ul>"))
+        elif route == "static":
+            self._send_html(200, _static_page(num(1)))
+        elif route == "js":
+            self._send_html(200, _js_page(num(1)))
+        elif route == "large":
+            self._send_html(200, _large_page(num(1), int(query.get("kb", 512))))
+        elif route in ("search_result", "search") or (route == "explore" and len(parts) == 1):
+            self._send_html(200, _redbook_search(query.get("keyword", ""), int(query.get("page", 1))))
+        elif route == "explore":
+            self._send_html(200, _redbook_note(parts[1]))
+        elif route == "robots.txt":
+            self._send(200, b"User-agent: *\nDisallow: /private/\nCrawl-delay: 0\n", "text/plain")
+        elif route == "sitemap.xml":
+            urls = "".join(f"<url><loc>{self.owner.url}/static/{i}</loc></url>" for i in range(50))
+            xml = f"<?xml version='1.0'?><urlset xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>{urls}</urlset>"
+            self._send(200, xml.encode("utf-8"), "application/xml")
+        elif route == "status":
+            code = num(1, 500)
+            headers = {"Retry-After": "1"} if code == 429 else None
+            self._send(code, _page(str(code), f"<h1>{code}</h1>").encode("utf-8"), "text/html", headers)
+        elif route == "slow":
+            time.sleep(int(query.get("ms", 1000)) / 1000)
+            self._send_html(200, _page("slow", "<p>slow page</p>"))
+        elif query.get("tab") == "repositories" and len(parts) == 1:
+            total = int(query.get("total", self.owner.repos_per_user))
+            self._send_html(200, _github_page(parts[0], int(query.get("page", 1)), total))
+        else:
+            self._send_html(404, _page("404", "<h1>Not Found</h1>"))
+
+
+class FixtureSite(_Server):
+    handler_cls = _SiteHandler
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, repos_per_user: int = 60) -> None:
+        super().__init__(host, port, latency_ms)
+        self.repos_per_user = repos_per_user
+
+
+# ---------------------------------------------------------------------------
+# 仿真模型服务
+# ---------------------------------------------------------------------------
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _messages_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for m in messages or []:
+        content = m.get("content")
+        if isinstance(content, list):
+            content = " ".join(str(c.get("text", "")) for c in content if isinstance(c, dict))
+        parts.append(str(content or ""))
+    return "\n".join(parts)
+
+
+def default_responder(prompt_text: str) -> str:
+    """默认返回一个合法 JSON，满足 SmartScraperGraph 对 JSON 输出的解析。"""
+    digest = hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()[:8]
+    return json.dumps({"content": f"mock extraction {digest}", "items": []}, ensure_ascii=False)
+
+
+_BATCH_PAGE = re.compile(r"^=== PAGE (\d+) \| (\S+) ===\n(.*?)(?=^=== )", re.M | re.S)
+
+
+def batch_responder(prompt_text: str) -> str:
+    """按批量抽取（batch_extract.py）的分页标记逐页返回结果，取每页第一行文本作为标题。"""
+    pages = []
+    for n, url, text in _BATCH_PAGE.findall(prompt_text):
+        lines = [line for line in text.splitlines() if line.strip()]
+        pages.append({"page": int(n), "result": {"url": url, "title": lines[0] if lines else ""}})
+    if not pages:
+        return default_responder(prompt_text)
+    return json.dumps({"pages": pages}, ensure_ascii=False)
+
+
+def _embedding(text: str, dim: int) -> List[float]:
+    seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+    rnd = random.Random(seed)
+    return [rnd.uniform(-1, 1) for _ in range(dim)]
+
+
+class _LLMHandler(_Handler):
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path.rstrip("/")
+        owner: MockLLMServer = self.owner
+        owner.count(path)
+        if path == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": m, "object": "model"} for m in owner.models]})
+        elif path == "/api/tags":
+            self._send_json(200, {"models": [{"name": m, "model": m} for m in owner.models]})
+        elif path == "/api/v0/models":
+            # LM Studio 原生接口：列出模型及加载状态
+            self._send_json(200, {"object": "list", "data": [
+                {"id": m, "object": "model", "type": "llm", "state": "loaded" if m in owner.loaded else "not-loaded"}
+                for m in owner.models
+            ]})
+        elif path == "/api/ps":
+            self._send_json(200, {"models": [{"name": m, "model": m} for m in sorted(owner.loaded)]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path.rstrip("/")
+        owner: MockLLMServer = self.owner
+        owner.count(path)
+        body = self._read_json()
+
+        if owner.fail_rate and random.random() < owner.fail_rate:
+            self._send_json(503, {"error": "mock server overloaded"})
+            return
+
+        with owner.slots:
+            owner.track_in_flight(+1)
+            try:
+                self._handle_post(path, body)
+            finally:
+                owner.track_in_flight(-1)
+
+    def _handle_post(self, path: str, body: Dict[str, Any]) -> None:
+        owner: MockLLMServer = self.owner
+        model = body.get("model") or (owner.models[0] if owner.models else "mock-model")
+
+        if path in ("/v1/embeddings", "/api/embed", "/api/embeddings"):
+            inputs = body.get("input", body.get("prompt", ""))
+            texts = inputs if isinstance(inputs, list) else [inputs]
+            vectors = [_embedding(str(t), owner.embedding_dim) for t in texts]
+            owner.sleep(prompt_tokens=sum(_estimate_tokens(str(t)) for t in texts), completion_tokens=0, model=model)
+            if path == "/v1/embeddings":
+                self._send_json(
+                    200,
+                    {"object": "list", "model": model, "data": [
+                        {"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)
+                    ]},
+                )
+            elif path == "/api/embed":
+                self._send_json(200, {"model": model, "embeddings": vectors})
+            else:
+                self._send_json(200, {"embedding": vectors[0]})
+            return
+
+        if path == "/v1/chat/completions":
+            prompt_text = _messages_text(body.get("messages", []))
+        elif path == "/api/chat":
+            prompt_text = _messages_text(body.get("messages", []))
+        elif path == "/api/generate":
+            prompt_text = str(body.get("prompt", ""))
+        else:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        content = owner.responder(prompt_text)
+        prompt_tokens = _estimate_tokens(prompt_text)
+        completion_tokens = _estimate_tokens(content)
+        cached_tokens = owner.cached_prefix_tokens(model, prompt_text)
+        load_s, prefill_s = owner.sleep(prompt_tokens - cached_tokens, completion_tokens, model)
+
+        if path == "/v1/chat/completions":
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+            extra: Dict[str, Any] = {}
+            if owner.prefix_cache:
+                usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+                # llama.cpp server 风格的耗时统计
+                extra["timings"] = {
+                    "prompt_n": prompt_tokens - cached_tokens,
+                    "cache_n": cached_tokens,
+                    "prompt_ms": prefill_s * 1000,
+                }
+            self._send_json(
+                200,
+                {
+                    "id": f"chatcmpl-{int(time.time() * 1000)}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                    ],
+                    "usage": usage,
+                    **extra,
+                },
+            )
+            return
+
+        stats = {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "load_duration": int(load_s * 1e9),
+            # 与 Ollama 一致：只计入本次实际计算的 token
+            "prompt_eval_count": prompt_tokens - cached_tokens,
+            "prompt_eval_duration": int(prefill_s * 1e9),
+            "eval_count": completion_tokens,
+        }
+        if path == "/api/chat":
+            self._send_json(200, {**stats, "message": {"role": "assistant", "content": content}})
+        else:
+            self._send_json(200, {**stats, "response": content})
+
+
+class MockLLMServer(_Server):
+    """
+    latency_ms：每个请求的固定延迟；per_token_ms：按输入+输出 token 数追加的延迟；
+    load_ms：模型首次被请求（或被换出后）时的加载耗时；max_concurrency：同时处理的请求数上限；
+    prefix_cache：模拟 llama.cpp 的前缀缓存，与同一模型上一次请求相同的前缀不再计入预填充耗时。
+    """
+
+    handler_cls = _LLMHandler
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0.0,
+        per_token_ms: float = 0.0,
+        load_ms: float = 0.0,
+        models: Optional[List[str]] = None,
+        fail_rate: float = 0.0,
+        max_concurrency: int = 64,
+        embedding_dim: int = 768,
+        responder: Callable[[str], str] = default_responder,
+        prefix_cache: bool = False,
+    ) -> None:
+        super().__init__(host, port, latency_ms)
+        self.per_token_ms = per_token_ms
+        self.load_ms = load_ms
+        self.models = list(models or ["mock-model"])
+        self.fail_rate = fail_rate
+        self.embedding_dim = embedding_dim
+        self.responder = responder
+        self.prefix_cache = prefix_cache
+        self._last_prompt: Dict[str, str] = {}
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.loaded: set = set()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def track_in_flight(self, delta: int) -> None:
+        with self._lock:
+            self.in_flight += delta
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def cached_prefix_tokens(self, model: str, prompt_text: str) -> int:
+        """与该模型上一次请求的公共前缀长度（token）；未开启 prefix_cache 时为 0。"""
+        if not self.prefix_cache:
+            return 0
+        with self._lock:
+            previous = self._last_prompt.get(model, "")
+            self._last_prompt[model] = prompt_text
+        common = 0
+        for a, b in zip(previous, prompt_text):
+            if a != b:
+                break
+            common += 1
+        # 最后一个 token 总要重新计算
+        return min(common // 4, max(0, _estimate_tokens(prompt_text) - 1))
+
+    def sleep(self, prompt_tokens: int, completion_tokens: int, model: str) -> Tuple[float, float]:
+        """模拟加载、预填充与生成耗时，返回 (加载秒数, 预填充秒数)。"""
+        load_s = 0.0
+        with self._lock:
+            if model not in self.loaded:
+                self.loaded.add(model)
+                load_s = self.load_ms / 1000
+        prefill_s = prompt_tokens * self.per_token_ms / 1000
+        total = load_s + self.latency_ms / 1000 + prefill_s + completion_tokens * self.per_token_ms / 1000
+        if total:
+            time.sleep(total)
+        return load_s, prefill_s
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="启动本地仿真站点与仿真模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--site-port", type=int, default=8765)
+    parser.add_argument("--site-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-port", type=int, default=8766)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-per-token-ms", type=float, default=0.0)
+    parser.add_argument("--llm-fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    site = FixtureSite(args.host, args.site_port, args.site_latency_ms).start()
+    llm = MockLLMServer(
+        args.host,
+        args.llm_port,
+        latency_ms=args.llm_latency_ms,
+        per_token_ms=args.llm_per_token_ms,
+        fail_rate=args.llm_fail_rate,
+    ).start()
+    print(f"仿真站点：{site.url}")
+    print(f"仿真模型（OpenAI 兼容）：{llm.url}/v1  （Ollama 兼容）：{llm.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        site.stop()
+        llm.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+变化监控：为每个 URL 保存归一化后的内容指纹，内容未变化时跳过 LLM 抽取并复用上次结果，
+内容变化时只把变化的片段交给模型，并把片段的抽取结果合并进上次的整页结果（见 merge_delta）。
+"""
+
+from __future__ import annotations
+
+import difflib
+import hashlib
+import json
+import re
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from urllib.parse import urldefrag
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+MONITOR_PATH = PROJECT_ROOT / "monitor_state.json"
+
+# 与 app.py 中的 HTML 截断阈值保持一致，避免状态文件无限膨胀
+MAX_BLOCKS_CHARS = 250_000
+MAX_DIFF_CHARS = 20_000
+# 变化片段前后各带上几行上下文，帮助模型理解变化位置
+DIFF_CONTEXT_BLOCKS = 1
+
+_NOISE_TAGS = ["script", "style", "noscript", "template", "svg", "iframe"]
+_WS_RE = re.compile(r"\s+")
+# 合并列表时用来判断两条记录是否为同一条的字段，按顺序取第一个在变化结果中出现的
+_IDENTITY_KEYS = ("id", "url", "link", "href", "title", "name")
+
+
+@dataclass
+class MonitorEntry:
+    url: str
+    selectors: List[str]
+    prompt_hash: str
+    fingerprint: str
+    blocks: List[str]
+    # 始终是整页结果：首次为整页抽取结果，之后为合并了各次变化片段抽取结果的整页结果
+    result: Any = None
+    # 最近一次仅对变化片段抽取的结果，便于排查合并效果
+    last_delta: Any = None
+    checks: int = 0
+    skips: int = 0
+    last_checked: str = ""
+    last_changed: str = ""
+    last_diff: str = ""
+
+
+@dataclass
+class MonitorCheck:
+    key: str
+    url: str
+    selectors: List[str]
+    prompt_hash: str
+    fingerprint: str
+    blocks: List[str]
+    first_seen: bool
+    changed: bool
+    previous: Optional[MonitorEntry] = None
+    diff: str = ""
+    changed_text: str = ""
+    changed_blocks: int = 0
+
+    @property
+    def can_skip(self) -> bool:
+        return not self.first_seen and not self.changed
+
+
+@dataclass
+class MonitorStats:
+    checks: int = 0
+    skips: int = 0
+    per_url: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    @property
+    def skip_rate(self) -> float:
+        return self.skips / self.checks if self.checks else 0.0
+
+
+def _now_iso() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def prompt_fingerprint(prompt: str, schema: Optional[Dict[str, Any]] = None) -> str:
+    """提示词或 Schema 变化后，旧结果不能再复用。"""
+    payload = json.dumps({"prompt": prompt, "schema": schema}, ensure_ascii=False, sort_keys=True)
+    return _sha256(payload)[:16]
+
+
+def monitor_key(url: str, selectors: List[str]) -> str:
+    clean_url, _ = urldefrag(url.strip())
+    return f"{clean_url}|{','.join(selectors)}"
+
+
+def parse_selectors(text: str) -> List[str]:
+    return [s.strip() for s in (text or "").replace("\n", ",").split(",") if s.strip()]
+
+
+def normalise_html(html: str, selectors: Optional[List[str]] = None) -> List[str]:
+    """
+    把 HTML 归一化为可比较的文本块列表：
+    去掉脚本/样式等噪声标签，按可见文本行切分并折叠空白。
+    指定 selectors 时只保留这些区域的内容。
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html or "", "lxml")
+    for tag in soup(_NOISE_TAGS):
+        tag.decompose()
+
+    regions = []
+    for sel in selectors or []:
+        try:
+            regions.extend(soup.select(sel))
+        except Exception:
+            # 非法选择器直接忽略，不影响其它区域
+            continue
+    if not selectors:
+        regions = [soup.body or soup]
+
+    blocks: List[str] = []
+    total = 0
+    for region in regions:
+        for line in region.get_text("\n").split("\n"):
+            line = _WS_RE.sub(" ", line).strip()
+            if not line:
+                continue
+            blocks.append(line)
+            total += len(line)
+            if total >= MAX_BLOCKS_CHARS:
+                return blocks
+    return blocks
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def _identity_key(items: List[Any]) -> Optional[str]:
+    dicts = [item for item in items if isinstance(item, dict)]
+    for key in _IDENTITY_KEYS:
+        if dicts and all(not _is_empty(item.get(key)) for item in dicts):
+            return key
+    return None
+
+
+def _merge_list(full: List[Any], delta: List[Any]) -> List[Any]:
+    """
+    列表逐条合并：变化结果中的记录按标识字段（id/url/title 等）匹配整页结果中的同一条并递归合并，
+    匹配不到的视为新增记录追加到末尾；没有标识字段时按值去重后追加。
+    """
+    merged = list(full)
+    key = _identity_key(delta)
+    for item in delta:
+        if key is not None and isinstance(item, dict):
+            for idx, old in enumerate(merged):
+                if isinstance(old, dict) and old.get(key) == item.get(key):
+                    merged[idx] = merge_delta(old, item)
+                    break
+            else:
+                merged.append(item)
+        elif item not in merged:
+            merged.append(item)
+    return merged
+
+
+def merge_delta(full: Any, delta: Any) -> Any:
+    """
+    把变化片段的抽取结果合并进上次的整页结果：
+    dict 逐键递归合并，list 逐条匹配合并（见 _merge_list），其他类型取变化结果中的非空值。
+    变化片段只覆盖页面的一部分，未出现在变化结果中的字段与记录保持上次的值。
+    """
+    if isinstance(full, dict) and isinstance(delta, dict):
+        merged = dict(full)
+        for key, value in delta.items():
+            merged[key] = merge_delta(full[key], value) if key in full else value
+        return merged
+    if isinstance(full, list) and isinstance(delta, list):
+        return _merge_list(full, delta)
+    return full if _is_empty(delta) else delta
+
+
+def _diff_blocks(old: List[str], new: List[str]) -> tuple[str, str, int]:
+    """返回 (unified diff 文本, 需要重新抽取的变化片段, 变化块数量)。"""
+    diff = "\n".join(
+        difflib.unified_diff(old, new, fromfile="previous", tofile="current", lineterm="", n=1)
+    )[:MAX_DIFF_CHARS]
+
+    matcher = difflib.SequenceMatcher(a=old, b=new, autojunk=False)
+    keep = set()
+    changed = 0
+    for tag, _i1, _i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        changed += max(j2 - j1, 1)
+        lo = max(j1 - DIFF_CONTEXT_BLOCKS, 0)
+        hi = min(j2 + DIFF_CONTEXT_BLOCKS, len(new))
+        keep.update(range(lo, hi))
+
+    # 相邻的变化块合并成一个片段，片段之间用分隔线隔开
+    sections: List[str] = []
+    current: List[str] = []
+    last = None
+    for idx in sorted(keep):
+        if last is not None and idx != last + 1 and current:
+            sections.append("\n".join(current))
+            current = []
+        current.append(new[idx])
+        last = idx
+    if current:
+        sections.append("\n".join(current))
+    return diff, "\n\n---\n\n".join(sections), changed
+
+
+class MonitorStore:
+    """基于本地 JSON 文件的指纹存储，写法与 history.py 保持一致。"""
+
+    def __init__(self, path: Path = MONITOR_PATH) -> None:
+        self.path = path
+
+    def _load_raw(self) -> Dict[str, Any]:
+        if not self.path.exists():
+            return {}
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+            return raw if isinstance(raw, dict) else {}
+        except Exception:
+            return {}
+
+    def _save_raw(self, raw: Dict[str, Any]) -> None:
+        self.path.write_text(json.dumps(raw, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def get(self, key: str) -> Optional[MonitorEntry]:
+        item = self._load_raw().get(key)
+        if not item:
+            return None
+        try:
+            return MonitorEntry(**item)
+        except Exception:
+            return None
+
+    def check(
+        self,
+        url: str,
+        html: str,
+        prompt: str,
+        schema: Optional[Dict[str, Any]] = None,
+        selectors: Optional[List[str]] = None,
+    ) -> MonitorCheck:
+        """对比新抓取的页面与上次指纹，不修改存储。"""
+        selectors = selectors or []
+        key = monitor_key(url, selectors)
+        blocks = normalise_html(html, selectors)
+        fingerprint = _sha256("\n".join(blocks))
+        p_hash = prompt_fingerprint(prompt, schema)
+        previous = self.get(key)
+
+        check = MonitorCheck(
+            key=key,
+            url=url,
+            selectors=selectors,
+            prompt_hash=p_hash,
+            fingerprint=fingerprint,
+            blocks=blocks,
+            first_seen=previous is None or previous.prompt_hash != p_hash,
+            changed=previous is None or previous.fingerprint != fingerprint,
+            previous=previous,
+        )
+        if previous is not None and check.changed and not check.first_seen:
+            check.diff, check.changed_text, check.changed_blocks = _diff_blocks(
+                previous.blocks, blocks
+            )
+        return check
+
+    def commit(self, check: MonitorCheck, result: Any = None) -> MonitorEntry:
+        """
+        记录一次检查。内容未变化时只更新计数（skip），
+        否则保存新的指纹、文本块和抽取结果：首次抓取时 result 即整页结果，
+        内容变化时 result 为变化片段的抽取结果，合并进上次的整页结果后保存。
+        返回的 entry.result 始终是整页结果。
+        """
+        raw = self._load_raw()
+        previous = check.previous
+        now = _now_iso()
+
+        if check.can_skip and previous is not None:
+            entry = previous
+            entry.checks += 1
+            entry.skips += 1
+            entry.last_checked = now
+        else:
+            delta = None
+            if not check.first_seen and previous is not None:
+                delta = result
+                result = merge_delta(previous.result, result)
+            entry = MonitorEntry(
+                url=check.url,
+                selectors=check.selectors,
+                prompt_hash=check.prompt_hash,
+                fingerprint=check.fingerprint,
+                blocks=check.blocks,
+                result=result,
+                last_delta=delta,
+                checks=(previous.checks if previous else 0) + 1,
+                skips=previous.skips if previous else 0,
+                last_checked=now,
+                last_changed=now,
+                last_diff=check.diff,
+            )
+
+        raw[check.key] = asdict(entry)
+        self._save_raw(raw)
+        return entry
+
+    def stats(self) -> MonitorStats:
+        stats = MonitorStats()
+        for key, item in self._load_raw().items():
+            checks = int(item.get("checks", 0))
+            skips = int(item.get("skips", 0))
+            stats.checks += checks
+            stats.skips += skips
+            stats.per_url[key] = {
+                "checks": checks,
+                "skips": skips,
+                "skip_rate": skips / checks if checks else 0.0,
+                "last_changed": item.get("last_changed", ""),
+            }
+        return stats
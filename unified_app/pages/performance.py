@@ -0,0 +1,263 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+# 与 app.py 相同：保证以 `streamlit run unified_app/app.py` 启动时可以使用绝对导入
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from unified_app.coalesce import COALESCER
+from unified_app.config import AppConfig
+from unified_app.endpoints import ENDPOINTS_DB_PATH, LOCAL_PROVIDERS, EndpointPool
+from unified_app.history import load_history
+from unified_app.politeness import POLITENESS_DB_PATH, PolitenessScheduler
+from unified_app.router import ROUTING_DB_PATH, ModelRouter
+from unified_app.telemetry import render_prometheus, schema_summary, summarise
+
+
+st.set_page_config(page_title="性能面板", layout="wide")
+
+
+def main():
+    st.title("性能面板 📈")
+    st.caption("基于历史记录中的运行指标，统计各阶段耗时分位数、token 用量与抓取字节数")
+
+    items = [i for i in load_history() if i.metrics]
+    if not items:
+        st.info("暂无带运行指标的历史记录，完成一次抓取后再来查看")
+        return
+
+    group_label = st.selectbox(
+        "分组维度",
+        ["不分组", "provider", "domain", "model"],
+        index=1,
+    )
+    group_by = None if group_label == "不分组" else group_label
+
+    rows = []
+    for group, stages in summarise(items, group_by).items():
+        for stage, s in stages.items():
+            rows.append(
+                {
+                    "分组": group,
+                    "阶段": stage,
+                    "次数": s["count"],
+                    "p50 (s)": round(s["p50"], 3),
+                    "p95 (s)": round(s["p95"], 3),
+                }
+            )
+    st.markdown("### 各阶段耗时")
+    st.dataframe(
+        pd.DataFrame(rows).sort_values(["分组", "p95 (s)"], ascending=[True, False]),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    runs = pd.DataFrame(
+        [
+            {
+                "时间": pd.to_datetime(i.timestamp, errors="coerce"),
+                "provider": i.metrics.get("provider", ""),
+                "model": i.metrics.get("model", ""),
+                "domain": i.metrics.get("domain", ""),
+                "总耗时 (s)": i.metrics.get("total_s", 0.0),
+                "输入 tokens": i.metrics.get("tokens_in", 0),
+                "输出 tokens": i.metrics.get("tokens_out", 0),
+                "抓取字节": i.metrics.get("bytes_fetched", 0),
+                # 页面内快照模式下只传输精简内容，与完整 HTML 的差值即节省的传输量
+                "完整 HTML 字节": i.metrics.get("html_bytes") or i.metrics.get("bytes_fetched", 0),
+                # 保存了性能剖析的运行，可在主页面侧边栏的历史记录中下载
+                "性能剖析": i.metrics.get("profile", ""),
+                # 合并到这次运行上的相同请求数
+                "合并等待": i.metrics.get("waiters", 0),
+            }
+            for i in items
+        ]
+    ).sort_values("时间")
+
+    st.markdown("### 总耗时趋势")
+    trend = runs.pivot_table(index="时间", columns="provider", values="总耗时 (s)", aggfunc="mean")
+    st.line_chart(trend)
+
+    st.markdown("### 用量汇总")
+    usage = runs.groupby(["provider", "model"], as_index=False)[
+        ["输入 tokens", "输出 tokens", "抓取字节", "完整 HTML 字节"]
+    ].sum()
+    st.dataframe(usage, use_container_width=True, hide_index=True)
+
+    schema_rows = [
+        {
+            "model": model,
+            "次数": row["runs"],
+            "直接通过": row["valid"],
+            "本地修复": row["repaired"],
+            "追问后通过": row["reasked"],
+            "未通过": row["failed"],
+            "修复类型": "、".join(f"{k} {n}" for k, n in sorted(row["repairs"].items(), key=lambda kv: -kv[1])),
+        }
+        for model, row in schema_summary(items).items()
+    ]
+    if schema_rows:
+        st.markdown("### 结构化输出校验")
+        st.caption("开启 JSON Schema 的抓取中，各模型的输出直接通过、本地修复后通过、追问一次后通过与最终未通过的次数")
+        st.dataframe(pd.DataFrame(schema_rows), use_container_width=True, hide_index=True)
+
+    coalesce_rows = {}
+    for i in items:
+        key, waiters = i.metrics.get("coalesce_key", ""), i.metrics.get("waiters", 0)
+        if key and waiters:
+            row = coalesce_rows.setdefault(key, {"请求键": key, "URL": i.url, "运行次数": 0, "合并等待": 0})
+            row["运行次数"] += 1
+            row["合并等待"] += waiters
+    in_flight = COALESCER.snapshot()
+    if coalesce_rows or in_flight:
+        st.markdown("### 请求合并")
+        st.caption("相同的进行中请求合并为一次运行：每个请求键真正执行的次数与挂到这些运行上的其他请求数")
+        if in_flight:
+            st.dataframe(
+                pd.DataFrame(in_flight).rename(
+                    columns={"key": "请求键", "url": "URL", "waiters": "等待数", "running_s": "已运行 (s)"}
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+        if coalesce_rows:
+            st.dataframe(
+                pd.DataFrame(coalesce_rows.values()).sort_values("合并等待", ascending=False),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+    with st.expander("最近运行明细", expanded=False):
+        st.dataframe(runs.sort_values("时间", ascending=False), use_container_width=True, hide_index=True)
+
+    st.download_button(
+        "下载 Prometheus 指标",
+        data=render_prometheus(items).encode("utf-8"),
+        file_name="metrics.prom",
+        mime="text/plain",
+    )
+
+
+def render_politeness():
+    """按域名的吞吐与封禁率（开启礼貌抓取后才有数据）。"""
+    if not POLITENESS_DB_PATH.exists():
+        return
+    scheduler = PolitenessScheduler()
+    domains = scheduler.domain_stats()
+    if not domains:
+        return
+    st.markdown("### 按域名抓取情况")
+    st.dataframe(
+        pd.DataFrame(
+            [
+                {
+                    "域名": d.domain,
+                    "请求": d.requests,
+                    "成功": d.ok,
+                    "封禁 (429/403)": d.blocked,
+                    "封禁率": f"{d.block_rate:.1%}",
+                    "错误": d.errors,
+                    "robots 拒绝": d.disallowed,
+                    "每分钟": round(d.per_minute, 1),
+                    "平均排队 (s)": round(d.avg_wait_s, 2),
+                    "当前间隔 (s)": round(d.delay_s, 2),
+                }
+                for d in domains
+            ]
+        ),
+        use_container_width=True,
+        hide_index=True,
+    )
+    proxies = scheduler.proxy_stats()
+    if proxies:
+        st.markdown("#### 代理健康度")
+        st.dataframe(
+            pd.DataFrame(
+                [
+                    {
+                        "代理": p.server,
+                        "健康分": round(p.score, 2),
+                        "使用": p.uses,
+                        "成功": p.ok,
+                        "封禁": p.blocked,
+                        "错误": p.errors,
+                        "状态": "冷却中" if p.cooling else "可用",
+                    }
+                    for p in proxies
+                ]
+            ),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+def render_routing():
+    """自动选择模型时各候选的实测吞吐、失败次数与花费（开启自动选择后才有数据）。"""
+    if not ROUTING_DB_PATH.exists():
+        return
+    router = ModelRouter.from_config()
+    rows = router.candidate_stats()
+    if not rows:
+        return
+    st.markdown("### 自动选择模型")
+    st.caption(f"今日花费 ${router.spent_today():.4f} / 预算 ${router.config.daily_budget_usd:.2f}")
+    st.dataframe(
+        pd.DataFrame(
+            [
+                {
+                    "provider": r["provider"],
+                    "模型": r["model"],
+                    "运行": r["runs"],
+                    "失败": r["failures"],
+                    "token/s": round(r["tokens_per_s"]),
+                    "进行中": r["in_flight"],
+                    "花费 ($)": round(r["cost_usd"], 4),
+                }
+                for r in rows
+            ]
+        ),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+
+def render_endpoints():
+    """多端点负载均衡时各端点的请求数、平均耗时、失败与健康状态（配置了多个端点后才有数据）。"""
+    if not ENDPOINTS_DB_PATH.exists():
+        return
+    app_cfg = AppConfig.load()
+    rows = []
+    for provider in LOCAL_PROVIDERS:
+        pool = EndpointPool(app_cfg, provider)
+        if not pool.pooled:
+            continue
+        for s in pool.states():
+            rows.append(
+                {
+                    "provider": provider,
+                    "端点": s.url,
+                    "权重": s.weight,
+                    "状态": "已移出" if s.ejected else {True: "健康", False: "不可用", None: "未检查"}[s.healthy],
+                    "模型": {"loaded": "已加载", "available": "未加载", "missing": "没有", "unknown": "未知"}[s.model_state],
+                    "进行中": s.in_flight,
+                    "请求": s.requests,
+                    "失败": s.errors,
+                    "平均耗时 (s)": round(s.avg_s, 2),
+                    "上次检查": s.checked_at,
+                    "最近错误": s.last_error,
+                }
+            )
+    if not rows:
+        return
+    st.markdown("### 模型服务端点")
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+
+main()
+render_politeness()
+render_routing()
+render_endpoints()
@@ -0,0 +1,448 @@
+"""
+抓取流水线：Playwright 获取页面（可选）→ SmartScraperGraph 抽取 → 写入历史记录。
+
+Streamlit UI、后台任务等所有入口共用这里的逻辑，不依赖 Streamlit。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, asdict, field
+from typing import Any, Callable, Dict, List, Optional
+
+from unified_app.coalesce import COALESCER, Flight, coalesce_key, share_outcome
+from unified_app.config import AppConfig, active_model, build_graph_config
+from unified_app.fetcher import Reporter, fetch_html_with_playwright, print_reporter
+from unified_app.har import OFF as HAR_OFF, HarSession
+from unified_app.history import append_history
+from unified_app.endpoints import EndpointPool
+from unified_app.llm_cassette import CassetteStats, apply_cassette, mode_from_env
+from unified_app.monitor import MonitorCheck, MonitorStore
+from unified_app.politeness import PolitenessScheduler
+from unified_app.profiling import RunProfiler, relative_path
+from unified_app.residency import ModelResidency
+from unified_app.router import AUTO, ModelRouter, RouteDecision
+from unified_app.schema_repair import SchemaCheck, check_and_repair, reask
+from unified_app.sinks import SinkSet, SinkStats, make_record
+from unified_app.telemetry import RunMetrics, RunRecorder
+
+
+# 与本地模型上下文长度相适配的 HTML 截断阈值
+MAX_HTML_CHARS = 250_000
+
+# progress(fraction, message)，fraction 取值 0~1
+Progress = Callable[[float, str], None]
+
+
+@dataclass
+class ScrapeRequest:
+    url: str
+    prompt: str
+    schema: Optional[Dict[str, Any]] = None
+    # 为空时使用配置文件中的 provider；为 "auto" 时按页面大小、Schema、实测吞吐与预算自动选择，见 router.py
+    provider: Optional[str] = None
+    wait_for_load: str = "networkidle"
+    enable_js: bool = True
+    wait_time: int = 3
+    need_login: bool = False
+    login_url: str = ""
+    use_storage: bool = True
+    manual_login: bool = False
+    headless: bool = True
+    monitor: bool = False
+    monitor_selectors: List[str] = field(default_factory=list)
+    # LLM 录制/回放模式（off / record / replay / strict），为空时读取环境变量
+    llm_cassette: str = ""
+    # 页面 HAR 录制/回放模式（off / record / replay），非 off 时用 Playwright 获取页面
+    har_mode: str = HAR_OFF
+    # 按域名限速 + robots.txt + 代理池（参数见配置文件中的 politeness 段），开启时用 Playwright 获取页面
+    polite: bool = False
+    # 结果额外写入的存储，例如 ["jsonl:results.jsonl", "sqlite:results.db"]，见 sinks.py
+    sinks: List[str] = field(default_factory=list)
+    # 结果在本地修复后仍不符合 schema 时，是否带着校验错误追问模型一次
+    schema_reask: bool = True
+    # 用 Playwright 获取页面，并在页面内生成精简快照代替完整 HTML（只含可见文本、链接、表格与表单），见 snapshot.py
+    snapshot: bool = False
+    # 性能剖析模式（off / slow / always），为空时使用配置文件 profiling 段的 mode，见 profiling.py
+    profile: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ScrapeRequest":
+        known = {k: v for k, v in data.items() if k in cls.__dataclass_fields__}
+        return cls(**known)
+
+
+@dataclass
+class ScrapeOutcome:
+    result: Any
+    provider: str
+    page_html: Optional[str] = None
+    # 监控模式下内容未变化、复用了上次结果
+    skipped: bool = False
+    monitor_check: Optional[MonitorCheck] = None
+    metrics: Optional[RunMetrics] = None
+    cassette_stats: Optional[CassetteStats] = None
+    har: Optional[HarSession] = None
+    schema_check: Optional[SchemaCheck] = None
+    sink_stats: List[SinkStats] = field(default_factory=list)
+    sink_errors: List[str] = field(default_factory=list)
+    route: Optional[RouteDecision] = None
+    # 与其他会话中相同的请求合并，结果来自那一次运行（见 coalesce.py）
+    coalesced: bool = False
+
+
+def _noop_progress(fraction: float, message: str) -> None:
+    return None
+
+
+def resolve_config(app_cfg: AppConfig, req: ScrapeRequest) -> AppConfig:
+    """按请求覆盖 provider，不修改调用方持有的配置对象。"""
+    if not req.provider or req.provider == AUTO or req.provider == app_cfg.provider:
+        return app_cfg
+    cfg = copy.deepcopy(app_cfg)
+    cfg.provider = req.provider  # type: ignore[assignment]
+    return cfg
+
+
+def enforce_schema(
+    graph_config: Dict[str, Any],
+    req: ScrapeRequest,
+    result: Any,
+    recorder: RunRecorder,
+    reporter: Reporter,
+) -> Optional[SchemaCheck]:
+    """校验并在本地修复抽取结果，仍不符合时按 req.schema_reask 追问一次；schema 不合法时返回 None。"""
+    with recorder.stage("schema_validate"):
+        try:
+            check = check_and_repair(result, req.schema)
+        except ValueError as e:
+            reporter("warning", f"⚠️ {e}，已跳过结构化校验")
+            return None
+    if not check.ok and req.schema_reask:
+        reporter("info", "🔁 抽取结果不符合 JSON Schema，且无法在本地修复，正在带着校验错误追问模型一次")
+        with recorder.stage("schema_reask"):
+            try:
+                check = reask(graph_config, req.schema, check, recorder)
+            except Exception as e:
+                reporter("warning", f"⚠️ 追问模型失败：{e}")
+    recorder.metrics.schema_status = check.status
+    recorder.metrics.schema_repairs = list(check.repairs)
+    return check
+
+
+def retrieve_relevant(
+    run_config: Dict[str, Any],
+    req: ScrapeRequest,
+    page_html: str,
+    recorder: RunRecorder,
+    reporter: Reporter,
+) -> Optional[str]:
+    """
+    Ollama 大页面：用带缓存的向量挑出与提示词最相关的文本块代替截断（见 embedding_cache.py）。
+    run_config 为已指向本次租用端点的配置，向量请求与抽取发往同一台服务。
+    不是 Ollama 或向量模型不可用时返回 None，由调用方按原方式截断。
+    """
+    # numpy / langchain 只在大页面时才需要
+    from unified_app.embedding_cache import embeddings_from_config, select_relevant_text
+
+    embedder = embeddings_from_config(run_config)
+    if embedder is None:
+        return None
+    try:
+        with recorder.stage("retrieve"):
+            text, picked, total = select_relevant_text(embedder, req.prompt, page_html)
+    except Exception as e:
+        reporter("warning", f"⚠️ 向量检索失败（{e}），改为截断页面")
+        return None
+    if not text:
+        return None
+    reporter("info", f"ℹ️ 页面较大，已按与提示词的相关度选取 {picked}/{total} 个文本块交给模型")
+    return text
+
+
+def run_scrape(
+    app_cfg: AppConfig,
+    req: ScrapeRequest,
+    reporter: Reporter = print_reporter,
+    progress: Progress = _noop_progress,
+    record_history: bool = True,
+    page_html: Optional[str] = None,
+    sinks: Optional[SinkSet] = None,
+) -> ScrapeOutcome:
+    """
+    page_html 为调用方已获取的页面（例如爬取模式），传入时不再重新抓取。
+    sinks 为调用方持有的结果存储（批量抓取时复用同一组缓冲）；未传入时按 req.sinks 打开，写完即关闭。
+    开启性能剖析时，耗时超过阈值（或 always 模式）的运行保存调用栈采样与 Playwright trace，
+    目录记录在 metrics.profile 中随历史记录保存；失败的运行同样按阈值保存。
+    配置文件 coalescing 段开启时（默认），同一进程内进行中的相同请求合并为一次运行，
+    后到的请求等待并共享其结果（outcome.coalesced 为 True）；调用方传入 page_html 或 sinks 时不合并。
+    """
+    key = None
+    if app_cfg.coalescing.enabled and page_html is None and sinks is None:
+        key = coalesce_key(app_cfg, req, record_history)
+    if key is None:
+        return _profiled_scrape(app_cfg, req, reporter, progress, record_history, page_html, sinks)
+
+    def lead(flight: Flight) -> ScrapeOutcome:
+        return _profiled_scrape(
+            app_cfg, req, flight.reporter(reporter), flight.progress_fn(progress), record_history, None, None, flight
+        )
+
+    outcome, flight, coalesced = COALESCER.run(key, lead, reporter, progress, url=req.url)
+    if coalesced:
+        return share_outcome(outcome)
+    if outcome.metrics is not None:
+        # 历史记录写入之后仍可能有请求挂上来，返回给调用方的指标使用最终的等待数
+        outcome.metrics.waiters = flight.waiters
+    return outcome
+
+
+def _profiled_scrape(
+    app_cfg: AppConfig,
+    req: ScrapeRequest,
+    reporter: Reporter,
+    progress: Progress,
+    record_history: bool,
+    page_html: Optional[str],
+    sinks: Optional[SinkSet],
+    flight: Optional[Flight] = None,
+) -> ScrapeOutcome:
+    # 在抓取之前打开，目标写错或缺少 pyarrow 时不必等到模型抽取完成才报错；
+    # 抓取或抽取失败时同样在 finally 中关闭，长时间运行的服务不会残留文件句柄与缓冲
+    own_sinks = sinks is None and bool(req.sinks)
+    if own_sinks:
+        sinks = SinkSet.from_config(app_cfg.sinks, req.sinks, app_cfg.dedupe)
+    outcome = None
+    try:
+        profiler = RunProfiler.from_config(app_cfg.profiling, req.profile, label=req.url).start()
+        try:
+            outcome = _run_scrape(
+                app_cfg, req, reporter, progress, record_history, page_html, sinks, profiler, flight
+            )
+            return outcome
+        finally:
+            # 正常结束时 _run_scrape 已经保存（这里返回同一结果）；出错时在这里按阈值保存
+            saved = profiler.finish()
+            if saved is not None:
+                reporter("info", f"🔬 已保存性能剖析：{relative_path(saved)}")
+    finally:
+        if own_sinks:
+            sinks.close()
+            if outcome is not None:
+                # 关闭时最后一次落盘的错误同样返回给调用方
+                outcome.sink_errors = list(sinks.errors)
+
+
+def _run_scrape(
+    app_cfg: AppConfig,
+    req: ScrapeRequest,
+    reporter: Reporter,
+    progress: Progress,
+    record_history: bool,
+    page_html: Optional[str],
+    sinks: Optional[SinkSet],
+    profiler: RunProfiler,
+    flight: Optional[Flight] = None,
+) -> ScrapeOutcome:
+    cfg = resolve_config(app_cfg, req)
+    recorder = RunRecorder(provider=cfg.provider, model=active_model(cfg), url=req.url)
+
+    har = HarSession.for_key(req.har_mode or HAR_OFF, req.url)
+
+    politeness = PolitenessScheduler.from_config(cfg.politeness) if req.polite else None
+
+    # 如需登录（或开启监控模式、HAR 录制/回放、礼貌抓取、页面内快照），先用 Playwright 获取页面 HTML
+    if page_html is None and (
+        req.need_login or req.monitor or har is not None or politeness is not None or req.snapshot
+    ):
+        progress(0.1, "正在获取页面")
+        page_html = asyncio.run(
+            fetch_html_with_playwright(
+                url=req.url,
+                need_login=req.need_login,
+                login_url=req.login_url,
+                use_storage=req.use_storage,
+                manual_login=req.manual_login,
+                headless=req.headless,
+                page_wait_strategy=req.wait_for_load,
+                page_timeout=60 + req.wait_time,
+                reporter=reporter,
+                recorder=recorder,
+                har=har,
+                politeness=politeness,
+                snapshot=req.snapshot,
+                profiler=profiler,
+            )
+        )
+        if not page_html:
+            raise RuntimeError("未能获取页面内容，请检查登录状态")
+
+    # 路由、监控与返回的页面都使用截断后的 HTML；抽取时 Ollama 改用完整页面做相关度检索（见 retrieve_relevant）
+    oversized_html = None
+    if page_html and len(page_html) > MAX_HTML_CHARS:
+        oversized_html = page_html
+        page_html = page_html[:MAX_HTML_CHARS]
+
+    # 自动选择模型放在获取页面之后，可按实际页面大小估算输入 token
+    router = decision = None
+    if req.provider == AUTO:
+        router = ModelRouter.from_config(cfg.routing)
+        with recorder.stage("route"):
+            decision = router.decide(cfg, req.url, page_html=page_html, schema=req.schema)
+        cfg = decision.apply(cfg)
+        recorder.metrics.provider = cfg.provider
+        recorder.metrics.model = active_model(cfg)
+        recorder.metrics.route = decision.summary()
+        reporter("info", f"🧭 已自动选择 {decision.provider}/{decision.model}")
+
+    graph_config = build_graph_config(cfg)
+    # loader_kwargs 复用原有高级选项配置
+    graph_config["loader_kwargs"] = {
+        "load_state": req.wait_for_load,
+        "requires_js_support": req.enable_js,
+        "timeout": 60 + req.wait_time,
+    }
+    cassette_store = apply_cassette(graph_config, cfg.provider, req.llm_cassette or mode_from_env())
+
+    source = page_html if page_html else req.url
+    monitor_store = MonitorStore() if req.monitor else None
+    monitor_check = None
+    if monitor_store is not None:
+        with recorder.stage("monitor_check"):
+            monitor_check = monitor_store.check(
+                url=req.url,
+                html=page_html,
+                prompt=req.prompt,
+                schema=req.schema,
+                selectors=req.monitor_selectors,
+            )
+        if monitor_check.changed and not monitor_check.first_seen:
+            if monitor_check.changed_text:
+                # 仅把变化片段交给模型
+                source = monitor_check.changed_text
+
+    skipped = False
+    schema_check = None
+    if monitor_check is not None and monitor_check.can_skip:
+        result = monitor_check.previous.result
+        monitor_store.commit(monitor_check)
+        skipped = True
+        reporter("info", "⏭️ 页面内容未变化，已跳过模型抽取并复用上次结果")
+    else:
+        progress(0.4, "正在调用模型抽取数据")
+        # scrapegraphai 导入耗时较长（约 2 秒），放到首次抽取时再导入
+        from scrapegraphai.graphs import SmartScraperGraph
+
+        pool = EndpointPool(cfg)
+        started = time.perf_counter()
+        ok = False
+        try:
+            with router.running(cfg.provider) if router is not None else nullcontext():
+                # 配置了多个端点时挑选进行中请求最少的一台；只有一个端点时就是 base_url
+                with pool.lease() as endpoint:
+                    if pool.pooled:
+                        recorder.metrics.endpoint = endpoint.url
+                    run_config = endpoint.point(graph_config)
+                    run_source = source
+                    if oversized_html is not None and source is page_html:
+                        # 向量请求发往本次租用的端点，与抽取一起参与负载均衡
+                        run_source = retrieve_relevant(run_config, req, oversized_html, recorder, reporter)
+                        if run_source is None:
+                            reporter(
+                                "info",
+                                "ℹ️ 页面较大，已自动截断部分 HTML 以适配模型上下文长度（约 250k 字符）",
+                            )
+                            run_source = source
+                    graph = SmartScraperGraph(
+                        prompt=req.prompt,
+                        source=run_source,
+                        config=run_config,
+                        schema=req.schema if req.schema else None,
+                    )
+                    # 同一本地服务上另一个模型正在使用时先等它完成，避免两个模型来回换入换出
+                    with ModelResidency(cfg).gate(endpoint.url) as waited:
+                        if waited:
+                            recorder.add_stage("model_wait", waited)
+                        with recorder.stage("extract"):
+                            result = graph.run()
+                        try:
+                            recorder.add_graph_execution_info(graph.get_execution_info())
+                        except Exception:
+                            # 执行信息只用于遥测，获取失败不影响抓取结果
+                            pass
+                        if req.schema:
+                            schema_check = enforce_schema(run_config, req, result, recorder, reporter)
+                            # 无法修复的结果原样保留，错误信息随 ScrapeOutcome.schema_check 返回
+                            if schema_check is not None and schema_check.ok:
+                                result = schema_check.value
+            ok = True
+        finally:
+            if router is not None:
+                # 模型没有返回 token 用量时按路由时的估算记录，以免吞吐统计被低估
+                router.record(
+                    provider=cfg.provider,
+                    model=active_model(cfg),
+                    url=req.url,
+                    tokens_in=recorder.metrics.tokens_in or decision.tokens_in,
+                    tokens_out=recorder.metrics.tokens_out or decision.tokens_out,
+                    seconds=time.perf_counter() - started,
+                    ok=ok,
+                    schema_status=recorder.metrics.schema_status,
+                )
+        if monitor_check is not None:
+            # 变化片段的结果合并进上次的整页结果，返回与保存的都是整页结果
+            result = monitor_store.commit(monitor_check, result).result
+            if not monitor_check.first_seen:
+                reporter(
+                    "info",
+                    f"🔄 检测到 {monitor_check.changed_blocks} 处内容变化，已仅对变化片段重新抽取并合并到上次结果",
+                )
+
+    metrics = recorder.finish()
+    saved = profiler.finish(metrics.total_s, metrics.stages)
+    if saved is not None:
+        metrics.profile = relative_path(saved)
+    if flight is not None:
+        metrics.coalesce_key = flight.key[:12]
+        metrics.waiters = flight.waiters
+    if record_history:
+        append_history(
+            provider=cfg.provider,
+            url=req.url,
+            prompt=req.prompt,
+            result=result,
+            metrics=metrics.to_dict(),
+        )
+    if sinks:
+        sinks.write(
+            make_record(
+                "scrape",
+                req.url,
+                result,
+                provider=cfg.provider,
+                prompt=req.prompt,
+                skipped=skipped,
+                total_s=metrics.total_s,
+            )
+        )
+    progress(1.0, "完成")
+    return ScrapeOutcome(
+        result=result,
+        provider=cfg.provider,
+        page_html=page_html,
+        skipped=skipped,
+        monitor_check=monitor_check,
+        metrics=metrics,
+        cassette_stats=cassette_store.stats if cassette_store is not None else None,
+        har=har,
+        schema_check=schema_check,
+        sink_stats=sinks.stats if sinks else [],
+        sink_errors=list(sinks.errors) if sinks else [],
+        route=decision,
+    )
@@ -0,0 +1,546 @@
+"""
+按域名的礼貌抓取调度。
+
+对同一站点的批量/重复抓取（GitHub、小红书等）如果集中发出请求，很容易被限流或封禁。
+这里为每个域名维护：
+
+- 并发上限与两次请求之间的最小间隔
+- 自适应退避：遇到 429/403 时间隔倍增（并遵守 Retry-After），之后每次成功逐步恢复
+- robots.txt 策略缓存（Crawl-delay 会抬高最小间隔）
+- 可选的代理池：按健康分加权选择，每个浏览器 context 使用一个代理，被封禁的代理暂时冷却
+
+状态保存在 SQLite（politeness.db）中，后台任务的多个工作进程共享同一套限速；
+进程异常退出时残留的占用会在下次申请时按 PID 清理。
+
+用法：
+
+    scheduler = PolitenessScheduler.from_config(app_cfg.politeness)
+    async with scheduler.aslot(url) as lease:
+        context = await browser.new_context(**lease.context_options())
+        response = await page.goto(url)
+        lease.record(response.status, response.headers.get("retry-after"))
+
+查看各域名吞吐与封禁率：python -m unified_app.politeness
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+from unified_app.config import AppConfig, PolitenessConfig
+from unified_app.localstate import connect_sqlite, pid_alive
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+POLITENESS_DB_PATH = PROJECT_ROOT / "politeness.db"
+
+BLOCK_STATUSES = (403, 429)
+# 每次成功后间隔乘以该系数，逐步回落到最小间隔
+RECOVERY_FACTOR = 0.8
+ROBOTS_TTL_SECONDS = 24 * 3600
+# robots.txt 获取失败时按允许处理，但只缓存较短时间
+ROBOTS_ERROR_TTL_SECONDS = 300
+# 占用超过该时长仍未释放的视为泄漏，直接回收
+LEASE_MAX_AGE_SECONDS = 1800
+POLL_INTERVAL = 0.2
+# 代理健康分：成功记 1、失败记 0 的指数滑动平均
+PROXY_SCORE_ALPHA = 0.3
+PROXY_MIN_SCORE = 0.05
+PROXY_COOLDOWN_SECONDS = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    domain TEXT PRIMARY KEY,
+    delay REAL NOT NULL,
+    next_at REAL NOT NULL DEFAULT 0,
+    requests INTEGER NOT NULL DEFAULT 0,
+    ok INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    disallowed INTEGER NOT NULL DEFAULT 0,
+    wait_s REAL NOT NULL DEFAULT 0,
+    first_at REAL,
+    last_at REAL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    domain TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    proxy TEXT,
+    acquired_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_leases_domain ON leases(domain);
+CREATE TABLE IF NOT EXISTS robots (
+    origin TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    status INTEGER,
+    body TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS proxies (
+    server TEXT PRIMARY KEY,
+    score REAL NOT NULL DEFAULT 1.0,
+    uses INTEGER NOT NULL DEFAULT 0,
+    ok INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    cooldown_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+class RobotsDisallowed(RuntimeError):
+    """robots.txt 不允许抓取该 URL。"""
+
+
+def domain_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def _parse_retry_after(value: Any) -> float:
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+@dataclass
+class DomainPolicy:
+    max_concurrency: int
+    min_delay_s: float
+    max_delay_s: float
+    backoff_factor: float
+
+
+@dataclass
+class Lease:
+    """一次抓取占用的名额；抓取完成后通过 record() 回报状态码。"""
+
+    id: int
+    domain: str
+    url: str
+    proxy: Optional[str] = None
+    waited_s: float = 0.0
+    status: Optional[int] = None
+    retry_after: float = 0.0
+    error: Optional[str] = None
+
+    def record(self, status: Optional[int], retry_after: Any = None) -> None:
+        self.status = status
+        self.retry_after = _parse_retry_after(retry_after)
+
+    def context_options(self) -> Dict[str, Any]:
+        """需要合并到 browser.new_context(...) 参数中的代理选项。"""
+        return {"proxy": {"server": self.proxy}} if self.proxy else {}
+
+
+@dataclass
+class DomainStats:
+    domain: str
+    requests: int
+    ok: int
+    blocked: int
+    errors: int
+    disallowed: int
+    delay_s: float
+    in_flight: int
+    avg_wait_s: float
+    per_minute: float
+
+    @property
+    def block_rate(self) -> float:
+        return self.blocked / self.requests if self.requests else 0.0
+
+
+@dataclass
+class ProxyStats:
+    server: str
+    score: float
+    uses: int
+    ok: int
+    blocked: int
+    errors: int
+    cooling: bool
+
+
+class PolitenessScheduler:
+    def __init__(
+        self,
+        config: Optional[PolitenessConfig] = None,
+        path: Path = POLITENESS_DB_PATH,
+    ) -> None:
+        self.config = config or PolitenessConfig()
+        self.path = Path(path)
+        self._robots: Dict[str, Tuple[float, RobotFileParser]] = {}
+        self._robots_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            for server in self.config.proxies:
+                conn.execute("INSERT OR IGNORE INTO proxies (server) VALUES (?)", (server,))
+
+    @classmethod
+    def from_config(
+        cls, config: Optional[PolitenessConfig] = None, path: Path = POLITENESS_DB_PATH
+    ) -> "PolitenessScheduler":
+        return cls(config if config is not None else AppConfig.load().politeness, path)
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(self.path)
+
+    # ---- 域名策略 ----
+
+    def policy_for(self, domain: str) -> DomainPolicy:
+        cfg = self.config
+        values = {
+            "max_concurrency": cfg.max_concurrency,
+            "min_delay_s": cfg.min_delay_s,
+            "max_delay_s": cfg.max_delay_s,
+            "backoff_factor": cfg.backoff_factor,
+        }
+        host = domain.split(":")[0]
+        # 覆盖项按后缀匹配，"github.com" 同时作用于 "api.github.com"
+        for pattern, override in sorted(cfg.domain_overrides.items(), key=lambda kv: len(kv[0])):
+            if host == pattern or host.endswith("." + pattern):
+                values.update({k: v for k, v in override.items() if k in values})
+        return DomainPolicy(
+            max_concurrency=max(1, int(values["max_concurrency"])),
+            min_delay_s=max(0.0, float(values["min_delay_s"])),
+            max_delay_s=float(values["max_delay_s"]),
+            backoff_factor=max(1.0, float(values["backoff_factor"])),
+        )
+
+    # ---- robots.txt ----
+
+    def _fetch_robots(self, origin: str) -> Tuple[Optional[int], str, float]:
+        import httpx
+
+        try:
+            resp = httpx.get(
+                f"{origin}/robots.txt",
+                headers={"User-Agent": self.config.user_agent},
+                timeout=10,
+                follow_redirects=True,
+            )
+        except Exception:
+            return None, "", ROBOTS_ERROR_TTL_SECONDS
+        if resp.status_code >= 500:
+            # RFC 9309：服务器错误时视为全部禁止，稍后重试
+            return resp.status_code, "User-agent: *\nDisallow: /", ROBOTS_ERROR_TTL_SECONDS
+        if resp.status_code >= 400:
+            return resp.status_code, "", ROBOTS_TTL_SECONDS
+        return resp.status_code, resp.text, ROBOTS_TTL_SECONDS
+
+    def robots_for(self, url: str) -> RobotFileParser:
+        parts = urlparse(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        now = time.time()
+        with self._robots_lock:
+            cached = self._robots.get(origin)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM robots WHERE origin = ?", (origin,)).fetchone()
+        if row is not None and row["expires_at"] > now:
+            body, expires_at = row["body"], row["expires_at"]
+        else:
+            status, body, ttl = self._fetch_robots(origin)
+            expires_at = now + ttl
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO robots (origin, fetched_at, expires_at, status, body) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (origin, now, expires_at, status, body),
+                )
+
+        parser = RobotFileParser()
+        parser.parse(body.splitlines())
+        with self._robots_lock:
+            self._robots[origin] = (expires_at, parser)
+        return parser
+
+    def allowed(self, url: str) -> bool:
+        if not self.config.respect_robots:
+            return True
+        return self.robots_for(url).can_fetch(self.config.user_agent, url)
+
+    def _base_delay(self, url: str, policy: DomainPolicy) -> float:
+        if not self.config.respect_robots:
+            return policy.min_delay_s
+        crawl_delay = self.robots_for(url).crawl_delay(self.config.user_agent)
+        return max(policy.min_delay_s, float(crawl_delay or 0))
+
+    # ---- 代理池 ----
+
+    def pick_proxy(self) -> Optional[str]:
+        """按健康分加权随机选择一个不在冷却中的代理；全部冷却时选最快恢复的那个。"""
+        if not self.config.proxies:
+            return None
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM proxies WHERE server IN (%s)" % ",".join("?" * len(self.config.proxies)),
+                self.config.proxies,
+            ).fetchall()
+        if not rows:
+            return None
+        ready = [r for r in rows if r["cooldown_until"] <= now]
+        if not ready:
+            return min(rows, key=lambda r: r["cooldown_until"])["server"]
+        weights = [max(r["score"], PROXY_MIN_SCORE) for r in ready]
+        return random.choices([r["server"] for r in ready], weights=weights, k=1)[0]
+
+    def _record_proxy(self, conn: sqlite3.Connection, server: str, outcome: str, now: float) -> None:
+        row = conn.execute("SELECT * FROM proxies WHERE server = ?", (server,)).fetchone()
+        if row is None:
+            return
+        success = outcome == "ok"
+        score = (1 - PROXY_SCORE_ALPHA) * row["score"] + PROXY_SCORE_ALPHA * (1.0 if success else 0.0)
+        failures = 0 if success else row["consecutive_failures"] + 1
+        cooldown_until = row["cooldown_until"]
+        if outcome == "blocked":
+            # 连续被封禁时冷却时间线性增长
+            cooldown_until = now + PROXY_COOLDOWN_SECONDS * failures
+        conn.execute(
+            f"UPDATE proxies SET score = ?, uses = uses + 1, {outcome} = {outcome} + 1, "
+            "consecutive_failures = ?, cooldown_until = ? WHERE server = ?",
+            (score, failures, cooldown_until, server),
+        )
+
+    # ---- 申请与释放 ----
+
+    def _try_acquire(
+        self, domain: str, initial_delay: float, policy: DomainPolicy, proxy: Optional[str]
+    ) -> Tuple[Optional[int], float]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for lease in conn.execute(
+                "SELECT id, pid, acquired_at FROM leases WHERE domain = ?", (domain,)
+            ).fetchall():
+                if not pid_alive(lease["pid"]) or now - lease["acquired_at"] > LEASE_MAX_AGE_SECONDS:
+                    conn.execute("DELETE FROM leases WHERE id = ?", (lease["id"],))
+            row = conn.execute("SELECT * FROM domains WHERE domain = ?", (domain,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO domains (domain, delay) VALUES (?, ?)",
+                    (domain, initial_delay),
+                )
+                row = conn.execute("SELECT * FROM domains WHERE domain = ?", (domain,)).fetchone()
+            in_flight = conn.execute(
+                "SELECT COUNT(*) FROM leases WHERE domain = ?", (domain,)
+            ).fetchone()[0]
+            if in_flight >= policy.max_concurrency:
+                conn.execute("COMMIT")
+                return None, POLL_INTERVAL
+            if now < row["next_at"]:
+                conn.execute("COMMIT")
+                return None, row["next_at"] - now
+            cur = conn.execute(
+                "INSERT INTO leases (domain, pid, proxy, acquired_at) VALUES (?, ?, ?, ?)",
+                (domain, os.getpid(), proxy, now),
+            )
+            conn.execute(
+                "UPDATE domains SET next_at = ?, first_at = COALESCE(first_at, ?) WHERE domain = ?",
+                (now + row["delay"], now, domain),
+            )
+            conn.execute("COMMIT")
+            return int(cur.lastrowid), 0.0
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _check_allowed(self, url: str, domain: str) -> None:
+        if self.allowed(url):
+            return
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO domains (domain, delay) VALUES (?, ?)", (domain, self.config.min_delay_s))
+            conn.execute("UPDATE domains SET disallowed = disallowed + 1 WHERE domain = ?", (domain,))
+        raise RobotsDisallowed(f"robots.txt 不允许抓取：{url}")
+
+    def acquire(self, url: str, proxy: Optional[str] = None) -> Lease:
+        """阻塞直到该域名有空闲名额且满足请求间隔；robots.txt 不允许时抛出 RobotsDisallowed。"""
+        domain = domain_of(url)
+        self._check_allowed(url, domain)
+        policy = self.policy_for(domain)
+        # robots.txt 可能需要联网获取，放在数据库事务之外
+        initial_delay = self._base_delay(url, policy)
+        proxy = proxy if proxy is not None else self.pick_proxy()
+        started = time.perf_counter()
+        while True:
+            lease_id, wait = self._try_acquire(domain, initial_delay, policy, proxy)
+            if lease_id is not None:
+                return Lease(lease_id, domain, url, proxy, waited_s=time.perf_counter() - started)
+            time.sleep(min(wait, 5.0))
+
+    async def acquire_async(self, url: str, proxy: Optional[str] = None) -> Lease:
+        domain = domain_of(url)
+        self._check_allowed(url, domain)
+        policy = self.policy_for(domain)
+        # robots.txt 可能需要联网获取，放在数据库事务之外
+        initial_delay = self._base_delay(url, policy)
+        proxy = proxy if proxy is not None else self.pick_proxy()
+        started = time.perf_counter()
+        while True:
+            lease_id, wait = self._try_acquire(domain, initial_delay, policy, proxy)
+            if lease_id is not None:
+                return Lease(lease_id, domain, url, proxy, waited_s=time.perf_counter() - started)
+            await asyncio.sleep(min(wait, 5.0))
+
+    def release(self, lease: Lease) -> None:
+        """释放名额，并根据结果调整该域名的请求间隔与代理健康分。"""
+        now = time.time()
+        policy = self.policy_for(lease.domain)
+        if lease.status in BLOCK_STATUSES:
+            outcome = "blocked"
+        elif lease.error is not None or (lease.status is not None and lease.status >= 500):
+            outcome = "errors"
+        else:
+            outcome = "ok"
+        base_delay = self._base_delay(lease.url, policy) if outcome == "ok" else 0.0
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM leases WHERE id = ?", (lease.id,))
+            row = conn.execute("SELECT * FROM domains WHERE domain = ?", (lease.domain,)).fetchone()
+            delay, next_at = row["delay"], row["next_at"]
+            if outcome == "blocked":
+                delay = min(
+                    policy.max_delay_s,
+                    max(delay * policy.backoff_factor, policy.min_delay_s * policy.backoff_factor, lease.retry_after),
+                )
+                next_at = max(next_at, now + delay)
+            elif outcome == "errors":
+                delay = min(policy.max_delay_s, max(delay, policy.min_delay_s) * 1.5)
+            else:
+                delay = max(base_delay, delay * RECOVERY_FACTOR)
+            conn.execute(
+                f"UPDATE domains SET delay = ?, next_at = ?, requests = requests + 1, "
+                f"{outcome} = {outcome} + 1, wait_s = wait_s + ?, last_at = ? WHERE domain = ?",
+                (delay, next_at, lease.waited_s, now, lease.domain),
+            )
+            if lease.proxy:
+                self._record_proxy(conn, lease.proxy, outcome, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    @contextmanager
+    def slot(self, url: str, proxy: Optional[str] = None) -> Iterator[Lease]:
+        lease = self.acquire(url, proxy)
+        try:
+            yield lease
+        except BaseException as e:
+            lease.error = type(e).__name__
+            raise
+        finally:
+            self.release(lease)
+
+    @asynccontextmanager
+    async def aslot(self, url: str, proxy: Optional[str] = None) -> AsyncIterator[Lease]:
+        lease = await self.acquire_async(url, proxy)
+        try:
+            yield lease
+        except BaseException as e:
+            lease.error = type(e).__name__
+            raise
+        finally:
+            self.release(lease)
+
+    # ---- 报告 ----
+
+    def domain_stats(self) -> List[DomainStats]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM domains ORDER BY requests DESC").fetchall()
+            in_flight = dict(conn.execute("SELECT domain, COUNT(*) FROM leases GROUP BY domain").fetchall())
+        stats = []
+        for r in rows:
+            span = (r["last_at"] or 0) - (r["first_at"] or 0)
+            stats.append(DomainStats(
+                domain=r["domain"],
+                requests=r["requests"],
+                ok=r["ok"],
+                blocked=r["blocked"],
+                errors=r["errors"],
+                disallowed=r["disallowed"],
+                delay_s=r["delay"],
+                in_flight=in_flight.get(r["domain"], 0),
+                avg_wait_s=r["wait_s"] / r["requests"] if r["requests"] else 0.0,
+                per_minute=r["requests"] / span * 60 if span > 0 else 0.0,
+            ))
+        return stats
+
+    def proxy_stats(self) -> List[ProxyStats]:
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM proxies ORDER BY score DESC").fetchall()
+        return [
+            ProxyStats(
+                server=r["server"],
+                score=r["score"],
+                uses=r["uses"],
+                ok=r["ok"],
+                blocked=r["blocked"],
+                errors=r["errors"],
+                cooling=r["cooldown_until"] > now,
+            )
+            for r in rows
+        ]
+
+    def reset(self) -> None:
+        """清空统计与退避状态（保留 robots.txt 缓存）。"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM domains")
+            conn.execute("DELETE FROM leases")
+            conn.execute("UPDATE proxies SET score = 1.0, uses = 0, ok = 0, blocked = 0, errors = 0, "
+                         "consecutive_failures = 0, cooldown_until = 0")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="按域名的抓取吞吐、封禁率与代理健康度")
+    parser.add_argument("--db", default=str(POLITENESS_DB_PATH))
+    parser.add_argument("--reset", action="store_true", help="清空统计与退避状态")
+    args = parser.parse_args()
+
+    scheduler = PolitenessScheduler(AppConfig.load().politeness, Path(args.db))
+    if args.reset:
+        scheduler.reset()
+        print("已清空")
+        return
+
+    domains = scheduler.domain_stats()
+    if not domains:
+        print("暂无记录")
+    for d in domains:
+        print(
+            f"{d.domain:<32} 请求 {d.requests:>5}  成功 {d.ok:>5}  封禁 {d.blocked:>4} ({d.block_rate:.0%})  "
+            f"错误 {d.errors:>4}  robots 拒绝 {d.disallowed:>3}  {d.per_minute:6.1f}/分钟  "
+            f"平均排队 {d.avg_wait_s:5.1f}s  当前间隔 {d.delay_s:5.1f}s"
+        )
+    for p in scheduler.proxy_stats():
+        state = "冷却中" if p.cooling else "可用"
+        print(f"代理 {p.server:<30} 健康分 {p.score:.2f}  使用 {p.uses}  封禁 {p.blocked}  错误 {p.errors}  {state}")
+
+
+if __name__ == "__main__":
+    main()
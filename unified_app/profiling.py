@@ -0,0 +1,401 @@
+"""
+按需性能剖析：抓取变慢时，定位时间花在 Python 解析、Playwright 还是等待模型上。
+
+开启后（配置文件 profiling 段的 mode，或单次请求的 profile）每次运行：
+
+- 后台线程定时采样发起运行的线程的调用栈（sys._current_frames，不依赖第三方库），
+  按调用栈中的模块把样本归入“模型调用 / 浏览器 / 解析 / 事件循环等待 / 其他”
+- Playwright 运行时同时录制 trace（截图 + DOM 快照），可用 `playwright show-trace trace-1.zip` 查看
+
+mode 为 slow 时只有耗时超过 slow_threshold_s 的运行才保存产物，否则丢弃；always 时每次都保存。
+产物放在 profiles/<时间>-<名称>/ 下：
+
+- profile.txt：耗时分布、阶段耗时与最耗时的函数
+- cpu.folded：折叠调用栈，可直接拖进 https://www.speedscope.app 或用 flamegraph.pl 生成火焰图
+- trace-N.zip：Playwright trace
+
+保存的目录记录在历史记录的运行指标中（metrics.profile），侧边栏历史记录中可以下载。
+只保留最近 keep 个目录。
+
+查看最近保存的剖析：
+    python -m unified_app.profiling
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from types import CodeType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+PROFILES_DIR = PROJECT_ROOT / "profiles"
+
+OFF = "off"
+SLOW = "slow"
+ALWAYS = "always"
+MODES = (OFF, SLOW, ALWAYS)
+
+MAX_STACK_DEPTH = 128
+
+# 按调用栈从内到外找到的第一个匹配的模块决定样本的归类
+_CATEGORIES: List[Tuple[str, Tuple[str, ...]]] = [
+    ("模型调用", ("openai", "httpx", "httpcore", "langchain", "ollama", "requests", "urllib3", "tiktoken")),
+    ("浏览器（Playwright）", ("playwright",)),
+    ("解析", ("bs4", "lxml", "html5lib", "html2text", "markdownify", "html/parser", "schema_repair", "monitor")),
+]
+# 没有匹配的模块、但处于 asyncio 事件循环中：在等待 Playwright 驱动进程等异步 I/O
+_LOOP_WAIT = "事件循环等待"
+_OTHER = "其他 Python"
+_LOOP_MARKERS = ("asyncio/base_events", "asyncio/selector_events", "selectors.py")
+
+
+def _short_path(filename: str) -> str:
+    parts = filename.replace("\\", "/").split("/")
+    for marker in ("site-packages", "dist-packages", "unified_app"):
+        if marker in parts:
+            index = parts.index(marker)
+            return "/".join(parts[index + 1 :] if marker != "unified_app" else parts[index:])
+    return "/".join(parts[-2:])
+
+
+def _frame_label(code: CodeType) -> str:
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+def categorise(stack: Tuple[CodeType, ...]) -> str:
+    """stack 为从内到外的 code 对象。"""
+    in_loop = False
+    for code in stack:
+        filename = code.co_filename.replace("\\", "/")
+        for name, markers in _CATEGORIES:
+            if any(f"/{m}" in filename for m in markers):
+                return name
+        in_loop = in_loop or any(m in filename for m in _LOOP_MARKERS)
+    return _LOOP_WAIT if in_loop else _OTHER
+
+
+class StackSampler:
+    """定时采样指定线程的调用栈（包括等待 I/O 的时间，即墙钟采样）。"""
+
+    def __init__(self, thread_id: Optional[int] = None, interval_s: float = 0.01) -> None:
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval_s = max(0.001, interval_s)
+        # 从内到外的 code 对象元组 -> 样本数
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                # 线程已结束
+                return
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            del frame
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def categories(self) -> Dict[str, int]:
+        totals: Counter = Counter()
+        for stack, count in self.stacks.items():
+            totals[categorise(stack)] += count
+        return dict(totals.most_common())
+
+    def top_functions(self, limit: int = 30) -> List[Tuple[str, int, int]]:
+        """返回 [(函数, 自身样本数, 含子调用的样本数)]，按自身样本数排序。"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            if not stack:
+                continue
+            own[stack[0]] += count
+            for code in set(stack):
+                total[code] += count
+        ranked = sorted(total, key=lambda c: (own[c], total[c]), reverse=True)[:limit]
+        return [(_frame_label(code), own[code], total[code]) for code in ranked]
+
+    def folded(self) -> str:
+        """折叠调用栈格式：每行 "外层;...;内层 样本数"。"""
+        lines = [
+            ";".join(_frame_label(code) for code in reversed(stack)) + f" {count}"
+            for stack, count in self.stacks.most_common()
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _slug(text: str) -> str:
+    text = re.sub(r"^[a-z]+://", "", text or "run")
+    return re.sub(r"[^0-9A-Za-z._-]+", "_", text).strip("_")[:60] or "run"
+
+
+def relative_path(path: Path) -> str:
+    """项目目录内的路径记录为相对路径，便于整个项目目录搬迁后仍能找到。"""
+    try:
+        return str(Path(path).resolve().relative_to(PROJECT_ROOT))
+    except ValueError:
+        return str(path)
+
+
+def resolve_path(stored: str) -> Path:
+    path = Path(stored)
+    return path if path.is_absolute() else PROJECT_ROOT / path
+
+
+class RunProfiler:
+    """
+    一次运行的剖析：start() 开始采样，Playwright 的 context 通过 start_trace / stop_trace 录制 trace，
+    finish(elapsed_s) 停止采样并按 mode 与阈值决定是否保存，返回保存的目录（未保存时为 None）。
+    mode 为 off 时所有方法都不做任何事。
+    """
+
+    def __init__(
+        self,
+        mode: str = OFF,
+        slow_threshold_s: float = 60.0,
+        interval_ms: float = 10.0,
+        playwright_trace: bool = True,
+        keep: int = 50,
+        label: str = "",
+        directory: Path = PROFILES_DIR,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f"未知的剖析模式：{mode}（可选 {', '.join(MODES)}）")
+        self.mode = mode
+        self.slow_threshold_s = slow_threshold_s
+        self.interval_s = interval_ms / 1000
+        self.playwright_trace = playwright_trace
+        self.keep = keep
+        self.label = label
+        self.directory = Path(directory)
+        self.sampler: Optional[StackSampler] = None
+        self.saved: Optional[Path] = None
+        self._started_at = ""
+        self._started = 0.0
+        self._finished = False
+        self._staging: Optional[Path] = None
+        self._traces: List[Path] = []
+        self._tracing: set = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Any = None, mode: str = "", label: str = "") -> "RunProfiler":
+        """config 为 ProfilingConfig（为空时读取配置文件）；mode 非空时覆盖配置中的 mode。"""
+        if config is None:
+            from unified_app.config import AppConfig
+
+            config = AppConfig.load().profiling
+        return cls(
+            mode=mode or config.mode,
+            slow_threshold_s=config.slow_threshold_s,
+            interval_ms=config.interval_ms,
+            playwright_trace=config.playwright_trace,
+            keep=config.keep,
+            label=label,
+        )
+
+    @property
+    def active(self) -> bool:
+        return self.mode != OFF
+
+    def start(self) -> "RunProfiler":
+        if self.active and self.sampler is None:
+            self._started_at = datetime.now().isoformat(timespec="seconds")
+            self._started = time.perf_counter()
+            self.sampler = StackSampler(interval_s=self.interval_s)
+            self.sampler.start()
+        return self
+
+    def __enter__(self) -> "RunProfiler":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.finish()
+
+    # ---- Playwright trace ----
+
+    def _trace_path(self, context: Any) -> Optional[Path]:
+        with self._lock:
+            if id(context) not in self._tracing:
+                return None
+            self._tracing.discard(id(context))
+            if self._staging is None:
+                self._staging = Path(tempfile.mkdtemp(prefix="scrape-profile-"))
+            path = self._staging / f"trace-{len(self._traces) + 1}.zip"
+            self._traces.append(path)
+            return path
+
+    def _should_trace(self, context: Any) -> bool:
+        if not (self.active and self.playwright_trace) or self._finished:
+            return False
+        with self._lock:
+            self._tracing.add(id(context))
+        return True
+
+    async def start_trace_async(self, context: Any) -> None:
+        """在 async API 的 BrowserContext 上开始录制；失败不影响抓取。"""
+        if self._should_trace(context):
+            try:
+                await context.tracing.start(screenshots=True, snapshots=True)
+            except Exception:
+                self._tracing.discard(id(context))
+
+    async def stop_trace_async(self, context: Any) -> None:
+        """在关闭 context 之前调用。"""
+        path = self._trace_path(context)
+        if path is not None:
+            try:
+                await context.tracing.stop(path=str(path))
+            except Exception:
+                pass
+
+    def start_trace(self, context: Any) -> None:
+        """同 start_trace_async，用于 sync API（例如小红书抓取）。"""
+        if self._should_trace(context):
+            try:
+                context.tracing.start(screenshots=True, snapshots=True)
+            except Exception:
+                self._tracing.discard(id(context))
+
+    def stop_trace(self, context: Any) -> None:
+        path = self._trace_path(context)
+        if path is not None:
+            try:
+                context.tracing.stop(path=str(path))
+            except Exception:
+                pass
+
+    # ---- 保存 ----
+
+    def finish(self, elapsed_s: Optional[float] = None, stages: Optional[Dict[str, float]] = None) -> Optional[Path]:
+        """停止采样；按 mode 与阈值决定是否保存产物。可以重复调用，之后的调用返回第一次的结果。"""
+        if not self.active or self._finished:
+            return self.saved
+        self._finished = True
+        if self.sampler is not None:
+            self.sampler.stop()
+        if elapsed_s is None:
+            elapsed_s = time.perf_counter() - self._started
+        try:
+            if self.mode == ALWAYS or elapsed_s >= self.slow_threshold_s:
+                self.saved = self._save(elapsed_s, stages or {})
+                self._prune()
+        finally:
+            if self._staging is not None:
+                shutil.rmtree(self._staging, ignore_errors=True)
+        return self.saved
+
+    def _save(self, elapsed_s: float, stages: Dict[str, float]) -> Path:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        target = self.directory / f"{stamp}-{_slug(self.label)}"
+        suffix = 1
+        while target.exists():
+            suffix += 1
+            target = self.directory / f"{stamp}-{_slug(self.label)}-{suffix}"
+        target.mkdir(parents=True)
+        for trace in self._traces:
+            if trace.exists():
+                shutil.move(str(trace), str(target / trace.name))
+        sampler = self.sampler or StackSampler()
+        (target / "cpu.folded").write_text(sampler.folded(), encoding="utf-8")
+        (target / "profile.txt").write_text(self._report(sampler, elapsed_s, stages), encoding="utf-8")
+        return target
+
+    def _report(self, sampler: StackSampler, elapsed_s: float, stages: Dict[str, float]) -> str:
+        reason = "每次运行" if self.mode == ALWAYS else f"超过阈值 {self.slow_threshold_s:g}s"
+        lines = [
+            f"运行：{self.label or '-'}",
+            f"开始：{self._started_at}",
+            f"耗时：{elapsed_s:.2f}s（保存原因：{reason}）",
+            f"采样：{sampler.samples} 次，间隔 {self.interval_s * 1000:g} ms（墙钟采样，包含等待 I/O 的时间）",
+            "",
+            "耗时分布：",
+        ]
+        samples = max(1, sampler.samples)
+        for name, count in sampler.categories().items():
+            lines.append(f"  {name:<14} {count / samples:6.1%}  约 {count * self.interval_s:.2f}s")
+        if stages:
+            lines += ["", "阶段耗时："]
+            lines += [f"  {name:<24} {seconds:.2f}s" for name, seconds in stages.items()]
+        lines += ["", "最耗时的函数（自身 / 含子调用）："]
+        for label, own, total in sampler.top_functions():
+            lines.append(f"  {own / samples:6.1%} {total / samples:6.1%}  {label}")
+        if self._traces:
+            lines += ["", "Playwright trace：" + "、".join(t.name for t in self._traces) + "（playwright show-trace <文件>）"]
+        return "\n".join(lines) + "\n"
+
+    def _prune(self) -> None:
+        dirs = sorted((d for d in self.directory.iterdir() if d.is_dir()), key=lambda d: d.stat().st_mtime)
+        for old in dirs[: max(0, len(dirs) - max(1, self.keep))]:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+@contextmanager
+def profile_run(
+    label: str,
+    config: Any = None,
+    mode: str = "",
+    reporter: Optional[Callable[[str, str], None]] = None,
+) -> Iterator[RunProfiler]:
+    """命令行与各抓取脚本使用：整段代码作为一次运行剖析，保存后通过 reporter 提示目录。"""
+    profiler = RunProfiler.from_config(config, mode, label).start()
+    try:
+        yield profiler
+    finally:
+        saved = profiler.finish()
+        if saved is not None and reporter is not None:
+            reporter("info", f"🔬 已保存性能剖析：{relative_path(saved)}")
+
+
+def list_profiles(directory: Path = PROFILES_DIR) -> List[Path]:
+    if not directory.exists():
+        return []
+    return sorted((d for d in directory.iterdir() if d.is_dir()), key=lambda d: d.stat().st_mtime, reverse=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="查看最近保存的性能剖析")
+    parser.add_argument("--dir", type=Path, default=PROFILES_DIR)
+    parser.add_argument("--last", type=int, default=10)
+    parser.add_argument("--show", default="", help="输出指定目录（名称）的 profile.txt")
+    args = parser.parse_args()
+
+    if args.show:
+        print((args.dir / args.show / "profile.txt").read_text(encoding="utf-8"))
+        return
+    profiles = list_profiles(args.dir)
+    if not profiles:
+        print("暂无保存的性能剖析")
+    for path in profiles[: args.last]:
+        # profile.txt 第三行是耗时与保存原因
+        report = (path / "profile.txt").read_text(encoding="utf-8").splitlines()
+        print(f"{path.name}  {report[2] if len(report) > 2 else ''}")
+        print("    " + ", ".join(sorted(f.name for f in path.iterdir())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+稳定前缀的请求布局与提示词缓存统计。
+
+批量抽取时，同一次运行中每个请求的系统提示、抽取提示与 JSON Schema 完全相同。OpenAI 的 prompt caching
+与基于 llama.cpp 的本地服务（LM Studio、Ollama）都能复用已经计算过的公共前缀，省掉这部分预填充，
+前提是静态部分在前，并且逐字节相同。build_messages 保证这一点：
+
+- 静态部分（系统提示 + 抽取提示 + Schema）全部放在第一条 system 消息中，Schema 按键排序、用固定分隔符序列化
+- 随页面变化的内容只出现在最后一条 user 消息中
+- 静态部分不含时间、页数等每次请求都不同的内容
+
+CacheReport 汇总一次运行中的缓存命中与预填充耗时，各服务返回的字段不同：
+- OpenAI（以及新版 LM Studio）：usage.prompt_tokens_details.cached_tokens
+- llama.cpp server：timings.cache_n / prompt_n / prompt_ms
+- LM Studio 原生接口：stats.time_to_first_token（近似为预填充耗时）
+- Ollama：prompt_eval_count 只计入本次实际计算的 token，prompt_eval_duration 为预填充耗时，不返回命中数
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+def canonical_json(value: Any) -> str:
+    """同一个值总是序列化为相同的字节：按键排序、固定分隔符。"""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def build_messages(
+    system: str,
+    instruction: str,
+    schema: Optional[Dict[str, Any]],
+    variable: str,
+) -> List[Dict[str, str]]:
+    """静态部分在前（system），可变部分在后（user）。"""
+    static = f"{system}\n\n{instruction.strip()}"
+    if schema:
+        static += f"\n\nJSON Schema:\n{canonical_json(schema)}"
+    return [
+        {"role": "system", "content": static},
+        {"role": "user", "content": variable},
+    ]
+
+
+def prefix_key(messages: List[Dict[str, str]]) -> str:
+    """除最后一条消息外的内容的指纹；同一次运行中所有请求应当相同。"""
+    return hashlib.sha256(canonical_json(messages[:-1]).encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class RequestUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # 服务未返回时为 None
+    cached_tokens: Optional[int] = None
+    prefill_s: Optional[float] = None
+
+
+def parse_usage(data: Dict[str, Any]) -> RequestUsage:
+    """从 OpenAI 兼容接口或 Ollama /api/chat 的响应中取出 token 用量、缓存命中与预填充耗时。"""
+    if "prompt_eval_count" in data or "eval_count" in data:
+        duration = data.get("prompt_eval_duration")
+        return RequestUsage(
+            prompt_tokens=int(data.get("prompt_eval_count") or 0),
+            completion_tokens=int(data.get("eval_count") or 0),
+            prefill_s=int(duration) / 1e9 if duration is not None else None,
+        )
+
+    usage = data.get("usage") or {}
+    result = RequestUsage(
+        prompt_tokens=int(usage.get("prompt_tokens") or 0),
+        completion_tokens=int(usage.get("completion_tokens") or 0),
+    )
+    details = usage.get("prompt_tokens_details") or {}
+    if details.get("cached_tokens") is not None:
+        result.cached_tokens = int(details["cached_tokens"])
+    timings = data.get("timings") or {}
+    if timings:
+        if timings.get("cache_n") is not None:
+            result.cached_tokens = int(timings["cache_n"])
+        if timings.get("prompt_ms") is not None:
+            result.prefill_s = float(timings["prompt_ms"]) / 1000
+    stats = data.get("stats") or {}
+    if result.prefill_s is None and stats.get("time_to_first_token") is not None:
+        result.prefill_s = float(stats["time_to_first_token"])
+    return result
+
+
+@dataclass
+class CacheReport:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    # 返回了命中数 / 预填充耗时的请求数，用于判断统计是否可用
+    cache_reported: int = 0
+    prefill_s: float = 0.0
+    prefill_reported: int = 0
+    # 前缀指纹 -> 请求数；布局正确时同一次运行只有一个指纹
+    prefixes: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, key: str, usage: RequestUsage) -> None:
+        self.requests += 1
+        self.prompt_tokens += usage.prompt_tokens
+        self.prefixes[key] = self.prefixes.get(key, 0) + 1
+        if usage.cached_tokens is not None:
+            self.cached_tokens += usage.cached_tokens
+            self.cache_reported += 1
+        if usage.prefill_s is not None:
+            self.prefill_s += usage.prefill_s
+            self.prefill_reported += 1
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        """命中的输入 token 占比；服务不返回命中数时为 None。"""
+        if not self.cache_reported or not self.prompt_tokens:
+            return None
+        return self.cached_tokens / self.prompt_tokens
+
+    @property
+    def avg_prefill_s(self) -> Optional[float]:
+        return self.prefill_s / self.prefill_reported if self.prefill_reported else None
+
+    def summary(self) -> str:
+        parts = [f"{self.requests} 次请求", f"输入 {self.prompt_tokens} token"]
+        hit_rate = self.hit_rate
+        parts.append(f"缓存命中 {self.cached_tokens} token（{hit_rate:.0%}）" if hit_rate is not None else "服务未返回缓存命中数")
+        if self.avg_prefill_s is not None:
+            parts.append(f"预填充共 {self.prefill_s:.2f}s（平均 {self.avg_prefill_s * 1000:.0f} ms）")
+        if len(self.prefixes) > 1:
+            parts.append(f"⚠️ 出现 {len(self.prefixes)} 种不同的前缀")
+        return " · ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "hit_rate": self.hit_rate,
+            "prefill_s": round(self.prefill_s, 4),
+            "avg_prefill_s": self.avg_prefill_s,
+            "distinct_prefixes": len(self.prefixes),
+        }
@@ -1,18 +1,156 @@
+import json
+import re
+import sqlite3
+import time
+from collections import deque
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Iterable, Iterator, Optional
+from urllib.parse import urljoin
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
+from unified_app.har import HarSession
+from unified_app.localstate import connect_sqlite
+from unified_app.politeness import PolitenessScheduler
+from unified_app.profiling import RunProfiler, profile_run
+from unified_app.sinks import SinkSet, make_record
+
 # 这是一个带有详细中文注释的版本，便于学习 Playwright 的使用与抓取小红书（RED）的思路。
 # 我保留了与原脚本相同的功能点：启动 Playwright、加载/保存会话、搜索并抓取最多 N 条结果、清理资源等。
 # 建议把这个文件作为学习参考；如果你想把注释直接写回原文件，我也可以替换原文件内容。
 
+# 笔记详情的抓取记录（用于跳过最近已经抓取过的笔记），与其他状态库一样放在项目根目录
+NOTES_DB_PATH = Path(__file__).resolve().parents[1] / "redbook_notes.db"
+
+# 笔记链接中的 id，例如 /explore/<id>、/discovery/item/<id>
+_NOTE_ID = re.compile(r"/(?:explore|discovery/item|note)/([0-9A-Za-z]+)")
+
+# 在详情页中一次性取出所有字段（只需一次 page.evaluate 往返，而不是每个字段一次 query_selector）：
+# 1) 优先读取页面内嵌的初始状态 window.__INITIAL_STATE__，里面有结构化的笔记数据
+# 2) 没有时按 DOM 选择器读取（与页面上看到的内容一致，选择器需要随站点改版调整）
+_EXTRACT_NOTE_JS = """
+() => {
+	const text = (sel) => {
+		const el = document.querySelector(sel);
+		return el ? el.innerText.trim() : "";
+	};
+	try {
+		const map = window.__INITIAL_STATE__ && window.__INITIAL_STATE__.note && window.__INITIAL_STATE__.note.noteDetailMap;
+		const first = map ? Object.values(map)[0] : null;
+		const note = first ? first.note : null;
+		if (note && (note.title || note.desc)) {
+			const info = note.interactInfo || {};
+			return {
+				title: note.title || "",
+				body: note.desc || "",
+				tags: (note.tagList || []).map((t) => t.name).filter(Boolean),
+				likes: String(info.likedCount ?? ""),
+				collects: String(info.collectedCount ?? ""),
+				comments: String(info.commentCount ?? ""),
+				published: note.time ? new Date(note.time).toISOString() : "",
+				author: (note.user && note.user.nickname) || "",
+			};
+		}
+	} catch (e) {}
+	const desc = document.querySelector("#detail-desc, .note-content .desc");
+	const tagLinks = desc ? Array.from(desc.querySelectorAll("a.tag, a#hash-tag")) : [];
+	let body = "";
+	if (desc) {
+		// 正文中夹着话题标签链接，复制一份去掉标签后再取文字
+		const clone = desc.cloneNode(true);
+		clone.querySelectorAll("a.tag, a#hash-tag").forEach((a) => a.remove());
+		body = clone.textContent.trim();
+	}
+	return {
+		title: text("#detail-title"),
+		body: body,
+		tags: tagLinks.map((a) => a.innerText.trim().replace(/^#/, "")).filter(Boolean),
+		likes: text(".like-wrapper .count"),
+		collects: text(".collect-wrapper .count"),
+		comments: text(".chat-wrapper .count"),
+		published: text(".bottom-container .date") || text(".date"),
+		author: text(".author-wrapper .username"),
+	};
+}
+"""
+
+
+def _note_id(link: str) -> str:
+	"""从笔记链接中取出 id；取不到时用整个链接（去掉查询参数）作为 id。"""
+	match = _NOTE_ID.search(link)
+	return match.group(1) if match else link.split("?", 1)[0]
+
+
+def _parse_count(value: Any) -> Optional[int]:
+	"""把页面上的互动数转成整数："1.2万" → 12000、"3k" → 3000、"10万+" → 100000；没有数字（例如显示为“赞”）时为 0。"""
+	if isinstance(value, (int, float)):
+		return int(value)
+	text = str(value or "").strip().replace(",", "").rstrip("+")
+	if not text:
+		return None
+	match = re.match(r"^(\d+(?:\.\d+)?)\s*(万|w|W|千|k|K)?", text)
+	if not match:
+		return 0
+	number = float(match.group(1))
+	unit = match.group(2) or ""
+	if unit in ("万", "w", "W"):
+		number *= 10_000
+	elif unit in ("千", "k", "K"):
+		number *= 1_000
+	return int(number)
+
+
+class EnrichedNoteStore:
+	"""
+	笔记详情的抓取结果，按笔记 id 保存在 SQLite 中（WAL 模式，多个进程可以同时使用）。
+	enrich_notes() 用它跳过最近已经抓取过的笔记，直接返回上次的结果。
+	"""
+
+	def __init__(self, path: Path = NOTES_DB_PATH) -> None:
+		self.path = Path(path)
+		with self._connect() as conn:
+			conn.execute(
+				"CREATE TABLE IF NOT EXISTS notes ("
+				"note_id TEXT PRIMARY KEY, link TEXT NOT NULL, enriched_at REAL NOT NULL, data TEXT NOT NULL)"
+			)
+
+	def _connect(self) -> sqlite3.Connection:
+		return connect_sqlite(self.path)
+
+	def fresh(self, note_id: str, max_age_s: float) -> Optional[Dict[str, Any]]:
+		"""max_age_s 秒内抓取过时返回上次的结果，否则返回 None。"""
+		with self._connect() as conn:
+			row = conn.execute(
+				"SELECT data FROM notes WHERE note_id = ? AND enriched_at >= ?", (note_id, time.time() - max_age_s)
+			).fetchone()
+		return json.loads(row["data"]) if row else None
+
+	def save(self, note_id: str, link: str, data: Dict[str, Any]) -> None:
+		with self._connect() as conn:
+			conn.execute(
+				"INSERT OR REPLACE INTO notes (note_id, link, enriched_at, data) VALUES (?, ?, ?, ?)",
+				(note_id, link, time.time(), json.dumps(data, ensure_ascii=False)),
+			)
+
+
 class RedBookScrapper:
 	# 构造函数
-	def __init__(self, storage_path: Optional[Path] = None, headless: bool = False) -> None:
+	def __init__(
+		self,
+		storage_path: Optional[Path] = None,
+		headless: bool = False,
+		base_url: str = "https://www.xiaohongshu.com",
+		har: Optional[HarSession] = None,
+		politeness: Optional[PolitenessScheduler] = None,
+		profiler: Optional[RunProfiler] = None,
+	) -> None:
 		"""
 		功能概述（中文注释详解）：
 		- storage_path: 持久化 Playwright context 的 storage state（json 文件），用于保存登录态（cookie/localStorage）。
 		- headless: 控制浏览器是否以无头模式运行。学习和调试时建议 False（可见浏览器更方便观察页面和手动登录）。
+		- base_url: 站点根地址，默认是小红书官网；基准测试时可以指向本地的仿真站点。
+		- har: HAR 录制/回放会话（见 unified_app/har.py），为 None 时正常访问站点。
+		- politeness: 按域名限速调度器（见 unified_app/politeness.py），每次导航前申请名额，并使用代理池中的代理。
+		- profiler: 性能剖析（见 unified_app/profiling.py），传入时在整个会话的 context 上录制 Playwright trace。
 		"""
 		# Playwright 运行时对象（在 start() 中初始化）
 		self.playwright = None
@@ -24,6 +162,14 @@ class RedBookScrapper:
 		self.page = None
 		# 是否无头运行（默认 False，方便手动登录）
 		self.headless = headless
+		# 站点根地址（去掉末尾的斜杠，方便拼接路径）
+		self.base_url = base_url.rstrip("/")
+		# HAR 录制/回放：record 时在 close() 关闭 context 时写入归档，replay 时不访问真实站点
+		self.har = har
+		# 礼貌抓取：控制访问频率，遇到 429/403 自动退避；proxy 为本次 context 绑定的代理
+		self.politeness = politeness
+		self.proxy: Optional[str] = None
+		self.profiler = profiler
 		# 存储会话的文件路径（如果用户未提供，则默认放在脚本目录下）
 		if storage_path:
 			self.storage_path = Path(storage_path)
@@ -39,20 +185,58 @@ class RedBookScrapper:
 		3) new_context() 可以接受 storage_state 来加载之前保存的登录态，从而实现“免登录”。
 		4) new_page() 返回 page 对象，用于后续的导航与选择器操作。
 		"""
+		try:
+			self._start()
+		except BaseException:
+			# 启动到一半失败（如 context 选项有误、trace 启动失败）时释放已启动的部分，避免残留 Chromium 进程
+			self.close()
+			raise
+		return self
+
+	def _start(self) -> None:
 		# 启动 Playwright 运行时
 		self.playwright = sync_playwright().start()
 		# 启动浏览器实例，headless 控制是否无头模式
 		self.browser = self.playwright.chromium.launch(headless=self.headless)
+		# 录制 HAR 时需要在创建 context 时传入 record_har_* 选项
+		context_options = self.har.context_options() if self.har is not None else {}
+		# 代理在 context 级别生效，整个会话使用同一个代理
+		if self.politeness is not None:
+			self.proxy = self.politeness.pick_proxy()
+			if self.proxy:
+				context_options["proxy"] = {"server": self.proxy}
 		# 如果存在之前保存的 storage state 文件，就加载，这样 context 带有登录态
 		if self.storage_path.exists():
 			# storage_state 可以直接传文件路径字符串或 dict（Playwright 会读取）
-			self.context = self.browser.new_context(storage_state=str(self.storage_path))
+			self.context = self.browser.new_context(storage_state=str(self.storage_path), **context_options)
 		else:
 			# 没有保存文件就创建全新的 context（无登录态）
-			self.context = self.browser.new_context()
+			self.context = self.browser.new_context(**context_options)
+		# 回放 HAR 时，所有请求都从归档中返回
+		if self.har is not None:
+			self.har.attach_sync(self.context)
+		if self.profiler is not None:
+			self.profiler.start_trace(self.context)
 		# 在 context 中新建一个页面用于浏览器自动化
 		self.page = self.context.new_page()
-		return self
+
+	def __enter__(self) -> "RedBookScrapper":
+		return self.start()
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+	# 导航到指定 URL；启用礼貌抓取时先等待该域名的空闲名额，并回报响应状态码
+	# page 默认是主页面，详情抓取时传入各自的标签页；wait_until 与 page.goto 相同
+	def _goto(self, url: str, timeout: int, page: Any = None, wait_until: str = "load") -> None:
+		page = page or self.page
+		if self.politeness is None:
+			page.goto(url, timeout=timeout, wait_until=wait_until)
+			return
+		with self.politeness.slot(url, proxy=self.proxy) as lease:
+			response = page.goto(url, timeout=timeout, wait_until=wait_until)
+			if response is not None:
+				lease.record(response.status, response.headers.get("retry-after"))
 
 	# 确保用户处于登录状态（交互式）
 	def ensure_logged_in(self) -> None:
@@ -70,7 +254,7 @@ class RedBookScrapper:
 			raise RuntimeError("Playwright not started. Call start() first.")
 
 		# 导航到小红书首页，这是触发（或检查）登录态的常见入口
-		self.page.goto("https://www.xiaohongshu.com", timeout=30000)
+		self._goto(self.base_url, timeout=30000)
 
 		# 如果没有保存的 session 文件，就要求用户手动登录并保存
 		if not self.storage_path.exists():
@@ -103,15 +287,15 @@ class RedBookScrapper:
 
 		# 常见的搜索或探索页 URL（可能随时失效，仅作尝试）
 		try_urls = [
-			f"https://www.xiaohongshu.com/search_result?keyword={keyword}",
-			f"https://www.xiaohongshu.com/search?keyword={keyword}",
-			f"https://www.xiaohongshu.com/explore?keyword={keyword}",
+			f"{self.base_url}/search_result?keyword={keyword}",
+			f"{self.base_url}/search?keyword={keyword}",
+			f"{self.base_url}/explore?keyword={keyword}",
 		]
 		navigated = False
 		# 逐个尝试访问这些 URL，如果能成功打开就停止尝试
 		for u in try_urls:
 			try:
-				self.page.goto(u, timeout=20000)
+				self._goto(u, timeout=20000)
 				navigated = True
 				break
 			except PlaywrightTimeoutError:
@@ -119,7 +303,7 @@ class RedBookScrapper:
 				continue
 		# 如果无法直接导航到结果页，则尝试在首页的搜索输入框里输入关键词并提交
 		if not navigated:
-			self.page.goto("https://www.xiaohongshu.com", timeout=20000)
+			self._goto(self.base_url, timeout=20000)
 			try:
 				# 使用包含“搜索”字样的 placeholder 定位输入框（适配中文站点）
 				self.page.fill('input[placeholder*="搜索"]', keyword, timeout=3000)
@@ -192,6 +376,106 @@ class RedBookScrapper:
 		# 最终返回不超过 max_results 条记录
 		return posts[:max_results]
 
+	# 并行访问笔记详情页，补全正文、标签、互动数与发布时间
+	def enrich_notes(
+		self,
+		notes: Iterable[Dict],
+		max_tabs: int = 4,
+		pace_s: float = 1.0,
+		max_age_s: float = 24 * 3600,
+		timeout: int = 20000,
+		store: Optional[EnrichedNoteStore] = None,
+	) -> Iterator[Dict]:
+		"""
+		功能：
+		- notes 为 search_latest() 的返回值（title + link），每完成一条就 yield 一条补全后的记录，
+		  调用方可以边抓边处理（打印、写入结果存储），不必等全部完成。
+		- 返回的字段：title、body（正文）、tags、likes、collects、comments（整数）、published、author，
+		  以及 note_id、link（完整地址）、enriched（是否成功）、cached（是否复用了最近的结果）、error。
+		实现思路（教学要点）：
+		1) 同一个 context 中最多打开 max_tabs 个标签页，共用 start() 加载的登录态（storage_state）、代理与 HAR。
+		2) 发起导航时只等到服务器开始返回（wait_until="commit"），不等页面加载完；
+		   各标签页在浏览器中并行加载，Python 这边按发起顺序依次等待 DOMContentLoaded 并取数据。
+		3) 每页只做一次 page.evaluate（见 _EXTRACT_NOTE_JS），字段在页面内一次取完。
+		4) 同一域名两次导航之间至少间隔 pace_s 秒；传入了 politeness 时改由调度器按域名限速与退避。
+		5) max_age_s 秒内抓取过的笔记直接返回上次的结果（记录在 redbook_notes.db 中），max_age_s 为 0 时总是重新抓取。
+		"""
+		if not self.context:
+			raise RuntimeError("Playwright not started. Call start() first.")
+		store = store or EnrichedNoteStore()
+
+		# 先处理缺少链接与最近抓取过的笔记，剩下的排队等待访问
+		pending = deque()
+		for note in notes:
+			link = note.get("link")
+			if not link:
+				yield {**note, "enriched": False, "cached": False, "error": "缺少笔记链接"}
+				continue
+			url = urljoin(self.base_url + "/", link)
+			note_id = _note_id(url)
+			cached = store.fresh(note_id, max_age_s) if max_age_s > 0 else None
+			if cached is not None:
+				yield {**note, **cached, "note_id": note_id, "link": url, "enriched": True, "cached": True, "error": ""}
+				continue
+			pending.append((note, url, note_id))
+
+		idle_tabs: List[Any] = []
+		# 已发起导航、还没取数据的标签页：(page, note, url, note_id, 导航时的错误)
+		in_flight = deque()
+		last_started = 0.0
+		try:
+			while pending or in_flight:
+				# 标签页没满时继续发起导航
+				while pending and len(in_flight) < max(1, max_tabs):
+					note, url, note_id = pending.popleft()
+					page = idle_tabs.pop() if idle_tabs else self.context.new_page()
+					if self.politeness is None and pace_s > 0:
+						wait = pace_s - (time.monotonic() - last_started)
+						if wait > 0:
+							time.sleep(wait)
+					last_started = time.monotonic()
+					error = ""
+					try:
+						self._goto(url, timeout=timeout, page=page, wait_until="commit")
+					except Exception as e:
+						error = f"打开详情页失败：{type(e).__name__}"
+					in_flight.append((page, note, url, note_id, error))
+
+				# 取出最早发起的一个，等它加载完成后一次性取出字段
+				page, note, url, note_id, error = in_flight.popleft()
+				data: Dict[str, Any] = {}
+				if not error:
+					try:
+						page.wait_for_load_state("domcontentloaded", timeout=timeout)
+						raw = page.evaluate(_EXTRACT_NOTE_JS) or {}
+						data = {
+							"title": raw.get("title") or note.get("title") or "",
+							"body": raw.get("body") or "",
+							"tags": list(raw.get("tags") or []),
+							"likes": _parse_count(raw.get("likes")),
+							"collects": _parse_count(raw.get("collects")),
+							"comments": _parse_count(raw.get("comments")),
+							"published": raw.get("published") or "",
+							"author": raw.get("author") or "",
+						}
+						if raw.get("title") or raw.get("body"):
+							store.save(note_id, url, data)
+						else:
+							# 通常是登录失效或触发了验证页，不记录，下次重新抓取
+							error = "页面中没有找到笔记内容（可能需要登录或触发了验证）"
+					except Exception as e:
+						error = f"读取详情页失败：{type(e).__name__}"
+				# 标签页留着给下一条笔记复用，比每次新建更快
+				idle_tabs.append(page)
+				yield {**note, **data, "note_id": note_id, "link": url, "enriched": not error, "cached": False, "error": error}
+		finally:
+			# 调用方提前停止迭代时同样会走到这里，关闭本次打开的所有标签页
+			for page in idle_tabs + [item[0] for item in in_flight]:
+				try:
+					page.close()
+				except Exception:
+					pass
+
 	# 关闭并清理 Playwright 资源
 	def close(self) -> None:
 		"""
@@ -200,8 +484,15 @@ class RedBookScrapper:
 		2) 关闭浏览器实例
 		3) 停止 Playwright 运行时
 		这些步骤都用 try/except 包裹以避免在清理阶段抛出未捕获异常导致进程崩溃。
+		关闭后各对象置为 None，重复调用 close() 不会再次操作已关闭的对象。
 		"""
 		if self.context:
+			try:
+				# trace 需要在 context 关闭前取出
+				if self.profiler is not None:
+					self.profiler.stop_trace(self.context)
+			except Exception:
+				pass
 			try:
 				self.context.close()
 			except Exception:
@@ -216,16 +507,13 @@ class RedBookScrapper:
 				self.playwright.stop()
 			except Exception:
 				pass
+		self.page = self.context = self.browser = self.playwright = None
 
 
-if __name__ == "__main__":
-	# 交互式示例：方便你在本地运行并观察行为
-	# 运行方式：
-	#   python unified_app/red_book_scrapper_zh.py
-	# 首次运行请先安装依赖并执行：python -m playwright install
-	scrapper = RedBookScrapper(headless=False)
-	scrapper.start()
-	try:
+def _run_interactive(scrapper: RedBookScrapper) -> None:
+	"""交互式示例的主体：登录、搜索、可选的详情补全与写入结果存储。"""
+	# 无论成功或失败，退出时都会关闭 Playwright，防止孤儿进程存在（start() 失败时也会释放已启动的部分）
+	with scrapper:
 		# 确保用户已登录（或保存登录态）
 		scrapper.ensure_logged_in()
 		# 让用户输入搜索关键字
@@ -236,8 +524,31 @@ if __name__ == "__main__":
 		for i, item in enumerate(results, start=1):
 			# 输出 title 与 link；注意 link 可能是相对路径，如果需要可以拼接站点域名
 			print(f"{i}. {item.get('title')!r} -> {item.get('link')}")
-	finally:
-		# 无论成功或失败，都要关闭 Playwright，防止孤儿进程存在
-		scrapper.close()
+		enrich = input("是否访问详情页补全正文、标签与互动数？(y/N): ").strip().lower() == "y"
+		# 配置文件 sinks 段中设置了结果存储时，一并写入
+		with SinkSet.from_config() as sinks:
+			if enrich:
+				# 每完成一条就输出并写入一条
+				for note in scrapper.enrich_notes(results):
+					if note["enriched"]:
+						source = "缓存" if note["cached"] else "详情页"
+						print(f"[{source}] {note['title']!r} 赞 {note['likes']} 藏 {note['collects']} 评 {note['comments']} {note['tags']}")
+					else:
+						print(f"[失败] {note.get('link')}：{note['error']}")
+					sinks.write(make_record("redbook", note.get("link") or "", note, keyword=keyword))
+			else:
+				sinks.write_many(make_record("redbook", item.get("link") or "", item, keyword=keyword) for item in results)
+		for stats in sinks.stats:
+			print(f"已写入 {stats.summary()}")
+		if sinks and sinks.dedupe_stats is not None:
+			print(sinks.dedupe_stats.summary())
 
 
+if __name__ == "__main__":
+	# 交互式示例：方便你在本地运行并观察行为
+	# 运行方式：
+	#   python unified_app/red_book_scrapper_zh.py
+	# 首次运行请先安装依赖并执行：python -m playwright install
+	# 配置文件 profiling 段开启时，整个会话作为一次运行剖析，超过阈值时保存调用栈采样与 trace
+	with profile_run("redbook", reporter=lambda level, message: print(message)) as profiler:
+		_run_interactive(RedBookScrapper(headless=False, profiler=profiler))
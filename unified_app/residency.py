@@ -0,0 +1,379 @@
+"""
+本地模型常驻：预加载、保持常驻与加载状态。
+
+Ollama 默认在模型空闲 5 分钟后卸载，LM Studio 的 JIT 加载同样会在 TTL 到期后卸载，
+之后的第一个请求要多等数秒的加载时间。ModelResidency 负责：
+
+- preload()：在应用启动或批量任务（爬取、工作进程池）开始前加载当前 provider 的对话模型与向量模型
+  - Ollama：不带输入的 /api/generate 与 /api/embed 只加载模型，keep_alive 指定空闲多久后卸载
+  - LM Studio：一次 max_tokens=1 的请求触发 JIT 加载，ttl 指定空闲多久后卸载
+  Ollama 的每个请求都会按请求中的 keep_alive 重新计时，不指定时按默认的 5 分钟，
+  因此抽取请求同样带上 keep_alive（见 config.build_graph_config 与 schema_repair.chat_json）
+- status()：通过 Ollama /api/ps、LM Studio /api/v0/models 查询模型是否已加载、何时卸载，
+  加上最近一次预加载的耗时（记录在 residency.db 中），显示在侧边栏
+- gate()：多个任务交替使用同一本地服务上的两个模型时，显存放不下两个模型的服务会来回换入换出。
+  进入抽取前登记正在使用的模型；同一服务上另一个模型仍有请求在运行时先等待其完成（最多 max_swap_wait_s），
+  同一模型的请求不受影响，混合批次因此按模型成组执行
+
+查看状态或手动预加载：
+    python -m unified_app.residency
+    python -m unified_app.residency --preload
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import os
+import sqlite3
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from unified_app.config import AppConfig, build_graph_config
+from unified_app.endpoints import EndpointPool
+from unified_app.localstate import connect_sqlite, pid_alive
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+RESIDENCY_DB_PATH = PROJECT_ROOT / "residency.db"
+
+CHAT = "chat"
+EMBEDDING = "embedding"
+LOCAL_PROVIDERS = ("ollama", "lmstudio")
+# 等待另一个模型的请求完成时的轮询间隔
+GATE_POLL_SECONDS = 0.25
+# 登记超过该时长视为进程异常退出后的残留
+ACTIVE_MAX_AGE_SECONDS = 3600
+STATUS_TIMEOUT = 3
+LOAD_TIMEOUT = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS loads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    detail TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_loads_model ON loads(provider, model, id);
+CREATE TABLE IF NOT EXISTS active (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server TEXT NOT NULL,
+    model TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL
+);
+"""
+
+
+def _ollama_base(base_url: str) -> str:
+    base = base_url.rstrip("/")
+    return base.rsplit("/v1", 1)[0] if base.endswith("/v1") else base
+
+
+@dataclass
+class ModelState:
+    provider: str
+    kind: str
+    model: str
+    # None 表示无法查询（服务不可达或不支持）
+    loaded: Optional[bool] = None
+    # 预计卸载时间（本地时间，Ollama 才有）
+    expires_at: str = ""
+    size_mb: float = 0.0
+    last_load_s: Optional[float] = None
+    last_load_at: str = ""
+    error: str = ""
+
+    def summary(self) -> str:
+        name = f"{self.model}（{'向量' if self.kind == EMBEDDING else '对话'}）"
+        if self.error:
+            return f"{name}：无法查询（{self.error}）"
+        state = {True: "已加载", False: "未加载", None: "状态未知"}[self.loaded]
+        parts = [state]
+        if self.loaded and self.expires_at:
+            parts.append(f"{self.expires_at} 卸载")
+        if self.size_mb:
+            parts.append(f"{self.size_mb:.0f} MB")
+        if self.last_load_s is not None:
+            parts.append(f"上次加载 {self.last_load_s:.1f}s（{self.last_load_at}）")
+        return f"{name}：" + " · ".join(parts)
+
+
+@dataclass
+class LoadResult:
+    provider: str
+    kind: str
+    model: str
+    seconds: float
+    ok: bool
+    detail: str = ""
+    server: str = ""
+
+
+class ModelResidency:
+    def __init__(self, app_cfg: AppConfig, path: Path = RESIDENCY_DB_PATH) -> None:
+        self.app_cfg = app_cfg
+        self.config = app_cfg.residency
+        self.path = Path(path)
+        self._initialised = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # 云端 provider 用不到状态库，首次使用时才创建
+        conn = connect_sqlite(self.path)
+        if not self._initialised:
+            conn.executescript(_SCHEMA)
+            self._initialised = True
+        return conn
+
+    @property
+    def provider(self) -> str:
+        return self.app_cfg.provider
+
+    @property
+    def local(self) -> bool:
+        return self.provider in LOCAL_PROVIDERS
+
+    @property
+    def server(self) -> str:
+        if self.provider == "ollama":
+            return _ollama_base(self.app_cfg.ollama.base_url)
+        return self.app_cfg.lmstudio.base_url.rstrip("/")
+
+    def targets(self) -> List[Tuple[str, str]]:
+        """当前 provider 需要常驻的 (类型, 模型名)；云端 provider 为空。"""
+        if self.provider == "ollama":
+            graph_config = build_graph_config(self.app_cfg)
+            targets = [(CHAT, self.app_cfg.ollama.model.split("/", 1)[-1])]
+            embedding = (graph_config.get("embeddings") or {}).get("model", "")
+            if embedding:
+                targets.append((EMBEDDING, embedding.split("/", 1)[-1]))
+            return targets
+        if self.provider == "lmstudio":
+            return [(CHAT, self.app_cfg.lmstudio.model)]
+        return []
+
+    # ---- 预加载 ----
+
+    def _load(self, kind: str, model: str) -> str:
+        import httpx
+
+        keep_alive = self.config.keep_alive_s
+        if self.provider == "ollama":
+            if kind == EMBEDDING:
+                resp = httpx.post(
+                    f"{self.server}/api/embed",
+                    json={"model": model, "input": "", "keep_alive": keep_alive},
+                    timeout=LOAD_TIMEOUT,
+                )
+            else:
+                # 不带 prompt 的 generate 请求只加载模型
+                resp = httpx.post(
+                    f"{self.server}/api/generate",
+                    json={"model": model, "keep_alive": keep_alive},
+                    timeout=LOAD_TIMEOUT,
+                )
+            resp.raise_for_status()
+            return "常驻" if keep_alive < 0 else f"空闲 {keep_alive}s 后卸载"
+        body: Dict[str, Any] = {"model": model, "messages": [{"role": "user", "content": "ping"}], "max_tokens": 1}
+        if keep_alive > 0:
+            # LM Studio 对 JIT 加载的模型按 ttl 计时，空闲超过 ttl 秒后卸载，之后的请求会重新计时
+            body["ttl"] = keep_alive
+        resp = httpx.post(
+            f"{self.server}/chat/completions",
+            headers={"Authorization": f"Bearer {self.app_cfg.lmstudio.api_key or 'lm-studio'}"},
+            json=body,
+            timeout=LOAD_TIMEOUT,
+        )
+        resp.raise_for_status()
+        return f"空闲 {keep_alive}s 后卸载" if keep_alive > 0 else "按 LM Studio 的设置卸载"
+
+    def preload(self) -> List[LoadResult]:
+        """加载当前 provider 的各个模型；已加载的模型只会刷新常驻时长，耗时很短。"""
+        results = []
+        for kind, model in self.targets():
+            started = time.perf_counter()
+            try:
+                detail, ok = self._load(kind, model), True
+            except Exception as e:
+                detail, ok = f"{type(e).__name__}: {(str(e).splitlines() or [''])[0]}", False
+            result = LoadResult(self.provider, kind, model, time.perf_counter() - started, ok, detail, self.server)
+            results.append(result)
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO loads (ts, provider, model, seconds, ok, detail) VALUES (?, ?, ?, ?, ?, ?)",
+                    (time.time(), self.provider, model, result.seconds, 1 if ok else 0, detail),
+                )
+        return results
+
+    # ---- 状态 ----
+
+    def _loaded_models(self) -> Dict[str, Dict[str, Any]]:
+        """{模型名: 服务返回的信息}，只包含已加载的模型。"""
+        import httpx
+
+        if self.provider == "ollama":
+            resp = httpx.get(f"{self.server}/api/ps", timeout=STATUS_TIMEOUT)
+            resp.raise_for_status()
+            loaded = {}
+            for m in resp.json().get("models") or []:
+                for name in (m.get("name"), m.get("model")):
+                    if name:
+                        loaded[name] = m
+                        # 未写标签时 Ollama 默认使用 latest
+                        loaded.setdefault(name.split(":latest", 1)[0], m)
+            return loaded
+        # LM Studio 原生接口返回所有已下载模型及其 state
+        base = self.server.rsplit("/v1", 1)[0] if self.server.endswith("/v1") else self.server
+        resp = httpx.get(f"{base}/api/v0/models", timeout=STATUS_TIMEOUT)
+        resp.raise_for_status()
+        return {m["id"]: m for m in resp.json().get("data") or [] if m.get("state") == "loaded"}
+
+    def _last_load(self, model: str) -> Optional[sqlite3.Row]:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT ts, seconds FROM loads WHERE provider = ? AND model = ? AND ok = 1 ORDER BY id DESC LIMIT 1",
+                (self.provider, model),
+            ).fetchone()
+
+    def status(self) -> List[ModelState]:
+        states = [ModelState(self.provider, kind, model) for kind, model in self.targets()]
+        if not states:
+            return states
+        try:
+            loaded = self._loaded_models()
+        except Exception as e:
+            loaded = None
+            for state in states:
+                state.error = type(e).__name__
+        for state in states:
+            last = self._last_load(state.model)
+            if last is not None:
+                state.last_load_s = last["seconds"]
+                state.last_load_at = datetime.fromtimestamp(last["ts"]).strftime("%H:%M:%S")
+            if loaded is None:
+                continue
+            info = loaded.get(state.model) or loaded.get(state.model.split(":latest", 1)[0])
+            state.loaded = info is not None
+            if info:
+                state.size_mb = float(info.get("size_vram") or info.get("size") or 0) / 1e6
+                expires = str(info.get("expires_at") or "")
+                if expires:
+                    try:
+                        state.expires_at = datetime.fromisoformat(expires.replace("Z", "+00:00")).astimezone().strftime(
+                            "%H:%M"
+                        )
+                    except ValueError:
+                        pass
+        return states
+
+    # ---- 避免来回换模型 ----
+
+    def _cleanup(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute("SELECT id, pid, started_at FROM active").fetchall()
+        now = time.time()
+        stale = [r["id"] for r in rows if now - r["started_at"] > ACTIVE_MAX_AGE_SECONDS or not pid_alive(r["pid"])]
+        if stale:
+            conn.execute("DELETE FROM active WHERE id IN (%s)" % ",".join("?" * len(stale)), stale)
+
+    @contextmanager
+    def _hold(self, model: str, server: str) -> Iterator[float]:
+        """登记对 model 的使用；同一服务上有其他模型在用时先等待，返回等待的秒数。"""
+        started = time.monotonic()
+        slot_id = None
+        while slot_id is None:
+            conn = self._connect()
+            try:
+                # 检查与登记在同一个写事务中完成，两个进程不会同时判定“没有其他模型在用”
+                conn.execute("BEGIN IMMEDIATE")
+                self._cleanup(conn)
+                other = conn.execute(
+                    "SELECT 1 FROM active WHERE server = ? AND model != ? LIMIT 1", (server, model)
+                ).fetchone()
+                if other is None or time.monotonic() - started >= self.config.max_swap_wait_s:
+                    slot_id = conn.execute(
+                        "INSERT INTO active (server, model, pid, started_at) VALUES (?, ?, ?, ?)",
+                        (server, model, os.getpid(), time.time()),
+                    ).lastrowid
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+            if slot_id is None:
+                time.sleep(GATE_POLL_SECONDS)
+        try:
+            yield time.monotonic() - started
+        finally:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM active WHERE id = ?", (slot_id,))
+
+    def gate(self, server: Optional[str] = None):
+        """
+        server 为多端点时本次请求实际使用的服务地址（见 endpoints.py），默认为配置中的 base_url。
+        云端 provider 不需要协调，返回空的上下文管理器。
+        """
+        targets = self.targets()
+        if not self.local or not targets:
+            return nullcontext(0.0)
+        if server:
+            server = _ollama_base(server) if self.provider == "ollama" else server.rstrip("/")
+        # 对话模型与向量模型在同一次抽取中一起使用，按对话模型登记
+        return self._hold(targets[0][1], server or self.server)
+
+
+def preload_for_batch(app_cfg: AppConfig, provider: Optional[str] = None, reporter: Any = None) -> List[LoadResult]:
+    """
+    批量任务开始前按配置预加载本地模型；provider 为空或 auto 时使用配置文件中的 provider。
+    云端 provider 或关闭了 preload_before_batch 时不做任何事。
+    """
+    if provider and provider in LOCAL_PROVIDERS and provider != app_cfg.provider:
+        app_cfg = copy.deepcopy(app_cfg)
+        app_cfg.provider = provider  # type: ignore[assignment]
+    if not app_cfg.residency.preload_before_batch or app_cfg.provider not in LOCAL_PROVIDERS:
+        return []
+    # 配置了多个端点时每台服务都预加载，负载均衡会优先选择已加载模型的端点
+    endpoints = EndpointPool(app_cfg).endpoints()
+    results = []
+    for endpoint in endpoints:
+        results.extend(ModelResidency(endpoint.apply(app_cfg)).preload())
+    if reporter is not None:
+        for r in results:
+            name = f"{r.model} @ {r.server}" if len(endpoints) > 1 else r.model
+            if r.ok:
+                reporter("info", f"🔥 已预加载 {name}（{r.seconds:.1f}s，{r.detail}）")
+            else:
+                reporter("warning", f"⚠️ 预加载 {name} 失败：{r.detail}")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地模型常驻状态与预加载")
+    parser.add_argument("--preload", action="store_true", help="按当前配置预加载模型")
+    parser.add_argument("--provider", choices=LOCAL_PROVIDERS, help="默认使用配置文件中的 provider")
+    args = parser.parse_args()
+
+    app_cfg = AppConfig.load()
+    if args.provider:
+        app_cfg.provider = args.provider  # type: ignore[assignment]
+    residency = ModelResidency(app_cfg)
+    if not residency.local:
+        print(f"{app_cfg.provider} 为云端模型，无需预加载")
+        return
+    if args.preload:
+        for r in residency.preload():
+            mark = "✓" if r.ok else "✗"
+            print(f"{mark} {r.model:<32} {r.seconds:6.2f}s  {r.detail}")
+    for state in residency.status():
+        print(state.summary())
+
+
+if __name__ == "__main__":
+    main()
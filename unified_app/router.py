@@ -0,0 +1,414 @@
+"""
+按任务自动选择 provider 与模型。
+
+抓取请求的 provider 为 "auto" 时，在 routing.candidates 中为每个任务挑选一个：
+
+- 估算输入 token：已获取页面时按去掉标签后的文本长度估算，否则取该域名历次实际输入 token 的中位数
+- Schema 复杂度：字段数、对象数组与嵌套层数，决定预估的输出长度，并抬高小模型的失败先验
+- 实测吞吐：最近成功运行的（输入 + 输出）token / 秒，以及当前正在该 provider 上运行的任务数（排队深度）
+- 成本预算：付费 provider 按价格估算本次花费，超出当日剩余预算的不参与选择
+- 从结果中学习：按输入规模分档统计失败率（异常或结构化校验未通过），样本越多越以实测为准
+
+每个候选的预计耗时为 开销 + 排队 + token / 吞吐，按失败率放大后再加上 花费 × seconds_per_usd，
+取最小者。运行结果与进行中的任务记录在 SQLite（routing.db）中，多个工作进程共享。
+
+查看各候选的实测吞吐与失败率：python -m unified_app.router
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import os
+import re
+import sqlite3
+import statistics
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from unified_app.config import AppConfig, RoutingConfig
+from unified_app.localstate import connect_sqlite, pid_alive
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+ROUTING_DB_PATH = PROJECT_ROOT / "routing.db"
+
+AUTO = "auto"
+
+# 没有实测数据时的先验：吞吐（token/秒）、固定开销（秒）与失败率
+PRIOR_TPS = {"openai": 1500.0, "ollama": 300.0, "lmstudio": 300.0}
+PRIOR_OVERHEAD_S = {"openai": 2.0, "ollama": 1.0, "lmstudio": 1.0}
+PRIOR_FAILURE = 0.05
+# 先验按多少个样本计入（样本更多时以实测为准）
+PRIOR_WEIGHT = 4
+# 统计吞吐与失败率时使用的最近运行数
+WINDOW = 50
+# 页面大小未知、域名也没有历史时的默认输入 token 数
+DEFAULT_TOKENS_IN = 4_000
+# 按输入 token 分档统计失败率
+SIZE_BUCKETS = (4_000, 16_000, 64_000)
+# 进行中的记录超过该时长视为进程异常退出后的残留
+INFLIGHT_MAX_AGE_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outcomes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    domain TEXT NOT NULL DEFAULT '',
+    tokens_in INTEGER NOT NULL DEFAULT 0,
+    tokens_out INTEGER NOT NULL DEFAULT 0,
+    seconds REAL NOT NULL DEFAULT 0,
+    ok INTEGER NOT NULL,
+    schema_status TEXT NOT NULL DEFAULT '',
+    cost_usd REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_outcomes_candidate ON outcomes(provider, model, id);
+CREATE INDEX IF NOT EXISTS idx_outcomes_domain ON outcomes(domain, id);
+CREATE TABLE IF NOT EXISTS inflight (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    provider TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL
+);
+"""
+
+_STRIP_BLOCKS = re.compile(r"<(script|style|noscript|svg)\b.*?</\1>", re.S | re.I)
+_STRIP_TAGS = re.compile(r"<[^>]+>")
+
+
+def estimate_tokens_from_html(html: str) -> int:
+    """模型看到的是页面文本而不是 HTML；按约 3 个字符一个 token（中英文混合的折中）估算。"""
+    text = _STRIP_TAGS.sub(" ", _STRIP_BLOCKS.sub(" ", html))
+    return max(1, len(" ".join(text.split())) // 3)
+
+
+def schema_complexity(schema: Optional[Dict[str, Any]]) -> int:
+    """字段数 + 2 × 对象数组数 + 嵌套层数；没有 Schema 时为 0。"""
+    if not schema:
+        return 0
+    fields = arrays = 0
+    deepest = 0
+
+    def walk(node: Any, depth: int) -> None:
+        nonlocal fields, arrays, deepest
+        if not isinstance(node, dict):
+            return
+        deepest = max(deepest, depth)
+        for sub in (node.get("properties") or {}).values():
+            fields += 1
+            walk(sub, depth + 1)
+        items = node.get("items")
+        if isinstance(items, dict):
+            if items.get("type") == "object" or "properties" in items:
+                arrays += 1
+            walk(items, depth + 1)
+        for key in ("anyOf", "oneOf", "allOf"):
+            for sub in node.get(key) or []:
+                walk(sub, depth)
+        for sub in (node.get("$defs") or node.get("definitions") or {}).values():
+            walk(sub, depth)
+
+    walk(schema, 0)
+    return fields + 2 * arrays + deepest
+
+
+def _bucket(tokens: int) -> int:
+    return sum(1 for edge in SIZE_BUCKETS if tokens >= edge)
+
+
+@dataclass
+class CandidateScore:
+    provider: str
+    model: str
+    eligible: bool
+    predicted_s: float = 0.0
+    failure_rate: float = 0.0
+    cost_usd: float = 0.0
+    score: float = 0.0
+    tps: float = 0.0
+    queue: int = 0
+    samples: int = 0
+    note: str = ""
+
+
+@dataclass
+class RouteDecision:
+    provider: str
+    model: str
+    tokens_in: int
+    tokens_out: int
+    complexity: int
+    reasons: List[str] = field(default_factory=list)
+    candidates: List[CandidateScore] = field(default_factory=list)
+
+    def apply(self, app_cfg: AppConfig) -> AppConfig:
+        cfg = copy.deepcopy(app_cfg)
+        cfg.provider = self.provider  # type: ignore[assignment]
+        return cfg
+
+    def summary(self) -> str:
+        return f"{self.provider}/{self.model}：" + "；".join(self.reasons)
+
+
+class ModelRouter:
+    def __init__(self, config: Optional[RoutingConfig] = None, path: Path = ROUTING_DB_PATH) -> None:
+        self.config = config or RoutingConfig()
+        self.path = Path(path)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @classmethod
+    def from_config(cls, config: Optional[RoutingConfig] = None, path: Path = ROUTING_DB_PATH) -> "ModelRouter":
+        return cls(config if config is not None else AppConfig.load().routing, path)
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(self.path)
+
+    # ---- 估算 ----
+
+    def estimate_tokens_in(self, url: str, page_html: Optional[str]) -> Tuple[int, str]:
+        if page_html:
+            return estimate_tokens_from_html(page_html), "按已获取页面的文本长度估算"
+        domain = urlparse(url).netloc.lower()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT tokens_in FROM outcomes WHERE domain = ? AND ok = 1 AND tokens_in > 0 "
+                "ORDER BY id DESC LIMIT ?",
+                (domain, WINDOW),
+            ).fetchall()
+        if rows:
+            return int(statistics.median(r["tokens_in"] for r in rows)), f"按 {domain} 最近 {len(rows)} 次的实际输入估算"
+        return DEFAULT_TOKENS_IN, "页面大小未知，按默认值估算"
+
+    @staticmethod
+    def estimate_tokens_out(complexity: int) -> int:
+        return 300 + 120 * complexity
+
+    def cost_usd(self, provider: str, tokens_in: int, tokens_out: int) -> float:
+        price_in, price_out = (list(self.config.prices_per_mtok.get(provider) or []) + [0.0, 0.0])[:2]
+        return (tokens_in * price_in + tokens_out * price_out) / 1e6
+
+    def spent_today(self) -> float:
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        with self._connect() as conn:
+            row = conn.execute("SELECT COALESCE(SUM(cost_usd), 0) AS s FROM outcomes WHERE ts >= ?", (midnight,)).fetchone()
+        return float(row["s"])
+
+    # ---- 学习到的统计 ----
+
+    def _queue_depth(self, conn: sqlite3.Connection, provider: str) -> int:
+        rows = conn.execute("SELECT id, pid, started_at FROM inflight WHERE provider = ?", (provider,)).fetchall()
+        now = time.time()
+        stale = [r["id"] for r in rows if now - r["started_at"] > INFLIGHT_MAX_AGE_SECONDS or not pid_alive(r["pid"])]
+        if stale:
+            conn.execute("DELETE FROM inflight WHERE id IN (%s)" % ",".join("?" * len(stale)), stale)
+        return len(rows) - len(stale)
+
+    def _candidate_stats(
+        self, conn: sqlite3.Connection, provider: str, model: str, bucket: int
+    ) -> Tuple[Optional[float], float, int, int, int]:
+        """返回 (实测吞吐, 平均耗时, 样本数, 该规模档样本数, 该规模档失败数)。"""
+        rows = conn.execute(
+            "SELECT tokens_in, tokens_out, seconds, ok, schema_status FROM outcomes "
+            "WHERE provider = ? AND model = ? ORDER BY id DESC LIMIT ?",
+            (provider, model, WINDOW),
+        ).fetchall()
+        good = [r for r in rows if r["ok"] and r["seconds"] > 0]
+        tokens = sum(r["tokens_in"] + r["tokens_out"] for r in good)
+        seconds = sum(r["seconds"] for r in good)
+        tps = tokens / seconds if good and tokens > 0 and seconds > 0 else None
+        avg_s = seconds / len(good) if good else 0.0
+        in_bucket = [r for r in rows if _bucket(r["tokens_in"]) == bucket]
+        failures = sum(1 for r in in_bucket if not r["ok"] or r["schema_status"] == "failed")
+        return tps, avg_s, len(rows), len(in_bucket), failures
+
+    def _prior_failure(self, provider: str, tokens_in: int, complexity: int) -> float:
+        prior = PRIOR_FAILURE
+        if provider in ("ollama", "lmstudio"):
+            # 本地小模型面对长输入和复杂 Schema 时更容易输出不合格的结果
+            limit = max(1, int(self.config.max_input_tokens.get(provider, 8_000)))
+            prior += 0.25 * min(1.0, tokens_in / limit) + 0.02 * min(complexity, 15)
+        return min(prior, 0.9)
+
+    # ---- 决策 ----
+
+    def decide(
+        self,
+        app_cfg: AppConfig,
+        url: str,
+        page_html: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> RouteDecision:
+        tokens_in, size_reason = self.estimate_tokens_in(url, page_html)
+        complexity = schema_complexity(schema)
+        tokens_out = self.estimate_tokens_out(complexity)
+        budget_left = self.config.daily_budget_usd - self.spent_today()
+        bucket = _bucket(tokens_in)
+
+        scores: List[CandidateScore] = []
+        with self._connect() as conn:
+            for provider in dict.fromkeys(self.config.candidates):
+                section = getattr(app_cfg, provider, None)
+                model = getattr(section, "model", "") if section is not None else ""
+                cand = CandidateScore(provider=provider, model=model, eligible=True)
+                scores.append(cand)
+                if section is None or not model:
+                    cand.eligible, cand.note = False, "未配置"
+                    continue
+                if provider == "openai" and not app_cfg.openai.api_key:
+                    cand.eligible, cand.note = False, "未填写 API Key"
+                    continue
+                limit = int(self.config.max_input_tokens.get(provider, 0) or 0)
+                if limit and tokens_in > limit:
+                    cand.eligible, cand.note = False, f"输入约 {tokens_in} token，超过上限 {limit}"
+                cand.cost_usd = self.cost_usd(provider, tokens_in, tokens_out)
+                if cand.cost_usd > 0 and cand.cost_usd > budget_left:
+                    cand.eligible, cand.note = False, f"今日预算剩余 ${max(0.0, budget_left):.2f}"
+
+                tps, avg_s, samples, bucket_n, bucket_fail = self._candidate_stats(conn, provider, model, bucket)
+                cand.samples = samples
+                cand.queue = self._queue_depth(conn, provider)
+                prior_tps = PRIOR_TPS.get(provider, 300.0)
+                cand.tps = tps if tps is not None else prior_tps
+                overhead = PRIOR_OVERHEAD_S.get(provider, 1.0)
+                # 本地服务一次处理一个请求，排队的任务需要等前面的跑完
+                queue_wait = cand.queue * (avg_s or (overhead + (tokens_in + tokens_out) / cand.tps))
+                cand.predicted_s = overhead + queue_wait + (tokens_in + tokens_out) / cand.tps
+                prior = self._prior_failure(provider, tokens_in, complexity)
+                cand.failure_rate = (bucket_fail + prior * PRIOR_WEIGHT) / (bucket_n + PRIOR_WEIGHT)
+                # 失败后需要重跑：预计耗时按成功率放大
+                cand.score = cand.predicted_s / (1 - min(cand.failure_rate, 0.9)) + cand.cost_usd * self.config.seconds_per_usd
+
+        eligible = [c for c in scores if c.eligible]
+        reasons = [f"输入约 {tokens_in} token（{size_reason}）", f"Schema 复杂度 {complexity}"]
+        if eligible:
+            best = min(eligible, key=lambda c: c.score)
+            reasons.append(
+                f"预计 {best.predicted_s:.1f}s（吞吐 {best.tps:.0f} token/s"
+                f"{'，实测' if best.samples else '，先验'}，排队 {best.queue}），"
+                f"失败率 {best.failure_rate:.0%}，花费 ${best.cost_usd:.4f}"
+            )
+            others = [c for c in eligible if c is not best]
+            if others:
+                runner_up = min(others, key=lambda c: c.score)
+                reasons.append(f"优于 {runner_up.provider}（评分 {best.score:.1f} < {runner_up.score:.1f}）")
+        else:
+            # 都不满足约束时退回上下文最长的已配置候选
+            configured = [c for c in scores if c.note not in ("未配置", "未填写 API Key")] or scores
+            best = max(configured, key=lambda c: int(self.config.max_input_tokens.get(c.provider, 0) or 0))
+            reasons.append("没有满足上下文与预算约束的候选，选择上下文最长的 provider")
+        for cand in scores:
+            if not cand.eligible and cand.note:
+                reasons.append(f"排除 {cand.provider}：{cand.note}")
+        return RouteDecision(
+            provider=best.provider,
+            model=best.model,
+            tokens_in=tokens_in,
+            tokens_out=tokens_out,
+            complexity=complexity,
+            reasons=reasons,
+            candidates=scores,
+        )
+
+    # ---- 记录 ----
+
+    @contextmanager
+    def running(self, provider: str) -> Iterator[None]:
+        """在该 provider 上运行期间计入排队深度。"""
+        with self._connect() as conn:
+            slot_id = conn.execute(
+                "INSERT INTO inflight (provider, pid, started_at) VALUES (?, ?, ?)",
+                (provider, os.getpid(), time.time()),
+            ).lastrowid
+        try:
+            yield
+        finally:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM inflight WHERE id = ?", (slot_id,))
+
+    def record(
+        self,
+        provider: str,
+        model: str,
+        url: str,
+        tokens_in: int,
+        tokens_out: int,
+        seconds: float,
+        ok: bool,
+        schema_status: str = "",
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO outcomes (ts, provider, model, domain, tokens_in, tokens_out, seconds, ok, "
+                "schema_status, cost_usd) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(),
+                    provider,
+                    model,
+                    urlparse(url).netloc.lower(),
+                    int(tokens_in),
+                    int(tokens_out),
+                    float(seconds),
+                    1 if ok else 0,
+                    schema_status,
+                    self.cost_usd(provider, tokens_in, tokens_out),
+                ),
+            )
+
+    def candidate_stats(self) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT provider, model, COUNT(*) AS runs, SUM(ok) AS ok, "
+                "SUM(CASE WHEN schema_status = 'failed' THEN 1 ELSE 0 END) AS schema_failed, "
+                "SUM(tokens_in + tokens_out) AS tokens, SUM(CASE WHEN ok = 1 THEN seconds ELSE 0 END) AS seconds, "
+                "SUM(cost_usd) AS cost FROM outcomes GROUP BY provider, model ORDER BY runs DESC"
+            ).fetchall()
+            out = []
+            for r in rows:
+                out.append({
+                    "provider": r["provider"],
+                    "model": r["model"],
+                    "runs": r["runs"],
+                    "failures": r["runs"] - (r["ok"] or 0) + (r["schema_failed"] or 0),
+                    "tokens_per_s": (r["tokens"] or 0) / r["seconds"] if r["seconds"] else 0.0,
+                    "cost_usd": r["cost"] or 0.0,
+                    "in_flight": self._queue_depth(conn, r["provider"]),
+                })
+        return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="模型路由：各候选的实测吞吐、失败率与花费")
+    parser.add_argument("--db", default=str(ROUTING_DB_PATH))
+    parser.add_argument("--explain", metavar="URL", help="按当前配置演示一次路由决策（不获取页面）")
+    args = parser.parse_args()
+
+    app_cfg = AppConfig.load()
+    router = ModelRouter(app_cfg.routing, Path(args.db))
+    if args.explain:
+        decision = router.decide(app_cfg, args.explain)
+        print(f"选择 {decision.provider}/{decision.model}")
+        for reason in decision.reasons:
+            print(f"  - {reason}")
+        return
+
+    rows = router.candidate_stats()
+    if not rows:
+        print("暂无记录")
+    for r in rows:
+        print(
+            f"{r['provider']:<10} {r['model']:<28} 运行 {r['runs']:>4}  失败 {r['failures']:>3}  "
+            f"{r['tokens_per_s']:7.0f} token/s  进行中 {r['in_flight']}  花费 ${r['cost_usd']:.4f}"
+        )
+    print(f"今日花费 ${router.spent_today():.4f} / 预算 ${app_cfg.routing.daily_budget_usd:.2f}")
+
+
+if __name__ == "__main__":
+    main()
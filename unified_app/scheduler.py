@@ -0,0 +1,452 @@
+"""
+周期性抓取调度器。
+
+调度定义保存在项目根目录的 unified_schedules.json（与 unified_config.json 并列），
+到点后把每个 URL 作为一个后台任务提交到任务队列（见 jobs.py），不依赖 Streamlit 页面。
+
+- cron 表达式：分 时 日 月 周，支持 *、*/n、a-b、a-b/n 和逗号列表，以及 @hourly / @daily 等简写
+- 抖动：每个调度按 id 得到一个固定的启动偏移，同一调度内的 URL 在 spread_seconds 内错开提交
+- 不重叠：同一调度上一轮仍有未完成任务时，本轮跳过
+- 补跑：停机期间错过的触发点在恢复后合并补跑一次（catch_up=False 时直接跳过）
+
+用法：
+    python -m unified_app.scheduler add --name news --cron "*/15 * * * *" \\
+        --urls-file urls.txt --prompt "提取标题和发布时间" --provider lmstudio
+    python -m unified_app.scheduler list
+    python -m unified_app.scheduler run
+    python -m unified_app.scheduler report
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass, asdict, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from unified_app.jobs import JOBS_DB_PATH, DEFAULT_PROCESSES, JobStore, ensure_pool
+from unified_app.localstate import connect_sqlite
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SCHEDULES_PATH = PROJECT_ROOT / "unified_schedules.json"
+
+TICK_SECONDS = 15
+# 触发点之后超过该秒数才被处理，视为停机错过的触发（需要补跑）
+MISSED_GRACE_SECONDS = 120
+
+_CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+# (最小值, 最大值)：分、时、日、月、周（0 和 7 都表示周日）
+_CRON_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+_RUNS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedule_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    schedule_id TEXT NOT NULL,
+    scheduled_for TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    state TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    note TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_schedule_runs ON schedule_runs(schedule_id, id);
+"""
+
+
+def _parse_cron_field(text: str, lo: int, hi: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f"cron 步长必须为正数：{text}")
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            start = int(part)
+            # 形如 5/10 表示从 5 开始每 10 个单位一次
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end:
+            raise ValueError(f"cron 字段超出范围：{text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+@dataclass
+class CronExpr:
+    minutes: Set[int]
+    hours: Set[int]
+    days: Set[int]
+    months: Set[int]
+    weekdays: Set[int]
+    # 与标准 cron 一致：日和周都被限定时，二者满足其一即可
+    day_any: bool
+    weekday_any: bool
+
+    @classmethod
+    def parse(cls, expr: str) -> "CronExpr":
+        expr = _CRON_ALIASES.get(expr.strip(), expr.strip())
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 表达式需要 5 个字段：{expr}")
+        parsed = [_parse_cron_field(f, lo, hi) for f, (lo, hi) in zip(fields, _CRON_RANGES)]
+        parsed[4] = {0 if d == 7 else d for d in parsed[4]}
+        return cls(*parsed, day_any=fields[2] == "*", weekday_any=fields[4] == "*")
+
+    def _day_matches(self, dt: datetime) -> bool:
+        weekday = (dt.weekday() + 1) % 7
+        if self.day_any or self.weekday_any:
+            return dt.day in self.days and weekday in self.weekdays
+        return dt.day in self.days or weekday in self.weekdays
+
+    def next_after(self, dt: datetime) -> datetime:
+        """返回严格晚于 dt 的下一个触发时间（精确到分钟）。"""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+                continue
+            if t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+                continue
+            return t
+        raise ValueError("cron 表达式在 5 年内没有可用的触发时间")
+
+
+@dataclass
+class Schedule:
+    id: str
+    name: str
+    cron: str
+    urls: List[str]
+    prompt: str
+    schema: Optional[Dict[str, Any]] = None
+    provider: Optional[str] = None
+    # 该调度相对触发点的最大启动偏移（按 id 固定取值，不同调度彼此错开）
+    jitter_seconds: int = 60
+    # 同一轮内各 URL 的提交在该时间窗口内均匀错开
+    spread_seconds: int = 0
+    catch_up: bool = True
+    enabled: bool = True
+    # 其它 ScrapeRequest 字段，例如 wait_for_load、need_login
+    options: Dict[str, Any] = field(default_factory=dict)
+    created_at: str = ""
+
+    def offset_seconds(self) -> int:
+        if self.jitter_seconds <= 0:
+            return 0
+        digest = hashlib.sha256(self.id.encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big") % (self.jitter_seconds + 1)
+
+    def build_requests(self) -> List[Dict[str, Any]]:
+        """生成提交给任务队列的请求，未指定的字段由 ScrapeRequest 的默认值补齐。"""
+        return [
+            {
+                **self.options,
+                "url": url,
+                "prompt": self.prompt,
+                "schema": self.schema,
+                "provider": self.provider,
+            }
+            for url in self.urls
+        ]
+
+
+def load_schedules(path: Path = SCHEDULES_PATH) -> List[Schedule]:
+    if not path.exists():
+        return []
+    try:
+        raw = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return []
+    schedules = []
+    for item in raw.get("schedules", []):
+        try:
+            known = {k: v for k, v in item.items() if k in Schedule.__dataclass_fields__}
+            schedules.append(Schedule(**known))
+        except Exception:
+            continue
+    return schedules
+
+
+def save_schedules(schedules: List[Schedule], path: Path = SCHEDULES_PATH) -> None:
+    data = {"schedules": [asdict(s) for s in schedules]}
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+class Scheduler:
+    def __init__(
+        self,
+        schedules_path: Path = SCHEDULES_PATH,
+        db_path: Path = JOBS_DB_PATH,
+        processes: int = DEFAULT_PROCESSES,
+    ) -> None:
+        self.schedules_path = schedules_path
+        self.db_path = db_path
+        self.processes = processes
+        self.jobs = JobStore(db_path)
+        with self._connect() as conn:
+            conn.executescript(_RUNS_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(self.db_path)
+
+    def _last_scheduled_for(self, schedule_id: str) -> Optional[datetime]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT scheduled_for FROM schedule_runs WHERE schedule_id = ? "
+                "ORDER BY id DESC LIMIT 1",
+                (schedule_id,),
+            ).fetchone()
+        return datetime.fromisoformat(row["scheduled_for"]) if row else None
+
+    def _record_run(
+        self, schedule_id: str, scheduled_for: datetime, state: str, total: int = 0, note: str = ""
+    ) -> int:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO schedule_runs (schedule_id, scheduled_for, created_at, state, total, note) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (schedule_id, scheduled_for.isoformat(), time.time(), state, total, note),
+            )
+            return int(cur.lastrowid)
+
+    def due_slot(self, schedule: Schedule, now: datetime) -> Optional[tuple[datetime, bool]]:
+        """
+        返回 (本次要处理的触发点, 是否为停机错过的补跑)。
+        多个错过的触发点合并为最近的一个，避免恢复后连续重复执行。
+        """
+        cron = CronExpr.parse(schedule.cron)
+        offset = timedelta(seconds=schedule.offset_seconds())
+        last = self._last_scheduled_for(schedule.id)
+        if last is None:
+            last = (
+                datetime.fromisoformat(schedule.created_at)
+                if schedule.created_at
+                else now - offset - timedelta(minutes=1)
+            )
+        slot = cron.next_after(last)
+        if slot + offset > now:
+            return None
+
+        latest = slot
+        while True:
+            following = cron.next_after(latest)
+            if following + offset > now:
+                break
+            latest = following
+        missed = latest != slot or (now - (latest + offset)).total_seconds() > MISSED_GRACE_SECONDS
+        return latest, missed
+
+    def tick(self, now: Optional[datetime] = None) -> List[str]:
+        now = now or datetime.now()
+        events: List[str] = []
+        for schedule in load_schedules(self.schedules_path):
+            if not schedule.enabled or not schedule.urls:
+                continue
+            try:
+                due = self.due_slot(schedule, now)
+            except ValueError as e:
+                events.append(f"[{schedule.name}] cron 无效：{e}")
+                continue
+            if due is None:
+                continue
+            slot, missed = due
+
+            if missed and not schedule.catch_up:
+                self._record_run(schedule.id, slot, "skipped", note="停机期间错过，未开启补跑")
+                events.append(f"[{schedule.name}] 跳过错过的触发点 {slot}")
+                continue
+            active = self.jobs.active_for_schedule(schedule.id)
+            if active:
+                self._record_run(schedule.id, slot, "skipped", note=f"上一轮仍有 {active} 个任务未完成")
+                events.append(f"[{schedule.name}] 上一轮尚未结束，跳过 {slot}")
+                continue
+
+            requests = schedule.build_requests()
+            run_id = self._record_run(
+                schedule.id, slot, "catch_up" if missed else "started", total=len(requests)
+            )
+            start = time.time()
+            step = schedule.spread_seconds / len(requests) if schedule.spread_seconds else 0
+            for i, req in enumerate(requests):
+                self.jobs.submit(
+                    req,
+                    schedule_id=schedule.id,
+                    run_id=run_id,
+                    not_before=start + i * step if step else None,
+                )
+            events.append(
+                f"[{schedule.name}] {'补跑' if missed else '触发'} {slot}，已提交 {len(requests)} 个任务"
+            )
+        if events:
+            ensure_pool(self.processes, self.db_path)
+        return events
+
+    def run_forever(self, tick_seconds: int = TICK_SECONDS) -> None:
+        print(f"调度器已启动，调度文件：{self.schedules_path}")
+        while True:
+            for event in self.tick():
+                print(f"{datetime.now().isoformat(timespec='seconds')} {event}")
+            time.sleep(tick_seconds)
+
+    def report(self, schedule_id: str, last_runs: int = 10) -> List[Dict[str, Any]]:
+        """每轮的耗时与吞吐：耗时从第一个任务开始到最后一个任务结束。"""
+        with self._connect() as conn:
+            runs = conn.execute(
+                "SELECT * FROM schedule_runs WHERE schedule_id = ? ORDER BY id DESC LIMIT ?",
+                (schedule_id, last_runs),
+            ).fetchall()
+            report = []
+            for run in runs:
+                stats = conn.execute(
+                    "SELECT "
+                    " SUM(state = 'done') AS done, SUM(state = 'failed') AS failed, "
+                    " SUM(state IN ('queued', 'running')) AS active, "
+                    " MIN(started_at) AS first_start, MAX(finished_at) AS last_finish "
+                    "FROM jobs WHERE run_id = ?",
+                    (run["id"],),
+                ).fetchone()
+                duration = None
+                if stats["first_start"] and stats["last_finish"] and not stats["active"]:
+                    duration = (
+                        datetime.fromisoformat(stats["last_finish"])
+                        - datetime.fromisoformat(stats["first_start"])
+                    ).total_seconds()
+                done = stats["done"] or 0
+                report.append(
+                    {
+                        "scheduled_for": run["scheduled_for"],
+                        "state": run["state"],
+                        "note": run["note"],
+                        "total": run["total"],
+                        "done": done,
+                        "failed": stats["failed"] or 0,
+                        "active": stats["active"] or 0,
+                        "duration_s": duration,
+                        "pages_per_min": round(done / duration * 60, 2) if duration else None,
+                    }
+                )
+        return report
+
+
+def _cmd_add(args: argparse.Namespace) -> None:
+    CronExpr.parse(args.cron)
+    urls = list(args.url or [])
+    if args.urls_file:
+        lines = Path(args.urls_file).read_text(encoding="utf-8").splitlines()
+        urls.extend(line.strip() for line in lines if line.strip() and not line.startswith("#"))
+    schema = json.loads(Path(args.schema_file).read_text(encoding="utf-8")) if args.schema_file else None
+
+    schedules = load_schedules(args.schedules)
+    schedule = Schedule(
+        id=uuid.uuid4().hex[:12],
+        name=args.name,
+        cron=args.cron,
+        urls=urls,
+        prompt=args.prompt,
+        schema=schema,
+        provider=args.provider,
+        jitter_seconds=args.jitter,
+        spread_seconds=args.spread,
+        catch_up=not args.no_catch_up,
+        created_at=datetime.now().isoformat(timespec="seconds"),
+    )
+    schedules.append(schedule)
+    save_schedules(schedules, args.schedules)
+    print(f"已添加调度 {schedule.id}（{schedule.name}），共 {len(urls)} 个 URL")
+
+
+def _cmd_list(args: argparse.Namespace) -> None:
+    now = datetime.now()
+    for s in load_schedules(args.schedules):
+        nxt = CronExpr.parse(s.cron).next_after(now) + timedelta(seconds=s.offset_seconds())
+        status = "启用" if s.enabled else "停用"
+        print(f"{s.id}  {s.name}  [{s.cron}]  {len(s.urls)} 个 URL  {status}  下次：{nxt}")
+
+
+def _cmd_remove(args: argparse.Namespace) -> None:
+    schedules = load_schedules(args.schedules)
+    kept = [s for s in schedules if s.id != args.id]
+    save_schedules(kept, args.schedules)
+    print("已删除" if len(kept) < len(schedules) else "未找到该调度")
+
+
+def _cmd_report(args: argparse.Namespace) -> None:
+    scheduler = Scheduler(args.schedules, args.db)
+    for s in load_schedules(args.schedules):
+        if args.id and s.id != args.id:
+            continue
+        print(f"== {s.name} ({s.id}) ==")
+        for r in scheduler.report(s.id, args.last):
+            duration = f"{r['duration_s']:.0f}s" if r["duration_s"] is not None else "-"
+            throughput = f"{r['pages_per_min']}/min" if r["pages_per_min"] is not None else "-"
+            print(
+                f"  {r['scheduled_for']}  {r['state']:<9} 完成 {r['done']}/{r['total']}"
+                f"  失败 {r['failed']}  耗时 {duration}  吞吐 {throughput}  {r['note']}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="统一抓取应用的周期性调度器")
+    parser.add_argument("--schedules", type=Path, default=SCHEDULES_PATH)
+    parser.add_argument("--db", type=Path, default=JOBS_DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    add = sub.add_parser("add", help="添加调度")
+    add.add_argument("--name", required=True)
+    add.add_argument("--cron", required=True, help='例如 "*/15 * * * *"')
+    add.add_argument("--url", action="append", help="可重复指定")
+    add.add_argument("--urls-file", help="每行一个 URL")
+    add.add_argument("--prompt", required=True)
+    add.add_argument("--schema-file")
+    add.add_argument("--provider", choices=["openai", "ollama", "lmstudio"])
+    add.add_argument("--jitter", type=int, default=60)
+    add.add_argument("--spread", type=int, default=0)
+    add.add_argument("--no-catch-up", action="store_true")
+    add.set_defaults(func=_cmd_add)
+
+    sub.add_parser("list", help="列出调度").set_defaults(func=_cmd_list)
+
+    remove = sub.add_parser("remove", help="删除调度")
+    remove.add_argument("id")
+    remove.set_defaults(func=_cmd_remove)
+
+    report = sub.add_parser("report", help="查看每轮耗时与吞吐")
+    report.add_argument("id", nargs="?")
+    report.add_argument("--last", type=int, default=10)
+    report.set_defaults(func=_cmd_report)
+
+    run = sub.add_parser("run", help="启动调度器（常驻）")
+    run.add_argument("--processes", type=int, default=DEFAULT_PROCESSES)
+    run.set_defaults(func=lambda a: Scheduler(a.schedules, a.db, a.processes).run_forever())
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
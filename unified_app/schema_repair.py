@@ -0,0 +1,413 @@
+"""
+结构化输出的本地校验与修复。
+
+开启 JSON Schema 时，小模型经常返回“差一点”符合要求的结果：JSON 后面跟着解释文字、
+键没有加引号、数字写成字符串、漏掉必填字段等。与其整次重跑（又一次完整的模型调用），
+先在本地按以下顺序修复：
+
+1. 解析：去掉 ``` 代码块标记与前后多余文字，修正未加引号的键、单引号、尾随逗号、Python 字面量
+2. 解包：SmartScraperGraph 有时把结果包在 {"content": ...} 中，Schema 里没有 content 字段时取出内层
+3. 按 Schema 转换类型："1,299" → 1299、"true" → true、单个对象 → 数组等
+4. 缺失的必填字段补为 null；必填字段缺失与显式返回 null 同样视为“值缺失”，不计入类型错误
+
+修复后仍不符合 Schema 的结果才会触发一次针对性的追问：只把上一次的输出、校验错误和 Schema 发给模型，
+不再附带页面内容。校验器按 Schema 内容缓存，同一 Schema 只编译一次。
+"""
+
+from __future__ import annotations
+
+import ast
+import copy
+import hashlib
+import json
+import math
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from unified_app.prompt_cache import CacheReport, build_messages, parse_usage, prefix_key
+
+
+VALID = "valid"
+REPAIRED = "repaired"
+REASKED = "reasked"
+FAILED = "failed"
+
+# 追问时附带的校验错误条数上限
+MAX_REASK_ERRORS = 8
+
+_validators: Dict[str, Any] = {}
+_validators_lock = threading.Lock()
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.S)
+_UNQUOTED_KEY = re.compile(r'([{,]\s*)([A-Za-z_一-鿿][\w一-鿿-]*)\s*:')
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_NUMBER_NOISE = re.compile(r"[\s,_¥$€£￥%]|(?:元|円)$")
+_TRUE_WORDS = {"true", "yes", "y", "1", "是", "有"}
+_FALSE_WORDS = {"false", "no", "n", "0", "否", "无", "没有"}
+
+Path = Tuple[Any, ...]
+
+
+@dataclass
+class SchemaCheck:
+    status: str
+    value: Any
+    # 实际做过的修复，例如 "parse:trailing_text"、"coerce:$.price"
+    repairs: List[str] = field(default_factory=list)
+    # 仍未通过的校验错误（status 为 failed 时非空）
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.status != FAILED
+
+
+def _schema_key(schema: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(schema, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def compiled_validator(schema: Dict[str, Any]) -> Any:
+    """按 Schema 内容缓存的校验器；Schema 本身不合法时抛出 ValueError。"""
+    key = _schema_key(schema)
+    with _validators_lock:
+        validator = _validators.get(key)
+        if validator is None:
+            from jsonschema import exceptions, validators
+
+            cls = validators.validator_for(schema)
+            try:
+                cls.check_schema(schema)
+            except exceptions.SchemaError as e:
+                raise ValueError(f"JSON Schema 不合法：{e.message}") from e
+            validator = cls(schema)
+            _validators[key] = validator
+        return validator
+
+
+def _format_path(path: Path) -> str:
+    return "$" + "".join(f"[{p}]" if isinstance(p, int) else f".{p}" for p in path)
+
+
+def validation_errors(schema: Dict[str, Any], value: Any, filled: Optional[Set[Path]] = None) -> List[str]:
+    """
+    返回校验错误；filled 中的路径是值为 null 的必填字段（修复时补上的或模型显式返回的），
+    它们的类型错误不计入（值确实缺失，用 null 表示比让模型编造更好）。
+    """
+    errors = []
+    for error in compiled_validator(schema).iter_errors(value):
+        path = tuple(error.absolute_path)
+        if filled and error.validator == "type" and error.instance is None and path in filled:
+            continue
+        errors.append(f"{_format_path(path)}: {error.message}")
+    return errors
+
+
+# ---- 1. 解析 ----
+
+def _raw_decode_from(text: str) -> Optional[Tuple[Any, bool]]:
+    """从第一个 { 或 [ 开始解析，返回 (值, 后面是否还有多余文字)。"""
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    start = min(starts)
+    try:
+        value, end = json.JSONDecoder().raw_decode(text, start)
+    except json.JSONDecodeError:
+        return None
+    return value, bool(text[:start].strip() or text[end:].strip())
+
+
+def _lenient_fix(text: str) -> str:
+    text = _UNQUOTED_KEY.sub(r'\1"\2":', text)
+    text = _TRAILING_COMMA.sub(r"\1", text)
+    text = re.sub(r"\bTrue\b", "true", text)
+    text = re.sub(r"\bFalse\b", "false", text)
+    return re.sub(r"\bNone\b", "null", text)
+
+
+def parse_json_text(text: str) -> Tuple[Any, List[str]]:
+    """把模型返回的文本解析为 JSON 值；无法解析时抛出 ValueError。"""
+    repairs: List[str] = []
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+        repairs.append("parse:code_fence")
+    try:
+        return json.loads(text), repairs
+    except json.JSONDecodeError:
+        pass
+
+    decoded = _raw_decode_from(text)
+    if decoded is not None:
+        value, trailing = decoded
+        if trailing:
+            repairs.append("parse:trailing_text")
+        return value, repairs
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if starts:
+        body = text[min(starts):max(text.rfind("}"), text.rfind("]")) + 1]
+        decoded = _raw_decode_from(_lenient_fix(body))
+        if decoded is not None:
+            repairs.append("parse:lenient")
+            return decoded[0], repairs
+        try:
+            # Python 字典写法（单引号、True/None）
+            value = ast.literal_eval(body)
+            if isinstance(value, (dict, list)):
+                repairs.append("parse:python_literal")
+                return value, repairs
+        except (ValueError, SyntaxError):
+            pass
+    raise ValueError("无法从模型输出中解析出 JSON")
+
+
+# ---- 3/4. 按 Schema 转换类型、补全必填字段 ----
+
+def _resolve(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    ref = schema.get("$ref") if isinstance(schema, dict) else None
+    if not isinstance(ref, str) or not ref.startswith("#/"):
+        return schema if isinstance(schema, dict) else {}
+    node: Any = root
+    for part in ref[2:].split("/"):
+        node = node.get(part, {}) if isinstance(node, dict) else {}
+    return node if isinstance(node, dict) else {}
+
+
+def _types(schema: Dict[str, Any]) -> List[str]:
+    t = schema.get("type")
+    if isinstance(t, list):
+        return t
+    return [t] if isinstance(t, str) else []
+
+
+def _matches(value: Any, type_name: str) -> bool:
+    if type_name == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if type_name == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return {
+        "string": isinstance(value, str),
+        "boolean": isinstance(value, bool),
+        "object": isinstance(value, dict),
+        "array": isinstance(value, list),
+        "null": value is None,
+    }.get(type_name, True)
+
+
+_MISSING = object()
+
+
+def _convert(value: Any, type_name: str) -> Any:
+    """把 value 转成 type_name，无法转换时返回 _MISSING。"""
+    if type_name in ("integer", "number"):
+        if isinstance(value, str):
+            cleaned = _NUMBER_NOISE.sub("", value)
+            try:
+                number = float(cleaned)
+            except ValueError:
+                return _MISSING
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            number = float(value)
+        else:
+            return _MISSING
+        if not math.isfinite(number):
+            return _MISSING
+        if type_name == "integer":
+            return int(number) if number.is_integer() else _MISSING
+        # "1,299" 这样的整数写法保留为整数
+        integral = number.is_integer() and (isinstance(value, int) or not re.search(r"[.eE]", str(value)))
+        return int(number) if integral else number
+    if type_name == "boolean" and isinstance(value, (str, int)):
+        word = str(value).strip().lower()
+        if word in _TRUE_WORDS:
+            return True
+        if word in _FALSE_WORDS:
+            return False
+        return _MISSING
+    if type_name == "string" and isinstance(value, (int, float, bool)):
+        return json.dumps(value) if isinstance(value, bool) else str(value)
+    if type_name == "array" and value is not None:
+        return [value]
+    return _MISSING
+
+
+def coerce(
+    value: Any,
+    schema: Dict[str, Any],
+    root: Dict[str, Any],
+    path: Path,
+    repairs: List[str],
+    filled: Set[Path],
+) -> Any:
+    schema = _resolve(schema, root)
+    types = _types(schema)
+    if types and not any(_matches(value, t) for t in types):
+        for t in types:
+            converted = _convert(value, t)
+            if converted is not _MISSING:
+                repairs.append(f"coerce:{_format_path(path)}")
+                value = converted
+                break
+
+    if isinstance(value, dict):
+        props = schema.get("properties") or {}
+        for key, sub in props.items():
+            if key in value:
+                value[key] = coerce(value[key], sub, root, path + (key,), repairs, filled)
+        for key in schema.get("required") or []:
+            if key not in value:
+                value[key] = None
+                repairs.append(f"fill_null:{_format_path(path + (key,))}")
+            if value[key] is None:
+                filled.add(path + (key,))
+    elif isinstance(value, list) and isinstance(schema.get("items"), dict):
+        for i, item in enumerate(value):
+            value[i] = coerce(item, schema["items"], root, path + (i,), repairs, filled)
+    return value
+
+
+def _unwrap_content(value: Any, schema: Dict[str, Any], repairs: List[str]) -> Any:
+    if (
+        isinstance(value, dict)
+        and set(value) == {"content"}
+        and "content" not in (schema.get("properties") or {})
+    ):
+        inner = value["content"]
+        if isinstance(inner, str):
+            try:
+                inner, parse_repairs = parse_json_text(inner)
+                repairs.extend(parse_repairs)
+            except ValueError:
+                return value
+        repairs.append("unwrap:content")
+        return inner
+    return value
+
+
+def check_and_repair(result: Any, schema: Dict[str, Any]) -> SchemaCheck:
+    """校验抽取结果，不符合时在本地修复；不会调用模型。"""
+    repairs: List[str] = []
+    value = result
+    if isinstance(value, str):
+        try:
+            value, parse_repairs = parse_json_text(value)
+            repairs.extend(parse_repairs)
+        except ValueError as e:
+            return SchemaCheck(status=FAILED, value=result, errors=[str(e)])
+
+    if not repairs and not validation_errors(schema, value):
+        return SchemaCheck(status=VALID, value=value)
+
+    value = _unwrap_content(copy.deepcopy(value), schema, repairs)
+    filled: Set[Path] = set()
+    value = coerce(value, schema, schema, (), repairs, filled)
+    errors = validation_errors(schema, value, filled)
+    if errors:
+        return SchemaCheck(status=FAILED, value=value, repairs=repairs, errors=errors)
+    if not repairs:
+        # 只有必填字段显式为 null，没有做任何修改
+        return SchemaCheck(status=VALID, value=value)
+    return SchemaCheck(status=REPAIRED, value=value, repairs=repairs)
+
+
+# ---- 追问 ----
+
+def _reask_messages(schema: Dict[str, Any], previous: Any, errors: List[str]) -> List[Dict[str, str]]:
+    previous_text = previous if isinstance(previous, str) else json.dumps(previous, ensure_ascii=False, default=str)
+    # Schema 放在静态的 system 消息中，同一 Schema 的多次追问可以复用模型服务的前缀缓存
+    return build_messages(
+        "You fix JSON so that it validates against a JSON Schema. "
+        "Reply with the corrected JSON only. Keep every value from the input; "
+        "use null for required values that are missing instead of inventing them.",
+        "",
+        schema,
+        f"Previous output:\n{previous_text[:20_000]}\n\n"
+        "Validation errors:\n" + "\n".join(errors[:MAX_REASK_ERRORS]),
+    )
+
+
+def chat_json(
+    graph_config: Dict[str, Any],
+    messages: List[Dict[str, str]],
+    schema: Optional[Dict[str, Any]] = None,
+    cache_report: Optional[CacheReport] = None,
+) -> Tuple[str, int, int]:
+    """
+    直接调用 build_graph_config 中配置的模型，要求输出 JSON，返回 (文本, 输入 token, 输出 token)。
+    配置中注入了录制/回放 transport 时同样经过它。传入 cache_report 时累计前缀缓存命中与预填充耗时。
+    """
+    llm = graph_config.get("llm") or {}
+    key = prefix_key(messages)
+    if llm.get("model_provider") == "ollama":
+        base = str(llm.get("base_url") or "http://localhost:11434").rstrip("/")
+        base = base.rsplit("/v1", 1)[0] if base.endswith("/v1") else base
+        transport = (llm.get("sync_client_kwargs") or {}).get("transport")
+        with httpx.Client(transport=transport, timeout=300) as client:
+            resp = client.post(
+                f"{base}/api/chat",
+                json={
+                    "model": str(llm.get("model", "")).split("/", 1)[-1],
+                    "messages": messages,
+                    "stream": False,
+                    # Ollama 支持直接用 JSON Schema 约束输出
+                    "format": schema or "json",
+                    "options": {"temperature": 0},
+                    # 与抽取请求一致，避免这次请求把模型的常驻时长重置为服务端默认值
+                    **({"keep_alive": llm["keep_alive"]} if "keep_alive" in llm else {}),
+                },
+            )
+            resp.raise_for_status()
+            data = resp.json()
+        content = data["message"]["content"]
+    else:
+        base = str(llm.get("base_url") or "https://api.openai.com/v1").rstrip("/")
+        model = str(llm.get("model", ""))
+        model = model.split("/", 1)[1] if model.startswith("openai/") else model
+        payload: Dict[str, Any] = {"model": model, "messages": messages, "temperature": 0}
+        if "api.openai.com" in base:
+            # 前缀相同的请求带上相同的 key，OpenAI 会尽量把它们路由到同一份缓存
+            payload["prompt_cache_key"] = key
+        # 配置中注入的 http_client 由调用方管理；临时创建的客户端用完即关闭，否则每次调用都会残留连接池与套接字
+        owned = llm.get("http_client") is None
+        client = llm.get("http_client") or httpx.Client(timeout=300)
+        try:
+            resp = client.post(
+                f"{base}/chat/completions",
+                headers={"Authorization": f"Bearer {llm.get('api_key') or 'none'}"},
+                json=payload,
+                timeout=300,
+            )
+            resp.raise_for_status()
+            data = resp.json()
+        finally:
+            if owned:
+                client.close()
+        content = data["choices"][0]["message"]["content"]
+
+    usage = parse_usage(data)
+    if cache_report is not None:
+        cache_report.add(key, usage)
+    return content, usage.prompt_tokens, usage.completion_tokens
+
+
+def reask(
+    graph_config: Dict[str, Any],
+    schema: Dict[str, Any],
+    failed: SchemaCheck,
+    recorder: Any = None,
+) -> SchemaCheck:
+    """本地修复失败后追问一次；追问结果同样经过本地修复。"""
+    content, tokens_in, tokens_out = chat_json(graph_config, _reask_messages(schema, failed.value, failed.errors), schema)
+    if recorder is not None:
+        recorder.metrics.tokens_in += tokens_in
+        recorder.metrics.tokens_out += tokens_out
+    check = check_and_repair(content, schema)
+    repairs = failed.repairs + ["reask"] + check.repairs
+    if not check.ok:
+        return SchemaCheck(status=FAILED, value=failed.value, repairs=repairs, errors=check.errors)
+    return SchemaCheck(status=REASKED, value=check.value, repairs=repairs)
@@ -0,0 +1,557 @@
+"""
+抓取服务（HTTP API），与 Streamlit 界面并行运行，供其他服务以编程方式调用。
+
+与界面共用 AppConfig（每个任务开始时读取 unified_config.json）、Playwright 抓取与历史记录，
+抓取在有界的线程池中执行：同时运行 workers 个，最多再排队 queue 个，超出时直接返回 429，
+调用方按 Retry-After 重试，而不是让请求无限堆积。
+
+接口（请求体为 ScrapeRequest 的字段，至少包含 url 与 prompt）：
+    POST   /v1/jobs                 提交任务，返回 202 与任务 ID
+    GET    /v1/jobs                 最近的任务
+    GET    /v1/jobs/{id}            任务状态与进度
+    GET    /v1/jobs/{id}/result     任务结果（未完成时返回 202）
+    GET    /v1/jobs/{id}/events     以 NDJSON 流式返回进度事件，直到任务结束
+    DELETE /v1/jobs/{id}            取消尚未开始的任务
+    POST   /v1/extract?timeout=60   同步抽取，超时返回 504（任务继续在后台运行，可按 ID 查询）
+    POST   /v1/extract?stream=1     同步抽取，以 NDJSON 流式返回进度与最终结果
+    GET    /v1/stats                并发、排队与拒绝次数，以及进行中相同请求的合并情况
+    GET    /healthz
+
+设置环境变量 SCRAPER_API_TOKEN 后，所有 /v1 接口需要 Authorization: Bearer <token>。
+请求体中的 sinks 只能是 results/ 下的相对路径（如 "sqlite:api.db"），绝对路径、~ 与 .. 返回 400。
+
+启动：
+    python -m unified_app.service --port 8765 --workers 2 --queue 8
+    python -m unified_app.service --mock-llm      # 使用本地仿真模型服务，不访问真实模型
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+from unified_app.coalesce import COALESCER
+from unified_app.config import AppConfig
+from unified_app.jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING
+from unified_app.sinks import confine_target
+
+
+ENV_TOKEN = "SCRAPER_API_TOKEN"
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE = 8
+SYNC_TIMEOUT_S = 120.0
+MAX_TIMEOUT_S = 900.0
+# 流式响应在没有新事件时发送心跳的间隔，避免被代理当作空闲连接断开
+HEARTBEAT_S = 15.0
+# 内存中保留的已结束任务数
+KEEP_FINISHED = 500
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+Runner = Callable[..., Any]
+
+_dumps = partial(json.dumps, ensure_ascii=False, default=str)
+
+
+def _now_iso() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class Saturated(RuntimeError):
+    """运行与排队的任务已满。"""
+
+
+@dataclass
+class ServiceJob:
+    id: str
+    request: Dict[str, Any]
+    state: str = QUEUED
+    created_at: str = field(default_factory=_now_iso)
+    started_at: str = ""
+    finished_at: str = ""
+    progress: float = 0.0
+    message: str = ""
+    result: Any = None
+    error: str = ""
+    # 任务的附加信息：provider、是否跳过、运行指标、结构化校验结果
+    info: Dict[str, Any] = field(default_factory=dict)
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    future: Optional[Future] = field(default=None, repr=False)
+    # 每次有新事件时替换，等待中的流式响应被唤醒
+    changed: Optional[asyncio.Event] = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "url": self.request.get("url", ""),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+        }
+
+    def result_body(self) -> Dict[str, Any]:
+        return {**self.status(), "result": self.result, **self.info}
+
+
+@dataclass
+class ServiceStats:
+    workers: int
+    queue_size: int
+    running: int = 0
+    queued: int = 0
+    accepted: int = 0
+    rejected: int = 0
+    completed: int = 0
+    failed: int = 0
+    total_run_s: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "running": self.running,
+            "queued": self.queued,
+            "capacity_left": max(0, self.workers + self.queue_size - self.running - self.queued),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_run_s": round(self.total_run_s / finished, 3) if finished else 0.0,
+        }
+
+
+def _default_runner(app_cfg: AppConfig, request: Any, reporter: Any, progress: Any) -> Any:
+    from unified_app.pipeline import run_scrape
+
+    return run_scrape(app_cfg, request, reporter=reporter, progress=progress)
+
+
+class ScrapeService:
+    """任务表与有界线程池；HTTP 层见 create_app。"""
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        queue_size: int = DEFAULT_QUEUE,
+        config_loader: Callable[[], AppConfig] = AppConfig.load,
+        runner: Runner = _default_runner,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.config_loader = config_loader
+        self.runner = runner
+        self.stats = ServiceStats(workers=self.workers, queue_size=self.queue_size)
+        self.jobs: "OrderedDict[str, ServiceJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scrape")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # ---- 事件 ----
+
+    def _notify(self, job: ServiceJob) -> None:
+        """在事件循环线程中执行：唤醒所有等待该任务新事件的流式响应。"""
+        old, job.changed = job.changed, asyncio.Event()
+        if old is not None:
+            old.set()
+
+    def _publish(self, job: ServiceJob, event: Dict[str, Any]) -> None:
+        with self._lock:
+            job.events.append({"ts": round(time.time(), 3), **event})
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._notify, job)
+
+    # ---- 提交与执行 ----
+
+    def submit(self, request: Dict[str, Any]) -> ServiceJob:
+        with self._lock:
+            if self.stats.running + self.stats.queued >= self.workers + self.queue_size:
+                self.stats.rejected += 1
+                raise Saturated(f"已有 {self.stats.running} 个任务运行、{self.stats.queued} 个排队")
+            job = ServiceJob(id=uuid.uuid4().hex[:12], request=request, changed=asyncio.Event())
+            self.jobs[job.id] = job
+            self.stats.queued += 1
+            self.stats.accepted += 1
+            self._prune()
+        job.future = self._pool.submit(self._execute, job)
+        return job
+
+    def _prune(self) -> None:
+        finished = [jid for jid, j in self.jobs.items() if j.finished]
+        for jid in finished[: max(0, len(finished) - KEEP_FINISHED)]:
+            del self.jobs[jid]
+
+    def get(self, job_id: str) -> Optional[ServiceJob]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def recent(self, limit: int = 50) -> List[ServiceJob]:
+        with self._lock:
+            return list(reversed(self.jobs.values()))[:limit]
+
+    def cancel(self, job_id: str) -> Optional[bool]:
+        """返回 None 表示任务不存在，False 表示已开始运行无法取消。"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            if job.state != QUEUED or job.future is None or not job.future.cancel():
+                return job.state == CANCELLED
+            job.state = CANCELLED
+            job.finished_at = _now_iso()
+            self.stats.queued -= 1
+        self._publish(job, {"type": "cancelled"})
+        return True
+
+    def _execute(self, job: ServiceJob) -> None:
+        from unified_app.pipeline import ScrapeRequest
+
+        with self._lock:
+            job.state = RUNNING
+            job.started_at = _now_iso()
+            self.stats.queued -= 1
+            self.stats.running += 1
+        self._publish(job, {"type": "started"})
+        started = time.perf_counter()
+
+        def reporter(level: str, message: str) -> None:
+            job.message = message
+            self._publish(job, {"type": "log", "level": level, "message": message})
+
+        def progress(fraction: float, message: str) -> None:
+            job.progress = round(fraction, 3)
+            job.message = message
+            self._publish(job, {"type": "progress", "progress": job.progress, "message": message})
+
+        try:
+            outcome = self.runner(self.config_loader(), ScrapeRequest.from_dict(job.request), reporter, progress)
+            job.result = outcome.result
+            job.info = {
+                "provider": outcome.provider,
+                "skipped": outcome.skipped,
+                "metrics": outcome.metrics.to_dict() if outcome.metrics is not None else None,
+                "schema_status": outcome.schema_check.status if outcome.schema_check is not None else None,
+                "route": outcome.route.reasons if outcome.route is not None else None,
+                # 与相同的进行中请求合并时，结果来自另一个任务的那次运行（见 coalesce.py）
+                "coalesced": outcome.coalesced,
+            }
+            state = DONE
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            state = FAILED
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            job.state = state
+            job.finished_at = _now_iso()
+            job.progress = 1.0 if state == DONE else job.progress
+            self.stats.running -= 1
+            self.stats.total_run_s += elapsed
+            if state == DONE:
+                self.stats.completed += 1
+            else:
+                self.stats.failed += 1
+        self._publish(job, {"type": state, "error": job.error} if job.error else {"type": state})
+
+    async def wait(self, job: ServiceJob, timeout: Optional[float]) -> bool:
+        """等待任务结束，超时返回 False（任务不会被中断）。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not job.finished:
+            changed = job.changed
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return job.finished
+        return True
+
+
+# ---- HTTP 层 ----
+
+SERVICE_KEY = web.AppKey("service", ScrapeService)
+
+
+def _json(data: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    return web.json_response(data, status=status, headers=headers, dumps=_dumps)
+
+
+def _error(status: int, message: str, **extra: Any) -> web.Response:
+    headers = {"Retry-After": "5"} if status == 429 else None
+    return _json({"error": message, **extra}, status=status, headers=headers)
+
+
+@web.middleware
+async def _auth_middleware(request: web.Request, handler: Callable) -> web.StreamResponse:
+    token = os.environ.get(ENV_TOKEN, "")
+    if token and request.path.startswith("/v1/"):
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied, token):
+            return _error(401, "缺少或错误的 API token")
+    return await handler(request)
+
+
+async def _read_scrape_request(request: web.Request) -> Dict[str, Any]:
+    """校验请求体，返回可直接交给 ScrapeRequest.from_dict 的字典；不合法时抛出 HTTPBadRequest。"""
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text=_dumps({"error": "请求体必须是 JSON"}), content_type="application/json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=_dumps({"error": "请求体必须是 JSON 对象"}), content_type="application/json")
+    url = str(body.get("url") or "")
+    if not url.startswith(("http://", "https://")) or not body.get("prompt"):
+        raise web.HTTPBadRequest(
+            text=_dumps({"error": "需要 url（http/https）与 prompt"}), content_type="application/json"
+        )
+    if body.get("manual_login"):
+        raise web.HTTPBadRequest(
+            text=_dumps({"error": "服务模式下无法手动登录，请先在界面中保存登录状态"}),
+            content_type="application/json",
+        )
+    sinks = body.get("sinks") or []
+    if not isinstance(sinks, list) or not all(isinstance(spec, str) for spec in sinks):
+        raise web.HTTPBadRequest(
+            text=_dumps({"error": "sinks 必须是字符串列表"}), content_type="application/json"
+        )
+    for spec in sinks:
+        # 客户端只能写入 results/ 下的文件，不能借结果存储覆盖服务器上的任意路径
+        try:
+            confine_target(spec)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=_dumps({"error": str(e)}), content_type="application/json")
+    # 服务端没有可见的浏览器窗口
+    return {**body, "headless": True, "manual_login": False}
+
+
+def _job_or_404(request: web.Request) -> ServiceJob:
+    job = request.app[SERVICE_KEY].get(request.match_info["job_id"])
+    if job is None:
+        raise web.HTTPNotFound(text=_dumps({"error": "任务不存在"}), content_type="application/json")
+    return job
+
+
+def _submit(service: ScrapeService, body: Dict[str, Any]) -> ServiceJob:
+    try:
+        return service.submit(body)
+    except Saturated as e:
+        raise web.HTTPTooManyRequests(
+            text=_dumps({"error": f"服务繁忙：{e}", "stats": service.stats.to_dict()}),
+            content_type="application/json",
+            headers={"Retry-After": "5"},
+        )
+
+
+async def _stream_events(request: web.Request, job: ServiceJob, final_result: bool) -> web.StreamResponse:
+    """以 NDJSON 输出任务事件，直到任务结束；final_result 为真时最后一行附带结果。"""
+    resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+    await resp.prepare(request)
+    sent = 0
+    while True:
+        pending = job.events[sent:]
+        for event in pending:
+            await resp.write((_dumps({"id": job.id, **event}) + "\n").encode("utf-8"))
+        sent += len(pending)
+        if job.finished and sent >= len(job.events):
+            break
+        changed = job.changed
+        try:
+            await asyncio.wait_for(changed.wait(), HEARTBEAT_S)
+        except asyncio.TimeoutError:
+            await resp.write((_dumps({"id": job.id, "type": "heartbeat"}) + "\n").encode("utf-8"))
+    if final_result:
+        await resp.write((_dumps({"type": "result", **job.result_body()}) + "\n").encode("utf-8"))
+    await resp.write_eof()
+    return resp
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return _json({"ok": True})
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    stats = COALESCER.stats
+    coalescing = {
+        "leaders": stats.leaders,
+        "coalesced": stats.coalesced,
+        "abandoned": stats.abandoned,
+        "in_flight": COALESCER.snapshot(),
+    }
+    return _json({**request.app[SERVICE_KEY].stats.to_dict(), "coalescing": coalescing})
+
+
+async def handle_submit(request: web.Request) -> web.Response:
+    service = request.app[SERVICE_KEY]
+    job = _submit(service, await _read_scrape_request(request))
+    return _json(
+        {
+            **job.status(),
+            "status_url": f"/v1/jobs/{job.id}",
+            "result_url": f"/v1/jobs/{job.id}/result",
+            "events_url": f"/v1/jobs/{job.id}/events",
+        },
+        status=202,
+    )
+
+
+async def handle_list(request: web.Request) -> web.Response:
+    try:
+        limit = min(200, max(1, int(request.query.get("limit", "50"))))
+    except ValueError:
+        raise web.HTTPBadRequest(text=_dumps({"error": "limit 必须是整数"}), content_type="application/json")
+    return _json([j.status() for j in request.app[SERVICE_KEY].recent(limit)])
+
+
+async def handle_status(request: web.Request) -> web.Response:
+    return _json(_job_or_404(request).status())
+
+
+def _result_response(job: ServiceJob) -> web.Response:
+    if not job.finished:
+        return _json(job.status(), status=202)
+    if job.state == FAILED:
+        return _json(job.result_body(), status=500)
+    if job.state == CANCELLED:
+        return _json(job.status(), status=410)
+    return _json(job.result_body())
+
+
+async def handle_result(request: web.Request) -> web.Response:
+    return _result_response(_job_or_404(request))
+
+
+async def handle_events(request: web.Request) -> web.StreamResponse:
+    return await _stream_events(request, _job_or_404(request), final_result=False)
+
+
+async def handle_cancel(request: web.Request) -> web.Response:
+    job = _job_or_404(request)
+    if not request.app[SERVICE_KEY].cancel(job.id):
+        return _error(409, "任务已开始运行或已结束，无法取消", state=job.state)
+    return _json(job.status())
+
+
+def _timeout_from(request: web.Request, body: Dict[str, Any]) -> float:
+    raw = request.query.get("timeout", body.pop("timeout_s", None))
+    try:
+        timeout = float(raw) if raw is not None else SYNC_TIMEOUT_S
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text=_dumps({"error": "timeout 必须是数字"}), content_type="application/json")
+    return min(MAX_TIMEOUT_S, max(1.0, timeout))
+
+
+async def handle_extract(request: web.Request) -> web.StreamResponse:
+    service = request.app[SERVICE_KEY]
+    body = await _read_scrape_request(request)
+    timeout = _timeout_from(request, body)
+    job = _submit(service, body)
+    if request.query.get("stream", "") in ("1", "true", "yes"):
+        return await _stream_events(request, job, final_result=True)
+    if not await service.wait(job, timeout):
+        return _error(
+            504,
+            f"{timeout:.0f} 秒内未完成，任务仍在后台运行",
+            id=job.id,
+            status_url=f"/v1/jobs/{job.id}",
+            result_url=f"/v1/jobs/{job.id}/result",
+        )
+    return _result_response(job)
+
+
+def create_app(service: ScrapeService) -> web.Application:
+    app = web.Application(middlewares=[_auth_middleware], client_max_size=8 * 1024 * 1024)
+    app[SERVICE_KEY] = service
+
+    async def on_startup(app: web.Application) -> None:
+        service.bind_loop(asyncio.get_running_loop())
+
+    async def on_cleanup(app: web.Application) -> None:
+        service.shutdown()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/v1/stats", handle_stats)
+    app.router.add_post("/v1/jobs", handle_submit)
+    app.router.add_get("/v1/jobs", handle_list)
+    app.router.add_get("/v1/jobs/{job_id}", handle_status)
+    app.router.add_get("/v1/jobs/{job_id}/result", handle_result)
+    app.router.add_get("/v1/jobs/{job_id}/events", handle_events)
+    app.router.add_delete("/v1/jobs/{job_id}", handle_cancel)
+    app.router.add_post("/v1/extract", handle_extract)
+    return app
+
+
+def mock_config_loader(llm_url: str) -> Callable[[], AppConfig]:
+    """把模型请求指向本地仿真服务，其余配置沿用 unified_config.json。"""
+
+    def load() -> AppConfig:
+        cfg = AppConfig.load()
+        cfg.provider = "lmstudio"
+        cfg.lmstudio.base_url = f"{llm_url}/v1"
+        cfg.lmstudio.model = "mock-model"
+        cfg.lmstudio.api_key = "mock"
+        return cfg
+
+    return load
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="抓取服务（HTTP API）")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="同时运行的抓取数")
+    parser.add_argument("--queue", type=int, default=DEFAULT_QUEUE, help="排队上限，超出时返回 429")
+    parser.add_argument("--mock-llm", action="store_true", help="启动本地仿真模型服务并使用它")
+    args = parser.parse_args()
+
+    config_loader: Callable[[], AppConfig] = AppConfig.load
+    llm = None
+    if args.mock_llm:
+        from unified_app.mock_servers import MockLLMServer
+
+        llm = MockLLMServer().start()
+        config_loader = mock_config_loader(llm.url)
+        print(f"仿真模型服务：{llm.url}")
+
+    service = ScrapeService(workers=args.workers, queue_size=args.queue, config_loader=config_loader)
+    try:
+        web.run_app(create_app(service), host=args.host, port=args.port, print=lambda msg: print(msg, flush=True))
+    finally:
+        if llm is not None:
+            llm.stop()
+
+
+if __name__ == "__main__":
+    main()
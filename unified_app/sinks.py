@@ -0,0 +1,491 @@
+"""
+抓取结果的输出存储（sink）：JSONL、SQLite、Parquet。
+
+结果先写入内存缓冲，攒够 flush_rows 条或距上次落盘超过 flush_interval_s 秒时批量写出，
+避免大批量抓取时每条结果都触发一次磁盘写入：
+
+- jsonl：只追加的文本文件，每次落盘一次 write
+- sqlite：每次落盘一个事务（executemany），开启 WAL，读取时不阻塞写入
+- parquet：目标是一个目录（数据集），每次打开写入一个新的 part 文件，每次落盘写出一个 row group；
+  part 文件尾部的元数据在 close() 时写入，未正常关闭的 part 无法读取。
+  pandas.read_parquet / pyarrow.dataset 可以直接读取整个目录
+
+目标用 "类型:路径" 指定，例如 "jsonl:out/results.jsonl"、"sqlite:results.db"，
+也可以只写路径、按扩展名（.jsonl / .db / .sqlite / .parquet）推断类型；相对路径放在 results/ 下。
+Parquet 依赖 pyarrow（可选依赖，未安装时只有 parquet 目标不可用）。
+
+SinkSet 可以在写入前经过 dedupe.RecordMerger 去重合并（配置见 DedupeConfig）：合并更新的记录带相同的
+dedupe_key，sqlite 按 dedupe_key 覆盖旧行，jsonl / parquet 中同一键以最后一行为准。
+
+命令行 `python -m unified_app.sinks out.parquet --rows 100000` 测试各目标的写入吞吐。
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = PROJECT_ROOT / "results"
+
+JSONL = "jsonl"
+SQLITE = "sqlite"
+PARQUET = "parquet"
+KINDS = (JSONL, SQLITE, PARQUET)
+
+DEFAULT_FLUSH_ROWS = 500
+DEFAULT_FLUSH_INTERVAL_S = 5.0
+
+_SUFFIX_KINDS = {
+    ".jsonl": JSONL,
+    ".ndjson": JSONL,
+    ".db": SQLITE,
+    ".sqlite": SQLITE,
+    ".sqlite3": SQLITE,
+    ".parquet": PARQUET,
+}
+
+
+def _now_iso() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+@dataclass
+class SinkStats:
+    target: str
+    rows: int = 0
+    batches: int = 0
+    bytes: int = 0
+    # 只统计实际写出的耗时，不含缓冲
+    write_s: float = 0.0
+    slowest_batch_s: float = 0.0
+
+    @property
+    def rows_per_s(self) -> float:
+        return self.rows / self.write_s if self.write_s > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["rows_per_s"] = self.rows_per_s
+        return data
+
+    def summary(self) -> str:
+        if not self.rows:
+            return f"{self.target}：未写入"
+        return (
+            f"{self.target}：{self.rows} 条 / {self.batches} 批，"
+            f"写入 {self.write_s * 1000:.1f} ms（{self.rows_per_s:,.0f} 条/秒）"
+        )
+
+
+class ResultSink:
+    """带缓冲的结果输出基类，子类实现 _write_batch / _close。线程安全。"""
+
+    kind = ""
+
+    def __init__(
+        self,
+        path: Path,
+        flush_rows: int = DEFAULT_FLUSH_ROWS,
+        flush_interval_s: float = DEFAULT_FLUSH_INTERVAL_S,
+    ) -> None:
+        self.path = Path(path)
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval_s = flush_interval_s
+        self.stats = SinkStats(target=f"{self.kind}:{self.path}")
+        self._buffer: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.write_many([record])
+
+    def write_many(self, records: Iterable[Dict[str, Any]]) -> None:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.stats.target} 已关闭")
+            self._buffer.extend(records)
+            if (
+                len(self._buffer) >= self.flush_rows
+                or time.monotonic() - self._last_flush >= self.flush_interval_s
+            ):
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        started = time.perf_counter()
+        written = self._write_batch(rows)
+        elapsed = time.perf_counter() - started
+        self.stats.rows += len(rows)
+        self.stats.batches += 1
+        self.stats.bytes += written
+        self.stats.write_s += elapsed
+        self.stats.slowest_batch_s = max(self.stats.slowest_batch_s, elapsed)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self._flush_locked()
+            finally:
+                self._closed = True
+                self._close()
+
+    def _write_batch(self, rows: List[Dict[str, Any]]) -> int:
+        """写出一批记录，返回写出的字节数（无法统计时返回 0）。"""
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        return None
+
+    def __enter__(self) -> "ResultSink":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class JsonlSink(ResultSink):
+    kind = JSONL
+
+    def __init__(self, path: Path, **kwargs: Any) -> None:
+        super().__init__(path, **kwargs)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _write_batch(self, rows: List[Dict[str, Any]]) -> int:
+        text = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in rows)
+        self._file.write(text)
+        self._file.flush()
+        return len(text.encode("utf-8"))
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    written_at TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT '',
+    url TEXT NOT NULL DEFAULT '',
+    record TEXT NOT NULL,
+    dedupe_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_url ON results(url);
+"""
+
+# 旧版本创建的表没有 dedupe_key 列，打开时补上
+_SQLITE_DEDUPE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS idx_results_dedupe_key ON results(dedupe_key)"
+
+
+class SqliteSink(ResultSink):
+    """记录整体以 JSON 存在 record 列，source / url 单独成列便于筛选。"""
+
+    kind = SQLITE
+
+    def __init__(self, path: Path, **kwargs: Any) -> None:
+        super().__init__(path, **kwargs)
+        # 缓冲可能由不同线程落盘（例如爬取的工作线程），由基类的锁保证串行
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        if "dedupe_key" not in columns:
+            self._conn.execute("ALTER TABLE results ADD COLUMN dedupe_key TEXT")
+        self._conn.execute(_SQLITE_DEDUPE_INDEX)
+
+    def _write_batch(self, rows: List[Dict[str, Any]]) -> int:
+        params = [
+            (
+                r.get("written_at") or _now_iso(),
+                str(r.get("source") or ""),
+                str(r.get("url") or ""),
+                json.dumps(r, ensure_ascii=False, default=str),
+                r.get("dedupe_key"),
+            )
+            for r in rows
+        ]
+        with self._conn:
+            # 没有 dedupe_key 的记录（NULL）不会冲突，照常追加；去重合并后的更新覆盖同一键的旧行
+            self._conn.executemany(
+                "INSERT INTO results (written_at, source, url, record, dedupe_key) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(dedupe_key) DO UPDATE SET written_at = excluded.written_at, "
+                "source = excluded.source, url = excluded.url, record = excluded.record",
+                params,
+            )
+        return sum(len(p[3]) for p in params)
+
+    def _close(self) -> None:
+        self._conn.close()
+
+
+_part_counter = itertools.count()
+
+
+def _parquet_value(value: Any) -> Any:
+    # 嵌套结构（模型抽取结果通常是 dict / list）序列化为 JSON 字符串，保证各批的列类型一致
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _coerce(value: Any, arrow_type: Any) -> Any:
+    import pyarrow as pa
+
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        return value if isinstance(value, str) else str(value)
+    try:
+        return pa.scalar(value, type=arrow_type).as_py()
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        return None
+
+
+class ParquetSink(ResultSink):
+    """
+    Parquet 文件写完后不能追加，所以 path 作为数据集目录，每个 ParquetSink 写一个 part 文件。
+    part 内的列由第一批记录确定：之后缺少的列填空值，新出现的键被忽略。
+    """
+
+    kind = PARQUET
+
+    def __init__(self, path: Path, **kwargs: Any) -> None:
+        try:
+            import pyarrow  # noqa: F401
+            import pyarrow.parquet  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError("写入 Parquet 需要 pyarrow：pip install pyarrow") from e
+        super().__init__(path, **kwargs)
+        self.path.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.part_path = self.path / f"part-{stamp}-{os.getpid()}-{next(_part_counter)}.parquet"
+        self._writer: Any = None
+        self._schema: Any = None
+
+    def _write_batch(self, rows: List[Dict[str, Any]]) -> int:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        flat = [{k: _parquet_value(v) for k, v in r.items()} for r in rows]
+        if self._writer is None:
+            table = pa.Table.from_pylist(flat)
+            # 第一批中全为空的列无法推断类型，按字符串处理
+            self._schema = pa.schema(
+                [pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in table.schema]
+            )
+            self._writer = pq.ParquetWriter(str(self.part_path), self._schema, compression="zstd")
+        try:
+            table = pa.Table.from_pylist(flat, schema=self._schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # 同一列前后类型不一致（例如先是整数后是字符串）：字符串列转成字符串，其他列无法转换的值写为空
+            table = pa.Table.from_pylist(
+                [
+                    {name: _coerce(r.get(name), t) for name, t in zip(self._schema.names, self._schema.types)}
+                    for r in flat
+                ],
+                schema=self._schema,
+            )
+        self._writer.write_table(table, row_group_size=len(flat))
+        return table.nbytes
+
+    def _close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+_SINK_CLASSES = {JSONL: JsonlSink, SQLITE: SqliteSink, PARQUET: ParquetSink}
+
+
+def parse_target(spec: str, directory: Path = RESULTS_DIR) -> Tuple[str, Path]:
+    """把 "类型:路径" 或带扩展名的路径解析为 (类型, 绝对路径)。"""
+    spec = spec.strip()
+    kind, sep, rest = spec.partition(":")
+    if sep and kind.lower() in KINDS:
+        kind, raw = kind.lower(), rest
+    else:
+        raw = spec
+        kind = _SUFFIX_KINDS.get(Path(spec).suffix.lower(), "")
+        if not kind:
+            raise ValueError(f"无法识别结果存储类型：{spec}（请使用 jsonl:/sqlite:/parquet: 前缀或对应扩展名）")
+    path = Path(raw).expanduser()
+    if not path.is_absolute():
+        path = directory / path
+    return kind, path
+
+
+def confine_target(spec: str, directory: Path = RESULTS_DIR) -> Tuple[str, Path]:
+    """
+    解析来自不可信来源（如抓取服务的请求体）的目标：路径只能是 directory 下的相对路径，
+    拒绝绝对路径、~ 与 ..，解析符号链接后仍须位于 directory 之内；不合法时抛出 ValueError。
+    """
+    head, sep, rest = spec.strip().partition(":")
+    raw = rest if sep and head.lower() in KINDS else spec.strip()
+    if not raw or raw.startswith("~") or Path(raw).is_absolute() or ".." in Path(raw).parts:
+        raise ValueError(f"结果存储只能使用 {directory.name}/ 下的相对路径：{spec}")
+    kind, path = parse_target(spec, directory)
+    if not path.resolve().is_relative_to(Path(directory).resolve()):
+        raise ValueError(f"结果存储只能使用 {directory.name}/ 下的相对路径：{spec}")
+    return kind, path
+
+
+def open_sink(
+    spec: str,
+    flush_rows: int = DEFAULT_FLUSH_ROWS,
+    flush_interval_s: float = DEFAULT_FLUSH_INTERVAL_S,
+    directory: Path = RESULTS_DIR,
+) -> ResultSink:
+    kind, path = parse_target(spec, directory)
+    return _SINK_CLASSES[kind](path, flush_rows=flush_rows, flush_interval_s=flush_interval_s)
+
+
+class SinkSet:
+    """
+    同时写入多个目标；某个目标落盘失败不影响其他目标，错误记录在 errors 中。
+    传入 dedupe（dedupe.RecordMerger）时记录先去重合并，重复且没有新内容的记录不写出。
+    """
+
+    def __init__(self, sinks: Sequence[ResultSink], dedupe: Any = None) -> None:
+        self.sinks = list(sinks)
+        self.dedupe = dedupe
+        self.errors: List[str] = []
+
+    @classmethod
+    def open(
+        cls,
+        specs: Iterable[str],
+        flush_rows: int = DEFAULT_FLUSH_ROWS,
+        flush_interval_s: float = DEFAULT_FLUSH_INTERVAL_S,
+        directory: Path = RESULTS_DIR,
+        dedupe: Any = None,
+    ) -> "SinkSet":
+        sinks: List[ResultSink] = []
+        try:
+            for spec in dict.fromkeys(s.strip() for s in specs if s and s.strip()):
+                sinks.append(open_sink(spec, flush_rows, flush_interval_s, directory))
+        except Exception:
+            for sink in sinks:
+                sink.close()
+            raise
+        return cls(sinks, dedupe)
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Any = None,
+        specs: Optional[Iterable[str]] = None,
+        dedupe: Any = None,
+    ) -> "SinkSet":
+        """
+        config 为 SinkConfig；specs 为空时使用配置中的 targets。
+        dedupe 为 DedupeConfig，启用时写入前去重合并；config 为空时两者都从配置文件读取。
+        """
+        if config is None:
+            from unified_app.config import AppConfig
+
+            app_cfg = AppConfig.load()
+            config = app_cfg.sinks
+            dedupe = app_cfg.dedupe if dedupe is None else dedupe
+        from unified_app.dedupe import RecordMerger
+
+        return cls.open(
+            config.targets if specs is None else specs,
+            flush_rows=config.flush_rows,
+            flush_interval_s=config.flush_interval_s,
+            dedupe=RecordMerger.from_config(dedupe),
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.sinks)
+
+    def _each(self, action: str, *args: Any) -> None:
+        for sink in self.sinks:
+            try:
+                getattr(sink, action)(*args)
+            except Exception as e:
+                self.errors.append(f"{sink.stats.target}：{type(e).__name__}: {e}")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.write_many([record])
+
+    def write_many(self, records: Iterable[Dict[str, Any]]) -> None:
+        rows = self.dedupe.feed_many(records) if self.dedupe is not None else list(records)
+        if rows:
+            self._each("write_many", rows)
+
+    def flush(self) -> None:
+        self._each("flush")
+
+    def close(self) -> None:
+        self._each("close")
+
+    @property
+    def stats(self) -> List[SinkStats]:
+        return [s.stats for s in self.sinks]
+
+    @property
+    def dedupe_stats(self) -> Any:
+        """未启用去重时为 None，否则为 dedupe.DedupeStats。"""
+        return self.dedupe.stats if self.dedupe is not None else None
+
+    def __enter__(self) -> "SinkSet":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def make_record(source: str, url: str, result: Any, **extra: Any) -> Dict[str, Any]:
+    """各抓取入口统一的记录格式：来源、URL、写入时间、结果，以及入口自己的附加字段。"""
+    return {"written_at": _now_iso(), "source": source, "url": url, **extra, "result": result}
+
+
+def _bench_record(i: int) -> Dict[str, Any]:
+    return make_record(
+        "bench",
+        f"https://example.com/item/{i}",
+        {"title": f"商品 {i}", "price": i * 0.5, "tags": ["a", "b"]},
+        provider="bench",
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="测试结果存储的写入吞吐")
+    parser.add_argument("targets", nargs="+", help="目标，例如 bench.jsonl sqlite:bench.db bench.parquet")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--flush-rows", type=int, default=DEFAULT_FLUSH_ROWS)
+    parser.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL_S)
+    args = parser.parse_args()
+
+    for spec in args.targets:
+        started = time.perf_counter()
+        with open_sink(spec, args.flush_rows, args.flush_interval) as sink:
+            for i in range(args.rows):
+                sink.write(_bench_record(i))
+        wall = time.perf_counter() - started
+        print(f"{sink.stats.summary()}，总耗时 {wall:.2f}s，最慢一批 {sink.stats.slowest_batch_s * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+页面内精简快照：在浏览器中遍历 DOM，只把可见内容传回 Python。
+
+page.content() 会序列化整个 DOM（含脚本、样式、隐藏元素与各种属性），经 CDP 传回后再被截断、复制，
+而模型真正需要的只是可见文本。快照模式下由 SNAPSHOT_JS 在页面内完成遍历：
+
+- 跳过 script/style/template/svg 等与不可见元素（display:none、visibility:hidden、content-visibility；
+  display:contents 的元素本身没有盒子，按其子节点判断）
+- 文本按块级元素分段，保留标题层级与列表项
+- 表格按行列取出单元格文本，表单控件取标签（label / aria-label / placeholder）、类型与名称
+- 链接取文本与绝对地址（爬取模式据此发现新链接）
+- 展开 open 模式的 shadow root（按 slot 的实际分配顺序），同源 iframe 的内容并入当前位置
+
+结果按顺序渲染为精简的 HTML（PageSnapshot.to_html），后续的截断、路由估算、监控指纹、链接解析与
+模型抽取都不需要改动。页面内同时计算完整 HTML 的字节数（不传输），用于对比传输量。
+
+注意：快照不保留原始的 class/id，监控模式中的 CSS 选择器在快照上不起作用。
+
+对比同一页面两种方式的传输量：
+    python -m unified_app.snapshot https://example.com
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import html as html_lib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+
+# 快照中可见文本的总字符数上限，超出后停止遍历（与 pipeline.MAX_HTML_CHARS 相当的量级）
+MAX_SNAPSHOT_CHARS = 200_000
+MAX_TABLE_ROWS = 200
+MAX_LINKS = 2_000
+
+SNAPSHOT_JS = """
+(maxChars) => {
+    const SKIP = new Set(["SCRIPT", "STYLE", "NOSCRIPT", "TEMPLATE", "SVG", "CANVAS", "VIDEO", "AUDIO", "OBJECT", "EMBED", "HEAD", "META", "LINK"]);
+    const BLOCKS = new Set([
+        "P", "DIV", "SECTION", "ARTICLE", "MAIN", "HEADER", "FOOTER", "NAV", "ASIDE", "UL", "OL", "LI",
+        "H1", "H2", "H3", "H4", "H5", "H6", "BLOCKQUOTE", "PRE", "DL", "DT", "DD", "FIGURE", "FIGCAPTION",
+        "DETAILS", "SUMMARY", "FORM", "FIELDSET", "LEGEND", "ADDRESS", "BODY",
+    ]);
+    const KINDS = {H1: "h1", H2: "h2", H3: "h3", H4: "h4", H5: "h5", H6: "h6", LI: "li", DT: "li", DD: "li", PRE: "pre", BLOCKQUOTE: "blockquote"};
+    const FIELDS = new Set(["INPUT", "SELECT", "TEXTAREA", "BUTTON"]);
+    const out = {title: document.title || "", url: location.href, blocks: [], links: [], frames: 0, shadow_roots: 0, truncated: false};
+    const seenLinks = new Set();
+    let buffer = [];
+    let kind = "p";
+    let chars = 0;
+
+    const clean = (text) => (text || "").replace(/\\s+/g, " ").trim();
+    const flush = () => {
+        const text = clean(buffer.join(" "));
+        buffer = [];
+        if (!text) return;
+        out.blocks.push([kind, text]);
+        chars += text.length;
+        if (chars >= maxChars) out.truncated = true;
+    };
+    const visible = (el) => {
+        const style = el.ownerDocument.defaultView.getComputedStyle(el);
+        // display: contents 的元素（slot 默认如此）自身不生成盒子，checkVisibility 会返回 false，
+        // 但子节点照常渲染，交给子节点各自判断
+        if (style.display === "contents") return true;
+        if (el.checkVisibility) return el.checkVisibility({checkVisibilityCSS: true});
+        return style.display !== "none" && style.visibility !== "hidden";
+    };
+    const fieldLabel = (el) => {
+        const labels = el.labels ? Array.from(el.labels).map((l) => clean(l.textContent)).filter(Boolean) : [];
+        return labels[0] || el.getAttribute("aria-label") || el.getAttribute("placeholder") || el.getAttribute("title") || "";
+    };
+    const readTable = (table) => {
+        const rows = [];
+        for (const row of Array.from(table.rows).slice(0, %(max_rows)d)) {
+            rows.push(Array.from(row.cells).map((cell) => clean(cell.innerText)));
+        }
+        for (const a of table.querySelectorAll("a[href]")) addLink(a);
+        const caption = table.caption ? clean(table.caption.innerText) : "";
+        chars += rows.reduce((n, r) => n + r.join("").length, 0);
+        return {caption: caption, rows: rows};
+    };
+    const addLink = (a) => {
+        const href = a.href;
+        if (!href || href.startsWith("javascript:") || seenLinks.has(href) || out.links.length >= %(max_links)d) return;
+        seenLinks.add(href);
+        out.links.push([clean(a.textContent).slice(0, 200), href]);
+    };
+    const children = (node) => {
+        for (let child = node.firstChild; child && !out.truncated; child = child.nextSibling) visit(child);
+    };
+    const visit = (node) => {
+        if (node.nodeType === 3) {
+            if (node.nodeValue.trim()) buffer.push(node.nodeValue);
+            return;
+        }
+        if (node.nodeType !== 1) return;
+        const el = node;
+        const tag = el.tagName.toUpperCase();
+        if (tag === "SLOT" && visible(el)) {
+            // 展开实际分配到 slot 的节点，它们各自判断可见性；没有分配时按普通元素遍历 slot 的默认内容
+            const assigned = el.assignedNodes({flatten: true});
+            if (assigned.length) {
+                for (const n of assigned) visit(n);
+                return;
+            }
+        }
+        if (SKIP.has(tag) || !visible(el)) return;
+        if (tag === "BR") {
+            flush();
+            return;
+        }
+        if (tag === "IFRAME" || tag === "FRAME") {
+            // 跨域 iframe 无法访问 contentDocument，直接跳过
+            let doc = null;
+            try {
+                doc = el.contentDocument;
+            } catch (e) {}
+            if (doc && doc.body) {
+                flush();
+                out.frames += 1;
+                visit(doc.body);
+                flush();
+            }
+            return;
+        }
+        if (tag === "TABLE") {
+            flush();
+            out.blocks.push(["table", readTable(el)]);
+            return;
+        }
+        if (FIELDS.has(tag)) {
+            const type = tag === "INPUT" ? (el.getAttribute("type") || "text").toLowerCase() : tag.toLowerCase();
+            if (type === "hidden") return;
+            flush();
+            const field = {label: clean(fieldLabel(el)), type: type, name: el.getAttribute("name") || ""};
+            if (tag === "BUTTON" || type === "submit" || type === "button") field.label = field.label || clean(el.innerText || el.value);
+            if (tag === "SELECT") field.options = Array.from(el.options).slice(0, 50).map((o) => clean(o.text));
+            out.blocks.push(["field", field]);
+            return;
+        }
+        if (tag === "A" && el.hasAttribute("href")) addLink(el);
+        const block = BLOCKS.has(tag);
+        const previous = kind;
+        if (block) {
+            flush();
+            kind = KINDS[tag] || "p";
+        }
+        if (el.shadowRoot) {
+            // 有 shadow root 时渲染的是 shadow 树，light DOM 中的子节点通过 slot 出现在其中
+            out.shadow_roots += 1;
+            children(el.shadowRoot);
+        } else {
+            children(el);
+        }
+        if (block) {
+            flush();
+            kind = previous;
+        }
+    };
+
+    if (document.body) visit(document.body);
+    flush();
+    // 完整 HTML 在页面内计算大小，不传回 Python
+    out.html_bytes = new Blob([document.documentElement.outerHTML]).size;
+    return out;
+}
+""" % {"max_rows": MAX_TABLE_ROWS, "max_links": MAX_LINKS}
+
+
+def _esc(text: Any) -> str:
+    return html_lib.escape(str(text or ""), quote=True)
+
+
+@dataclass
+class PageSnapshot:
+    title: str = ""
+    url: str = ""
+    # 按页面顺序：[类型, 内容]，类型为 h1~h6 / p / li / pre / blockquote（文本）、table、field
+    blocks: List[List[Any]] = field(default_factory=list)
+    # [链接文本, 绝对地址]
+    links: List[List[str]] = field(default_factory=list)
+    frames: int = 0
+    shadow_roots: int = 0
+    truncated: bool = False
+    # 完整 HTML（page.content() 会传输的内容）与快照实际传输的字节数
+    html_bytes: int = 0
+    transfer_bytes: int = 0
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PageSnapshot":
+        snapshot = cls(**{k: v for k, v in (data or {}).items() if k in cls.__dataclass_fields__})
+        snapshot.transfer_bytes = len(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        return snapshot
+
+    @property
+    def saved_ratio(self) -> float:
+        return 1 - self.transfer_bytes / self.html_bytes if self.html_bytes else 0.0
+
+    def summary(self) -> str:
+        parts = [
+            f"传输 {self.transfer_bytes / 1024:.1f} KB",
+            f"完整 HTML {self.html_bytes / 1024:.1f} KB",
+            f"减少 {self.saved_ratio:.0%}",
+            f"{len(self.blocks)} 段 · {len(self.links)} 个链接",
+        ]
+        if self.frames or self.shadow_roots:
+            parts.append(f"展开 {self.frames} 个 iframe、{self.shadow_roots} 个 shadow root")
+        if self.truncated:
+            parts.append("内容过长已截断")
+        return " · ".join(parts)
+
+    def _render_block(self, kind: str, content: Any) -> str:
+        if kind == "table":
+            caption = f"<caption>{_esc(content.get('caption'))}</caption>" if content.get("caption") else ""
+            rows = "".join(
+                "<tr>" + "".join(f"<td>{_esc(cell)}</td>" for cell in row) + "</tr>" for row in content.get("rows") or []
+            )
+            return f"<table>{caption}{rows}</table>"
+        if kind == "field":
+            attrs = f' type="{_esc(content.get("type"))}"'
+            if content.get("name"):
+                attrs += f' name="{_esc(content["name"])}"'
+            options = "".join(f"<option>{_esc(o)}</option>" for o in content.get("options") or [])
+            control = f"<select{attrs}>{options}</select>" if options else f"<input{attrs}>"
+            return f"<label>{_esc(content.get('label'))} {control}</label>"
+        tag = kind if kind in ("h1", "h2", "h3", "h4", "h5", "h6", "li", "pre", "blockquote") else "p"
+        return f"<{tag}>{_esc(content)}</{tag}>"
+
+    def to_html(self) -> str:
+        """渲染为精简 HTML：只有标题、段落、列表项、表格、表单标签与页面链接，没有属性与脚本。"""
+        body = "\n".join(self._render_block(kind, content) for kind, content in self.blocks)
+        links = "".join(f'<li><a href="{_esc(href)}">{_esc(text)}</a></li>' for text, href in self.links)
+        return (
+            f"<html><head><title>{_esc(self.title)}</title></head><body>\n{body}\n"
+            + (f"<nav><ul>{links}</ul></nav>" if links else "")
+            + "</body></html>"
+        )
+
+
+async def take_snapshot(page: Any, max_chars: int = MAX_SNAPSHOT_CHARS) -> PageSnapshot:
+    """在 Playwright（async API）页面中生成快照。"""
+    return PageSnapshot.from_dict(await page.evaluate(SNAPSHOT_JS, max_chars))
+
+
+async def _compare(url: str, wait_until: str) -> None:
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            page = await browser.new_page()
+            await page.goto(url, wait_until=wait_until, timeout=60_000)
+            full_html = await page.content()
+            snapshot = await take_snapshot(page)
+        finally:
+            await browser.close()
+    compact = snapshot.to_html()
+    full_bytes, compact_bytes = len(full_html.encode("utf-8")), len(compact.encode("utf-8"))
+    print(f"page.content()：{full_bytes / 1024:.1f} KB（约 {len(full_html) // 3} token）")
+    print(f"页面内快照：传输 {snapshot.transfer_bytes / 1024:.1f} KB，渲染后 {compact_bytes / 1024:.1f} KB（约 {len(compact) // 3} token）")
+    print(snapshot.summary())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="对比完整 HTML 与页面内快照的传输量")
+    parser.add_argument("url")
+    parser.add_argument("--wait-until", default="load", choices=["load", "domcontentloaded", "networkidle"])
+    args = parser.parse_args()
+    asyncio.run(_compare(args.url, args.wait_until))
+
+
+if __name__ == "__main__":
+    main()
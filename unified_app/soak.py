@@ -0,0 +1,549 @@
+"""
+长时间运行的资源泄漏测试（soak test）。
+
+启动本地仿真站点与仿真模型服务（见 mock_servers.py），在线程池中连续运行数千次抓取循环，
+按比例注入失败（连接被拒、HTTP 5xx、模型 503、会话中途抛出异常）与超时（慢页面、慢模型），期间定期采样：
+
+- 本进程 RSS、打开的文件描述符数与线程数；进程树 RSS 与子进程数只作参考（Playwright 驱动随会话启停，波动很大）
+- Chromium 进程数（浏览器未关闭时会一直累积）
+- 事件循环延迟：独立线程中的 asyncio 循环按固定间隔休眠，实际醒来时间与预期之差
+
+预热阶段之后，比较稳定阶段开头与结尾的采样中位数，任一指标增长超过阈值、全部循环结束后仍有
+Chromium 或 Playwright 驱动进程残留、事件循环延迟 p95 超过阈值或未注入失败的循环出错比例过高时判定失败，退出码为 1。
+结果（含时间序列）为 JSON，可用于画图或与之前的运行对比。
+
+用法：
+    python -m unified_app.soak --cycles 2000 --concurrency 4 --out soak.json
+    python -m unified_app.soak --scenarios http,llm --cycles 5000 --failure-rate 0.2 --max-rss-growth-mb 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from unified_app.benchmark import _git_commit, _silent, count_fds, process_tree_stats
+from unified_app.mock_servers import FixtureSite, MockLLMServer
+from unified_app.telemetry import percentile
+
+
+SCENARIOS = ["fetch", "github", "redbook", "http", "llm", "extract"]
+# extract 需要 scrapegraphai，默认不运行
+DEFAULT_SCENARIOS = ["fetch", "github", "redbook", "http", "llm"]
+FAULTS = ["error", "timeout"]
+# 注入超时时页面/模型的响应延迟与页面超时（秒）
+SLOW_RESPONSE_S = 3.0
+FAULT_TIMEOUT_S = 1
+# 稳定阶段开头与结尾各取多少个采样的中位数，避免单次 GC 或抖动造成误判
+EDGE_SAMPLES = 3
+
+
+# ---------------------------------------------------------------------------
+# 采样
+# ---------------------------------------------------------------------------
+
+
+class LoopLagProbe:
+    """独立线程中的 asyncio 循环按 interval 休眠，记录每次实际醒来比预期晚了多少毫秒。"""
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self._lags: List[float] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    async def _tick(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._stop.is_set():
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            with self._lock:
+                self._lags.append(max(0.0, loop.time() - expected) * 1000)
+
+    def drain(self) -> List[float]:
+        """取出上次调用以来的全部延迟（毫秒）。"""
+        with self._lock:
+            lags, self._lags = self._lags, []
+        return lags
+
+    def __enter__(self) -> "LoopLagProbe":
+        self._thread = threading.Thread(target=asyncio.run, args=(self._tick(),), daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _self_rss_bytes() -> int:
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+@dataclass
+class SoakSample:
+    elapsed_s: float
+    cycles: int
+    rss_mb: float
+    fds: int
+    threads: int
+    chromium: int
+    # 子进程数（Chromium 与 Playwright 驱动）与包含它们的进程树 RSS
+    children: int
+    tree_rss_mb: float
+    loop_lag_p95_ms: float
+    loop_lag_max_ms: float
+
+
+def take_sample(started: float, cycles: int, probe: LoopLagProbe) -> SoakSample:
+    stats = process_tree_stats()
+    lags = probe.drain()
+    return SoakSample(
+        elapsed_s=round(time.perf_counter() - started, 1),
+        cycles=cycles,
+        rss_mb=round(_self_rss_bytes() / 1024 / 1024, 1),
+        fds=count_fds(),
+        threads=threading.active_count(),
+        chromium=stats["chromium"],
+        children=max(0, stats["processes"] - 1),
+        tree_rss_mb=round(stats["rss_bytes"] / 1024 / 1024, 1),
+        loop_lag_p95_ms=round(percentile(lags, 95), 1),
+        loop_lag_max_ms=round(max(lags), 1) if lags else 0.0,
+    )
+
+
+# ---------------------------------------------------------------------------
+# 场景：func(ctx, i, fault)，fault 为 None 时正常运行，否则为 FAULTS 之一
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class SoakContext:
+    site: FixtureSite
+    # 正常的模型服务、总是返回 503 的模型服务与响应很慢的模型服务
+    llm: MockLLMServer
+    llm_down: MockLLMServer
+    llm_slow: MockLLMServer
+    tmp_dir: Path
+    # 没有服务监听的地址，用于注入连接被拒
+    dead_url: str
+
+
+def _dead_url() -> str:
+    import socket
+
+    # 绑定后立即关闭，拿到一个当前没有服务监听的端口
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def _scenario_fetch(ctx: SoakContext, i: int, fault: Optional[str]) -> Any:
+    from unified_app.fetcher import fetch_html_with_playwright
+
+    url, timeout = f"{ctx.site.url}/js/{i}", 30
+    if fault == "timeout":
+        url, timeout = f"{ctx.site.url}/slow?ms={int(SLOW_RESPONSE_S * 1000)}", FAULT_TIMEOUT_S
+    elif fault == "error":
+        url = f"{ctx.dead_url}/static/{i}"
+    html = asyncio.run(
+        fetch_html_with_playwright(url=url, page_wait_strategy="load", page_timeout=timeout, reporter=_silent)
+    )
+    if not html:
+        raise RuntimeError(f"空页面：{url}")
+    return len(html)
+
+
+def _scenario_github(ctx: SoakContext, i: int, fault: Optional[str]) -> Any:
+    from unified_app.github_repos import fetch_github_repos
+
+    # 仓库页没有慢速版本，超时与错误都用连接被拒代替：覆盖导航失败后的清理路径
+    base_url = ctx.dead_url if fault else ctx.site.url
+    repos = asyncio.run(fetch_github_repos(f"user{i}", base_url=base_url, timeout_sec=FAULT_TIMEOUT_S if fault else 30))
+    if not repos:
+        raise RuntimeError("未解析到仓库")
+    return len(repos)
+
+
+def _scenario_redbook(ctx: SoakContext, i: int, fault: Optional[str]) -> Any:
+    from unified_app.red_book_scrapper import RedBookScrapper
+
+    scrapper = RedBookScrapper(
+        # 所有循环共用一个登录态文件路径（文件并不存在），避免临时目录中的文件随循环数增长
+        storage_path=ctx.tmp_dir / "redbook.json",
+        headless=True,
+        base_url=ctx.dead_url if fault == "error" else ctx.site.url,
+    )
+    with scrapper:
+        if fault == "timeout":
+            # 模拟会话中途出错：调用方抛出异常后，上下文管理器仍要关闭整个浏览器
+            raise TimeoutError("注入的会话超时")
+        posts = scrapper.search_latest(f"关键词{i}", max_results=10)
+    if not posts:
+        raise RuntimeError("未解析到笔记")
+    return len(posts)
+
+
+def _scenario_http(ctx: SoakContext, i: int, fault: Optional[str]) -> Any:
+    from unified_app.crawler import Crawler
+
+    # 与爬取模式的 http 抓取相同的代码路径；注入超时时改用连接被拒（该路径的超时固定为 30 秒）
+    if fault == "error":
+        url = f"{ctx.site.url}/status/500"
+    elif fault == "timeout":
+        url = f"{ctx.dead_url}/static/{i}"
+    else:
+        url = f"{ctx.site.url}/static/{i}"
+    return len(Crawler._http_get(url))
+
+
+def _scenario_llm(ctx: SoakContext, i: int, fault: Optional[str]) -> Any:
+    from unified_app.schema_repair import chat_json
+
+    # chat_json 的请求超时固定为 300 秒，注入超时时模型只是响应很慢，不会抛出异常（计入“注入未生效”）
+    server = {"error": ctx.llm_down, "timeout": ctx.llm_slow}.get(fault, ctx.llm)
+    graph_config = {
+        "llm": {"model_provider": "openai", "model": "openai/mock-model", "api_key": "soak", "base_url": f"{server.url}/v1"}
+    }
+    content, _tokens_in, _tokens_out = chat_json(graph_config, [{"role": "user", "content": f"提取第 {i} 页的标题，输出 JSON"}])
+    return len(content)
+
+
+def _scenario_extract(ctx: SoakContext, i: int, fault: Optional[str]) -> Any:
+    from unified_app.config import AppConfig, LMStudioConfig
+    from unified_app.pipeline import ScrapeRequest, run_scrape
+
+    # 抽取流水线的页面超时不可配置，注入超时时改为慢模型
+    server = {"error": ctx.llm_down, "timeout": ctx.llm_slow}.get(fault, ctx.llm)
+    cfg = AppConfig(
+        provider="lmstudio",
+        lmstudio=LMStudioConfig(base_url=f"{server.url}/v1", model="mock-model", api_key="soak"),
+    )
+    req = ScrapeRequest(
+        url=f"{ctx.site.url}/static/{i}",
+        prompt="提取页面中的商品名称和价格",
+        provider="lmstudio",
+        wait_for_load="load",
+        wait_time=0,
+    )
+    outcome = run_scrape(cfg, req, reporter=_silent, record_history=False)
+    return outcome.result
+
+
+SCENARIO_FUNCS: Dict[str, Callable[[SoakContext, int, Optional[str]], Any]] = {
+    "fetch": _scenario_fetch,
+    "github": _scenario_github,
+    "redbook": _scenario_redbook,
+    "http": _scenario_http,
+    "llm": _scenario_llm,
+    "extract": _scenario_extract,
+}
+
+
+# ---------------------------------------------------------------------------
+# 判定
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class SoakThresholds:
+    # 稳定阶段结尾相对开头的增长上限
+    max_rss_growth_mb: float = 200.0
+    max_fd_growth: int = 32
+    max_thread_growth: int = 8
+    # 全部循环结束后允许残留的子进程数（Chromium 与 Playwright 驱动）
+    max_leftover_processes: int = 0
+    # 任一采样窗口内事件循环延迟 p95 的上限
+    max_loop_lag_ms: float = 250.0
+    # 未注入失败的循环中出错的比例上限
+    max_error_rate: float = 0.02
+
+
+@dataclass
+class ScenarioStats:
+    cycles: int = 0
+    ok: int = 0
+    # 注入失败且按预期抛出异常的循环；注入失败却成功返回的循环计入 fault_not_raised
+    injected: int = 0
+    fault_not_raised: int = 0
+    errors: int = 0
+    error_samples: List[str] = field(default_factory=list)
+    latency_ms: List[float] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["latency_ms"] = {
+            "p50": round(percentile(self.latency_ms, 50), 1),
+            "p95": round(percentile(self.latency_ms, 95), 1),
+            "max": round(max(self.latency_ms), 1) if self.latency_ms else 0.0,
+        }
+        return data
+
+
+def _edge_median(samples: List[SoakSample], attr: str, tail: bool) -> float:
+    edge = samples[-EDGE_SAMPLES:] if tail else samples[:EDGE_SAMPLES]
+    return statistics.median(getattr(s, attr) for s in edge)
+
+
+def _slope_per_1k(samples: List[SoakSample], attr: str) -> float:
+    """指标随循环数的最小二乘斜率（每 1000 次循环的增量），只用于报告趋势。"""
+    xs = [s.cycles for s in samples]
+    ys = [getattr(s, attr) for s in samples]
+    if len(xs) < 2 or max(xs) == min(xs):
+        return 0.0
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    num = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    den = sum((x - mean_x) ** 2 for x in xs)
+    return round(num / den * 1000, 2)
+
+
+def evaluate(
+    samples: List[SoakSample],
+    final: SoakSample,
+    stats: Dict[str, ScenarioStats],
+    warmup_cycles: int,
+    thresholds: SoakThresholds,
+) -> tuple[Dict[str, Any], List[str]]:
+    """返回 (增长与趋势摘要, 超出阈值的说明列表)。"""
+    steady = [s for s in samples if s.cycles >= warmup_cycles] + [final]
+    violations: List[str] = []
+    growth: Dict[str, Any] = {}
+    limits = {
+        "rss_mb": thresholds.max_rss_growth_mb,
+        "fds": thresholds.max_fd_growth,
+        "threads": thresholds.max_thread_growth,
+    }
+    for attr, limit in limits.items():
+        delta = _edge_median(steady, attr, tail=True) - _edge_median(steady, attr, tail=False)
+        growth[attr] = {
+            "start": _edge_median(steady, attr, tail=False),
+            "end": _edge_median(steady, attr, tail=True),
+            "growth": round(delta, 1),
+            "per_1k_cycles": _slope_per_1k(steady, attr),
+        }
+        if delta > limit:
+            violations.append(f"{attr} 增长 {delta:.1f}，超过阈值 {limit}")
+
+    if final.children > thresholds.max_leftover_processes:
+        violations.append(f"全部循环结束后仍有 {final.children} 个子进程（其中 Chromium {final.chromium} 个）")
+    worst_lag = max((s.loop_lag_p95_ms for s in samples), default=0.0)
+    growth["loop_lag_p95_ms_worst"] = worst_lag
+    if worst_lag > thresholds.max_loop_lag_ms:
+        violations.append(f"事件循环延迟 p95 达到 {worst_lag} ms，超过阈值 {thresholds.max_loop_lag_ms} ms")
+
+    normal = sum(s.ok + s.errors for s in stats.values())
+    errors = sum(s.errors for s in stats.values())
+    error_rate = errors / normal if normal else 0.0
+    growth["error_rate"] = round(error_rate, 4)
+    if error_rate > thresholds.max_error_rate:
+        violations.append(f"未注入失败的循环出错比例 {error_rate:.1%}，超过阈值 {thresholds.max_error_rate:.1%}")
+    return growth, violations
+
+
+# ---------------------------------------------------------------------------
+# 运行
+# ---------------------------------------------------------------------------
+
+
+def run_soak(
+    ctx: SoakContext,
+    scenarios: List[str],
+    cycles: int,
+    concurrency: int,
+    failure_rate: float,
+    sample_interval: float = 5.0,
+    duration_s: Optional[float] = None,
+    settle_s: float = 10.0,
+    seed: int = 0,
+    on_sample: Optional[Callable[[SoakSample], None]] = None,
+) -> tuple[List[SoakSample], SoakSample, Dict[str, ScenarioStats]]:
+    """
+    运行 cycles 次循环（第 i 次运行 scenarios[i % len]），按 failure_rate 的比例注入失败，
+    返回 (定期采样, 结束并等待清理后的采样, 各场景统计)。duration_s 到达后不再开始新的循环。
+    """
+    stats = {name: ScenarioStats() for name in scenarios}
+    lock = threading.Lock()
+    done = 0
+    stop = threading.Event()
+    samples: List[SoakSample] = []
+
+    def one(i: int) -> None:
+        nonlocal done
+        if stop.is_set():
+            return
+        name = scenarios[i % len(scenarios)]
+        rng = random.Random(seed * 1_000_003 + i)
+        fault = rng.choice(FAULTS) if rng.random() < failure_rate else None
+        started = time.perf_counter()
+        error = None
+        try:
+            SCENARIO_FUNCS[name](ctx, i, fault)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:300]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            done += 1
+            s = stats[name]
+            s.cycles += 1
+            s.latency_ms.append(elapsed_ms)
+            if fault and error:
+                s.injected += 1
+            elif fault:
+                s.fault_not_raised += 1
+            elif error:
+                s.errors += 1
+                if len(s.error_samples) < 3:
+                    s.error_samples.append(error)
+            else:
+                s.ok += 1
+
+    with LoopLagProbe() as probe:
+        started = time.perf_counter()
+
+        def sample_loop() -> None:
+            while not stop.wait(sample_interval):
+                sample = take_sample(started, done, probe)
+                samples.append(sample)
+                if on_sample is not None:
+                    on_sample(sample)
+                if duration_s is not None and sample.elapsed_s >= duration_s:
+                    stop.set()
+
+        sampler = threading.Thread(target=sample_loop, daemon=True)
+        samples.append(take_sample(started, 0, probe))
+        sampler.start()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(cycles)))
+        stop.set()
+        sampler.join()
+
+        # 等待浏览器子进程退出、仿真服务中的慢请求结束，再做最后一次采样
+        gc.collect()
+        deadline = time.perf_counter() + settle_s
+        final = take_sample(started, done, probe)
+        while final.children and time.perf_counter() < deadline:
+            time.sleep(0.5)
+            final = take_sample(started, done, probe)
+    return samples, final, stats
+
+
+def main() -> None:
+    defaults = SoakThresholds()
+    parser = argparse.ArgumentParser(description="长时间运行的资源泄漏测试")
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS), help=f"逗号分隔，可选：{','.join(SCENARIOS)}")
+    parser.add_argument("--cycles", type=int, default=2000, help="总循环次数，按顺序轮流运行各场景")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="注入失败或超时的循环比例")
+    parser.add_argument("--duration", type=float, help="最长运行秒数，到达后不再开始新的循环")
+    parser.add_argument("--warmup-cycles", type=int, help="预热循环数，之前的采样不参与增长判定（默认总数的 10%%）")
+    parser.add_argument("--sample-interval", type=float, default=5.0, help="采样间隔（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="注入失败的随机种子，相同种子的注入位置相同")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=defaults.max_rss_growth_mb)
+    parser.add_argument("--max-fd-growth", type=int, default=defaults.max_fd_growth)
+    parser.add_argument("--max-thread-growth", type=int, default=defaults.max_thread_growth)
+    parser.add_argument("--max-leftover-processes", type=int, default=defaults.max_leftover_processes)
+    parser.add_argument("--max-loop-lag-ms", type=float, default=defaults.max_loop_lag_ms)
+    parser.add_argument("--max-error-rate", type=float, default=defaults.max_error_rate)
+    parser.add_argument("--out", type=Path, help="结果 JSON 输出路径（默认打印到标准输出）")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIO_FUNCS]
+    if unknown or not scenarios:
+        parser.error(f"未知场景：{', '.join(unknown)}" if unknown else "至少需要一个场景")
+    warmup = args.warmup_cycles if args.warmup_cycles is not None else args.cycles // 10
+    thresholds = SoakThresholds(
+        max_rss_growth_mb=args.max_rss_growth_mb,
+        max_fd_growth=args.max_fd_growth,
+        max_thread_growth=args.max_thread_growth,
+        max_leftover_processes=args.max_leftover_processes,
+        max_loop_lag_ms=args.max_loop_lag_ms,
+        max_error_rate=args.max_error_rate,
+    )
+
+    def show(sample: SoakSample) -> None:
+        print(
+            f"[{sample.elapsed_s:>7.1f}s] {sample.cycles} 次循环 · RSS {sample.rss_mb} MB · fd {sample.fds} · "
+            f"线程 {sample.threads} · chromium {sample.chromium} · 循环延迟 p95 {sample.loop_lag_p95_ms} ms",
+            file=sys.stderr,
+        )
+
+    with tempfile.TemporaryDirectory() as tmp, FixtureSite() as site, MockLLMServer() as llm, MockLLMServer(
+        fail_rate=1.0
+    ) as llm_down, MockLLMServer(latency_ms=SLOW_RESPONSE_S * 1000) as llm_slow:
+        ctx = SoakContext(
+            site=site, llm=llm, llm_down=llm_down, llm_slow=llm_slow, tmp_dir=Path(tmp), dead_url=_dead_url()
+        )
+        samples, final, stats = run_soak(
+            ctx,
+            scenarios,
+            cycles=args.cycles,
+            concurrency=args.concurrency,
+            failure_rate=args.failure_rate,
+            sample_interval=args.sample_interval,
+            duration_s=args.duration,
+            seed=args.seed,
+            on_sample=show,
+        )
+    show(final)
+    growth, violations = evaluate(samples, final, stats, warmup, thresholds)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "thresholds": asdict(thresholds),
+        "passed": not violations,
+        "violations": violations,
+        "growth": growth,
+        "scenarios": {name: s.to_dict() for name, s in stats.items()},
+        "samples": [asdict(s) for s in samples] + [asdict(final)],
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        args.out.write_text(text, encoding="utf-8")
+        print(f"结果已写入 {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+    for name, s in stats.items():
+        print(
+            f"{name}: {s.cycles} 次 · 成功 {s.ok} · 注入失败 {s.injected} · 注入未生效 {s.fault_not_raised} · 出错 {s.errors}",
+            file=sys.stderr,
+        )
+        for sample in s.error_samples:
+            print(f"  {sample}", file=sys.stderr)
+    if violations:
+        print("资源泄漏测试未通过：" + "；".join(violations), file=sys.stderr)
+        sys.exit(1)
+    print("资源泄漏测试通过", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+冷启动：按导入统计启动耗时，以及服务启动后的后台预热。
+
+app.py 只在用到时才导入 scrapegraphai / Playwright / pandas 等重依赖，首屏不再等待它们；
+代价转移到了第一次抓取上，所以可以在服务启动时于后台线程预热：
+
+1. 预先导入重依赖模块
+2. 启动一次无头 Chromium（把浏览器可执行文件读入系统缓存，后续启动明显更快）
+3. 检查当前 provider 是否可连接
+4. 预加载模型（见 residency.py：Ollama 通过 keep_alive 加载，LM Studio 通过一次最小请求触发 JIT 加载）
+
+设置环境变量 SCRAPER_WARMUP=1 后，Streamlit 服务进程在第一次渲染时启动预热。
+命令行 `python -m unified_app.startup` 输出每个重依赖在全新进程中的导入耗时与主要组成。
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from unified_app.config import AppConfig
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+# 首屏之后才需要的重依赖
+HEAVY_MODULES = (
+    "scrapegraphai.graphs",
+    "playwright.async_api",
+    "pandas",
+    "bs4",
+    "requests",
+)
+# 启动报告中额外统计的应用自身模块
+APP_MODULES = ("streamlit", "unified_app.pipeline", "unified_app.jobs")
+
+ENV_WARMUP = "SCRAPER_WARMUP"
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)")
+
+
+def warmup_enabled() -> bool:
+    return os.environ.get(ENV_WARMUP, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    seconds: float
+    error: str = ""
+    # (顶层包名, 秒)，按耗时降序
+    breakdown: List[Tuple[str, float]] = field(default_factory=list)
+
+
+def parse_importtime(stderr: str, top: int = 8) -> List[Tuple[str, float]]:
+    """把 -X importtime 的输出按顶层包汇总 self 耗时（各包之和即总耗时）。"""
+    totals: Dict[str, int] = defaultdict(int)
+    for line in stderr.splitlines():
+        m = _IMPORTTIME_LINE.match(line)
+        if m:
+            totals[m.group(4).split(".")[0]] += int(m.group(1))
+    ranked = sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
+    return [(name, us / 1e6) for name, us in ranked[:top] if us >= 5_000]
+
+
+def measure_import(module: str, python: str = sys.executable) -> ImportTiming:
+    """在全新的解释器中导入 module，得到冷启动耗时。"""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - t)"
+    )
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", code],
+        cwd=str(PROJECT_ROOT),
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        last = (proc.stderr.strip().splitlines() or [""])[-1]
+        return ImportTiming(module=module, seconds=0.0, error=last)
+    return ImportTiming(
+        module=module,
+        seconds=float(proc.stdout.strip().splitlines()[-1]),
+        breakdown=parse_importtime(proc.stderr),
+    )
+
+
+def import_report(modules: Sequence[str] = APP_MODULES + HEAVY_MODULES) -> List[ImportTiming]:
+    return [measure_import(m) for m in modules]
+
+
+@dataclass
+class WarmupStep:
+    name: str
+    seconds: float
+    ok: bool
+    detail: str = ""
+
+
+@dataclass
+class WarmupReport:
+    started_at: str = field(default_factory=lambda: datetime.now().isoformat(timespec="seconds"))
+    steps: List[WarmupStep] = field(default_factory=list)
+    done: bool = False
+
+    @property
+    def total_s(self) -> float:
+        return sum(s.seconds for s in self.steps)
+
+
+def _ollama_base(app_cfg: AppConfig) -> str:
+    base = app_cfg.ollama.base_url.rstrip("/")
+    return base.rsplit("/v1", 1)[0] if base.endswith("/v1") else base
+
+
+def _launch_browser() -> str:
+    from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        try:
+            page = browser.new_page()
+            page.set_content("<html><body>warm-up</body></html>")
+        finally:
+            browser.close()
+    return "Chromium 可正常启动"
+
+
+def _ping_provider(app_cfg: AppConfig) -> str:
+    import httpx
+
+    if app_cfg.provider == "ollama":
+        resp = httpx.get(f"{_ollama_base(app_cfg)}/api/tags", timeout=10)
+    elif app_cfg.provider == "lmstudio":
+        resp = httpx.get(f"{app_cfg.lmstudio.base_url.rstrip('/')}/models", timeout=10)
+    else:
+        resp = httpx.get(
+            "https://api.openai.com/v1/models",
+            headers={"Authorization": f"Bearer {app_cfg.openai.api_key}"},
+            timeout=10,
+        )
+    resp.raise_for_status()
+    return f"{app_cfg.provider} 可连接（HTTP {resp.status_code}）"
+
+
+def _preload_model(app_cfg: AppConfig) -> str:
+    from unified_app.residency import ModelResidency
+
+    results = ModelResidency(app_cfg).preload()
+    if not results:
+        return "云端模型无需预加载"
+    failed = [r for r in results if not r.ok]
+    if failed:
+        raise RuntimeError("；".join(f"{r.model}: {r.detail}" for r in failed))
+    return "；".join(f"已加载 {r.model}（{r.seconds:.1f}s，{r.detail}）" for r in results)
+
+
+def _run_step(report: WarmupReport, name: str, fn: Callable[[], str]) -> None:
+    started = time.perf_counter()
+    try:
+        detail = fn()
+        ok = True
+    except Exception as e:
+        # Playwright 等库的报错信息很长，只保留第一行
+        detail = f"{type(e).__name__}: {(str(e).splitlines() or [''])[0]}"
+        ok = False
+    report.steps.append(WarmupStep(name=name, seconds=time.perf_counter() - started, ok=ok, detail=detail))
+
+
+def _import_module(module: str) -> str:
+    importlib.import_module(module)
+    return "已导入"
+
+
+def warm_up(
+    app_cfg: AppConfig,
+    report: Optional[WarmupReport] = None,
+    modules: Sequence[str] = HEAVY_MODULES,
+    browser: bool = True,
+) -> WarmupReport:
+    """依次执行各预热步骤；单个步骤失败只记录在报告中，不影响后续步骤。"""
+    report = report or WarmupReport()
+    for module in modules:
+        _run_step(report, f"import {module}", lambda m=module: _import_module(m))
+    if browser:
+        _run_step(report, "browser_launch", _launch_browser)
+    _run_step(report, "provider_ping", lambda: _ping_provider(app_cfg))
+    _run_step(report, "model_preload", lambda: _preload_model(app_cfg))
+    report.done = True
+    return report
+
+
+def start_background_warmup(app_cfg: AppConfig, **kwargs) -> WarmupReport:
+    """在守护线程中预热，立即返回会被逐步填充的报告。"""
+    report = WarmupReport()
+    thread = threading.Thread(
+        target=warm_up, args=(app_cfg, report), kwargs=kwargs, name="warmup", daemon=True
+    )
+    thread.start()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="启动耗时报告与预热")
+    parser.add_argument("modules", nargs="*", help="要统计的模块，默认统计应用依赖")
+    parser.add_argument("--warmup", action="store_true", help="按当前配置执行一次预热并输出各步骤耗时")
+    args = parser.parse_args()
+
+    if args.warmup:
+        report = warm_up(AppConfig.load())
+        for step in report.steps:
+            mark = "✓" if step.ok else "✗"
+            print(f"{mark} {step.name:<28} {step.seconds:7.2f}s  {step.detail}")
+        print(f"合计 {report.total_s:.2f}s")
+        return
+
+    for timing in import_report(args.modules or APP_MODULES + HEAVY_MODULES):
+        if timing.error:
+            print(f"{timing.module:<24}    失败  {timing.error}")
+            continue
+        print(f"{timing.module:<24} {timing.seconds:7.2f}s")
+        for name, seconds in timing.breakdown:
+            print(f"    {name:<20} {seconds:7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,115 +2,77 @@
 仅保留针对 GitHub 用户/组织仓库列表的提取逻辑，去除其他表格导出功能。
 """
 
+import sys
+from pathlib import Path
+
 import streamlit as st
 import asyncio
-from playwright.async_api import async_playwright, TimeoutError
-import pandas as pd
-from urllib.parse import urlparse
+
+# 保证以 `streamlit run unified_app/table_exporter.py` 启动时可以使用绝对导入
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from unified_app.github_repos import normalize_username, fetch_github_repos, repos_to_dataframe
+from unified_app.har import MODES as HAR_MODES, HarSession
+from unified_app.politeness import PolitenessScheduler
+from unified_app.profiling import profile_run
+from unified_app.sinks import SinkSet, make_record
 
 # 页面配置
 st.set_page_config(page_title="GitHub 仓库抓取器", layout="wide")
 st.title("GitHub 仓库抓取器")
 st.write("输入 GitHub 用户名或个人/组织主页 URL，抓取其仓库列表并展示结构化数据。")
 
-def normalize_username(input_str: str) -> str:
-    """从输入中提取 GitHub 用户名或组织名"""
-    input_str = (input_str or "").strip()
-    if not input_str:
-        return ""
-    if input_str.startswith("http"):
-        try:
-            p = urlparse(input_str)
-            parts = [p for p in p.path.split("/") if p]
-            if parts:
-                return parts[0]
-            return ""
-        except Exception:
-            return input_str
-    # 允许直接输入包含额外路径，如 "username?tab=repositories"
-    return input_str.split("/")[0].split("?")[0]
-
-async def fetch_github_repos(username: str, headless: bool = True, timeout_sec: int = 30):
-    """使用 Playwright 抓取 GitHub 用户/组织的仓库信息，返回 list[dict]"""
-    target_url = f"https://github.com/{username}?tab=repositories"
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=headless)
-        context = await browser.new_context()
-        page = await context.new_page()
-        try:
-            await page.goto(target_url, wait_until="domcontentloaded", timeout=timeout_sec * 1000)
-        except TimeoutError:
-            # 退回到简单加载等待
-            await page.goto(target_url, wait_until="load", timeout=timeout_sec * 1000)
-        # 等待仓库列表出现（有些页面会懒加载）
-        try:
-            await page.wait_for_selector('[data-testid="repository-list"], .repo-list', timeout=8000)
-        except Exception:
-            # 允许继续尝试，即使选择器没出现
-            pass
-
-        # 在页面上下文中抽取结构化仓库信息
-        repos = await page.evaluate(
-            """(user) => {
-                const containers = Array.from(document.querySelectorAll(
-                    '[data-testid="repository-list"] li, [data-testid="results-list"] li, article, li'
-                ));
-                const data = [];
-                for (const el of containers) {
-                    // 尝试定位与用户名相关的链接
-                    const link = el.querySelector(`a[href*="/${user}/"]`);
-                    if (!link) continue;
-                    const name = link.textContent.trim();
-                    if (!name) continue;
-                    const href = link.getAttribute('href') || '';
-                    const descEl = el.querySelector('p, .repo-description, [itemprop="description"]');
-                    const langEl = el.querySelector('[itemprop="programmingLanguage"], .repo-language-color + span, [data-testid="repo-card-language"]');
-                    const starEl = el.querySelector('a[href$="/stargazers"], [data-testid="stargazers"]');
-                    data.push({
-                        "name": name,
-                        "url": href.startsWith('http') ? href : `https://github.com${href}`,
-                        "description": descEl ? descEl.textContent.trim() : "",
-                        "language": langEl ? langEl.textContent.trim() : "",
-                        "stars": starEl ? starEl.textContent.trim() : ""
-                    });
-                }
-                // 去重并返回
-                const seen = new Set();
-                return data.filter(item => {
-                    if (!item.name) return false;
-                    if (seen.has(item.url)) return false;
-                    seen.add(item.url);
-                    return true;
-                });
-            }""",
-            username,
-        )
-
-        await browser.close()
-        return repos
-
-def repos_to_dataframe(repos_list):
-    """将抓取到的仓库列表转换为 pandas.DataFrame"""
-    if not repos_list:
-        return pd.DataFrame()
-    return pd.DataFrame(repos_list)
-
 # --- Streamlit UI ---
 input_text = st.text_input("GitHub 用户名或主页 URL", placeholder="例如：octocat 或 https://github.com/octocat")
 headless = st.checkbox("无头模式 (headless)", value=True, help="调试时取消勾选以查看浏览器行为")
 timeout_sec = st.slider("页面加载超时（秒）", 10, 60, 30)
+polite = st.checkbox(
+    "礼貌抓取",
+    value=True,
+    help="按域名限速并遵守 robots.txt，连续抓取多个账号时可避免被 GitHub 限流；代理池在 unified_config.json 的 politeness 段中配置",
+)
+har_mode = st.selectbox(
+    "HAR 录制/回放",
+    list(HAR_MODES),
+    help="record：保存页面请求为 HAR 归档；replay：从归档离线回放，不访问 GitHub",
+)
+sink_text = st.text_input(
+    "结果存储（可选，多个用逗号分隔）",
+    placeholder="例如：sqlite:github_repos.db, parquet:github_repos.parquet",
+    help="每个仓库作为一条记录写入；相对路径位于 results/ 目录下",
+)
 
 if st.button("抓取仓库列表"):
     username = normalize_username(input_text)
     if not username:
         st.warning("请输入有效的 GitHub 用户名或主页 URL。")
     else:
-        with st.spinner(f"正在抓取 {username} 的仓库列表..."):
+        har = HarSession.for_key(har_mode, f"https://github.com/{username}?tab=repositories")
+        # 配置文件 profiling 段开启时剖析本次抓取，保存后在页面上提示目录
+        with st.spinner(f"正在抓取 {username} 的仓库列表..."), profile_run(
+            f"github-{username}", reporter=lambda level, message: st.caption(message)
+        ) as profiler:
             try:
-                repos = asyncio.run(fetch_github_repos(username, headless=headless, timeout_sec=timeout_sec))
+                repos = asyncio.run(
+                    fetch_github_repos(
+                        username,
+                        headless=headless,
+                        timeout_sec=timeout_sec,
+                        har=har,
+                        politeness=PolitenessScheduler.from_config() if polite else None,
+                        profiler=profiler,
+                    )
+                )
             except Exception as e:
                 st.error(f"抓取失败：{e}")
                 repos = None
+        if har is not None:
+            if har.misses:
+                st.warning(har.summary())
+            else:
+                st.caption(har.summary())
 
         if repos is None:
             st.error("未能获取仓库数据。")
@@ -120,6 +82,22 @@ if st.button("抓取仓库列表"):
                 st.info("未找到仓库或仓库列表为空。")
             else:
                 st.success(f"抓取到 {len(df)} 个仓库")
+                sink_specs = [s.strip() for s in sink_text.split(",") if s.strip()]
+                if sink_specs:
+                    try:
+                        with SinkSet.from_config(specs=sink_specs) as sinks:
+                            sinks.write_many(
+                                make_record("github_repos", repo.get("url") or "", repo, username=username)
+                                for repo in repos
+                            )
+                        for stats in sinks.stats:
+                            st.caption(f"已写入 {stats.summary()}")
+                        if sinks.dedupe_stats is not None:
+                            st.caption(sinks.dedupe_stats.summary())
+                        for error in sinks.errors:
+                            st.warning(f"结果存储写入失败：{error}")
+                    except Exception as e:
+                        st.error(f"无法打开结果存储：{e}")
                 # 显示基本信息
                 st.dataframe(df.astype(str), use_container_width=True)
                 # 提供 CSV 下载（简单导出）
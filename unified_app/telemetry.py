@@ -0,0 +1,288 @@
+"""
+运行时遥测：记录每次抓取各阶段耗时、抓取字节数、token 用量和 provider/model，
+随历史记录一起保存，并提供分位数汇总与 Prometheus 文本格式导出。
+
+导出到文件（可配合 node_exporter 的 textfile collector）：
+    python -m unified_app.telemetry --out metrics.prom
+以 HTTP 端点形式提供：
+    python -m unified_app.telemetry --serve 9464
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, asdict, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlparse
+
+
+@dataclass
+class RunMetrics:
+    provider: str = ""
+    model: str = ""
+    domain: str = ""
+    # 阶段名 -> 秒
+    stages: Dict[str, float] = field(default_factory=dict)
+    # 从浏览器传回的字节数；html_bytes 为完整 HTML 的字节数，页面内快照模式下两者不同（见 snapshot.py）
+    bytes_fetched: int = 0
+    html_bytes: int = 0
+    tokens_in: int = 0
+    tokens_out: int = 0
+    total_s: float = 0.0
+    # 开启 JSON Schema 时的校验结果（valid / repaired / reasked / failed）与做过的修复，见 schema_repair.py
+    schema_status: str = ""
+    schema_repairs: List[str] = field(default_factory=list)
+    # provider 为 auto 时的路由决策摘要，见 router.py
+    route: str = ""
+    # 配置了多个端点时本次抽取使用的服务地址，见 endpoints.py
+    endpoint: str = ""
+    # 保存了性能剖析时的目录（相对项目目录），见 profiling.py
+    profile: str = ""
+    # 合并相同请求时的请求键（前 12 位）与挂到这次运行上的其他请求数，见 coalesce.py
+    coalesce_key: str = ""
+    waiters: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class RunRecorder:
+    """在一次抓取过程中累积阶段耗时，同名阶段多次出现时累加。"""
+
+    def __init__(self, provider: str = "", model: str = "", url: str = "") -> None:
+        self.metrics = RunMetrics(
+            provider=provider,
+            model=model,
+            domain=urlparse(url).netloc if url else "",
+        )
+        self._started = time.perf_counter()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        self.metrics.stages[name] = round(self.metrics.stages.get(name, 0.0) + seconds, 4)
+
+    def since(self, name: str, started: float) -> None:
+        """记录从 started（time.perf_counter() 的返回值）到现在的耗时。"""
+        self.add_stage(name, time.perf_counter() - started)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.since(name, started)
+
+    def add_graph_execution_info(self, exec_info: Optional[List[Dict[str, Any]]]) -> None:
+        """合并 SmartScraperGraph.get_execution_info() 中的节点耗时与 token 用量。"""
+        for node in exec_info or []:
+            name = node.get("node_name", "")
+            if name == "TOTAL RESULT":
+                self.metrics.tokens_in += int(node.get("prompt_tokens") or 0)
+                self.metrics.tokens_out += int(node.get("completion_tokens") or 0)
+            elif name:
+                self.add_stage(f"graph.{name}", float(node.get("exec_time") or 0.0))
+
+    def finish(self) -> RunMetrics:
+        self.metrics.total_s = round(time.perf_counter() - self._started, 4)
+        return self.metrics
+
+
+def timed(recorder: Optional[RunRecorder], name: str):
+    """recorder 为空时不做任何记录，便于在可选遥测的代码路径中使用。"""
+    return recorder.stage(name) if recorder is not None else nullcontext()
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法分位数，q 取值 0~100。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _iter_metrics(items: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+    for item in items:
+        metrics = getattr(item, "metrics", None)
+        if metrics:
+            yield metrics
+
+
+def summarise(items: Iterable[Any], group_by: Optional[str] = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    按 group_by（provider / domain / model，None 表示不分组）汇总各阶段 p50/p95。
+    返回 {分组: {阶段: {"count", "p50", "p95"}}}，阶段 "total" 为整次运行耗时。
+    """
+    samples: Dict[str, Dict[str, List[float]]] = {}
+    for m in _iter_metrics(items):
+        group = str(m.get(group_by, "") or "-") if group_by else "all"
+        stages = dict(m.get("stages") or {})
+        stages["total"] = m.get("total_s", 0.0)
+        for stage, seconds in stages.items():
+            samples.setdefault(group, {}).setdefault(stage, []).append(float(seconds))
+
+    return {
+        group: {
+            stage: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+            }
+            for stage, values in stages.items()
+        }
+        for group, stages in samples.items()
+    }
+
+
+def schema_summary(items: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    按模型统计结构化输出的校验结果：{模型: {"runs", 各状态次数, "repairs": {修复类型: 次数}}}。
+    修复类型取 "coerce:$.price" 中冒号前的部分。
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    for m in _iter_metrics(items):
+        status = m.get("schema_status")
+        if not status:
+            continue
+        row = out.setdefault(
+            m.get("model") or "-",
+            {"runs": 0, "valid": 0, "repaired": 0, "reasked": 0, "failed": 0, "repairs": {}},
+        )
+        row["runs"] += 1
+        row[status] = row.get(status, 0) + 1
+        for repair in m.get("schema_repairs") or []:
+            kind = repair.split(":", 1)[0]
+            row["repairs"][kind] = row["repairs"].get(kind, 0) + 1
+    return out
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def render_prometheus(items: Iterable[Any]) -> str:
+    items = list(items)
+    lines = [
+        "# HELP scrape_stage_seconds Per-stage scrape latency quantiles over recent history.",
+        "# TYPE scrape_stage_seconds summary",
+    ]
+    for provider, stages in sorted(summarise(items, "provider").items()):
+        for stage, s in sorted(stages.items()):
+            labels = f'provider="{_label(provider)}",stage="{_label(stage)}"'
+            lines.append(f'scrape_stage_seconds{{{labels},quantile="0.5"}} {s["p50"]}')
+            lines.append(f'scrape_stage_seconds{{{labels},quantile="0.95"}} {s["p95"]}')
+            lines.append(f"scrape_stage_seconds_count{{{labels}}} {s['count']}")
+
+    runs: Dict[str, int] = {}
+    tokens: Dict[tuple, int] = {}
+    fetched: Dict[str, int] = {}
+    html_bytes: Dict[str, int] = {}
+    coalesced: Dict[str, List[int]] = {}
+    for m in _iter_metrics(items):
+        provider = m.get("provider") or "-"
+        runs[provider] = runs.get(provider, 0) + 1
+        for direction, key in (("in", "tokens_in"), ("out", "tokens_out")):
+            tokens[(provider, direction)] = tokens.get((provider, direction), 0) + int(m.get(key) or 0)
+        fetched[provider] = fetched.get(provider, 0) + int(m.get("bytes_fetched") or 0)
+        html_bytes[provider] = html_bytes.get(provider, 0) + int(m.get("html_bytes") or m.get("bytes_fetched") or 0)
+        if m.get("waiters"):
+            row = coalesced.setdefault(provider, [0, 0])
+            row[0] += 1
+            row[1] += int(m["waiters"])
+
+    lines += [
+        "# HELP scrape_runs Runs recorded in recent history.",
+        "# TYPE scrape_runs gauge",
+    ]
+    lines += [f'scrape_runs{{provider="{_label(p)}"}} {n}' for p, n in sorted(runs.items())]
+    lines += [
+        "# HELP scrape_tokens LLM tokens used by runs in recent history.",
+        "# TYPE scrape_tokens gauge",
+    ]
+    lines += [
+        f'scrape_tokens{{provider="{_label(p)}",direction="{d}"}} {n}'
+        for (p, d), n in sorted(tokens.items())
+    ]
+    lines += [
+        "# HELP scrape_bytes_fetched Page bytes fetched by runs in recent history.",
+        "# TYPE scrape_bytes_fetched gauge",
+    ]
+    lines += [f'scrape_bytes_fetched{{provider="{_label(p)}"}} {n}' for p, n in sorted(fetched.items())]
+    lines += [
+        "# HELP scrape_html_bytes Full page HTML bytes of runs in recent history (larger than fetched bytes in snapshot mode).",
+        "# TYPE scrape_html_bytes gauge",
+    ]
+    lines += [f'scrape_html_bytes{{provider="{_label(p)}"}} {n}' for p, n in sorted(html_bytes.items())]
+    lines += [
+        "# HELP scrape_coalesced_runs Runs in recent history that other identical in-flight requests attached to.",
+        "# TYPE scrape_coalesced_runs gauge",
+    ]
+    lines += [f'scrape_coalesced_runs{{provider="{_label(p)}"}} {r[0]}' for p, r in sorted(coalesced.items())]
+    lines += [
+        "# HELP scrape_coalesced_waiters Identical requests served by another in-flight run in recent history.",
+        "# TYPE scrape_coalesced_waiters gauge",
+    ]
+    lines += [f'scrape_coalesced_waiters{{provider="{_label(p)}"}} {r[1]}' for p, r in sorted(coalesced.items())]
+    lines += [
+        "# HELP scrape_schema_results Structured-output validation results by model in recent history.",
+        "# TYPE scrape_schema_results gauge",
+    ]
+    for model, row in sorted(schema_summary(items).items()):
+        for status in ("valid", "repaired", "reasked", "failed"):
+            lines.append(f'scrape_schema_results{{model="{_label(model)}",status="{status}"}} {row[status]}')
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(path: Path) -> None:
+    from unified_app.history import load_history
+
+    # 先写临时文件再替换，避免采集方读到写了一半的内容
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(render_prometheus(load_history()), encoding="utf-8")
+    tmp.replace(path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        from unified_app.history import load_history
+
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_prometheus(load_history()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        return
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="导出抓取遥测指标（Prometheus 文本格式）")
+    parser.add_argument("--out", type=Path, help="写入指定文件")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="以 HTTP /metrics 端点提供")
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args()
+
+    if args.out:
+        export_prometheus(args.out)
+        print(f"已导出到 {args.out}")
+    if args.serve:
+        print(f"指标端点：http://{args.host}:{args.serve}/metrics")
+        ThreadingHTTPServer((args.host, args.serve), _MetricsHandler).serve_forever()
+    if not args.out and not args.serve:
+        from unified_app.history import load_history
+
+        print(render_prometheus(load_history()), end="")
+
+
+if __name__ == "__main__":
+    main()